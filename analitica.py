@@ -0,0 +1,506 @@
+# analitica.py - Foto columnar del historial de ventas y análisis con NumPy
+
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, date, timedelta
+
+try:
+    import numpy as np
+    NUMPY_DISPONIBLE = True
+except ImportError:
+    np = None
+    NUMPY_DISPONIBLE = False
+
+
+# Columnas de la foto (una por archivo .npy) y su tipo
+COLUMNAS_FOTO = (
+    ('factura_id', 'int32'),
+    ('fecha', 'datetime64[s]'),
+    ('producto_id', 'int32'),
+    ('cantidad', 'float64'),
+    ('subtotal', 'float64'),
+    ('iva', 'float64'),
+    ('medio', 'int8'),
+)
+
+# Umbrales del análisis ABC (participación acumulada en el total vendido)
+LIMITE_CLASE_A = 80.0
+LIMITE_CLASE_B = 95.0
+
+SIN_CATEGORIA = 'Sin categoría'
+
+
+class FotoVentas:
+    """Columnas de una foto abiertas como memmap (solo lectura, ordenadas por fecha)"""
+
+    def __init__(self, directorio, manifiesto):
+        self.nombre = manifiesto['nombre']
+        self.generada = manifiesto['generada']
+        self.hasta = manifiesto['hasta']
+        self.filas = manifiesto['filas']
+        self.medios = manifiesto['medios']
+        self.categorias = manifiesto['categorias']
+
+        carpeta = os.path.join(directorio, self.nombre)
+        self.columnas = {
+            nombre: np.load(os.path.join(carpeta, f'{nombre}.npy'), mmap_mode='r')[:self.filas]
+            for nombre, _ in COLUMNAS_FOTO
+        }
+
+        # Dimensión de productos: ids ordenados para buscar con searchsorted
+        self.productos_id = np.load(os.path.join(carpeta, 'productos_id.npy'))
+        self.productos_categoria = np.load(os.path.join(carpeta, 'productos_categoria.npy'))
+        self.productos_costo = np.load(os.path.join(carpeta, 'productos_costo.npy'))
+        with open(os.path.join(carpeta, 'productos.json'), encoding='utf-8') as archivo:
+            self.productos = {int(clave): valor for clave, valor in json.load(archivo).items()}
+
+    def tramo(self, desde=None, hasta=None):
+        """Columnas de las líneas con fecha en [desde, hasta] (date inclusive, sin copiar)"""
+        fechas = self.columnas['fecha']
+        inicio = 0
+        fin = self.filas
+        if desde is not None:
+            inicio = int(np.searchsorted(fechas, np.datetime64(desde, 's'), side='left'))
+        if hasta is not None:
+            fin = int(np.searchsorted(fechas, np.datetime64(hasta + timedelta(days=1), 's'), side='left'))
+        return {nombre: columna[inicio:fin] for nombre, columna in self.columnas.items()}
+
+    def indice_productos(self, producto_id):
+        """Posición de cada producto en la dimensión (-1 si no está)"""
+        if len(self.productos_id) == 0:
+            return np.full(len(producto_id), -1, dtype='int64')
+        posiciones = np.searchsorted(self.productos_id, producto_id)
+        posiciones = np.minimum(posiciones, len(self.productos_id) - 1)
+        return np.where(self.productos_id[posiciones] == producto_id, posiciones, -1)
+
+
+class AnaliticaVentas:
+    """Foto nocturna del historial de ventas en archivos columnares y análisis
+    vectorizados sobre ella.
+
+    La foto se escribe en una carpeta nueva y se publica reemplazando
+    actual.json, así las consultas en curso siguen leyendo la foto anterior.
+    """
+
+    def __init__(self, directorio, tamano_lote=20000):
+        self.directorio = directorio
+        self.tamano_lote = tamano_lote
+        self._foto = None
+        self._lock = threading.Lock()
+        self._exportando = threading.Lock()
+        self._programacion = None
+        self.ultimo_error = None
+
+    @property
+    def disponible(self):
+        return NUMPY_DISPONIBLE
+
+    # ------------------------------------------------------------------
+    # Exportación
+    # ------------------------------------------------------------------
+
+    def exportar(self, total_filas, filas, productos, hasta):
+        """Escribir una foto nueva y publicarla.
+
+        total_filas: cantidad de líneas que va a entregar `filas`
+        filas: iterable de (factura_id, fecha, producto_id, cantidad, subtotal, iva, medio)
+               ordenado por fecha
+        productos: iterable de (id, codigo, nombre, categoria, costo)
+        hasta: fecha (exclusiva) hasta la que llega la foto
+        """
+        if not NUMPY_DISPONIBLE:
+            raise RuntimeError('NumPy no está instalado (pip install numpy)')
+
+        if not self._exportando.acquire(blocking=False):
+            raise RuntimeError('Ya hay una exportación en curso')
+
+        try:
+            inicio = time.time()
+            os.makedirs(self.directorio, exist_ok=True)
+            nombre = 'foto_' + datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            carpeta = os.path.join(self.directorio, nombre)
+            os.makedirs(carpeta)
+
+            try:
+                escritas, medios = self._escribir_lineas(carpeta, total_filas, filas)
+                categorias = self._escribir_productos(carpeta, productos)
+                manifiesto = {
+                    'nombre': nombre,
+                    'generada': datetime.now().isoformat(timespec='seconds'),
+                    'hasta': hasta.isoformat(),
+                    'filas': escritas,
+                    'medios': medios,
+                    'categorias': categorias
+                }
+                self._escribir_json(os.path.join(carpeta, 'manifiesto.json'), manifiesto)
+            except Exception:
+                shutil.rmtree(carpeta, ignore_errors=True)
+                raise
+
+            # Publicar: reemplazo atómico del puntero a la foto actual
+            self._escribir_json(os.path.join(self.directorio, 'actual.json'), manifiesto)
+            with self._lock:
+                self._foto = None
+            self._borrar_fotos_anteriores(nombre)
+
+            print(f"📦 Foto analítica {nombre}: {escritas} líneas en {time.time() - inicio:.1f}s")
+            return manifiesto
+        finally:
+            self._exportando.release()
+
+    def _escribir_lineas(self, carpeta, total_filas, filas):
+        """Volcar las líneas por lotes en columnas .npy preasignadas"""
+        columnas = {
+            nombre: np.lib.format.open_memmap(
+                os.path.join(carpeta, f'{nombre}.npy'), mode='w+', dtype=tipo, shape=(total_filas,)
+            )
+            for nombre, tipo in COLUMNAS_FOTO
+        }
+        medios = []
+        codigos_medio = {}
+        escritas = 0
+        lote = []
+
+        def volcar():
+            nonlocal escritas
+            hasta = escritas + len(lote)
+            factura_id, fecha, producto_id, cantidad, subtotal, iva, medio = zip(*lote)
+            columnas['factura_id'][escritas:hasta] = factura_id
+            columnas['fecha'][escritas:hasta] = np.array(fecha, dtype='datetime64[s]')
+            columnas['producto_id'][escritas:hasta] = [valor or 0 for valor in producto_id]
+            columnas['cantidad'][escritas:hasta] = [float(valor or 0) for valor in cantidad]
+            columnas['subtotal'][escritas:hasta] = [float(valor or 0) for valor in subtotal]
+            columnas['iva'][escritas:hasta] = [float(valor or 0) for valor in iva]
+            columnas['medio'][escritas:hasta] = medio
+            escritas = hasta
+            lote.clear()
+
+        for fila in filas:
+            # Si aparecieron líneas después de contar, quedan para la próxima foto
+            if escritas + len(lote) >= total_filas:
+                break
+            medio = fila[6] or 'sin_registro'
+            if medio not in codigos_medio:
+                codigos_medio[medio] = len(medios)
+                medios.append(medio)
+            lote.append(fila[:6] + (codigos_medio[medio],))
+            if len(lote) >= self.tamano_lote:
+                volcar()
+        if lote:
+            volcar()
+
+        for columna in columnas.values():
+            columna.flush()
+        del columnas
+        return escritas, medios
+
+    def _escribir_productos(self, carpeta, productos):
+        """Dimensión de productos: categoría y costo actuales, nombres para mostrar"""
+        categorias = [SIN_CATEGORIA]
+        codigos_categoria = {SIN_CATEGORIA: 0}
+        ids, categoria_producto, costos, datos = [], [], [], {}
+
+        for producto_id, codigo, nombre, categoria, costo in productos:
+            categoria = (categoria or '').strip() or SIN_CATEGORIA
+            if categoria not in codigos_categoria:
+                codigos_categoria[categoria] = len(categorias)
+                categorias.append(categoria)
+            ids.append(producto_id)
+            categoria_producto.append(codigos_categoria[categoria])
+            costos.append(float(costo or 0))
+            datos[producto_id] = [codigo, nombre]
+
+        orden = np.argsort(np.array(ids, dtype='int32'), kind='stable')
+        np.save(os.path.join(carpeta, 'productos_id.npy'), np.array(ids, dtype='int32')[orden])
+        np.save(os.path.join(carpeta, 'productos_categoria.npy'), np.array(categoria_producto, dtype='int32')[orden])
+        np.save(os.path.join(carpeta, 'productos_costo.npy'), np.array(costos, dtype='float64')[orden])
+        self._escribir_json(os.path.join(carpeta, 'productos.json'), datos)
+        return categorias
+
+    @staticmethod
+    def _escribir_json(ruta, datos):
+        temporal = ruta + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(datos, archivo, ensure_ascii=False)
+        os.replace(temporal, ruta)
+
+    def _borrar_fotos_anteriores(self, actual):
+        """Borrar las fotos viejas (en Windows puede fallar si otra consulta la tiene abierta)"""
+        for nombre in os.listdir(self.directorio):
+            if nombre.startswith('foto_') and nombre != actual:
+                shutil.rmtree(os.path.join(self.directorio, nombre), ignore_errors=True)
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+
+    def foto(self):
+        """Foto publicada (o None si todavía no se exportó ninguna)"""
+        if not NUMPY_DISPONIBLE:
+            return None
+
+        ruta = os.path.join(self.directorio, 'actual.json')
+        if not os.path.exists(ruta):
+            return None
+
+        with open(ruta, encoding='utf-8') as archivo:
+            manifiesto = json.load(archivo)
+
+        with self._lock:
+            if self._foto is None or self._foto.nombre != manifiesto['nombre']:
+                self._foto = FotoVentas(self.directorio, manifiesto)
+            return self._foto
+
+    def estado(self):
+        foto = self.foto()
+        return {
+            'numpy_disponible': NUMPY_DISPONIBLE,
+            'exportando': self._exportando.locked(),
+            'foto': None if foto is None else {
+                'nombre': foto.nombre,
+                'generada': foto.generada,
+                'hasta': foto.hasta,
+                'lineas': foto.filas
+            },
+            'ultimo_error': self.ultimo_error
+        }
+
+    # ------------------------------------------------------------------
+    # Análisis
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _inicios_factura(factura_id):
+        """1 en la primera línea de cada factura (las líneas vienen agrupadas)"""
+        inicios = np.ones(len(factura_id), dtype='float64')
+        if len(factura_id) > 1:
+            inicios[1:] = factura_id[1:] != factura_id[:-1]
+        return inicios
+
+    @staticmethod
+    def _meses(fechas):
+        """Meses desde 1970 de cada fecha (año = m // 12 + 1970, mes = m % 12 + 1)"""
+        return fechas.astype('datetime64[M]').astype('int64')
+
+    @staticmethod
+    def _dias(fechas):
+        return fechas.astype('datetime64[D]').astype('int64')
+
+    def ventas_por_ano_mes(self, foto, anos):
+        """{(año, mes): (cantidad de ventas, total)} para los años pedidos"""
+        anos = sorted(set(anos))
+        if not anos:
+            return {}
+
+        tramo = foto.tramo(date(anos[0], 1, 1), date(anos[-1], 12, 31))
+        meses = self._meses(tramo['fecha']) - (anos[0] - 1970) * 12
+        total_meses = (anos[-1] - anos[0] + 1) * 12
+
+        cantidades = np.bincount(meses, weights=self._inicios_factura(tramo['factura_id']), minlength=total_meses)
+        totales = np.bincount(meses, weights=tramo['subtotal'] + tramo['iva'], minlength=total_meses)
+
+        resultado = {}
+        for ano in anos:
+            for mes in range(1, 13):
+                posicion = (ano - anos[0]) * 12 + mes - 1
+                resultado[(ano, mes)] = (int(cantidades[posicion]), round(float(totales[posicion]), 2))
+        return resultado
+
+    def top_productos(self, foto, desde, hasta, limite=10):
+        """Productos más vendidos (por cantidad) en el período"""
+        tramo = foto.tramo(desde, hasta)
+        ids, inversa = np.unique(tramo['producto_id'], return_inverse=True)
+        cantidades = np.bincount(inversa, weights=tramo['cantidad'], minlength=len(ids))
+        totales = np.bincount(inversa, weights=tramo['subtotal'], minlength=len(ids))
+
+        orden = np.argsort(-cantidades, kind='stable')[:limite]
+        return [
+            self._datos_producto(foto, int(ids[i]), {
+                'cantidad_vendida': float(cantidades[i]),
+                'total_vendido': round(float(totales[i]), 2)
+            })
+            for i in orden
+        ]
+
+    def analisis_abc(self, foto, desde, hasta):
+        """Clasificación ABC de productos por participación en el total vendido"""
+        tramo = foto.tramo(desde, hasta)
+        ids, inversa = np.unique(tramo['producto_id'], return_inverse=True)
+        totales = np.bincount(inversa, weights=tramo['subtotal'], minlength=len(ids))
+        cantidades = np.bincount(inversa, weights=tramo['cantidad'], minlength=len(ids))
+
+        orden = np.argsort(-totales, kind='stable')
+        total_general = float(totales.sum())
+        if total_general > 0:
+            participacion = totales[orden] / total_general * 100
+        else:
+            participacion = np.zeros(len(orden))
+        acumulado = np.cumsum(participacion)
+
+        # La clase se define por el acumulado antes del producto: el primero siempre es A
+        previo = acumulado - participacion
+        clases = np.where(previo < LIMITE_CLASE_A, 'A', np.where(previo < LIMITE_CLASE_B, 'B', 'C'))
+
+        productos = [
+            self._datos_producto(foto, int(ids[i]), {
+                'clase': str(clases[posicion]),
+                'total_vendido': round(float(totales[i]), 2),
+                'cantidad_vendida': float(cantidades[i]),
+                'participacion': round(float(participacion[posicion]), 2),
+                'acumulado': round(float(acumulado[posicion]), 2)
+            })
+            for posicion, i in enumerate(orden)
+        ]
+
+        resumen = {}
+        for clase in ('A', 'B', 'C'):
+            mascara = clases == clase
+            resumen[clase] = {
+                'productos': int(mascara.sum()),
+                'total_vendido': round(float(totales[orden][mascara].sum()), 2)
+            }
+
+        return {'productos': productos, 'resumen': resumen, 'total_vendido': round(total_general, 2)}
+
+    def estacionalidad(self, foto, desde, hasta):
+        """Índices estacionales por mes del año y por día de la semana (1 = promedio)"""
+        tramo = foto.tramo(desde, hasta)
+        importes = tramo['subtotal'] + tramo['iva']
+
+        # Mes del año: promedio por ocurrencia del mes dentro del período
+        meses = self._meses(tramo['fecha']) % 12
+        total_mes = np.bincount(meses, weights=importes, minlength=12)
+        calendario_meses = np.arange(np.datetime64(desde, 'M'), np.datetime64(hasta, 'M') + 1).astype('int64') % 12
+        ocurrencias_mes = np.bincount(calendario_meses, minlength=12)
+        promedio_mes = np.divide(total_mes, ocurrencias_mes, out=np.zeros(12), where=ocurrencias_mes > 0)
+
+        # Día de la semana (0 = lunes): el 1/1/1970 fue jueves
+        dias_semana = (self._dias(tramo['fecha']) + 3) % 7
+        total_dia = np.bincount(dias_semana, weights=importes, minlength=7)
+        calendario_dias = (np.arange(np.datetime64(desde, 'D'), np.datetime64(hasta, 'D') + 1).astype('int64') + 3) % 7
+        ocurrencias_dia = np.bincount(calendario_dias, minlength=7)
+        promedio_dia = np.divide(total_dia, ocurrencias_dia, out=np.zeros(7), where=ocurrencias_dia > 0)
+
+        def indices(promedios, ocurrencias):
+            base = promedios[ocurrencias > 0].mean() if (ocurrencias > 0).any() else 0
+            return promedios / base if base else np.zeros(len(promedios))
+
+        indice_mes = indices(promedio_mes, ocurrencias_mes)
+        indice_dia = indices(promedio_dia, ocurrencias_dia)
+
+        return {
+            'meses': [{
+                'mes': mes + 1,
+                'total': round(float(total_mes[mes]), 2),
+                'promedio': round(float(promedio_mes[mes]), 2),
+                'indice': round(float(indice_mes[mes]), 3)
+            } for mes in range(12)],
+            'dias_semana': [{
+                'dia': dia,
+                'total': round(float(total_dia[dia]), 2),
+                'promedio': round(float(promedio_dia[dia]), 2),
+                'indice': round(float(indice_dia[dia]), 3)
+            } for dia in range(7)]
+        }
+
+    def mapa_horas(self, foto, desde, hasta):
+        """Matrices 7x24 (día de la semana x hora) de ventas e importe"""
+        tramo = foto.tramo(desde, hasta)
+        segundos = tramo['fecha'].astype('int64')
+        celdas = ((segundos // 86400 + 3) % 7) * 24 + (segundos // 3600) % 24
+
+        ventas = np.bincount(celdas, weights=self._inicios_factura(tramo['factura_id']), minlength=168)
+        importes = np.bincount(celdas, weights=tramo['subtotal'] + tramo['iva'], minlength=168)
+
+        return {
+            'ventas': ventas.reshape(7, 24).astype('int64').tolist(),
+            'importes': np.round(importes.reshape(7, 24), 2).tolist()
+        }
+
+    def margen_por_categoria(self, foto, desde, hasta):
+        """Ventas, costo y margen por categoría (con el costo actual de cada producto)"""
+        tramo = foto.tramo(desde, hasta)
+        posiciones = foto.indice_productos(tramo['producto_id'])
+        conocidos = posiciones >= 0
+        posiciones_validas = np.where(conocidos, posiciones, 0)
+
+        categorias = np.where(conocidos, foto.productos_categoria[posiciones_validas], 0)
+        costos_unitarios = np.where(conocidos, foto.productos_costo[posiciones_validas], 0.0)
+
+        cantidad_categorias = len(foto.categorias)
+        ventas = np.bincount(categorias, weights=tramo['subtotal'], minlength=cantidad_categorias)
+        costos = np.bincount(categorias, weights=tramo['cantidad'] * costos_unitarios, minlength=cantidad_categorias)
+        lineas = np.bincount(categorias, minlength=cantidad_categorias)
+
+        resultado = []
+        for codigo in np.argsort(-ventas, kind='stable'):
+            if lineas[codigo] == 0:
+                continue
+            margen = ventas[codigo] - costos[codigo]
+            resultado.append({
+                'categoria': foto.categorias[codigo],
+                'ventas': round(float(ventas[codigo]), 2),
+                'costo': round(float(costos[codigo]), 2),
+                'margen': round(float(margen), 2),
+                'margen_porcentaje': round(float(margen / ventas[codigo] * 100), 1) if ventas[codigo] else 0.0
+            })
+        return resultado
+
+    def ventas_por_medio(self, foto, desde, hasta):
+        """Importe de las líneas por medio de pago de la factura"""
+        tramo = foto.tramo(desde, hasta)
+        totales = np.bincount(tramo['medio'].astype('int64'), weights=tramo['subtotal'] + tramo['iva'],
+                              minlength=len(foto.medios))
+        return {medio: round(float(totales[codigo]), 2) for codigo, medio in enumerate(foto.medios)}
+
+    @staticmethod
+    def _datos_producto(foto, producto_id, datos):
+        codigo, nombre = foto.productos.get(producto_id, (None, f'Producto {producto_id}'))
+        return {'producto_id': producto_id, 'codigo': codigo, 'nombre': nombre, **datos}
+
+    # ------------------------------------------------------------------
+    # Programación
+    # ------------------------------------------------------------------
+
+    def iniciar_exportacion_nocturna(self, hora, exportar):
+        """Llamar a exportar() todos los días a la hora indicada (una sola vez por proceso).
+
+        Si no hay foto o la publicada no llega a hoy, exporta al iniciar.
+        """
+        with self._lock:
+            if self._programacion and self._programacion.is_alive():
+                return
+            self._programacion = threading.Thread(
+                target=self._programar, args=(hora, exportar), daemon=True
+            )
+            self._programacion.start()
+
+    def _programar(self, hora, exportar):
+        foto = self.foto()
+        if NUMPY_DISPONIBLE and (foto is None or foto.hasta < date.today().isoformat()):
+            self.ejecutar_exportacion(exportar)
+
+        while True:
+            ahora = datetime.now()
+            proxima = ahora.replace(hour=hora, minute=0, second=0, microsecond=0)
+            if proxima <= ahora:
+                proxima += timedelta(days=1)
+            time.sleep((proxima - ahora).total_seconds())
+            self.ejecutar_exportacion(exportar)
+
+    def ejecutar_exportacion(self, exportar):
+        """Correr exportar() registrando el error (para el hilo programado o un pedido manual)"""
+        try:
+            exportar()
+            self.ultimo_error = None
+        except Exception as e:
+            self.ultimo_error = str(e)
+            print(f"❌ Error exportando foto analítica: {e}")
+
+
+def crear_analitica_ventas(directorio, tamano_lote=20000):
+    """Función de conveniencia para crear el motor de analítica"""
+    return AnaliticaVentas(directorio, tamano_lote)
@@ -1,11 +1,11 @@
 # app.py - Sistema de Punto de Venta Argentina con Flask, MySQL, ARCA e Impresión Térmica
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import Numeric, or_, and_, func, desc, asc, case  
 #from sqlalchemy import Numeric, or_, and_  # ← IMPORTAR AQUÍ
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 #import mysql.connector
 from decimal import Decimal
 from qr_afip import crear_generador_qr
@@ -18,14 +18,30 @@ import base64
 import hashlib
 import csv
 import io
-from flask import make_response
+import gzip
+import re
+import unicodedata
+import uuid
+from flask import make_response, send_file
 from cryptography import x509
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 import json
 import subprocess
+import threading
 import MySQLdb.cursors
+from sqlalchemy import event, inspect as sa_inspect, select, update, bindparam, literal, cast as sa_cast
+from sqlalchemy.orm import selectinload, joinedload, contains_eager
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from estadisticas import init_estadisticas
+from codigos_balanza import crear_decodificador_balanza
+from cache_reportes import crear_cache_reportes
+from eventos import crear_bus_eventos
+from analitica import crear_analitica_ventas
+from importacion_productos import crear_importador_productos, crear_lector_lista_precios
+from clasificador_categorias import crear_clasificador_categorias, REGLAS_CATEGORIA_DEFECTO, CATEGORIA_DEFECTO
+from migraciones import crear_registro_migraciones
+from backfill import crear_ejecutor_backfill
 
 # ================ FIX SSL COMPATIBLE PARA AFIP ================
 import ssl
@@ -187,6 +203,7 @@ class Cliente(db.Model):
     telefono = db.Column(db.String(20))
     direccion = db.Column(db.Text)
     condicion_iva = db.Column(db.String(50))  # Responsable Inscripto, Monotributista, etc.
+    nombre_normalizado = db.Column(db.String(100), index=True)  # minúsculas sin acentos (búsqueda por prefijo)
 
 class Producto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -215,6 +232,11 @@ class Producto(db.Model):
     # ✅ AGREGAR ESTA RELACIÓN:
     producto_base = db.relationship('Producto', remote_side=[id], backref='combos_derivados')
     
+    __table_args__ = (
+        db.Index('idx_producto_combo_descuento', 'es_combo', 'descuento_porcentaje'),
+        db.Index('idx_producto_fecha_modificacion', 'fecha_modificacion'),  # Delta del catálogo
+    )
+    
     def __repr__(self):
         return f'<Producto {self.codigo}: {self.nombre}>'
     
@@ -291,10 +313,27 @@ class Producto(db.Model):
     
     @staticmethod
     def obtener_productos_con_ofertas():
-        """Obtener productos base con sus ofertas"""
+        """Obtener productos base con sus ofertas (cacheado hasta que cambie el catálogo)"""
+        return obtener_cache_catalogo('productos_con_ofertas', Producto._armar_productos_con_ofertas)
+    
+    @staticmethod
+    def _armar_productos_con_ofertas():
+        """Armar la lista base + combos con dos consultas y agrupar en memoria"""
         # Productos base (no combos)
         productos_base = Producto.query.filter_by(es_combo=False, activo=True).all()
         
+        # Todos los combos activos de una vez, ordenados por precio dentro de cada base.
+        # producto_base se resuelve desde el identity map (ya cargado arriba)
+        combos = Producto.query.filter(
+            Producto.es_combo == True,
+            Producto.activo == True,
+            Producto.producto_base_id.isnot(None)
+        ).order_by(Producto.producto_base_id, Producto.precio).all()
+        
+        combos_por_base = {}
+        for combo in combos:
+            combos_por_base.setdefault(combo.producto_base_id, []).append(combo)
+        
         resultado = []
         for producto_base in productos_base:
             # Agregar producto base
@@ -303,13 +342,7 @@ class Producto(db.Model):
             resultado.append(item_base)
             
             # Agregar sus combos/ofertas
-            combos = Producto.query.filter_by(
-                producto_base_id=producto_base.id, 
-                es_combo=True, 
-                activo=True
-            ).order_by(Producto.precio).all()
-            
-            for combo in combos:
+            for combo in combos_por_base.get(producto_base.id, []):
                 item_combo = combo.to_dict()
                 item_combo['tipo'] = 'COMBO'
                 resultado.append(item_combo)
@@ -440,6 +473,214 @@ class OfertaVolumen(db.Model):
 
     
 
+class CatalogoCambio(db.Model):
+    """Registro de cambios del catálogo - el id es la versión del catálogo"""
+    __tablename__ = 'catalogo_cambios'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entidad = db.Column(db.String(20), nullable=False)  # producto, oferta (id del producto)
+    entidad_id = db.Column(db.Integer)
+    fecha = db.Column(db.DateTime, default=datetime.now, index=True)
+    
+    def __repr__(self):
+        return f'<CatalogoCambio v{self.id}: {self.entidad} {self.entidad_id}>'
+    
+    @staticmethod
+    def version_actual():
+        """Versión actual del catálogo (0 si nunca hubo cambios)"""
+        return db.session.query(func.max(CatalogoCambio.id)).scalar() or 0
+
+
+class VersionEsquema(db.Model):
+    """Migración aplicada - la versión del esquema es la mayor"""
+    __tablename__ = 'schema_version'
+    
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    descripcion = db.Column(db.String(200))
+    fecha_aplicacion = db.Column(db.DateTime, default=datetime.now)
+    duracion_ms = db.Column(db.Integer)
+    
+    def __repr__(self):
+        return f'<VersionEsquema {self.version}: {self.descripcion}>'
+    
+    def to_dict(self):
+        """Convertir a diccionario"""
+        return {
+            'version': self.version,
+            'descripcion': self.descripcion,
+            'fecha_aplicacion': self.fecha_aplicacion.isoformat() if self.fecha_aplicacion else None,
+            'duracion_ms': self.duracion_ms
+        }
+
+
+class AvanceBackfill(db.Model):
+    """Checkpoint de un backfill: hasta qué id se procesó"""
+    __tablename__ = 'backfill_avance'
+    
+    nombre = db.Column(db.String(100), primary_key=True)
+    estado = db.Column(db.String(20), default='en_curso')  # en_curso, pausado, completado, error
+    id_minimo = db.Column(db.BigInteger, default=0)
+    id_maximo = db.Column(db.BigInteger, default=0)
+    ultimo_id = db.Column(db.BigInteger, default=0)
+    filas_actualizadas = db.Column(db.Integer, default=0)
+    tramos = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    fecha_inicio = db.Column(db.DateTime, default=datetime.now)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.now)
+    fecha_fin = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<AvanceBackfill {self.nombre}: {self.ultimo_id}/{self.id_maximo} ({self.estado})>'
+
+
+class EscaneoIntegridad(db.Model):
+    """Pasada del escáner de integridad sobre un rango de ids de factura"""
+    __tablename__ = 'integridad_escaneos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    desde_id = db.Column(db.Integer, default=0)   # Último id revisado por la pasada anterior
+    hasta_id = db.Column(db.Integer, default=0)   # Mayor id de factura revisado
+    completo = db.Column(db.Boolean, default=False)  # True si se revisaron todas las facturas
+    estado = db.Column(db.String(20), default='en_curso')  # en_curso, completado, error
+    hallazgos = db.Column(db.Integer, default=0)
+    duracion_ms = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    fecha_inicio = db.Column(db.DateTime, default=datetime.now)
+    fecha_fin = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_integridad_escaneo_estado', 'estado', 'hasta_id'),
+    )
+
+    def to_dict(self):
+        """Convertir a diccionario"""
+        return {
+            'id': self.id,
+            'desde_id': self.desde_id,
+            'hasta_id': self.hasta_id,
+            'completo': bool(self.completo),
+            'estado': self.estado,
+            'hallazgos': self.hallazgos,
+            'duracion_ms': self.duracion_ms,
+            'error': self.error,
+            'fecha_inicio': self.fecha_inicio.isoformat() if self.fecha_inicio else None,
+            'fecha_fin': self.fecha_fin.isoformat() if self.fecha_fin else None
+        }
+
+
+class HallazgoIntegridad(db.Model):
+    """Problema de integridad encontrado en facturas (reporte del escáner)"""
+    __tablename__ = 'integridad_hallazgos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    escaneo_id = db.Column(db.Integer, db.ForeignKey('integridad_escaneos.id'), nullable=False)
+    tipo = db.Column(db.String(30), nullable=False)  # Ver TIPOS_HALLAZGO_INTEGRIDAD
+    factura_id = db.Column(db.Integer)
+    detalle_id = db.Column(db.Integer)
+    producto_id = db.Column(db.Integer)
+    numero = db.Column(db.String(50))
+    punto_venta = db.Column(db.Integer)
+    esperado = db.Column(Numeric(12, 2))
+    encontrado = db.Column(Numeric(12, 2))
+    resuelto = db.Column(db.Boolean, default=False)
+    fecha = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('idx_integridad_hallazgo_tipo', 'resuelto', 'tipo'),
+        db.Index('idx_integridad_hallazgo_factura', 'factura_id'),
+    )
+
+    def to_dict(self):
+        """Convertir a diccionario"""
+        return {
+            'id': self.id,
+            'escaneo_id': self.escaneo_id,
+            'tipo': self.tipo,
+            'descripcion': TIPOS_HALLAZGO_INTEGRIDAD.get(self.tipo, self.tipo),
+            'factura_id': self.factura_id,
+            'detalle_id': self.detalle_id,
+            'producto_id': self.producto_id,
+            'numero': self.numero,
+            'punto_venta': self.punto_venta,
+            'esperado': float(self.esperado) if self.esperado is not None else None,
+            'encontrado': float(self.encontrado) if self.encontrado is not None else None,
+            'resuelto': bool(self.resuelto),
+            'fecha': self.fecha.isoformat() if self.fecha else None
+        }
+
+
+class ReglaCategoria(db.Model):
+    """Palabra clave que asigna una categoría a los productos por su descripción"""
+    __tablename__ = 'reglas_categoria'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    palabra = db.Column(db.String(100), nullable=False)
+    categoria = db.Column(db.String(50), nullable=False)
+    prioridad = db.Column(db.Integer, default=0)  # Mayor prioridad gana si coinciden varias
+    activo = db.Column(db.Boolean, default=True)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f'<ReglaCategoria {self.palabra} -> {self.categoria} ({self.prioridad})>'
+    
+    def to_dict(self):
+        """Convertir a diccionario"""
+        return {
+            'id': self.id,
+            'palabra': self.palabra,
+            'categoria': self.categoria,
+            'prioridad': self.prioridad or 0,
+            'activo': self.activo,
+            'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None
+        }
+
+
+class CambioPrecioProgramado(db.Model):
+    """Cambio de costo, margen o precio de un producto que se aplica desde una fecha"""
+    __tablename__ = 'cambios_precio_programados'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False, index=True)
+    nuevo_costo = db.Column(Numeric(10, 2), nullable=True)
+    nuevo_margen = db.Column(Numeric(5, 2), nullable=True)
+    nuevo_precio = db.Column(Numeric(10, 2), nullable=True)  # Si falta se calcula con costo y margen
+    vigente_desde = db.Column(db.DateTime, nullable=False)
+    lote = db.Column(db.String(50), index=True)  # Para agrupar un aumento de proveedor
+    estado = db.Column(db.String(20), default='pendiente')  # pendiente, aplicado, reemplazado, cancelado
+    aplicacion = db.Column(db.String(32), index=True)  # Marca de la corrida que lo tomó
+    precio_anterior = db.Column(Numeric(10, 2), nullable=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    fecha_creacion = db.Column(db.DateTime, default=datetime.now)
+    fecha_aplicacion = db.Column(db.DateTime, nullable=True)
+    
+    producto = db.relationship('Producto')
+    
+    __table_args__ = (
+        db.Index('idx_cambio_precio_estado_vigencia', 'estado', 'vigente_desde'),
+    )
+    
+    def __repr__(self):
+        return f'<CambioPrecioProgramado {self.producto_id} desde {self.vigente_desde} ({self.estado})>'
+    
+    def to_dict(self):
+        """Convertir a diccionario"""
+        return {
+            'id': self.id,
+            'producto_id': self.producto_id,
+            'codigo': self.producto.codigo if self.producto else None,
+            'nombre': self.producto.nombre if self.producto else None,
+            'nuevo_costo': float(self.nuevo_costo) if self.nuevo_costo is not None else None,
+            'nuevo_margen': float(self.nuevo_margen) if self.nuevo_margen is not None else None,
+            'nuevo_precio': float(self.nuevo_precio) if self.nuevo_precio is not None else None,
+            'vigente_desde': self.vigente_desde.isoformat() if self.vigente_desde else None,
+            'lote': self.lote,
+            'estado': self.estado,
+            'precio_anterior': float(self.precio_anterior) if self.precio_anterior is not None else None,
+            'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None,
+            'fecha_aplicacion': self.fecha_aplicacion.isoformat() if self.fecha_aplicacion else None
+        }
+
+
 class Factura(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     numero = db.Column(db.String(50), unique=True)
@@ -457,12 +698,17 @@ class Factura(db.Model):
     
     cliente = db.relationship('Cliente', backref='facturas')
     usuario = db.relationship('Usuario', backref='facturas')
+    
+    __table_args__ = (
+        db.Index('idx_factura_fecha_estado', 'fecha', 'estado'),
+        db.Index('idx_factura_fecha_id', 'fecha', 'id'),
+    )
 
 class DetalleFactura(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     factura_id = db.Column(db.Integer, db.ForeignKey('factura.id'))
     producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'))
-    cantidad = db.Column(db.Integer, nullable=False)
+    cantidad = db.Column(Numeric(10, 3), nullable=False)  # Kilos con decimales en productos pesables
     precio_unitario = db.Column(Numeric(10, 2), nullable=False)
     subtotal = db.Column(Numeric(10, 2), nullable=False)
     porcentaje_iva = db.Column(Numeric(5, 2), nullable=False, default=21.00)  # ← NUEVO CAMPO
@@ -470,6 +716,10 @@ class DetalleFactura(db.Model):
     
     factura = db.relationship('Factura', backref='detalles')
     producto = db.relationship('Producto', backref='detalles_factura')
+    
+    __table_args__ = (
+        db.Index('idx_detalle_factura_producto', 'factura_id', 'producto_id'),
+    )
 
 class DescuentoFactura(db.Model):
     """Registro de descuentos aplicados a facturas - tabla independiente"""
@@ -514,6 +764,10 @@ class MedioPago(db.Model):
     # Relación con Factura
     factura = db.relationship('Factura', backref=db.backref('medios_pago', lazy=True))
     
+    __table_args__ = (
+        db.Index('idx_medios_pago_fecha_medio', 'fecha_registro', 'medio_pago'),
+    )
+    
     def __repr__(self):
         return f'<MedioPago {self.medio_pago}: ${self.importe}>'
     
@@ -543,16 +797,31 @@ class MedioPago(db.Model):
         try:
             from sqlalchemy import func, and_
             
-            resultado = db.session.query(
-                MedioPago.medio_pago,
-                func.sum(MedioPago.importe).label('total'),
-                func.count(MedioPago.id).label('cantidad_operaciones')
-            ).filter(
-                and_(
-                    MedioPago.fecha_registro >= fecha_desde,
-                    MedioPago.fecha_registro <= fecha_hasta
-                )
-            ).group_by(MedioPago.medio_pago).all()
+            if fecha_desde == datetime.combine(fecha_desde.date(), datetime.min.time()):
+                # Rango de días completos: leer el resumen diario
+                # (hasta puede ser 23:59:59 del último día o 00:00 del día siguiente)
+                ultimo_dia = (fecha_hasta - timedelta(microseconds=1)).date()
+                resultado = db.session.query(
+                    VentaDiariaMedioPago.medio_pago,
+                    func.sum(VentaDiariaMedioPago.importe).label('total'),
+                    func.sum(VentaDiariaMedioPago.operaciones).label('cantidad_operaciones')
+                ).filter(
+                    and_(
+                        VentaDiariaMedioPago.fecha >= fecha_desde.date(),
+                        VentaDiariaMedioPago.fecha <= ultimo_dia
+                    )
+                ).group_by(VentaDiariaMedioPago.medio_pago).all()
+            else:
+                resultado = db.session.query(
+                    MedioPago.medio_pago,
+                    func.sum(MedioPago.importe).label('total'),
+                    func.count(MedioPago.id).label('cantidad_operaciones')
+                ).filter(
+                    and_(
+                        MedioPago.fecha_registro >= fecha_desde,
+                        MedioPago.fecha_registro <= fecha_hasta
+                    )
+                ).group_by(MedioPago.medio_pago).all()
             
             # Convertir a diccionario
             recaudacion = {}
@@ -561,7 +830,7 @@ class MedioPago(db.Model):
             for medio, total, cantidad in resultado:
                 recaudacion[medio] = {
                     'total': float(total),
-                    'cantidad_operaciones': cantidad
+                    'cantidad_operaciones': int(cantidad or 0)
                 }
                 total_general += float(total)
             
@@ -597,6 +866,10 @@ class Gasto(db.Model):
     # Relación con Usuario
     usuario = db.relationship('Usuario', backref=db.backref('gastos', lazy=True))
     
+    __table_args__ = (
+        db.Index('idx_gastos_fecha_activo', 'fecha', 'activo'),
+    )
+    
     def __repr__(self):
         return f'<Gasto {self.descripcion}: ${self.monto}>'
     
@@ -696,510 +969,1741 @@ class Gasto(db.Model):
         except Exception as e:
             print(f"Error obteniendo gastos por medio: {e}")
             return {}
-# ================== RUTAS API PARA REPORTES ==================
 
 
-@app.route('/api/reporte_medios_pago')
-def api_reporte_medios_pago():
-    try:
-        fecha_desde = request.args.get('desde')
-        fecha_hasta = request.args.get('hasta')
+class VentaDiariaProducto(db.Model):
+    """Resumen diario de ventas por producto y estado de factura (mantenido en cada venta)"""
+    __tablename__ = 'ventas_diarias_producto'
+    
+    fecha = db.Column(db.Date, primary_key=True)
+    producto_id = db.Column(db.Integer, primary_key=True, index=True)
+    estado = db.Column(db.String(20), primary_key=True)
+    cantidad = db.Column(Numeric(14, 3), nullable=False, default=0)  # unidades vendidas (combos como 1)
+    cantidad_real = db.Column(Numeric(14, 3), nullable=False, default=0)  # combos × cantidad_combo
+    subtotal = db.Column(Numeric(14, 2), nullable=False, default=0)
+    suma_precio_unitario = db.Column(Numeric(16, 2), nullable=False, default=0)  # para el precio promedio
+    num_lineas = db.Column(db.Integer, nullable=False, default=0)
+    ultima_venta = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<VentaDiariaProducto {self.fecha} #{self.producto_id} {self.estado}: {self.cantidad}>'
 
-        if not fecha_desde or not fecha_hasta:
-            return jsonify({'success': False, 'error': 'Fechas requeridas'})
 
-        desde = datetime.strptime(fecha_desde, "%Y-%m-%d")
-        hasta = datetime.strptime(fecha_hasta, "%Y-%m-%d") + timedelta(days=1)
+class VentaDiariaMedioPago(db.Model):
+    """Resumen diario de recaudación por medio de pago (mantenido en cada venta)"""
+    __tablename__ = 'ventas_diarias_medio_pago'
+    
+    fecha = db.Column(db.Date, primary_key=True)
+    medio_pago = db.Column(db.String(20), primary_key=True)
+    importe = db.Column(Numeric(14, 2), nullable=False, default=0)
+    operaciones = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<VentaDiariaMedioPago {self.fecha} {self.medio_pago}: ${self.importe}>'
 
-        datos = MedioPago.calcular_recaudacion_por_fecha(desde, hasta)
 
-        medios_pago = []
-        if datos and 'recaudacion_por_medio' in datos:
-            for medio, valores in datos['recaudacion_por_medio'].items():
-                medios_pago.append({
-                    'medio_pago': medio,
-                    'total': valores['total'],
-                    'cantidad': valores['cantidad_operaciones']
-                })
+# ================== CACHE DE PRODUCTOS POR CÓDIGO ==================
+# Índice en memoria código → id de productos activos. Se arma con una sola
+# consulta y se invalida cuando se confirma (commit) un cambio de código,
+# estado, alta o baja de productos. Los cambios de stock no lo invalidan.
+#
+# Los datos derivados de todo el catálogo (precios, stock, combos, ofertas)
+# se guardan aparte y se invalidan con cualquier cambio confirmado de
+# productos u ofertas por volumen.
 
-        return jsonify({
-            'success': True,
-            'reporte': {
-                'medios_pago': medios_pago,
-                'total_general': datos['total_general'] if datos else 0
-            }
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+_cache_codigos_producto = {'indice': None, 'generacion': 0}
+_cache_datos_catalogo = {}
+_cache_codigos_lock = threading.Lock()
 
 
-@app.route('/api/reporte_gastos')
-def api_reporte_gastos():
-    try:
-        fecha_desde = request.args.get('desde')
-        fecha_hasta = request.args.get('hasta')
+def obtener_id_producto_por_codigo(codigo):
+    """Resolver un código de producto activo a su id usando el cache"""
+    indice = _cache_codigos_producto['indice']
+    
+    if indice is None:
+        # Se arma fuera del lock: la invalidación al confirmar (en cada venta)
+        # no tiene que esperar esta consulta
+        generacion = _cache_codigos_producto['generacion']
+        filas = db.session.query(Producto.codigo, Producto.id).filter(
+            Producto.activo == True
+        ).all()
+        indice = {codigo_producto: producto_id for codigo_producto, producto_id in filas}
+        
+        # Solo publicar si nadie invalidó mientras se armaba
+        with _cache_codigos_lock:
+            if generacion == _cache_codigos_producto['generacion']:
+                _cache_codigos_producto['indice'] = indice
+    
+    return indice.get(codigo)
 
-        if not fecha_desde or not fecha_hasta:
-            return jsonify({'success': False, 'error': 'Fechas requeridas'})
 
-        desde = datetime.strptime(fecha_desde, "%Y-%m-%d")
-        hasta = datetime.strptime(fecha_hasta, "%Y-%m-%d") + timedelta(days=1)
+def obtener_cache_catalogo(nombre, construir):
+    """Obtener datos derivados del catálogo, armándolos con construir() si no están en cache.
+    
+    El resultado es compartido entre requests: no modificarlo.
+    """
+    datos = _cache_datos_catalogo.get(nombre)
+    
+    if datos is None:
+        # construir() consulta la base fuera del lock (ver obtener_id_producto_por_codigo)
+        generacion = _cache_codigos_producto['generacion']
+        datos = construir()
+        
+        # Solo publicar si nadie invalidó mientras se armaba
+        with _cache_codigos_lock:
+            if generacion == _cache_codigos_producto['generacion']:
+                _cache_datos_catalogo[nombre] = datos
+    
+    return datos
 
-        datos = Gasto.calcular_gastos_por_fecha(desde, hasta)
 
-        gastos = []
-        if datos and 'gastos_por_categoria' in datos:
-            for categoria, valores in datos['gastos_por_categoria'].items():
-                gastos.append({
-                    'categoria': categoria,
-                    'total': valores['total'],
-                    'cantidad': valores['cantidad_gastos']
-                })
+def invalidar_caches_catalogo():
+    """Invalidar los caches en memoria que dependen del catálogo de productos"""
+    with _cache_codigos_lock:
+        _cache_codigos_producto['indice'] = None
+        _cache_datos_catalogo.clear()
+        _cache_codigos_producto['generacion'] += 1
 
-        return jsonify({
-            'success': True,
-            'reporte': {
-                'gastos': gastos,
-                'total_general': datos['total_general'] if datos else 0
-            }
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
 
+def invalidar_datos_catalogo():
+    """Invalidar solo los datos derivados (precios, stock, ofertas), no el índice de códigos"""
+    with _cache_codigos_lock:
+        _cache_datos_catalogo.clear()
+        _cache_codigos_producto['generacion'] += 1
 
-@app.route('/api/reporte_caja_diaria')
-def api_reporte_caja_diaria():
-    print(">>> API reporte_caja_diaria llamada")
-    try:
-        fecha_desde = request.args.get('desde')
-        fecha_hasta = request.args.get('hasta')
 
-        if not fecha_desde or not fecha_hasta:
-            return jsonify({'success': False, 'error': 'Fechas requeridas'})
+def _cambio_afecta_catalogo(session):
+    """Detectar si el flush incluye cambios de productos relevantes para los caches"""
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Producto):
+            return True
+    
+    for obj in session.dirty:
+        if isinstance(obj, Producto):
+            estado = sa_inspect(obj)
+            if estado.attrs.codigo.history.has_changes() or estado.attrs.activo.history.has_changes():
+                return True
+    
+    return False
 
-        desde = datetime.strptime(fecha_desde, "%Y-%m-%d")
-        hasta = datetime.strptime(fecha_hasta, "%Y-%m-%d") + timedelta(days=1)
 
-        ingresos = MedioPago.calcular_recaudacion_por_fecha(desde, hasta)
-        gastos = Gasto.calcular_gastos_por_fecha(desde, hasta)
+def _cambio_afecta_datos_catalogo(session):
+    """Detectar cualquier cambio de productos u ofertas por volumen en el flush"""
+    for obj in list(session.new) + list(session.deleted) + list(session.dirty):
+        if isinstance(obj, (Producto, OfertaVolumen)):
+            return True
+    return False
 
-        total_ingresos = ingresos['total_general'] if ingresos else 0
-        total_gastos = gastos['total_general'] if gastos else 0
-        balance = total_ingresos - total_gastos
 
-        detalle_ingresos = []
-        if ingresos and 'recaudacion_por_medio' in ingresos:
-            for medio, valores in ingresos['recaudacion_por_medio'].items():
-                detalle_ingresos.append({
-                    'medio_pago': medio,
-                    'total': valores['total'],
-                    'cantidad': valores['cantidad_operaciones']
-                })
+@event.listens_for(db.session, 'after_flush')
+def _marcar_cambios_catalogo(session, flush_context):
+    if _cambio_afecta_catalogo(session):
+        session.info['catalogo_modificado'] = True
+    if _cambio_afecta_datos_catalogo(session):
+        session.info['datos_catalogo_modificados'] = True
 
-        detalle_gastos = []
-        if gastos and 'gastos_por_categoria' in gastos:
-            for categoria, valores in gastos['gastos_por_categoria'].items():
-                detalle_gastos.append({
-                    'categoria': categoria,
-                    'total': valores['total'],
-                    'cantidad': valores['cantidad_gastos']
-                })
 
-        return jsonify({
-            'success': True,
-            'totalIngresos': total_ingresos,
-            'totalGastos': total_gastos,
-            'balance': balance,
-            'detalleIngresos': detalle_ingresos,
-            'detalleGastos': detalle_gastos
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_catalogo_al_confirmar(session):
+    datos_modificados = session.info.pop('datos_catalogo_modificados', False)
+    if session.info.pop('catalogo_modificado', False):
+        invalidar_caches_catalogo()
+    elif datos_modificados:
+        invalidar_datos_catalogo()
 
 
-# Clase para manejo de ARCA/AFIP
-class ARCAClient:
-    def __init__(self):
-        self.config = ARCA_CONFIG
-        self.token = None
-        self.sign = None
-        self.cuit = self.config.CUIT
-        self.openssl_path = self._buscar_openssl()
-        
-        print(f"🔧 AFIP Client inicializado")
-        print(f"   CUIT: {self.config.CUIT}")
-        print(f"   Ambiente: {'HOMOLOGACIÓN' if self.config.USE_HOMOLOGACION else 'PRODUCCIÓN'}")
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_cambios_catalogo(session):
+    session.info.pop('catalogo_modificado', None)
+    session.info.pop('datos_catalogo_modificados', None)
+
+
+# ================== CLASIFICADOR DE CATEGORÍAS ==================
+# Las reglas de reglas_categoria se compilan una sola vez en un clasificador
+# que se comparte entre requests; se vuelve a armar cuando se confirma un
+# cambio de reglas.
+
+_cache_clasificador = {'clasificador': None, 'generacion': 0}
+_cache_clasificador_lock = threading.Lock()
+
+
+def obtener_clasificador_categorias():
+    """Clasificador compilado con las reglas activas"""
+    clasificador = _cache_clasificador['clasificador']
     
-    def _buscar_openssl(self):
-        """Buscar OpenSSL en ubicaciones conocidas"""
-        ubicaciones = [
-            './openssl.exe',
-            'openssl.exe', 
-            'openssl',
-            r'C:\Program Files\OpenSSL-Win64\bin\openssl.exe',
-            r'C:\OpenSSL-Win64\bin\openssl.exe',
-            r'C:\Program Files (x86)\OpenSSL-Win32\bin\openssl.exe'
-        ]
+    if clasificador is None:
+        # Se arma fuera del lock, que solo protege el reemplazo
+        generacion = _cache_clasificador['generacion']
+        reglas = db.session.query(
+            ReglaCategoria.palabra, ReglaCategoria.categoria, ReglaCategoria.prioridad
+        ).filter(
+            ReglaCategoria.activo == True
+        ).order_by(ReglaCategoria.prioridad.desc(), ReglaCategoria.id).all()
         
-        for ubicacion in ubicaciones:
-            try:
-                if os.path.exists(ubicacion) or ubicacion in ['openssl.exe', 'openssl']:
-                    result = subprocess.run([ubicacion, 'version'], 
-                                          capture_output=True, text=True, timeout=5)
-                    if result.returncode == 0:
-                        print(f"✅ OpenSSL encontrado: {ubicacion}")
-                        return ubicacion
-            except:
-                continue
+        clasificador = crear_clasificador_categorias(reglas)
         
-        print("❌ OpenSSL no encontrado, usando 'openssl' por defecto")
-        return 'openssl'
+        # Solo publicar si no cambiaron las reglas mientras se armaba
+        with _cache_clasificador_lock:
+            if generacion == _cache_clasificador['generacion']:
+                _cache_clasificador['clasificador'] = clasificador
     
-    def crear_tra(self):
-        """Crear Ticket Request Access"""
-        now = datetime.now()
-        expire = now + timedelta(hours=12)
-        unique_id = int(now.timestamp())
+    return clasificador
+
+
+def inicializar_reglas_categoria():
+    """Cargar las reglas iniciales si la tabla de reglas está vacía"""
+    try:
+        if ReglaCategoria.query.first() is not None:
+            return
         
-        tra_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
-<loginTicketRequest version="1.0">
-    <header>
-        <uniqueId>{unique_id}</uniqueId>
-        <generationTime>{now.strftime('%Y-%m-%dT%H:%M:%S.000-00:00')}</generationTime>
-        <expirationTime>{expire.strftime('%Y-%m-%dT%H:%M:%S.000-00:00')}</expirationTime>
-    </header>
-    <service>wsfe</service>
-</loginTicketRequest>'''
+        for palabra, categoria, prioridad in REGLAS_CATEGORIA_DEFECTO:
+            db.session.add(ReglaCategoria(palabra=palabra, categoria=categoria, prioridad=prioridad))
+        db.session.commit()
+        print(f"✅ Reglas de categorías cargadas: {len(REGLAS_CATEGORIA_DEFECTO)}")
         
-        return tra_xml
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error cargando reglas de categorías: {e}")
+        raise
+
+
+@event.listens_for(db.session, 'after_flush')
+def _marcar_cambios_reglas_categoria(session, flush_context):
+    for obj in list(session.new) + list(session.deleted) + list(session.dirty):
+        if isinstance(obj, ReglaCategoria):
+            session.info['reglas_categoria_modificadas'] = True
+            return
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_clasificador_al_confirmar(session):
+    if session.info.pop('reglas_categoria_modificadas', False):
+        with _cache_clasificador_lock:
+            _cache_clasificador['clasificador'] = None
+            _cache_clasificador['generacion'] += 1
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_cambios_reglas_categoria(session):
+    session.info.pop('reglas_categoria_modificadas', None)
+
+
+# ================== VERSIÓN DEL CATÁLOGO (REGISTRO DE CAMBIOS) ==================
+# Cada alta, modificación o baja de productos y ofertas agrega una fila a
+# catalogo_cambios dentro de la misma transacción. El id de la última fila
+# es la versión del catálogo que usan el snapshot y el delta de la caja.
+# Los ids se asignan al insertar y no al confirmar: una transacción larga
+# (una venta esperando a AFIP) puede confirmar un id menor que la versión
+# que una caja ya leyó. Por eso el delta vuelve a enviar los cambios de un
+# margen de tiempo anterior a la versión de referencia.
+
+def _registrar_cambio_catalogo(connection, entidad, entidad_id):
+    connection.execute(
+        CatalogoCambio.__table__.insert().values(
+            entidad=entidad,
+            entidad_id=entidad_id,
+            fecha=datetime.now()
+        )
+    )
+
+
+def _tiene_cambios_columnas(target, excluir=()):
+    estado = sa_inspect(target)
+    return any(
+        estado.attrs[col.key].history.has_changes()
+        for col in estado.mapper.column_attrs if col.key not in excluir
+    )
+
+
+@event.listens_for(Producto, 'after_insert')
+@event.listens_for(Producto, 'after_delete')
+def _producto_alta_baja(mapper, connection, target):
+    _registrar_cambio_catalogo(connection, 'producto', target.id)
+
+
+# El stock cambia con cada venta: viaja a las cajas en el evento 'stock' del
+# canal SSE y no genera filas en el registro (crecería una por línea vendida)
+COLUMNAS_SIN_VERSION_CATALOGO = {'stock', 'fecha_modificacion'}
+
+
+@event.listens_for(Producto, 'after_update')
+def _producto_modificado(mapper, connection, target):
+    if _tiene_cambios_columnas(target, excluir=COLUMNAS_SIN_VERSION_CATALOGO):
+        _registrar_cambio_catalogo(connection, 'producto', target.id)
+
+
+@event.listens_for(OfertaVolumen, 'after_insert')
+@event.listens_for(OfertaVolumen, 'after_delete')
+def _oferta_alta_baja(mapper, connection, target):
+    _registrar_cambio_catalogo(connection, 'oferta', target.producto_id)
+
+
+@event.listens_for(OfertaVolumen, 'after_update')
+def _oferta_modificada(mapper, connection, target):
+    if _tiene_cambios_columnas(target):
+        _registrar_cambio_catalogo(connection, 'oferta', target.producto_id)
+
+
+# ================== DESCUENTO DE COMBOS (COLUMNA PERSISTIDA) ==================
+# descuento_porcentaje se mantiene igual a ((precio_base * cantidad - precio) /
+# (precio_base * cantidad)) * 100 usando el precio ACTUAL del producto base,
+# para poder filtrar y ordenar combos por descuento en la base de datos.
+
+def _expresion_descuento_combo(tabla_combo, precio_base):
+    """Expresión SQL del descuento de un combo dado el precio unitario del producto base"""
+    precio_normal = precio_base * tabla_combo.c.cantidad_combo
+    return case(
+        (precio_normal > 0, (precio_normal - tabla_combo.c.precio) * 100 / precio_normal),
+        else_=0
+    )
+
+
+@event.listens_for(Producto, 'before_insert')
+@event.listens_for(Producto, 'before_update')
+def _sincronizar_descuento_combo(mapper, connection, target):
+    """Recalcular el descuento cuando cambia el combo (precio, cantidad o base)"""
+    if not target.es_combo or not target.producto_base_id:
+        return
     
-    def firmar_tra_openssl(self, tra_xml):
-        """Firmar TRA usando OpenSSL"""
-        try:
-            import tempfile
-            
-            print(f"🔐 Firmando TRA con OpenSSL: {self.openssl_path}")
-            
-            # Verificar certificados
-            if not os.path.exists(self.config.CERT_PATH):
-                raise Exception(f"Certificado no encontrado: {self.config.CERT_PATH}")
-            if not os.path.exists(self.config.KEY_PATH):
-                raise Exception(f"Clave privada no encontrada: {self.config.KEY_PATH}")
-            
-            # Crear archivos temporales
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as tra_file:
-                tra_file.write(tra_xml)
-                tra_temp = tra_file.name
-            
-            with tempfile.NamedTemporaryFile(suffix='.cms', delete=False) as cms_file:
-                cms_temp = cms_file.name
-            
-            try:
-                # Comando OpenSSL
-                cmd = [
-                    self.openssl_path, 'smime', '-sign',
-                    '-in', tra_temp,
-                    '-out', cms_temp,
-                    '-signer', self.config.CERT_PATH,
-                    '-inkey', self.config.KEY_PATH,
-                    '-outform', 'DER',
-                    '-nodetach'
+    estado = sa_inspect(target)
+    if estado.persistent and not any(
+        estado.attrs[campo].history.has_changes()
+        for campo in ('precio', 'cantidad_combo', 'producto_base_id', 'es_combo')
+    ):
+        return
+    
+    precio_base = connection.execute(
+        select(Producto.precio).where(Producto.id == target.producto_base_id)
+    ).scalar()
+    
+    precio_normal = Decimal(str(precio_base or 0)) * Decimal(str(target.cantidad_combo or 1))
+    if precio_normal > 0:
+        descuento = (precio_normal - Decimal(str(target.precio))) * 100 / precio_normal
+    else:
+        descuento = Decimal('0')
+    target.descuento_porcentaje = descuento.quantize(Decimal('0.01'))
+
+
+# ================== PROPAGACIÓN DE PRECIOS A COMBOS ==================
+# Cuando cambia el precio o el costo de un producto base, todos sus combos se
+# recalculan con un UPDATE por tramo de productos base: precio unitario, costo
+# (costo base * cantidad) y, según la política, el descuento (se mantiene el
+# precio del combo) o el precio (se mantiene el porcentaje de descuento).
+
+POLITICAS_COMBOS = ('mantener_precio', 'mantener_descuento')
+
+
+def politica_combos(politica=None):
+    """Política pedida o la configurada; error si no es válida"""
+    politica = politica or app.config.get('COMBOS_POLITICA_PRECIO', 'mantener_precio')
+    if politica not in POLITICAS_COMBOS:
+        raise ValueError(f"Política de combos inválida: {politica} (usar {' o '.join(POLITICAS_COMBOS)})")
+    return politica
+
+
+def _sentencia_propagar_combos(ids_base, politica, ahora, excluir=None):
+    """UPDATE de los combos derivados de los productos base indicados (salvo los ids de 'excluir')"""
+    tabla = Producto.__table__
+    base = tabla.alias('base')
+    
+    valores = {
+        'precio_unitario_base': base.c.precio,
+        'costo': func.round(func.coalesce(base.c.costo, 0) * tabla.c.cantidad_combo, 2),
+        'fecha_modificacion': ahora
+    }
+    if politica == 'mantener_descuento':
+        valores['precio'] = func.round(
+            base.c.precio * tabla.c.cantidad_combo * (100 - func.coalesce(tabla.c.descuento_porcentaje, 0)) / 100, 2
+        )
+    else:
+        valores['descuento_porcentaje'] = _expresion_descuento_combo(tabla, base.c.precio)
+    
+    condiciones = [
+        tabla.c.producto_base_id == base.c.id,
+        tabla.c.es_combo == True,
+        base.c.id.in_(ids_base)
+    ]
+    if excluir is not None:
+        condiciones.append(tabla.c.id.notin_(excluir))
+    
+    return update(tabla).where(*condiciones).values(**valores)
+
+
+def propagar_precios_combos(ids_base, politica=None, excluir=None, tamano_tramo=500):
+    """Recalcular los combos derivados de los productos base (sin confirmar); devuelve cuántos.
+    
+    'excluir' son combos que no se tocan (por ejemplo, los que recibieron un precio propio).
+    """
+    politica = politica_combos(politica)
+    ids_base = list(ids_base)
+    ahora = datetime.now()
+    
+    actualizados = 0
+    for inicio in range(0, len(ids_base), tamano_tramo):
+        actualizados += db.session.execute(
+            _sentencia_propagar_combos(ids_base[inicio:inicio + tamano_tramo], politica, ahora, excluir)
+        ).rowcount
+    return actualizados
+
+
+@event.listens_for(Producto, 'after_update')
+def _propagar_precios_a_combos(mapper, connection, target):
+    """Cuando cambia el precio o el costo de un producto base, actualizar sus combos en un solo UPDATE"""
+    if target.es_combo:
+        return
+    
+    estado = sa_inspect(target)
+    if not (estado.attrs.precio.history.has_changes() or estado.attrs.costo.history.has_changes()):
+        return
+    
+    connection.execute(_sentencia_propagar_combos([target.id], politica_combos(), datetime.now()))
+
+
+def sincronizar_descuentos_combos():
+    """Recalcular descuento_porcentaje de todos los combos con un único UPDATE"""
+    try:
+        # Crear el índice en bases existentes (create_all no modifica tablas ya creadas)
+        for indice in Producto.__table__.indexes:
+            indice.create(db.engine, checkfirst=True)
+        
+        tabla = Producto.__table__
+        base = tabla.alias('base')
+        resultado = db.session.execute(
+            update(tabla)
+            .where(
+                tabla.c.producto_base_id == base.c.id,
+                tabla.c.es_combo == True
+            )
+            .values(descuento_porcentaje=_expresion_descuento_combo(tabla, base.c.precio))
+        )
+        db.session.commit()
+        print(f"✅ Descuentos de combos sincronizados: {resultado.rowcount} combos")
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error sincronizando descuentos de combos: {e}")
+        raise
+
+
+# ================== NOMBRE NORMALIZADO DE CLIENTES ==================
+# cliente.nombre_normalizado guarda el nombre en minúsculas, sin acentos y con
+# espacios simples. Está indexado para buscar clientes por prefijo.
+
+def normalizar_texto_busqueda(texto):
+    """Minúsculas, sin acentos y con espacios simples"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+
+@event.listens_for(Cliente, 'before_insert')
+@event.listens_for(Cliente, 'before_update')
+def _normalizar_nombre_cliente(mapper, connection, target):
+    target.nombre_normalizado = normalizar_texto_busqueda(target.nombre)[:100]
+
+
+def sincronizar_nombres_clientes(tamano_lote=1000):
+    """Agregar la columna en bases existentes y completar los nombres normalizados"""
+    try:
+        tabla = Cliente.__table__
+        columnas = {columna['name'] for columna in sa_inspect(db.engine).get_columns(tabla.name)}
+        if 'nombre_normalizado' not in columnas:
+            print("🔧 Agregando columna cliente.nombre_normalizado...")
+            with db.engine.begin() as conexion:
+                conexion.exec_driver_sql(
+                    f"ALTER TABLE {tabla.name} ADD COLUMN nombre_normalizado VARCHAR(100)"
+                )
+        for indice in tabla.indexes:
+            indice.create(db.engine, checkfirst=True)
+        
+        completados = 0
+        while True:
+            pendientes = db.session.query(Cliente.id, Cliente.nombre).filter(
+                Cliente.nombre_normalizado.is_(None)
+            ).limit(tamano_lote).all()
+            if not pendientes:
+                break
+            
+            db.session.execute(
+                update(tabla).where(tabla.c.id == bindparam('cliente_id')),
+                [
+                    {'cliente_id': cliente_id, 'nombre_normalizado': normalizar_texto_busqueda(nombre)[:100]}
+                    for cliente_id, nombre in pendientes
                 ]
-                
-                print(f"📝 Ejecutando firma...")
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-                
-                if result.returncode != 0:
-                    raise Exception(f"Error OpenSSL: {result.stderr}")
-                
-                # Leer archivo firmado
-                with open(cms_temp, 'rb') as f:
-                    cms_data = f.read()
-                
-                if len(cms_data) == 0:
-                    raise Exception("Archivo CMS vacío")
-                
-                # Codificar en base64
-                cms_b64 = base64.b64encode(cms_data).decode('utf-8')
-                
-                print("✅ TRA firmado correctamente")
-                return cms_b64
-                
-            finally:
-                # Limpiar archivos temporales
-                try:
-                    os.unlink(tra_temp)
-                    os.unlink(cms_temp)
-                except:
-                    pass
-                    
-        except Exception as e:
-            print(f"❌ Error firmando TRA: {e}")
-            raise Exception(f"Error firmando TRA: {e}")
+            )
+            db.session.commit()
+            completados += len(pendientes)
+        
+        if completados:
+            print(f"✅ Nombres de clientes normalizados: {completados}")
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error sincronizando nombres de clientes: {e}")
+        raise
+
+
+# ================== RESÚMENES DIARIOS DE VENTAS ==================
+# ventas_diarias_producto y ventas_diarias_medio_pago se actualizan en la
+# misma transacción que la venta. Un cambio de estado de la factura (anulada,
+# autorizada al reintentar, etc.) mueve sus importes entre estados. Los
+# reportes leen estos resúmenes en lugar de recorrer detalle_factura.
+
+def rango_dia(dia):
+    """Rango semiabierto [inicio, fin) de un día, para filtrar columnas DATETIME usando índices"""
+    inicio = datetime.combine(dia, datetime.min.time())
+    return inicio, inicio + timedelta(days=1)
+
+
+def _cantidad_real_detalle():
+    """Cantidad en unidades reales: los combos cuentan cantidad × cantidad_combo"""
+    return case(
+        (Producto.es_combo == True, DetalleFactura.cantidad * Producto.cantidad_combo),
+        else_=DetalleFactura.cantidad
+    )
+
+
+def _upsert_sumando(connection, tabla, filas, claves, maximos=()):
+    """INSERT ... ON DUPLICATE KEY UPDATE sumando las columnas que no son clave
     
-    def get_ticket_access(self):
-        """Obtener ticket de acceso de WSAA con cache inteligente"""
+    Las columnas de 'maximos' conservan el mayor valor; un NULL en la fila
+    nueva (al restar una factura) no borra el valor guardado.
+    """
+    if not filas:
+        return
+    
+    sumas = [col.name for col in tabla.columns if col.name not in claves and col.name not in maximos]
+    
+    if connection.dialect.name == 'mysql':
+        stmt = mysql_insert(tabla).values(filas)
+        cambios = {col: tabla.c[col] + stmt.inserted[col] for col in sumas}
+        for col in maximos:
+            cambios[col] = func.greatest(
+                func.coalesce(tabla.c[col], stmt.inserted[col]),
+                func.coalesce(stmt.inserted[col], tabla.c[col])
+            )
+        stmt = stmt.on_duplicate_key_update(**cambios)
+    else:
+        # Otros motores (desarrollo): INSERT ... ON CONFLICT
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(tabla).values(filas)
+        cambios = {col: tabla.c[col] + stmt.excluded[col] for col in sumas}
+        for col in maximos:
+            cambios[col] = func.max(
+                func.coalesce(tabla.c[col], stmt.excluded[col]),
+                func.coalesce(stmt.excluded[col], tabla.c[col])
+            )
+        stmt = stmt.on_conflict_do_update(index_elements=list(claves), set_=cambios)
+    
+    connection.execute(stmt)
+
+
+def _aplicar_factura_a_resumen_productos(connection, factura_id, fecha, estado, signo):
+    """Sumar (signo=1) o restar (signo=-1) los detalles de una factura al resumen por producto"""
+    filas = connection.execute(
+        select(
+            DetalleFactura.producto_id,
+            func.sum(DetalleFactura.cantidad).label('cantidad'),
+            func.sum(func.coalesce(_cantidad_real_detalle(), DetalleFactura.cantidad)).label('cantidad_real'),
+            func.sum(DetalleFactura.subtotal).label('subtotal'),
+            func.sum(DetalleFactura.precio_unitario).label('suma_precio_unitario'),
+            func.count(DetalleFactura.id).label('num_lineas')
+        ).select_from(DetalleFactura).outerjoin(
+            Producto, Producto.id == DetalleFactura.producto_id
+        ).where(
+            DetalleFactura.factura_id == factura_id
+        ).group_by(DetalleFactura.producto_id)
+    ).all()
+    
+    dia = fecha.date()
+    _upsert_sumando(
+        connection,
+        VentaDiariaProducto.__table__,
+        [{
+            'fecha': dia,
+            'producto_id': fila.producto_id,
+            'estado': estado,
+            'cantidad': (fila.cantidad or 0) * signo,
+            'cantidad_real': (fila.cantidad_real or 0) * signo,
+            'subtotal': (fila.subtotal or 0) * signo,
+            'suma_precio_unitario': (fila.suma_precio_unitario or 0) * signo,
+            'num_lineas': (fila.num_lineas or 0) * signo,
+            'ultima_venta': fecha if signo > 0 else None
+        } for fila in filas if fila.producto_id is not None],
+        claves=('fecha', 'producto_id', 'estado'),
+        maximos=('ultima_venta',)
+    )
+    
+    if signo < 0:
+        tabla = VentaDiariaProducto.__table__
+        connection.execute(
+            tabla.delete().where(
+                tabla.c.fecha == dia,
+                tabla.c.estado == estado,
+                tabla.c.num_lineas <= 0
+            )
+        )
+
+
+def _aplicar_factura_a_resumen_medios(connection, factura_id, signo):
+    """Sumar (signo=1) o restar (signo=-1) los medios de pago de una factura al resumen diario"""
+    filas = connection.execute(
+        select(
+            MedioPago.medio_pago,
+            MedioPago.fecha_registro,
+            MedioPago.importe
+        ).where(MedioPago.factura_id == factura_id)
+    ).all()
+    
+    acumulado = {}
+    for fila in filas:
+        clave = (fila.fecha_registro.date(), fila.medio_pago)
+        importe, operaciones = acumulado.get(clave, (Decimal('0'), 0))
+        acumulado[clave] = (importe + Decimal(str(fila.importe)), operaciones + 1)
+    
+    _upsert_sumando(
+        connection,
+        VentaDiariaMedioPago.__table__,
+        [{
+            'fecha': dia,
+            'medio_pago': medio,
+            'importe': importe * signo,
+            'operaciones': operaciones * signo
+        } for (dia, medio), (importe, operaciones) in acumulado.items()],
+        claves=('fecha', 'medio_pago')
+    )
+
+
+def registrar_venta_en_resumenes(factura):
+    """Agregar una venta nueva a los resúmenes diarios con su estado final.
+    
+    Se llama justo antes del commit de la venta. Mientras la factura tenga
+    resumen_pendiente, los cambios de estado no tocan los resúmenes.
+    """
+    db.session.flush()
+    connection = db.session.connection()
+    _aplicar_factura_a_resumen_productos(connection, factura.id, factura.fecha, factura.estado or 'pendiente', 1)
+    _aplicar_factura_a_resumen_medios(connection, factura.id, 1)
+    factura.resumen_pendiente = False
+
+
+@event.listens_for(Factura, 'after_update')
+def _mover_factura_entre_estados(mapper, connection, target):
+    """Al cambiar el estado de una factura, mover sus importes al nuevo estado"""
+    if getattr(target, 'resumen_pendiente', False):
+        # Venta en curso: todavía no se sumó a los resúmenes
+        return
+    
+    historial = sa_inspect(target).attrs.estado.history
+    if not historial.has_changes() or not historial.deleted or historial.deleted[0] is None:
+        return
+    
+    estado_anterior = historial.deleted[0]
+    estado_nuevo = target.estado
+    if estado_anterior == estado_nuevo or not target.fecha:
+        return
+    
+    _aplicar_factura_a_resumen_productos(connection, target.id, target.fecha, estado_anterior, -1)
+    _aplicar_factura_a_resumen_productos(connection, target.id, target.fecha, estado_nuevo, 1)
+
+
+def reconstruir_resumenes_ventas(fecha_desde=None, fecha_hasta=None, dias_por_lote=31):
+    """Reconstruir los resúmenes diarios desde detalle_factura y medios_pago.
+    
+    Procesa el rango por lotes de días, cada uno en su propia transacción.
+    Sin fechas reconstruye todo el historial.
+    """
+    if fecha_desde is None:
+        primera = db.session.query(func.min(Factura.fecha)).scalar()
+        fecha_desde = primera.date() if primera else date.today()
+    if fecha_hasta is None:
+        fecha_hasta = date.today()
+    
+    tabla_productos = VentaDiariaProducto.__table__
+    tabla_medios = VentaDiariaMedioPago.__table__
+    dias_procesados = 0
+    
+    inicio = fecha_desde
+    while inicio <= fecha_hasta:
+        fin = min(inicio + timedelta(days=dias_por_lote - 1), fecha_hasta)
+        desde_dt = datetime.combine(inicio, datetime.min.time())
+        hasta_dt = datetime.combine(fin + timedelta(days=1), datetime.min.time())
+        
         try:
-            # *** NUEVO: Cache inteligente de tokens ***
-            if hasattr(self, 'token_timestamp') and self.token and self.sign:
-                # Verificar si el token aún es válido (duran 12 horas, usamos 10 horas para estar seguros)
-                tiempo_transcurrido = datetime.now() - self.token_timestamp
-                
-                if tiempo_transcurrido < timedelta(hours=10):
-                    print(f"🎫 Usando token existente (válido por {10 - tiempo_transcurrido.seconds//3600} horas más)")
-                    return True
-                else:
-                    print("⏰ Token expirado, obteniendo uno nuevo...")
-                    # Limpiar tokens viejos
-                    self.token = None
-                    self.sign = None
-                    delattr(self, 'token_timestamp')
-            
-            print("🎫 Obteniendo nuevo ticket de acceso...")
-            
-            # Crear y firmar TRA
-            tra_xml = self.crear_tra()
-            tra_firmado = self.firmar_tra_openssl(tra_xml)
-            
-            # URL del WSAA
-            wsaa_url = self.config.WSAA_URL + '?wsdl' if not self.config.WSAA_URL.endswith('?wsdl') else self.config.WSAA_URL
-            
-            print(f"🌐 Conectando con WSAA: {wsaa_url}")
-            
-            # USAR SESIÓN PERSONALIZADA
-            session = crear_session_afip()
-            
-            from zeep.transports import Transport
-            
-            transport = Transport(session=session, timeout=60)
-            client = Client(wsaa_url, transport=transport)
+            db.session.execute(tabla_productos.delete().where(
+                tabla_productos.c.fecha >= inicio, tabla_productos.c.fecha <= fin
+            ))
+            db.session.execute(tabla_medios.delete().where(
+                tabla_medios.c.fecha >= inicio, tabla_medios.c.fecha <= fin
+            ))
+            
+            dia = func.date(Factura.fecha)
+            db.session.execute(
+                tabla_productos.insert().from_select(
+                    ['fecha', 'producto_id', 'estado', 'cantidad', 'cantidad_real',
+                     'subtotal', 'suma_precio_unitario', 'num_lineas', 'ultima_venta'],
+                    select(
+                        dia,
+                        DetalleFactura.producto_id,
+                        func.coalesce(Factura.estado, 'pendiente'),
+                        func.sum(DetalleFactura.cantidad),
+                        func.sum(func.coalesce(_cantidad_real_detalle(), DetalleFactura.cantidad)),
+                        func.sum(DetalleFactura.subtotal),
+                        func.sum(DetalleFactura.precio_unitario),
+                        func.count(DetalleFactura.id),
+                        func.max(Factura.fecha)
+                    ).select_from(DetalleFactura).join(
+                        Factura, DetalleFactura.factura_id == Factura.id
+                    ).outerjoin(
+                        Producto, Producto.id == DetalleFactura.producto_id
+                    ).where(
+                        Factura.fecha >= desde_dt,
+                        Factura.fecha < hasta_dt,
+                        DetalleFactura.producto_id.isnot(None)
+                    ).group_by(dia, DetalleFactura.producto_id, func.coalesce(Factura.estado, 'pendiente'))
+                )
+            )
             
-            # Enviar solicitud
-            response = client.service.loginCms(tra_firmado)
+            dia_medio = func.date(MedioPago.fecha_registro)
+            db.session.execute(
+                tabla_medios.insert().from_select(
+                    ['fecha', 'medio_pago', 'importe', 'operaciones'],
+                    select(
+                        dia_medio,
+                        MedioPago.medio_pago,
+                        func.sum(MedioPago.importe),
+                        func.count(MedioPago.id)
+                    ).where(
+                        MedioPago.fecha_registro >= desde_dt,
+                        MedioPago.fecha_registro < hasta_dt
+                    ).group_by(dia_medio, MedioPago.medio_pago)
+                )
+            )
             
-            if response:
-                # Procesar respuesta XML
-                root = ET.fromstring(response)
-                
-                token_elem = root.find('.//token')
-                sign_elem = root.find('.//sign')
-                
-                if token_elem is None or sign_elem is None:
-                    raise Exception("Token o Sign no encontrados en respuesta")
-                
-                self.token = token_elem.text
-                self.sign = sign_elem.text
-                
-                # *** NUEVO: Guardar timestamp del token ***
-                self.token_timestamp = datetime.now()
-                
-                print("✅ Ticket de acceso obtenido y guardado en cache")
+            db.session.commit()
+            dias_procesados += (fin - inicio).days + 1
+            print(f"📊 Resúmenes reconstruidos: {inicio} a {fin}")
+            
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        inicio = fin + timedelta(days=1)
+    
+    # Los reportes cacheados pueden haber leído resúmenes incompletos
+    cache_reportes.limpiar()
+    return dias_procesados
+
+
+def consulta_resumen_ventas_productos(fecha_desde, fecha_hasta, categoria=None, orden='cantidad_desc', estado=None):
+    """Consulta agregada por producto leyendo ventas_diarias_producto (fechas inclusive)"""
+    query = db.session.query(
+        Producto.id,
+        Producto.codigo,
+        Producto.nombre,
+        Producto.descripcion,
+        Producto.categoria,
+        Producto.es_combo,
+        Producto.cantidad_combo,
+        func.sum(VentaDiariaProducto.cantidad_real).label('cantidad_real_vendida'),
+        func.sum(VentaDiariaProducto.cantidad).label('unidades_combos_vendidas'),
+        func.sum(VentaDiariaProducto.subtotal).label('total_vendido'),
+        (func.sum(VentaDiariaProducto.suma_precio_unitario) /
+         func.nullif(func.sum(VentaDiariaProducto.num_lineas), 0)).label('precio_promedio'),
+        func.max(VentaDiariaProducto.ultima_venta).label('ultima_venta'),
+        func.sum(VentaDiariaProducto.num_lineas).label('num_transacciones')
+    ).join(
+        VentaDiariaProducto, Producto.id == VentaDiariaProducto.producto_id
+    ).filter(
+        VentaDiariaProducto.fecha >= fecha_desde,
+        VentaDiariaProducto.fecha <= fecha_hasta
+    )
+    
+    if estado:
+        query = query.filter(VentaDiariaProducto.estado == estado)
+    
+    if categoria:
+        query = query.filter(Producto.categoria == categoria)
+    
+    query = query.group_by(
+        Producto.id,
+        Producto.codigo,
+        Producto.nombre,
+        Producto.descripcion,
+        Producto.categoria,
+        Producto.es_combo,
+        Producto.cantidad_combo
+    )
+    
+    if orden == 'cantidad_desc':
+        query = query.order_by(desc('cantidad_real_vendida'))
+    elif orden == 'cantidad_asc':
+        query = query.order_by(asc('cantidad_real_vendida'))
+    elif orden == 'total_desc':
+        query = query.order_by(desc('total_vendido'))
+    elif orden == 'total_asc':
+        query = query.order_by(asc('total_vendido'))
+    elif orden == 'codigo':
+        query = query.order_by(Producto.codigo)
+    elif orden == 'nombre':
+        query = query.order_by(Producto.nombre)
+    
+    return query
+
+
+def inicializar_resumenes_ventas():
+    """Armar los resúmenes la primera vez si hay facturas pero las tablas están vacías"""
+    try:
+        if db.session.query(VentaDiariaProducto.fecha).first() is None and \
+                db.session.query(Factura.id).first() is not None:
+            print("📊 Resúmenes de ventas vacíos: reconstruyendo historial...")
+            reconstruir_resumenes_ventas()
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error inicializando resúmenes de ventas: {e}")
+        raise
+
+
+@app.route('/api/resumenes_ventas/reconstruir', methods=['POST'])
+def api_reconstruir_resumenes_ventas():
+    """Reconstruir los resúmenes diarios de ventas (todo el historial o un rango)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        fecha_desde = data.get('fecha_desde') or request.args.get('fecha_desde')
+        fecha_hasta = data.get('fecha_hasta') or request.args.get('fecha_hasta')
+        
+        try:
+            desde = datetime.strptime(fecha_desde, '%Y-%m-%d').date() if fecha_desde else None
+            hasta = datetime.strptime(fecha_hasta, '%Y-%m-%d').date() if fecha_hasta else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Formato de fecha inválido. Use YYYY-MM-DD'}), 400
+        
+        print(f"🔄 Reconstruyendo resúmenes de ventas: {desde or 'inicio'} a {hasta or 'hoy'}")
+        dias = reconstruir_resumenes_ventas(desde, hasta)
+        
+        return jsonify({
+            'success': True,
+            'dias_procesados': dias,
+            'message': f'Resúmenes reconstruidos ({dias} días)'
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error reconstruyendo resúmenes: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ================== CACHE DE RESULTADOS DE REPORTES ==================
+# Los reportes se cachean por endpoint y parámetros. Las ventas, anulaciones
+# y gastos confirmados suben la versión de datos (invalida lo que incluye hoy)
+# y descartan los períodos cerrados que contienen la fecha modificada.
+
+cache_reportes = crear_cache_reportes(app.config.get('CACHE_REPORTES_MAX_ENTRADAS', 500))
+
+# Columnas de producto que se muestran en los reportes
+_COLUMNAS_PRODUCTO_REPORTES = ('codigo', 'nombre', 'descripcion', 'categoria', 'es_combo', 'cantidad_combo')
+
+
+def _fecha_de(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    return valor
+
+
+def _fechas_modificadas_reportes(session):
+    """Fechas de facturas, medios de pago y gastos tocados en el flush"""
+    fechas = set()
+    borrados = set(session.deleted)
+    
+    for obj in list(session.new) + list(session.dirty) + list(borrados):
+        if isinstance(obj, (Factura, Gasto)):
+            estado = sa_inspect(obj)
+            # Incluir la fecha anterior si se modificó
+            fechas.update(_fecha_de(valor) for valor in estado.attrs.fecha.history.deleted)
+            fechas.add(_fecha_de(estado.dict.get('fecha') if obj in borrados else obj.fecha))
+        elif isinstance(obj, MedioPago):
+            fechas.add(_fecha_de(obj.__dict__.get('fecha_registro')) or date.today())
+        elif isinstance(obj, DetalleFactura):
+            # Sin forzar la carga de la factura: si no está en memoria se asume hoy
+            factura = obj.__dict__.get('factura')
+            fechas.add(_fecha_de(factura.fecha) if factura is not None and factura.fecha else date.today())
+    
+    fechas.discard(None)
+    return fechas
+
+
+def _cambio_afecta_productos_reportes(session):
+    """Detectar cambios de los datos de producto que muestran los reportes"""
+    for obj in session.dirty:
+        if isinstance(obj, Producto):
+            estado = sa_inspect(obj)
+            if any(getattr(estado.attrs, columna).history.has_changes() for columna in _COLUMNAS_PRODUCTO_REPORTES):
                 return True
-            else:
-                raise Exception("Respuesta vacía de WSAA")
-                
-        except Exception as e:
-            error_msg = str(e)
-            
-            # *** NUEVO: Manejo específico del error de token duplicado ***
-            if "El CEE ya posee un TA valido" in error_msg:
-                print("⚠️ AFIP indica que ya hay un token válido")
-                print("💡 Esperando 30 segundos y reintentando...")
-                
-                import time
-                time.sleep(30)  # Esperar 30 segundos
-                
-                # Limpiar tokens y reintentar UNA SOLA VEZ
-                self.token = None
-                self.sign = None
-                if hasattr(self, 'token_timestamp'):
-                    delattr(self, 'token_timestamp')
-                
-                # Reintentar una vez
-                try:
-                    print("🔄 Reintentando obtener token...")
-                    tra_xml = self.crear_tra()
-                    tra_firmado = self.firmar_tra_openssl(tra_xml)
-                    
-                    session = crear_session_afip()
-                    transport = Transport(session=session, timeout=60)
-                    client = Client(wsaa_url, transport=transport)
-                    
-                    response = client.service.loginCms(tra_firmado)
-                    
-                    if response:
-                        root = ET.fromstring(response)
-                        token_elem = root.find('.//token')
-                        sign_elem = root.find('.//sign')
-                        
-                        if token_elem is not None and sign_elem is not None:
-                            self.token = token_elem.text
-                            self.sign = sign_elem.text
-                            self.token_timestamp = datetime.now()
-                            
-                            print("✅ Token obtenido exitosamente en segundo intento")
-                            return True
-                    
-                except Exception as e2:
-                    print(f"❌ Segundo intento también falló: {e2}")
-            
-            print(f"❌ Error obteniendo ticket: {e}")
-            return False
+    return False
 
-    def autorizar_comprobante(self, datos_comprobante):
-        """
-        Autorizar comprobante en AFIP usando WSFEv1 - VERSIÓN CORREGIDA CON MÚLTIPLES ALÍCUOTAS IVA
-        """
+
+@event.listens_for(db.session, 'after_flush')
+def _marcar_cambios_reportes(session, flush_context):
+    fechas = _fechas_modificadas_reportes(session)
+    if fechas:
+        session.info.setdefault('fechas_reportes', set()).update(fechas)
+    if _cambio_afecta_productos_reportes(session):
+        session.info['productos_reportes_modificados'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_reportes_al_confirmar(session):
+    fechas = session.info.pop('fechas_reportes', None)
+    if session.info.pop('productos_reportes_modificados', False):
+        cache_reportes.limpiar()
+    elif fechas:
+        cache_reportes.registrar_cambio(fechas)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_cambios_reportes(session):
+    session.info.pop('fechas_reportes', None)
+    session.info.pop('productos_reportes_modificados', None)
+
+
+# ================== EVENTOS EN TIEMPO REAL (SSE) ==================
+# Las ventas, autorizaciones (CAE), cambios de estado de facturas y cambios
+# de stock confirmados se publican una sola vez en el bus de eventos, que
+# los reparte a los dashboards y cajas conectados a /api/eventos.
+
+bus_eventos = crear_bus_eventos()
+
+
+def _datos_factura_evento(factura):
+    return {
+        'factura_id': factura.id,
+        'numero': factura.numero,
+        'total': float(factura.total or 0),
+        'estado': factura.estado,
+        'cae': factura.cae,
+        'fecha': factura.fecha.isoformat() if factura.fecha else None
+    }
+
+
+@event.listens_for(db.session, 'after_flush')
+def _marcar_eventos_tiempo_real(session, flush_context):
+    pendientes = session.info.setdefault('eventos_pendientes', {'facturas': {}, 'stock': {}})
+    
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Factura):
+            estado = sa_inspect(obj)
+            anterior = pendientes['facturas'].get(obj.id, {})
+            pendientes['facturas'][obj.id] = {
+                'nueva': anterior.get('nueva', obj in session.new),
+                'cambio_estado': anterior.get('cambio_estado', False) or estado.attrs.estado.history.has_changes(),
+                'cambio_cae': anterior.get('cambio_cae', False) or estado.attrs.cae.history.has_changes(),
+                'datos': _datos_factura_evento(obj)
+            }
+        elif isinstance(obj, Producto) and sa_inspect(obj).attrs.stock.history.has_changes():
+            pendientes['stock'][obj.id] = {
+                'id': obj.id,
+                'codigo': obj.codigo,
+                'stock': float(obj.stock or 0)
+            }
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publicar_eventos_al_confirmar(session):
+    pendientes = session.info.pop('eventos_pendientes', None)
+    if not pendientes:
+        return
+    
+    for factura in pendientes['facturas'].values():
+        if factura['nueva']:
+            bus_eventos.publicar('venta', factura['datos'])
+        else:
+            if factura['cambio_cae'] and factura['datos']['cae']:
+                bus_eventos.publicar('cae', factura['datos'])
+            if factura['cambio_estado']:
+                bus_eventos.publicar('factura_estado', factura['datos'])
+    
+    if pendientes['stock']:
+        bus_eventos.publicar('stock', {'productos': list(pendientes['stock'].values())})
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_eventos_tiempo_real(session):
+    session.info.pop('eventos_pendientes', None)
+
+
+@app.route('/api/eventos')
+def api_eventos():
+    """Canal SSE con las novedades de ventas, CAE, stock y estado de AFIP"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    cola = bus_eventos.suscribir(ultimo_id)
+    
+    return app.response_class(
+        bus_eventos.generar_sse(cola),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+# ================== CÓDIGOS DE BALANZA (EAN-13 MEDIDA VARIABLE) ==================
+
+decodificador_balanza = crear_decodificador_balanza(app.config.get('BALANZA_PREFIJOS'))
+
+
+def buscar_producto_por_codigo_balanza(codigo):
+    """Resolver una etiqueta de balanza a (producto, datos de la etiqueta)"""
+    decodificado = decodificador_balanza.decodificar(codigo)
+    if not decodificado:
+        return None, None
+    
+    for codigo_candidato in decodificador_balanza.codigos_candidatos(decodificado['plu']):
+        producto_id = obtener_id_producto_por_codigo(codigo_candidato)
+        if not producto_id:
+            continue
+        
+        producto = db.session.get(Producto, producto_id)
+        if not producto or not producto.activo:
+            continue
+        
+        calculo = decodificador_balanza.calcular_cantidad(decodificado, producto.precio)
+        if not calculo:
+            return None, None
+        
+        etiqueta = {
+            'codigo': decodificado['codigo'],
+            'tipo': decodificado['tipo'],
+            'plu': decodificado['plu'],
+            'valor': float(decodificado['valor']),
+            'cantidad': calculo['cantidad'],
+            'importe': calculo['importe']
+        }
+        return producto, etiqueta
+    
+    print(f"⚠️ Etiqueta de balanza {codigo}: PLU {decodificado['plu']} sin producto asociado")
+    return None, None
+
+
+# ================== ANALÍTICA COLUMNAR (FOTO NOCTURNA DE VENTAS) ==================
+# Una vez por noche las líneas de venta de los días cerrados se vuelcan a
+# archivos .npy por columna (ver analitica.py). Los análisis pesados (ABC,
+# estacionalidad, mapa de horas, margen por categoría) se calculan con NumPy
+# sobre esos archivos y no consultan la base transaccional.
+
+analitica_ventas = crear_analitica_ventas(
+    app.config.get('ANALITICA_DIRECTORIO', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analitica'))
+)
+
+# Facturas que no cuentan como venta
+_ESTADOS_EXCLUIDOS_ANALITICA = ('cancelada', 'anulada')
+LOTE_FOTO_ANALITICA = 5000
+
+
+def exportar_foto_analitica():
+    """Volcar las líneas de venta hasta ayer (inclusive) a una foto nueva"""
+    hoy = datetime.combine(date.today(), datetime.min.time())
+    
+    with app.app_context():
         try:
-            print("🎫 Verificando ticket de acceso...")
-            
-            # Verificar que tenemos ticket válido
-            if not self.get_ticket_access():
-                raise Exception("No se pudo obtener ticket de acceso")
-            
-            print("🌐 Conectando con WSFEv1...")
-            
-            # IMPORTANTE: URL limpia y configuración correcta
-            wsfev1_url = 'https://servicios1.afip.gov.ar/wsfev1/service.asmx?WSDL'
-            
-            # Crear cliente SOAP con configuración específica
-            session = crear_session_afip()
-            from zeep.transports import Transport
-            from zeep import Settings
-            
-            # Configuración específica para AFIP
-            settings = Settings(strict=False, xml_huge_tree=True)
-            transport = Transport(session=session, timeout=60, operation_timeout=60)
-            
-            try:
-                from zeep import Client
-                client = Client(wsfev1_url, transport=transport, settings=settings)
-                print("✅ Cliente WSFEv1 creado correctamente")
-            except Exception as e:
-                error_str = str(e).lower()
-                if any(keyword in error_str for keyword in ['invalid xml', 'mismatch', 'html', 'br line', 'span']):
-                    raise Exception("WSFEv1 devolviendo HTML en lugar de XML - Servicio en mantenimiento")
-                else:
-                    raise Exception(f"Error creando cliente SOAP: {str(e)}")
+            # Medio de pago de cada factura ('mixto' si se pagó con más de uno)
+            medios = db.session.query(
+                MedioPago.factura_id,
+                func.count(func.distinct(MedioPago.medio_pago)).label('cantidad'),
+                func.min(MedioPago.medio_pago).label('medio')
+            ).group_by(MedioPago.factura_id).subquery()
+            
+            filtros = (
+                Factura.fecha < hoy,
+                Factura.estado.notin_(_ESTADOS_EXCLUIDOS_ANALITICA)
+            )
             
-            # Preparar autenticación
-            auth = {
-                'Token': self.token,
-                'Sign': self.sign,
-                'Cuit': self.cuit
+            total_filas = db.session.query(func.count(DetalleFactura.id)).join(
+                Factura, Factura.id == DetalleFactura.factura_id
+            ).filter(*filtros).scalar() or 0
+            
+            filas = db.session.query(
+                DetalleFactura.factura_id,
+                Factura.fecha,
+                DetalleFactura.producto_id,
+                DetalleFactura.cantidad,
+                DetalleFactura.subtotal,
+                DetalleFactura.importe_iva,
+                case((medios.c.cantidad > 1, 'mixto'), else_=medios.c.medio)
+            ).join(
+                Factura, Factura.id == DetalleFactura.factura_id
+            ).outerjoin(
+                medios, medios.c.factura_id == Factura.id
+            ).filter(*filtros).order_by(
+                Factura.fecha, Factura.id
+            ).yield_per(LOTE_FOTO_ANALITICA)
+            
+            productos = db.session.query(
+                Producto.id, Producto.codigo, Producto.nombre, Producto.categoria, Producto.costo
+            ).yield_per(LOTE_FOTO_ANALITICA)
+            
+            return analitica_ventas.exportar(
+                total_filas,
+                (tuple(fila) for fila in filas),
+                (tuple(producto) for producto in productos),
+                hoy.date()
+            )
+        finally:
+            db.session.remove()
+
+
+@app.before_request
+def _programar_foto_analitica():
+    """Arrancar la exportación nocturna con el primer request del proceso que atiende"""
+    if analitica_ventas.disponible:
+        analitica_ventas.iniciar_exportacion_nocturna(
+            app.config.get('ANALITICA_HORA_EXPORTACION', 3), exportar_foto_analitica
+        )
+
+
+def _periodo_analitica(foto):
+    """Rango [desde, hasta] pedido; por defecto los últimos 365 días de la foto"""
+    ultimo_dia = date.fromisoformat(foto.hasta) - timedelta(days=1)
+    hasta = request.args.get('hasta')
+    hasta = datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else ultimo_dia
+    desde = request.args.get('desde')
+    desde = datetime.strptime(desde, '%Y-%m-%d').date() if desde else hasta - timedelta(days=364)
+    if desde > hasta:
+        raise ValueError('La fecha desde no puede ser posterior a la fecha hasta')
+    return desde, hasta
+
+
+def _responder_analitica(calcular):
+    """Resolver la foto y el período y responder el análisis en JSON"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    if not analitica_ventas.disponible:
+        return jsonify({'success': False, 'error': 'NumPy no está instalado (pip install numpy)'}), 503
+    
+    try:
+        foto = analitica_ventas.foto()
+        if foto is None:
+            return jsonify({
+                'success': False,
+                'error': 'Todavía no hay foto analítica: se genera cada noche o desde /api/analitica/exportar'
+            }), 503
+        
+        desde, hasta = _periodo_analitica(foto)
+        resultado = calcular(foto, desde, hasta)
+        # El análisis puede informar su propio período (por ejemplo, años completos)
+        return jsonify({
+            'success': True,
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'foto_generada': foto.generada,
+            **resultado
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ Error en analítica: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/analitica/estado')
+def estado_analitica():
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    return jsonify({'success': True, **analitica_ventas.estado()})
+
+
+@app.route('/api/analitica/exportar', methods=['POST'])
+def exportar_analitica():
+    """Generar la foto ahora (en segundo plano)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    if not analitica_ventas.disponible:
+        return jsonify({'success': False, 'error': 'NumPy no está instalado (pip install numpy)'}), 503
+    
+    if analitica_ventas.estado()['exportando']:
+        return jsonify({'success': False, 'error': 'Ya hay una exportación en curso'}), 409
+    
+    threading.Thread(target=analitica_ventas.ejecutar_exportacion, args=(exportar_foto_analitica,), daemon=True).start()
+    return jsonify({'success': True, 'mensaje': 'Exportación iniciada'}), 202
+
+
+@app.route('/api/analitica/ventas_mensuales')
+def analitica_ventas_mensuales():
+    """Cantidad y total de ventas por mes de los años pedidos"""
+    anos = request.args.getlist('anos', type=int) or [datetime.now().year - 1, datetime.now().year]
+    
+    def calcular(foto, desde, hasta):
+        ventas = analitica_ventas.ventas_por_ano_mes(foto, anos)
+        return {
+            'desde': date(min(anos), 1, 1).isoformat(),
+            'hasta': date(max(anos), 12, 31).isoformat(),
+            'datos': [{
+                'ano': ano,
+                'cantidad_ventas': [ventas[(ano, mes)][0] for mes in range(1, 13)],
+                'ventas_mensuales': [ventas[(ano, mes)][1] for mes in range(1, 13)]
+            } for ano in sorted(set(anos))]
+        }
+    
+    return _responder_analitica(calcular)
+
+
+@app.route('/api/analitica/top_productos')
+def analitica_top_productos():
+    limite = request.args.get('limite', 10, type=int)
+    return _responder_analitica(
+        lambda foto, desde, hasta: {'productos': analitica_ventas.top_productos(foto, desde, hasta, limite)}
+    )
+
+
+@app.route('/api/analitica/abc')
+def analitica_abc():
+    """Clasificación ABC de productos (A: 80% de la venta, B: hasta 95%, C: resto)"""
+    return _responder_analitica(analitica_ventas.analisis_abc)
+
+
+@app.route('/api/analitica/estacionalidad')
+def analitica_estacionalidad():
+    return _responder_analitica(analitica_ventas.estacionalidad)
+
+
+@app.route('/api/analitica/mapa_horas')
+def analitica_mapa_horas():
+    """Ventas e importe por día de la semana (0 = lunes) y hora"""
+    return _responder_analitica(analitica_ventas.mapa_horas)
+
+
+@app.route('/api/analitica/margen_categorias')
+def analitica_margen_categorias():
+    return _responder_analitica(
+        lambda foto, desde, hasta: {'categorias': analitica_ventas.margen_por_categoria(foto, desde, hasta)}
+    )
+
+
+@app.route('/api/analitica/medios_pago')
+def analitica_medios_pago():
+    return _responder_analitica(
+        lambda foto, desde, hasta: {'medios': analitica_ventas.ventas_por_medio(foto, desde, hasta)}
+    )
+
+
+# ================== RUTAS API PARA REPORTES ==================
+
+
+@app.route('/api/reporte_medios_pago')
+def api_reporte_medios_pago():
+    try:
+        fecha_desde = request.args.get('desde')
+        fecha_hasta = request.args.get('hasta')
+
+        if not fecha_desde or not fecha_hasta:
+            return jsonify({'success': False, 'error': 'Fechas requeridas'})
+
+        desde = datetime.strptime(fecha_desde, "%Y-%m-%d")
+        hasta = datetime.strptime(fecha_hasta, "%Y-%m-%d") + timedelta(days=1)
+
+        datos = MedioPago.calcular_recaudacion_por_fecha(desde, hasta)
+
+        medios_pago = []
+        if datos and 'recaudacion_por_medio' in datos:
+            for medio, valores in datos['recaudacion_por_medio'].items():
+                medios_pago.append({
+                    'medio_pago': medio,
+                    'total': valores['total'],
+                    'cantidad': valores['cantidad_operaciones']
+                })
+
+        return jsonify({
+            'success': True,
+            'reporte': {
+                'medios_pago': medios_pago,
+                'total_general': datos['total_general'] if datos else 0
             }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@app.route('/api/reporte_gastos')
+def api_reporte_gastos():
+    try:
+        fecha_desde = request.args.get('desde')
+        fecha_hasta = request.args.get('hasta')
+
+        if not fecha_desde or not fecha_hasta:
+            return jsonify({'success': False, 'error': 'Fechas requeridas'})
+
+        desde = datetime.strptime(fecha_desde, "%Y-%m-%d")
+        hasta = datetime.strptime(fecha_hasta, "%Y-%m-%d") + timedelta(days=1)
+
+        datos = Gasto.calcular_gastos_por_fecha(desde, hasta)
+
+        gastos = []
+        if datos and 'gastos_por_categoria' in datos:
+            for categoria, valores in datos['gastos_por_categoria'].items():
+                gastos.append({
+                    'categoria': categoria,
+                    'total': valores['total'],
+                    'cantidad': valores['cantidad_gastos']
+                })
+
+        return jsonify({
+            'success': True,
+            'reporte': {
+                'gastos': gastos,
+                'total_general': datos['total_general'] if datos else 0
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@app.route('/api/reporte_caja_diaria')
+def api_reporte_caja_diaria():
+    print(">>> API reporte_caja_diaria llamada")
+    try:
+        fecha_desde = request.args.get('desde')
+        fecha_hasta = request.args.get('hasta')
+
+        if not fecha_desde or not fecha_hasta:
+            return jsonify({'success': False, 'error': 'Fechas requeridas'})
+
+        desde = datetime.strptime(fecha_desde, "%Y-%m-%d")
+        hasta = datetime.strptime(fecha_hasta, "%Y-%m-%d") + timedelta(days=1)
+
+        def calcular():
+            ingresos = MedioPago.calcular_recaudacion_por_fecha(desde, hasta)
+            gastos = Gasto.calcular_gastos_por_fecha(desde, hasta)
+
+            total_ingresos = ingresos['total_general'] if ingresos else 0
+            total_gastos = gastos['total_general'] if gastos else 0
+            balance = total_ingresos - total_gastos
+
+            detalle_ingresos = []
+            if ingresos and 'recaudacion_por_medio' in ingresos:
+                for medio, valores in ingresos['recaudacion_por_medio'].items():
+                    detalle_ingresos.append({
+                        'medio_pago': medio,
+                        'total': valores['total'],
+                        'cantidad': valores['cantidad_operaciones']
+                    })
+
+            detalle_gastos = []
+            if gastos and 'gastos_por_categoria' in gastos:
+                for categoria, valores in gastos['gastos_por_categoria'].items():
+                    detalle_gastos.append({
+                        'categoria': categoria,
+                        'total': valores['total'],
+                        'cantidad': valores['cantidad_gastos']
+                    })
+
+            return {
+                'success': True,
+                'totalIngresos': total_ingresos,
+                'totalGastos': total_gastos,
+                'balance': balance,
+                'detalleIngresos': detalle_ingresos,
+                'detalleGastos': detalle_gastos
+            }
+
+        return jsonify(cache_reportes.obtener(
+            'reporte_caja_diaria', {'desde': fecha_desde, 'hasta': fecha_hasta},
+            desde.date(), hasta.date(), calcular
+        ))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+# Clase para manejo de ARCA/AFIP
+class ARCAClient:
+    def __init__(self):
+        self.config = ARCA_CONFIG
+        self.token = None
+        self.sign = None
+        self.cuit = self.config.CUIT
+        self.openssl_path = self._buscar_openssl()
+        
+        print(f"🔧 AFIP Client inicializado")
+        print(f"   CUIT: {self.config.CUIT}")
+        print(f"   Ambiente: {'HOMOLOGACIÓN' if self.config.USE_HOMOLOGACION else 'PRODUCCIÓN'}")
+    
+    def _buscar_openssl(self):
+        """Buscar OpenSSL en ubicaciones conocidas"""
+        ubicaciones = [
+            './openssl.exe',
+            'openssl.exe', 
+            'openssl',
+            r'C:\Program Files\OpenSSL-Win64\bin\openssl.exe',
+            r'C:\OpenSSL-Win64\bin\openssl.exe',
+            r'C:\Program Files (x86)\OpenSSL-Win32\bin\openssl.exe'
+        ]
+        
+        for ubicacion in ubicaciones:
+            try:
+                if os.path.exists(ubicacion) or ubicacion in ['openssl.exe', 'openssl']:
+                    result = subprocess.run([ubicacion, 'version'], 
+                                          capture_output=True, text=True, timeout=5)
+                    if result.returncode == 0:
+                        print(f"✅ OpenSSL encontrado: {ubicacion}")
+                        return ubicacion
+            except:
+                continue
+        
+        print("❌ OpenSSL no encontrado, usando 'openssl' por defecto")
+        return 'openssl'
+    
+    def crear_tra(self):
+        """Crear Ticket Request Access"""
+        now = datetime.now()
+        expire = now + timedelta(hours=12)
+        unique_id = int(now.timestamp())
+        
+        tra_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
+<loginTicketRequest version="1.0">
+    <header>
+        <uniqueId>{unique_id}</uniqueId>
+        <generationTime>{now.strftime('%Y-%m-%dT%H:%M:%S.000-00:00')}</generationTime>
+        <expirationTime>{expire.strftime('%Y-%m-%dT%H:%M:%S.000-00:00')}</expirationTime>
+    </header>
+    <service>wsfe</service>
+</loginTicketRequest>'''
+        
+        return tra_xml
+    
+    def firmar_tra_openssl(self, tra_xml):
+        """Firmar TRA usando OpenSSL"""
+        try:
+            import tempfile
             
-            print("📋 Preparando datos del comprobante...")
-            
-            # Obtener configuración
-            pto_vta = datos_comprobante.get('punto_venta', self.config.PUNTO_VENTA)
-            tipo_cbte = datos_comprobante.get('tipo_comprobante', 11)  # 11 = Factura C
-            
-            # Test rápido con FEDummy para verificar que el servicio funciona
-            try:
-                print("🧪 Verificando servicio con FEDummy...")
-                dummy_response = client.service.FEDummy()
-                print(f"✅ FEDummy OK: {dummy_response}")
-            except Exception as e:
-                error_str = str(e).lower()
-                if any(keyword in error_str for keyword in ['invalid xml', 'mismatch', 'html']):
-                    raise Exception("FEDummy devolviendo HTML - WSFEv1 en mantenimiento")
-                else:
-                    print(f"⚠️ Warning en FEDummy: {e}")
-            
-            # Obtener último comprobante autorizado
-            try:
-                print("📊 Consultando último comprobante autorizado...")
-                ultimo_cbte_response = client.service.FECompUltimoAutorizado(
-                    Auth=auth,
-                    PtoVta=pto_vta,
-                    CbteTipo=tipo_cbte
-                )
-                
-                # Verificar errores en la respuesta
-                if hasattr(ultimo_cbte_response, 'Errors') and ultimo_cbte_response.Errors:
-                    print(f"⚠️ Advertencias al obtener último comprobante:")
-                    if hasattr(ultimo_cbte_response.Errors, 'Err'):
-                        errors = ultimo_cbte_response.Errors.Err
-                        if isinstance(errors, list):
-                            for error in errors:
-                                print(f"   [{error.Code}] {error.Msg}")
-                        else:
-                            print(f"   [{errors.Code}] {errors.Msg}")
-                
-                ultimo_nro = getattr(ultimo_cbte_response, 'CbteNro', 0)
-                proximo_nro = ultimo_nro + 1
-                
-                print(f"📊 Último comprobante AFIP: {ultimo_nro}")
-                print(f"📊 Próximo número: {proximo_nro}")
-                
-            except Exception as e:
-                error_str = str(e).lower()
-                if any(keyword in error_str for keyword in ['invalid xml', 'mismatch', 'html']):
-                    raise Exception("FECompUltimoAutorizado devolviendo HTML")
-                else:
-                    print(f"⚠️ Error obteniendo último comprobante: {e}")
-                    print("🔄 Usando número secuencial local...")
-                    proximo_nro = 1
-            
-            # Preparar datos del comprobante
-            fecha_hoy = datetime.now().strftime('%Y%m%d')
-            
-            # *** NUEVO: CALCULAR ALÍCUOTAS IVA SEPARADAS ***
-            # Obtener los items del comprobante (deben venir con detalle por producto)
-            items_detalle = datos_comprobante.get('items_detalle', [])
+            print(f"🔐 Firmando TRA con OpenSSL: {self.openssl_path}")
             
-            if not items_detalle:
-                raise Exception("Se requieren items detallados con alícuotas IVA individuales")
+            # Verificar certificados
+            if not os.path.exists(self.config.CERT_PATH):
+                raise Exception(f"Certificado no encontrado: {self.config.CERT_PATH}")
+            if not os.path.exists(self.config.KEY_PATH):
+                raise Exception(f"Clave privada no encontrada: {self.config.KEY_PATH}")
             
-            # Agrupar por alícuota de IVA
-            alicuotas_iva = {}
-            importe_neto_total = 0
-            importe_iva_total = 0
+            # Crear archivos temporales
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as tra_file:
+                tra_file.write(tra_xml)
+                tra_temp = tra_file.name
             
-            print("🧮 Calculando alícuotas de IVA por separado...")
+            with tempfile.NamedTemporaryFile(suffix='.cms', delete=False) as cms_file:
+                cms_temp = cms_file.name
             
-            for item in items_detalle:
-                subtotal = float(item.get('subtotal', 0))
-                iva_porcentaje = float(item.get('iva_porcentaje', 0))
+            try:
+                # Comando OpenSSL
+                cmd = [
+                    self.openssl_path, 'smime', '-sign',
+                    '-in', tra_temp,
+                    '-out', cms_temp,
+                    '-signer', self.config.CERT_PATH,
+                    '-inkey', self.config.KEY_PATH,
+                    '-outform', 'DER',
+                    '-nodetach'
+                ]
                 
-                # Calcular IVA del item con redondeo AFIP
-                iva_item = round((subtotal * iva_porcentaje / 100), 2)
+                print(f"📝 Ejecutando firma...")
                 
-                # Agrupar por alícuota
-                if iva_porcentaje not in alicuotas_iva:
-                    alicuotas_iva[iva_porcentaje] = {
-                        'base_imponible': 0,
-                        'iva_total': 0
-                    }
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
                 
-                alicuotas_iva[iva_porcentaje]['base_imponible'] += subtotal
-                alicuotas_iva[iva_porcentaje]['iva_total'] += iva_item
+                if result.returncode != 0:
+                    raise Exception(f"Error OpenSSL: {result.stderr}")
                 
-                importe_neto_total += subtotal
-                importe_iva_total += iva_item
+                # Leer archivo firmado
+                with open(cms_temp, 'rb') as f:
+                    cms_data = f.read()
                 
-                print(f"   📦 Item: ${subtotal:.2f} (IVA {iva_porcentaje}% = ${iva_item:.2f})")
+                if len(cms_data) == 0:
+                    raise Exception("Archivo CMS vacío")
+                
+                # Codificar en base64
+                cms_b64 = base64.b64encode(cms_data).decode('utf-8')
+                
+                print("✅ TRA firmado correctamente")
+                return cms_b64
+                
+            finally:
+                # Limpiar archivos temporales
+                try:
+                    os.unlink(tra_temp)
+                    os.unlink(cms_temp)
+                except:
+                    pass
+                    
+        except Exception as e:
+            print(f"❌ Error firmando TRA: {e}")
+            raise Exception(f"Error firmando TRA: {e}")
+    
+    def get_ticket_access(self):
+        """Obtener ticket de acceso de WSAA con cache inteligente"""
+        try:
+            # *** NUEVO: Cache inteligente de tokens ***
+            if hasattr(self, 'token_timestamp') and self.token and self.sign:
+                # Verificar si el token aún es válido (duran 12 horas, usamos 10 horas para estar seguros)
+                tiempo_transcurrido = datetime.now() - self.token_timestamp
+                
+                if tiempo_transcurrido < timedelta(hours=10):
+                    print(f"🎫 Usando token existente (válido por {10 - tiempo_transcurrido.seconds//3600} horas más)")
+                    return True
+                else:
+                    print("⏰ Token expirado, obteniendo uno nuevo...")
+                    # Limpiar tokens viejos
+                    self.token = None
+                    self.sign = None
+                    delattr(self, 'token_timestamp')
             
-            # Redondear totales
-            importe_neto_total = round(importe_neto_total, 2)
-            importe_iva_total = round(importe_iva_total, 2)
-            importe_total = round(importe_neto_total + importe_iva_total, 2)
+            print("🎫 Obteniendo nuevo ticket de acceso...")
             
-            print(f"💰 Totales calculados: Neto=${importe_neto_total:.2f}, IVA=${importe_iva_total:.2f}, Total=${importe_total:.2f}")
+            # Crear y firmar TRA
+            tra_xml = self.crear_tra()
+            tra_firmado = self.firmar_tra_openssl(tra_xml)
             
-            # Mostrar alícuotas calculadas
-            print("📊 Alícuotas de IVA:")
-            for porcentaje, datos in alicuotas_iva.items():
-                base = round(datos['base_imponible'], 2)
-                iva = round(datos['iva_total'], 2)
-                print(f"   IVA {porcentaje}%: Base=${base:.2f}, IVA=${iva:.2f}")
+            # URL del WSAA
+            wsaa_url = self.config.WSAA_URL + '?wsdl' if not self.config.WSAA_URL.endswith('?wsdl') else self.config.WSAA_URL
             
-            # Estructura del comprobante según especificación AFIP
-            comprobante = {
-                'Concepto': 1,
-                'DocTipo': datos_comprobante.get('doc_tipo', 99),
+            print(f"🌐 Conectando con WSAA: {wsaa_url}")
+            
+            # USAR SESIÓN PERSONALIZADA
+            session = crear_session_afip()
+            
+            from zeep.transports import Transport
+            
+            transport = Transport(session=session, timeout=60)
+            client = Client(wsaa_url, transport=transport)
+            
+            # Enviar solicitud
+            response = client.service.loginCms(tra_firmado)
+            
+            if response:
+                # Procesar respuesta XML
+                root = ET.fromstring(response)
+                
+                token_elem = root.find('.//token')
+                sign_elem = root.find('.//sign')
+                
+                if token_elem is None or sign_elem is None:
+                    raise Exception("Token o Sign no encontrados en respuesta")
+                
+                self.token = token_elem.text
+                self.sign = sign_elem.text
+                
+                # *** NUEVO: Guardar timestamp del token ***
+                self.token_timestamp = datetime.now()
+                
+                print("✅ Ticket de acceso obtenido y guardado en cache")
+                return True
+            else:
+                raise Exception("Respuesta vacía de WSAA")
+                
+        except Exception as e:
+            error_msg = str(e)
+            
+            # *** NUEVO: Manejo específico del error de token duplicado ***
+            if "El CEE ya posee un TA valido" in error_msg:
+                print("⚠️ AFIP indica que ya hay un token válido")
+                print("💡 Esperando 30 segundos y reintentando...")
+                
+                import time
+                time.sleep(30)  # Esperar 30 segundos
+                
+                # Limpiar tokens y reintentar UNA SOLA VEZ
+                self.token = None
+                self.sign = None
+                if hasattr(self, 'token_timestamp'):
+                    delattr(self, 'token_timestamp')
+                
+                # Reintentar una vez
+                try:
+                    print("🔄 Reintentando obtener token...")
+                    tra_xml = self.crear_tra()
+                    tra_firmado = self.firmar_tra_openssl(tra_xml)
+                    
+                    session = crear_session_afip()
+                    transport = Transport(session=session, timeout=60)
+                    client = Client(wsaa_url, transport=transport)
+                    
+                    response = client.service.loginCms(tra_firmado)
+                    
+                    if response:
+                        root = ET.fromstring(response)
+                        token_elem = root.find('.//token')
+                        sign_elem = root.find('.//sign')
+                        
+                        if token_elem is not None and sign_elem is not None:
+                            self.token = token_elem.text
+                            self.sign = sign_elem.text
+                            self.token_timestamp = datetime.now()
+                            
+                            print("✅ Token obtenido exitosamente en segundo intento")
+                            return True
+                    
+                except Exception as e2:
+                    print(f"❌ Segundo intento también falló: {e2}")
+            
+            print(f"❌ Error obteniendo ticket: {e}")
+            return False
+
+    def autorizar_comprobante(self, datos_comprobante):
+        """
+        Autorizar comprobante en AFIP usando WSFEv1 - VERSIÓN CORREGIDA CON MÚLTIPLES ALÍCUOTAS IVA
+        """
+        try:
+            print("🎫 Verificando ticket de acceso...")
+            
+            # Verificar que tenemos ticket válido
+            if not self.get_ticket_access():
+                raise Exception("No se pudo obtener ticket de acceso")
+            
+            print("🌐 Conectando con WSFEv1...")
+            
+            # IMPORTANTE: URL limpia y configuración correcta
+            wsfev1_url = 'https://servicios1.afip.gov.ar/wsfev1/service.asmx?WSDL'
+            
+            # Crear cliente SOAP con configuración específica
+            session = crear_session_afip()
+            from zeep.transports import Transport
+            from zeep import Settings
+            
+            # Configuración específica para AFIP
+            settings = Settings(strict=False, xml_huge_tree=True)
+            transport = Transport(session=session, timeout=60, operation_timeout=60)
+            
+            try:
+                from zeep import Client
+                client = Client(wsfev1_url, transport=transport, settings=settings)
+                print("✅ Cliente WSFEv1 creado correctamente")
+            except Exception as e:
+                error_str = str(e).lower()
+                if any(keyword in error_str for keyword in ['invalid xml', 'mismatch', 'html', 'br line', 'span']):
+                    raise Exception("WSFEv1 devolviendo HTML en lugar de XML - Servicio en mantenimiento")
+                else:
+                    raise Exception(f"Error creando cliente SOAP: {str(e)}")
+            
+            # Preparar autenticación
+            auth = {
+                'Token': self.token,
+                'Sign': self.sign,
+                'Cuit': self.cuit
+            }
+            
+            print("📋 Preparando datos del comprobante...")
+            
+            # Obtener configuración
+            pto_vta = datos_comprobante.get('punto_venta', self.config.PUNTO_VENTA)
+            tipo_cbte = datos_comprobante.get('tipo_comprobante', 11)  # 11 = Factura C
+            
+            # Test rápido con FEDummy para verificar que el servicio funciona
+            try:
+                print("🧪 Verificando servicio con FEDummy...")
+                dummy_response = client.service.FEDummy()
+                print(f"✅ FEDummy OK: {dummy_response}")
+            except Exception as e:
+                error_str = str(e).lower()
+                if any(keyword in error_str for keyword in ['invalid xml', 'mismatch', 'html']):
+                    raise Exception("FEDummy devolviendo HTML - WSFEv1 en mantenimiento")
+                else:
+                    print(f"⚠️ Warning en FEDummy: {e}")
+            
+            # Obtener último comprobante autorizado
+            try:
+                print("📊 Consultando último comprobante autorizado...")
+                ultimo_cbte_response = client.service.FECompUltimoAutorizado(
+                    Auth=auth,
+                    PtoVta=pto_vta,
+                    CbteTipo=tipo_cbte
+                )
+                
+                # Verificar errores en la respuesta
+                if hasattr(ultimo_cbte_response, 'Errors') and ultimo_cbte_response.Errors:
+                    print(f"⚠️ Advertencias al obtener último comprobante:")
+                    if hasattr(ultimo_cbte_response.Errors, 'Err'):
+                        errors = ultimo_cbte_response.Errors.Err
+                        if isinstance(errors, list):
+                            for error in errors:
+                                print(f"   [{error.Code}] {error.Msg}")
+                        else:
+                            print(f"   [{errors.Code}] {errors.Msg}")
+                
+                ultimo_nro = getattr(ultimo_cbte_response, 'CbteNro', 0)
+                proximo_nro = ultimo_nro + 1
+                
+                print(f"📊 Último comprobante AFIP: {ultimo_nro}")
+                print(f"📊 Próximo número: {proximo_nro}")
+                
+            except Exception as e:
+                error_str = str(e).lower()
+                if any(keyword in error_str for keyword in ['invalid xml', 'mismatch', 'html']):
+                    raise Exception("FECompUltimoAutorizado devolviendo HTML")
+                else:
+                    print(f"⚠️ Error obteniendo último comprobante: {e}")
+                    print("🔄 Usando número secuencial local...")
+                    proximo_nro = 1
+            
+            # Preparar datos del comprobante
+            fecha_hoy = datetime.now().strftime('%Y%m%d')
+            
+            # *** NUEVO: CALCULAR ALÍCUOTAS IVA SEPARADAS ***
+            # Obtener los items del comprobante (deben venir con detalle por producto)
+            items_detalle = datos_comprobante.get('items_detalle', [])
+            
+            if not items_detalle:
+                raise Exception("Se requieren items detallados con alícuotas IVA individuales")
+            
+            # Agrupar por alícuota de IVA
+            alicuotas_iva = {}
+            importe_neto_total = 0
+            importe_iva_total = 0
+            
+            print("🧮 Calculando alícuotas de IVA por separado...")
+            
+            for item in items_detalle:
+                subtotal = float(item.get('subtotal', 0))
+                iva_porcentaje = float(item.get('iva_porcentaje', 0))
+                
+                # Calcular IVA del item con redondeo AFIP
+                iva_item = round((subtotal * iva_porcentaje / 100), 2)
+                
+                # Agrupar por alícuota
+                if iva_porcentaje not in alicuotas_iva:
+                    alicuotas_iva[iva_porcentaje] = {
+                        'base_imponible': 0,
+                        'iva_total': 0
+                    }
+                
+                alicuotas_iva[iva_porcentaje]['base_imponible'] += subtotal
+                alicuotas_iva[iva_porcentaje]['iva_total'] += iva_item
+                
+                importe_neto_total += subtotal
+                importe_iva_total += iva_item
+                
+                print(f"   📦 Item: ${subtotal:.2f} (IVA {iva_porcentaje}% = ${iva_item:.2f})")
+            
+            # Redondear totales
+            importe_neto_total = round(importe_neto_total, 2)
+            importe_iva_total = round(importe_iva_total, 2)
+            importe_total = round(importe_neto_total + importe_iva_total, 2)
+            
+            print(f"💰 Totales calculados: Neto=${importe_neto_total:.2f}, IVA=${importe_iva_total:.2f}, Total=${importe_total:.2f}")
+            
+            # Mostrar alícuotas calculadas
+            print("📊 Alícuotas de IVA:")
+            for porcentaje, datos in alicuotas_iva.items():
+                base = round(datos['base_imponible'], 2)
+                iva = round(datos['iva_total'], 2)
+                print(f"   IVA {porcentaje}%: Base=${base:.2f}, IVA=${iva:.2f}")
+            
+            # Estructura del comprobante según especificación AFIP
+            comprobante = {
+                'Concepto': 1,
+                'DocTipo': datos_comprobante.get('doc_tipo', 99),
                 'DocNro': datos_comprobante.get('doc_nro', 0),
                 'CbteDesde': proximo_nro,
                 'CbteHasta': proximo_nro,
@@ -1329,3231 +2833,5196 @@ class ARCAClient:
             print(f"   CAE: {cae}")
             print(f"   Vencimiento CAE: {fecha_vencimiento}")
             
-            return {
-                'success': True,
-                'cae': cae,
-                'numero': numero_completo,
-                'punto_venta': pto_vta,
-                'numero_comprobante': proximo_nro,
-                'fecha_vencimiento': fecha_vencimiento,
-                'fecha_proceso': fecha_hoy,
-                'importe_total': importe_total,
-                'tipo_comprobante': tipo_cbte,
-                'estado': 'autorizada',
-                'vto_cae': datetime.strptime(fecha_vencimiento, '%Y%m%d').date()
-            }
+            return {
+                'success': True,
+                'cae': cae,
+                'numero': numero_completo,
+                'punto_venta': pto_vta,
+                'numero_comprobante': proximo_nro,
+                'fecha_vencimiento': fecha_vencimiento,
+                'fecha_proceso': fecha_hoy,
+                'importe_total': importe_total,
+                'tipo_comprobante': tipo_cbte,
+                'estado': 'autorizada',
+                'vto_cae': datetime.strptime(fecha_vencimiento, '%Y%m%d').date()
+            }
+            
+        except Exception as e:
+            print(f"❌ Error en autorización AFIP: {e}")
+            return {
+                'success': False,
+                'error': str(e),
+                'cae': None,
+                'vto_cae': None,
+                'estado': 'error_afip'
+            }
+
+    def get_codigo_iva_afip(self, porcentaje):
+        """Mapear porcentajes de IVA a códigos AFIP"""
+        mapeo_iva = {
+            0: 3,      # Exento
+            10.5: 4,   # IVA 10.5%
+            21: 5,     # IVA 21%
+            27: 6,     # IVA 27%
+            2.5: 9     # IVA 2.5%
+        }
+        
+        codigo = mapeo_iva.get(porcentaje, None)
+        if codigo is None:
+            print(f"⚠️ Porcentaje IVA {porcentaje}% no reconocido, usando código 5 (21%) por defecto")
+            return 5  # Por defecto IVA 21%
+        
+        return codigo
+    
+
+    def get_ultimo_comprobante(self, tipo_cbte):
+        """Obtener último comprobante autorizado"""
+        try:
+            print(f"📋 Consultando último comprobante tipo {tipo_cbte}...")
+            
+            if not self.get_ticket_access():
+                raise Exception("No se pudo obtener acceso a AFIP")
+            
+            # URL del WSFEv1
+            wsfe_url = self.config.WSFEv1_URL
+            
+            print(f"🌐 Conectando con WSFEv1: {wsfe_url}")
+            
+            # USAR SESIÓN PERSONALIZADA
+            session = crear_session_afip()
+            
+            from zeep.transports import Transport
+            
+            transport = Transport(session=session, timeout=60)
+            client = Client(wsfe_url, transport=transport)
+            
+            response = client.service.FECompUltimoAutorizado(
+                Auth={
+                    'Token': self.token,
+                    'Sign': self.sign,
+                    'Cuit': self.cuit
+                },
+                PtoVta=self.config.PUNTO_VENTA,
+                CbteTipo=tipo_cbte
+            )
+            
+            if hasattr(response, 'Errors') and response.Errors:
+                error_msg = response.Errors.Err[0].Msg
+                raise Exception(f"Error AFIP: {error_msg}")
+            
+            ultimo_num = response.CbteNro
+            print(f"✅ Último comprobante: {ultimo_num}")
+            return ultimo_num
+            
+        except Exception as e:
+            print(f"❌ Error consultando comprobante: {e}")
+            raise Exception(f"Error al obtener último comprobante: {e}")
+
+
+arca_client = ARCAClient()
+
+# Monitor AFIP simplificado
+class AFIPStatusMonitor:
+    def __init__(self, arca_config, bus=None):
+        self.config = arca_config
+        self.bus = bus
+        self.ultimo_estado = None
+        self._vigilancia = None
+        self._lock = threading.Lock()
+    
+    def verificar_rapido(self):
+        """Verificación rápida solo de conectividad"""
+        try:
+            import socket
+            from urllib.parse import urlparse
+            
+            wsaa_host = urlparse(self.config.WSAA_URL).hostname
+            
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(5)
+            result = sock.connect_ex((wsaa_host, 443))
+            sock.close()
+            
+            estado = {
+                'conectividad': result == 0,
+                'mensaje': '✅ AFIP accesible' if result == 0 else '❌ AFIP no accesible'
+            }
+        except Exception as e:
+            estado = {
+                'conectividad': False,
+                'mensaje': f'❌ Error: {str(e)}'
+            }
+        
+        self._registrar_estado(estado)
+        return estado
+    
+    def _registrar_estado(self, estado):
+        """Publicar el estado en el bus solo cuando cambia la conectividad"""
+        with self._lock:
+            anterior = self.ultimo_estado
+            self.ultimo_estado = estado
+        
+        if self.bus and (anterior is None or anterior['conectividad'] != estado['conectividad']):
+            self.bus.publicar('estado_afip', estado)
+    
+    def iniciar_vigilancia(self, intervalo=120):
+        """Verificar en segundo plano (una sola vez por proceso) mientras haya clientes conectados"""
+        with self._lock:
+            if self._vigilancia and self._vigilancia.is_alive():
+                return
+            self._vigilancia = threading.Thread(target=self._vigilar, args=(intervalo,), daemon=True)
+            self._vigilancia.start()
+    
+    def _vigilar(self, intervalo):
+        import time
+        while self.bus and self.bus.cantidad_suscripciones > 0:
+            self.verificar_rapido()
+            time.sleep(intervalo)
+
+# Crear instancia del monitor (publica los cambios de estado en el bus de eventos)
+afip_monitor = AFIPStatusMonitor(ARCA_CONFIG, bus_eventos)
+bus_eventos.al_suscribir(afip_monitor.iniciar_vigilancia)
+
+
+# DESPUÉS DE DEFINIR LOS MODELOS Y ANTES DE LAS RUTAS:
+# Inicializar y registrar el blueprint de estadísticas
+estadisticas_bp = init_estadisticas(db, Factura, DetalleFactura, Producto, VentaDiariaProducto, cache_reportes)
+app.register_blueprint(estadisticas_bp)
+
+
+# Rutas de la aplicación
+@app.route('/')
+def index():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    return render_template('dashboard.html')
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        
+        usuario = Usuario.query.filter_by(username=username, activo=True).first()
+        
+        # Login simple sin encriptación
+        if usuario and usuario.password_hash == password:
+            session['user_id'] = usuario.id
+            session['username'] = usuario.username
+            session['nombre'] = usuario.nombre
+            return redirect(url_for('index'))
+        else:
+            flash('Usuario o contraseña incorrectos')
+    
+    return render_template('login.html')
+
+@app.route('/logout')
+def logout():
+    session.clear()
+    return redirect(url_for('login'))
+
+    
+@app.route('/api/hora_actual')
+def hora_actual():
+    from datetime import datetime
+    import pytz
+    
+    # Zona horaria de Argentina
+    argentina_tz = pytz.timezone('America/Argentina/Buenos_Aires')
+    ahora = datetime.now(argentina_tz)
+    
+    return jsonify({
+        'success': True,
+        'timestamp': ahora.isoformat(),
+        'fecha_legible': ahora.strftime('%A, %d de %B de %Y'),
+        'hora_legible': ahora.strftime('%H:%M:%S'),
+        'zona_horaria': 'America/Argentina/Buenos_Aires'
+    })
+
+@app.route('/productos')
+def productos():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    # Primera página; el resto se pide con "Cargar más" vía /buscar_productos_admin
+    productos, siguiente_cursor = _pagina_productos_admin(Producto.query.filter_by(activo=True))
+    return render_template('productos.html', productos=productos, siguiente_cursor=siguiente_cursor)
+
+@app.route('/combos')
+def combos():
+    # Obtener solo productos que son combos
+    combos, siguiente_cursor = _pagina_productos_admin(
+        Producto.query.options(selectinload(Producto.producto_base)).filter_by(es_combo=True)
+    )
+    return render_template('combos.html', combos=combos, siguiente_cursor=siguiente_cursor)
+
+@app.route('/clientes')
+def clientes():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    clientes = Cliente.query.all()
+    return render_template('clientes.html', clientes=clientes)
+
+# ==================== RUTAS DE CLIENTES ====================
+
+@app.route('/api/cliente/<int:cliente_id>')
+def obtener_cliente(cliente_id):
+    """Obtener datos de un cliente por ID para edición"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        # Método compatible con SQLAlchemy antiguo
+        cliente = Cliente.query.get_or_404(cliente_id)
+        return jsonify({
+            'id': cliente.id,
+            'nombre': cliente.nombre,
+            'documento': cliente.documento or '',
+            'tipo_documento': cliente.tipo_documento or 'DNI',
+            'email': cliente.email or '',
+            'telefono': cliente.telefono or '',
+            'direccion': cliente.direccion or '',
+            'condicion_iva': cliente.condicion_iva or 'CONSUMIDOR_FINAL'
+        })
+    except Exception as e:
+        return jsonify({'error': f'Error al obtener cliente: {str(e)}'}), 500
+
+@app.route('/guardar_cliente', methods=['POST'])
+def guardar_cliente():
+    """Crear o actualizar un cliente"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        data = request.json
+        
+        # Validar datos requeridos
+        if not data.get('nombre', '').strip():
+            return jsonify({'error': 'El nombre es obligatorio'}), 400
+        
+        # Validar CUIT si es necesario
+        if data.get('tipo_documento') == 'CUIT' and data.get('documento'):
+            documento = data['documento'].strip()
+            if not documento.isdigit() or len(documento) != 11:
+                return jsonify({'error': 'El CUIT debe tener 11 dígitos sin guiones'}), 400
+        
+        cliente_id = data.get('id')
+        
+        if cliente_id:  # Editar cliente existente
+            cliente = Cliente.query.get_or_404(cliente_id)
+            accion = 'actualizado'
+        else:  # Crear nuevo cliente
+            cliente = Cliente()
+            accion = 'creado'
+        
+        # Actualizar datos del cliente
+        cliente.nombre = data['nombre'].strip()
+        cliente.documento = data.get('documento', '').strip() or None
+        cliente.tipo_documento = data.get('tipo_documento', 'DNI')
+        cliente.email = data.get('email', '').strip() or None
+        cliente.telefono = data.get('telefono', '').strip() or None
+        cliente.direccion = data.get('direccion', '').strip() or None
+        cliente.condicion_iva = data.get('condicion_iva', 'CONSUMIDOR_FINAL')
+        
+        # Guardar en base de datos
+        if not cliente_id:  # Solo agregar si es nuevo
+            db.session.add(cliente)
+        
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Cliente {accion} correctamente',
+            'cliente_id': cliente.id,
+            'cliente_nombre': cliente.nombre
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error guardando cliente: {str(e)}")
+        return jsonify({'error': f'Error al guardar cliente: {str(e)}'}), 500
+
+@app.route('/eliminar_cliente/<int:cliente_id>', methods=['DELETE'])
+def eliminar_cliente(cliente_id):
+    """Eliminar un cliente (marcar como inactivo)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        cliente = Cliente.query.get_or_404(cliente_id)
+        
+        # Verificar si tiene facturas asociadas
+        facturas_count = Factura.query.filter_by(cliente_id=cliente_id).count()
+        
+        if facturas_count > 0:
+            return jsonify({
+                'error': f'No se puede eliminar el cliente porque tiene {facturas_count} facturas asociadas'
+            }), 400
+        
+        # Si no tiene facturas, se puede eliminar
+        db.session.delete(cliente)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Cliente eliminado correctamente'
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error eliminando cliente: {str(e)}")
+        return jsonify({'error': f'Error al eliminar cliente: {str(e)}'}), 500
+
+@app.route('/buscar_clientes')
+def buscar_clientes():
+    """Buscar clientes con filtros"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        # Obtener parámetros de búsqueda
+        buscar = request.args.get('buscar', '').strip()
+        tipo_doc = request.args.get('tipo_documento', '').strip()
+        condicion_iva = request.args.get('condicion_iva', '').strip()
+        
+        # Construir query base
+        query = Cliente.query
+        
+        # Aplicar filtros
+        if buscar:
+            query = query.filter(
+                or_(
+                    Cliente.nombre.ilike(f'%{buscar}%'),
+                    Cliente.documento.ilike(f'%{buscar}%'),
+                    Cliente.email.ilike(f'%{buscar}%')
+                )
+            )
+        
+        if tipo_doc:
+            query = query.filter(Cliente.tipo_documento == tipo_doc)
+        
+        if condicion_iva:
+            query = query.filter(Cliente.condicion_iva == condicion_iva)
+        
+        # Obtener resultados
+        clientes = query.order_by(Cliente.nombre).all()
+        
+        # Formatear respuesta
+        resultado = []
+        for cliente in clientes:
+            resultado.append({
+                'id': cliente.id,
+                'nombre': cliente.nombre,
+                'documento': cliente.documento,
+                'tipo_documento': cliente.tipo_documento,
+                'email': cliente.email,
+                'telefono': cliente.telefono,
+                'direccion': cliente.direccion,
+                'condicion_iva': cliente.condicion_iva
+            })
+        
+        return jsonify({
+            'success': True,
+            'clientes': resultado,
+            'total': len(resultado)
+        })
+        
+    except Exception as e:
+        print(f"Error buscando clientes: {str(e)}")
+        return jsonify({'error': f'Error en la búsqueda: {str(e)}'}), 500
+
+# ==================== RUTAS DE PRODUCTOS ====================
+
+# 1. ACTUALIZAR LA RUTA /api/producto_detalle/<int:producto_id>
+@app.route('/api/producto_detalle/<int:producto_id>')
+def obtener_producto_detalle(producto_id):
+    """Obtener datos completos de un producto para edición"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        producto = Producto.query.get_or_404(producto_id)
+        
+        # Usar valores por defecto si costo o margen son 0 o None
+        costo = float(producto.costo) if producto.costo and producto.costo > 0 else 0.0
+        margen = float(producto.margen) if producto.margen is not None else 30.0
+        
+        # Si no hay costo pero hay precio, calcular costo aproximado
+        if costo == 0.0 and producto.precio > 0:
+            costo = float(producto.precio) / (1 + (margen / 100))
+        
+        # Datos base del producto
+        resultado = {
+            'id': producto.id,
+            'codigo': producto.codigo,
+            'nombre': producto.nombre,
+            'descripcion': producto.descripcion or '',
+            'precio': float(producto.precio),
+            'costo': round(costo, 2),
+            'margen': float(margen),
+            'stock': producto.stock,
+            'categoria': producto.categoria or '',
+            'iva': float(producto.iva),
+            'activo': producto.activo,
+            
+            # ✅ CAMPOS DE COMBO AGREGADOS
+            'es_combo': getattr(producto, 'es_combo', False),
+            'cantidad_combo': getattr(producto, 'cantidad_combo', None),
+            'producto_base_id': getattr(producto, 'producto_base_id', None)
+        }
+        
+        # ✅ SI ES UN COMBO, AGREGAR INFORMACIÓN DEL PRODUCTO BASE
+        if resultado['es_combo'] and resultado['producto_base_id']:
+            try:
+                producto_base = Producto.query.get(resultado['producto_base_id'])
+                if producto_base:
+                    resultado['producto_base'] = {
+                        'id': producto_base.id,
+                        'codigo': producto_base.codigo,
+                        'nombre': producto_base.nombre,
+                        'precio': float(producto_base.precio)
+                    }
+                    # Precio unitario del producto base para cálculos
+                    resultado['precio_unitario_base'] = float(producto_base.precio)
+                else:
+                    resultado['producto_base'] = None
+                    resultado['precio_unitario_base'] = 0.0
+            except Exception as e:
+                print(f"Error obteniendo producto base: {str(e)}")
+                resultado['producto_base'] = None
+                resultado['precio_unitario_base'] = 0.0
+        
+        return jsonify(resultado)
+        
+    except Exception as e:
+        print(f"Error en obtener_producto_detalle: {str(e)}")
+        return jsonify({'error': f'Error al obtener producto: {str(e)}'}), 500
+
+# 2. ACTUALIZAR LA RUTA /guardar_producto
+@app.route('/guardar_producto', methods=['POST'])
+def guardar_producto():
+    """Crear o actualizar un producto con costo y margen"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        data = request.json
+        
+        # Validar datos requeridos
+        if not data.get('codigo', '').strip():
+            return jsonify({'error': 'El código es obligatorio'}), 400
+        
+        if not data.get('nombre', '').strip():
+            return jsonify({'error': 'El nombre es obligatorio'}), 400
+        
+        # Validar costo
+        try:
+            costo = float(data.get('costo', 0))
+            if costo <= 0:
+                return jsonify({'error': 'El costo debe ser mayor a 0'}), 400
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Costo inválido'}), 400
+        
+        # Validar margen
+        try:
+            margen = float(data.get('margen', 30))
+            if margen < 0:
+                return jsonify({'error': 'El margen no puede ser negativo'}), 400
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Margen inválido'}), 400
+        
+        # Calcular precio automáticamente
+        precio_calculado = costo * (1 + (margen / 100))
+        
+        producto_id = data.get('id')
+        codigo = data['codigo'].strip().upper()
+        
+        # Verificar que el código no exista (excepto si es el mismo producto)
+        producto_existente = Producto.query.filter_by(codigo=codigo).first()
+        if producto_existente and (not producto_id or producto_existente.id != int(producto_id)):
+            return jsonify({'error': f'Ya existe un producto con el código {codigo}'}), 400
+        
+        if producto_id:  # Editar producto existente
+            producto = Producto.query.get_or_404(producto_id)
+            accion = 'actualizado'
+        else:  # Crear nuevo producto
+            producto = Producto()
+            accion = 'creado'
+        
+        # Actualizar datos del producto
+        producto.codigo = codigo
+        producto.nombre = data['nombre'].strip()
+        producto.descripcion = data.get('descripcion', '').strip() or None
+        producto.precio = Decimal(str(round(precio_calculado, 2)))
+        producto.costo = Decimal(str(round(costo, 2)))
+        producto.margen = Decimal(str(round(margen, 2)))
+        producto.categoria = data.get('categoria', '').strip() or None
+        producto.iva = Decimal(str(data.get('iva', 21)))
+        producto.activo = bool(data.get('activo', True))
+        producto.fecha_modificacion = datetime.now()
+        
+        # Solo actualizar stock si es producto nuevo
+        if not producto_id:
+            producto.stock = int(data.get('stock', 0))
+        
+        # Guardar en base de datos
+        if not producto_id:  # Solo agregar si es nuevo
+            db.session.add(producto)
+        
+        db.session.commit()
+        
+        print(f"✅ Producto {accion}: {codigo}")
+        print(f"   Costo: ${costo:.2f}")
+        print(f"   Margen: {margen}%")
+        print(f"   Precio: ${precio_calculado:.2f}")
+        
+        return jsonify({
+            'success': True,
+            'message': f'Producto {accion} correctamente',
+            'producto_id': producto.id,
+            'producto_codigo': producto.codigo,
+            'precio_calculado': round(precio_calculado, 2),
+            'costo': round(costo, 2),
+            'margen': round(margen, 2)
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error guardando producto: {str(e)}")
+        return jsonify({'error': f'Error al guardar producto: {str(e)}'}), 500
+
+
+
+
+@app.route('/ajustar_stock', methods=['POST'])
+def ajustar_stock():
+    """Ajustar stock de un producto"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        data = request.json
+        
+        producto_id = data.get('producto_id')
+        tipo_movimiento = data.get('tipo_movimiento')  # entrada, salida, ajuste
+        cantidad = int(data.get('cantidad', 0))
+        motivo = data.get('motivo', '').strip()
+        
+        if not producto_id:
+            return jsonify({'error': 'ID de producto requerido'}), 400
+        
+        if cantidad <= 0 and tipo_movimiento != 'ajuste':
+            return jsonify({'error': 'La cantidad debe ser mayor a 0'}), 400
+        
+        producto = Producto.query.get_or_404(producto_id)
+        stock_anterior = producto.stock
+        
+        # Aplicar movimiento según el tipo
+        if tipo_movimiento == 'entrada':
+            producto.stock += cantidad
+            descripcion = f"Entrada: +{cantidad}"
+        elif tipo_movimiento == 'salida':
+            if cantidad > producto.stock:
+                return jsonify({'error': f'No hay suficiente stock. Stock actual: {producto.stock}'}), 400
+            producto.stock -= cantidad
+            descripcion = f"Salida: -{cantidad}"
+        elif tipo_movimiento == 'ajuste':
+            if cantidad < 0:
+                return jsonify({'error': 'La cantidad para ajuste no puede ser negativa'}), 400
+            descripcion = f"Ajuste: {stock_anterior} → {cantidad}"
+            producto.stock = cantidad
+        else:
+            return jsonify({'error': 'Tipo de movimiento inválido'}), 400
+        
+        # Guardar cambios
+        db.session.commit()
+        
+        # Registrar el movimiento (opcional - puedes crear una tabla de movimientos)
+        print(f"MOVIMIENTO STOCK: Producto {producto.codigo} - {descripcion} - Motivo: {motivo}")
+        
+        return jsonify({
+            'success': True,
+            'message': f'Stock ajustado correctamente',
+            'stock_anterior': stock_anterior,
+            'stock_nuevo': producto.stock,
+            'movimiento': descripcion
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error ajustando stock: {str(e)}")
+        return jsonify({'error': f'Error al ajustar stock: {str(e)}'}), 500
+
+@app.route('/toggle_producto/<int:producto_id>', methods=['POST'])
+def toggle_producto(producto_id):
+    """Activar/desactivar un producto"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        producto = Producto.query.get_or_404(producto_id)
+        
+        # Cambiar estado
+        producto.activo = not producto.activo
+        estado = 'activado' if producto.activo else 'desactivado'
+        
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Producto {estado} correctamente',
+            'activo': producto.activo
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error cambiando estado del producto: {str(e)}")
+        return jsonify({'error': f'Error al cambiar estado: {str(e)}'}), 500
+
+# 3. ACTUALIZAR LA RUTA /buscar_productos_admin
+LIMITE_PRODUCTOS_ADMIN = 200
+LIMITE_MAXIMO_PRODUCTOS_ADMIN = 1000
+
+
+def _producto_admin_dict(producto):
+    """Formatear un producto para las grillas de administración"""
+    # Manejar valores por defecto
+    costo = float(producto.costo) if producto.costo else 0.0
+    margen = float(producto.margen) if producto.margen is not None else 0.0
+    
+    # Si no hay costo guardado, calcularlo aproximadamente desde precio
+    if costo == 0.0 and producto.precio > 0 and margen > 0:
+        costo = float(producto.precio) / (1 + (margen / 100))
+    
+    producto_dict = {
+        'id': producto.id,
+        'codigo': producto.codigo,
+        'nombre': producto.nombre,
+        'descripcion': producto.descripcion,
+        'precio': float(producto.precio),
+        'costo': round(costo, 2),
+        'margen': round(margen, 1),
+        'stock': producto.stock,
+        'categoria': producto.categoria,
+        'iva': float(producto.iva),
+        'activo': producto.activo,
+        'es_combo': producto.es_combo,
+        'acceso_rapido': producto.acceso_rapido if hasattr(producto, 'acceso_rapido') else False,
+        'orden_acceso_rapido': producto.orden_acceso_rapido if hasattr(producto, 'orden_acceso_rapido') else 0
+    }
+    
+    # ✅ AGREGAR INFORMACIÓN ESPECÍFICA PARA COMBOS
+    if producto.es_combo:
+        producto_dict.update({
+            'producto_base_id': producto.producto_base_id,
+            'cantidad_combo': float(producto.cantidad_combo) if producto.cantidad_combo else 1.0,
+            'precio_unitario_base': float(producto.precio_unitario_base) if producto.precio_unitario_base else 0.0
+        })
+        
+        # Información del producto base
+        if producto.producto_base:
+            producto_dict['producto_base'] = {
+                'id': producto.producto_base.id,
+                'codigo': producto.producto_base.codigo,
+                'nombre': producto.producto_base.nombre,
+                'precio': float(producto.producto_base.precio)
+            }
+    
+    return producto_dict
+
+
+def _pagina_productos_admin(query, despues_codigo=None, despues_id=None, limite=LIMITE_PRODUCTOS_ADMIN):
+    """Obtener una página por keyset (codigo, id). Devuelve (productos, siguiente_cursor)"""
+    if despues_codigo is not None and despues_id is not None:
+        query = query.filter(
+            or_(
+                Producto.codigo > despues_codigo,
+                and_(Producto.codigo == despues_codigo, Producto.id > despues_id)
+            )
+        )
+    
+    # Pedir una fila extra para saber si hay más páginas
+    productos = query.order_by(Producto.codigo, Producto.id).limit(limite + 1).all()
+    
+    siguiente_cursor = None
+    if len(productos) > limite:
+        productos = productos[:limite]
+        ultimo = productos[-1]
+        siguiente_cursor = {'despues_codigo': ultimo.codigo, 'despues_id': ultimo.id}
+    
+    return productos, siguiente_cursor
+
+
+def _filtro_descuento_combos(descuento):
+    """Condición SQL por nivel de descuento (alto, medio, bajo) sobre descuento_porcentaje"""
+    niveles = {
+        'alto': Producto.descuento_porcentaje > 30,
+        'medio': Producto.descuento_porcentaje.between(15, 30),
+        'bajo': Producto.descuento_porcentaje < 15
+    }
+    condicion = niveles.get(descuento)
+    if condicion is None:
+        return None
+    
+    # Combos sin producto base se incluyen sin filtro de descuento
+    return or_(Producto.producto_base_id.is_(None), condicion)
+
+
+@app.route('/buscar_productos_admin')
+def buscar_productos_admin():
+    """Buscar productos con filtros para administración - INCLUYE FILTROS PARA COMBOS
+    
+    Paginado por keyset (codigo, id): devuelve siguiente_cursor para pedir la
+    próxima página con despues_codigo/despues_id. Con formato=ndjson se envían
+    todos los resultados como un producto JSON por línea.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        # Obtener parámetros de búsqueda
+        buscar = request.args.get('buscar', '').strip()
+        categoria = request.args.get('categoria', '').strip()
+        filtro_stock = request.args.get('stock', '').strip()
+        estado = request.args.get('estado', '').strip()
+        
+        # ✅ NUEVOS PARÁMETROS PARA COMBOS
+        solo_combos = request.args.get('solo_combos', '').strip().lower() == 'true'
+        estado = request.args.get('estado', '').strip()  # activo, inactivo
+        descuento = request.args.get('descuento', '').strip()  # alto, medio, bajo
+        
+        # Paginación
+        limite = request.args.get('limite', LIMITE_PRODUCTOS_ADMIN, type=int)
+        limite = max(1, min(limite, LIMITE_MAXIMO_PRODUCTOS_ADMIN))
+        despues_codigo = request.args.get('despues_codigo')
+        despues_id = request.args.get('despues_id', type=int)
+        formato = request.args.get('formato', 'json').strip().lower()
+        
+        print(f"🔍 Búsqueda productos admin:")
+        print(f"   Buscar: '{buscar}'")
+        print(f"   Solo combos: {solo_combos}")
+        print(f"   Estado: '{estado}'")
+        print(f"   Descuento: '{descuento}'")
+        print(f"   Página: {limite} después de {despues_codigo!r}/{despues_id}")
+        
+        # Construir query base (producto base de combos en una sola consulta extra)
+        query = Producto.query.options(selectinload(Producto.producto_base))
+        
+        # ✅ FILTRO PARA SOLO COMBOS
+        if solo_combos:
+            query = query.filter(Producto.es_combo == True)
+            print("   Filtro aplicado: Solo combos")
+        
+        # Aplicar filtros generales
+        if buscar:
+            query = query.filter(
+                or_(
+                    Producto.codigo.ilike(f'%{buscar}%'),
+                    Producto.nombre.ilike(f'%{buscar}%'),
+                    Producto.descripcion.ilike(f'%{buscar}%')
+                )
+            )
+            print(f"   Filtro aplicado: Búsqueda '{buscar}'")
+        
+        if categoria:
+            query = query.filter(Producto.categoria == categoria)
+            print(f"   Filtro aplicado: Categoría '{categoria}'")
+        
+        if filtro_stock == 'bajo':
+            query = query.filter(Producto.stock < 10)
+        elif filtro_stock == 'sin_stock':
+            query = query.filter(Producto.stock <= 0)
+        
+        # ✅ FILTRO DE ESTADO (ACTIVO/INACTIVO)
+        if estado == 'activo':
+            query = query.filter(Producto.activo == True)
+            print("   Filtro aplicado: Solo activos")
+        elif estado == 'inactivo':
+            query = query.filter(Producto.activo == False)
+            print("   Filtro aplicado: Solo inactivos")
+        
+        # ✅ FILTRO DE DESCUENTO EN LA BASE DE DATOS (solo para combos)
+        if descuento and solo_combos:
+            filtro_descuento = _filtro_descuento_combos(descuento)
+            if filtro_descuento is not None:
+                query = query.filter(filtro_descuento)
+                print(f"   Filtro aplicado: Descuento '{descuento}'")
+        
+        # ✅ MODO STREAMING: recorrer todas las páginas sin armar una lista gigante
+        if formato == 'ndjson':
+            def generar():
+                cursor = {'despues_codigo': despues_codigo, 'despues_id': despues_id}
+                enviados = 0
+                while cursor:
+                    pagina, cursor = _pagina_productos_admin(
+                        query, cursor['despues_codigo'], cursor['despues_id'], limite
+                    )
+                    for producto in pagina:
+                        yield app.json.dumps(_producto_admin_dict(producto)) + '\n'
+                    enviados += len(pagina)
+                    # Liberar los objetos de la página ya enviada
+                    db.session.expunge_all()
+                print(f"✅ Búsqueda (ndjson) completada: {enviados} productos")
+            
+            return app.response_class(
+                stream_with_context(generar()),
+                mimetype='application/x-ndjson'
+            )
+        
+        productos, siguiente_cursor = _pagina_productos_admin(query, despues_codigo, despues_id, limite)
+        
+        # Formatear respuesta
+        resultado = [_producto_admin_dict(producto) for producto in productos]
+        
+        print(f"✅ Búsqueda completada: {len(resultado)} productos")
+        
+        return jsonify({
+            'success': True,
+            'productos': resultado,
+            'total': len(resultado),
+            'limite': limite,
+            'hay_mas': siguiente_cursor is not None,
+            'siguiente_cursor': siguiente_cursor,
+            'filtros_aplicados': {
+                'buscar': buscar,
+                'solo_combos': solo_combos,
+                'estado': estado,
+                'descuento': descuento,
+                'categoria': categoria,
+                'filtro_stock': filtro_stock
+            }
+        })
+        
+    except Exception as e:
+        print(f"❌ Error buscando productos: {str(e)}")
+        import traceback
+        print(f"📋 Stack trace: {traceback.format_exc()}")
+        return jsonify({'error': f'Error en la búsqueda: {str(e)}'}), 500
+
+# ================== ACTUALIZACIONES MASIVAS DE PRODUCTOS POR TRAMOS ==================
+# Los recálculos de costos y precios se hacen con UPDATE en SQL por tramos de
+# id, confirmando cada tramo: cada uno bloquea pocas filas por poco tiempo y
+# las cajas siguen vendiendo mientras se actualiza el catálogo.
+
+TAMANO_TRAMO_ACTUALIZACION = 500
+MAX_MUESTRA_ACTUALIZACION = 20
+
+
+def _registrar_actualizacion_masiva_productos(entidad, ahora=None):
+    """Subir la versión del catálogo una vez por actualización masiva y avisar a los caches.
+    
+    La caja recibe los productos modificados por fecha_modificacion en el delta.
+    """
+    db.session.execute(
+        CatalogoCambio.__table__.insert().values(entidad=entidad, entidad_id=None, fecha=ahora or datetime.now())
+    )
+    db.session.info['datos_catalogo_modificados'] = True
+    db.session.info['productos_reportes_modificados'] = True
+
+
+def _fila_muestra(fila, columnas, despues=None):
+    """Fila de la muestra de una actualización masiva: valores antes y después"""
+    valores = lambda origen, prefijo='': {
+        columna.name: float(getattr(origen, prefijo + columna.name) or 0) for columna in columnas
+    }
+    return {
+        'id': fila.id,
+        'codigo': fila.codigo,
+        'nombre': fila.nombre,
+        'antes': valores(fila),
+        'despues': valores(despues) if despues is not None else valores(fila, 'nuevo_')
+    }
+
+
+def actualizar_productos_por_tramos(condiciones, valores, entidad, columnas_muestra=(),
+                                    al_actualizar=None, simular=False,
+                                    tamano_tramo=TAMANO_TRAMO_ACTUALIZACION):
+    """UPDATE de los productos que cumplen 'condiciones', por tramos de id.
+    
+    'valores' es una lista de (columna, expresión) que se asignan en ese orden.
+    Cada tramo se confirma por separado y al_actualizar(ids) corre dentro de la
+    transacción del tramo. Como MySQL no tiene RETURNING, el resumen trae la
+    cantidad de productos y una muestra con las columnas indicadas antes y
+    después; con simular solo se cuenta y la muestra trae los valores calculados.
+    """
+    tabla = Producto.__table__
+    columnas = [tabla.c.id, tabla.c.codigo, tabla.c.nombre] + list(columnas_muestra)
+    nombres_muestra = {columna.name for columna in columnas_muestra}
+    resumen = {'actualizados': 0, 'tramos': 0, 'muestra': []}
+    
+    if simular:
+        resumen['actualizados'] = db.session.execute(
+            select(func.count()).select_from(tabla).where(*condiciones)
+        ).scalar()
+        calculados = [
+            expresion.label(f'nuevo_{columna.name}')
+            for columna, expresion in valores if columna.name in nombres_muestra
+        ]
+        calculados += [
+            columna.label(f'nuevo_{columna.name}') for columna in columnas_muestra
+            if columna.name not in {c.name for c, _ in valores}
+        ]
+        filas = db.session.execute(
+            select(*columnas, *calculados).where(*condiciones).order_by(tabla.c.id).limit(MAX_MUESTRA_ACTUALIZACION)
+        ).all()
+        resumen['muestra'] = [_fila_muestra(fila, columnas_muestra) for fila in filas]
+        return resumen
+    
+    ultimo_id = 0
+    while True:
+        filas = db.session.execute(
+            select(*columnas).where(tabla.c.id > ultimo_id, *condiciones).order_by(tabla.c.id).limit(tamano_tramo)
+        ).all()
+        if not filas:
+            break
+        ids = [fila.id for fila in filas]
+        ultimo_id = ids[-1]
+        ahora = datetime.now()
+        
+        try:
+            actualizados = db.session.execute(
+                update(tabla)
+                .where(tabla.c.id.in_(ids), *condiciones)
+                .ordered_values(*valores, (tabla.c.fecha_modificacion, ahora))
+            ).rowcount
+            
+            if al_actualizar:
+                al_actualizar(ids)
+            _registrar_actualizacion_masiva_productos(entidad, ahora)
+            
+            faltan = MAX_MUESTRA_ACTUALIZACION - len(resumen['muestra'])
+            if faltan > 0:
+                antes = filas[:faltan]
+                despues = {
+                    fila.id: fila for fila in db.session.execute(
+                        select(*columnas).where(tabla.c.id.in_([fila.id for fila in antes]))
+                    ).all()
+                }
+                resumen['muestra'].extend(
+                    _fila_muestra(fila, columnas_muestra, despues[fila.id]) for fila in antes if fila.id in despues
+                )
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        resumen['actualizados'] += actualizados
+        resumen['tramos'] += 1
+    
+    return resumen
+
+
+def _margen_o_defecto(tabla):
+    """Margen del producto, o 30% si no tiene uno cargado"""
+    return case((or_(tabla.c.margen.is_(None), tabla.c.margen == 0), 30), else_=tabla.c.margen)
+
+
+# FUNCIÓN PARA ACTUALIZAR PRODUCTOS EXISTENTES CON COSTO CALCULADO
+@app.route('/actualizar_costos_productos', methods=['POST'])
+def actualizar_costos_productos():
+    """Actualizar productos que tienen costo 0 calculándolo desde precio y margen"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        tabla = Producto.__table__
+        # costo = precio / (1 + margen/100)
+        resumen = actualizar_productos_por_tramos(
+            [or_(tabla.c.costo == 0, tabla.c.costo.is_(None)), tabla.c.precio > 0],
+            [(tabla.c.costo, func.round(tabla.c.precio / (1 + _margen_o_defecto(tabla) / 100), 2))],
+            'costos',
+            columnas_muestra=(tabla.c.precio, tabla.c.costo),
+            al_actualizar=propagar_precios_combos
+        )
+        contador_actualizados = resumen['actualizados']
+        print(f"📦 Costos calculados: {contador_actualizados} productos en {resumen['tramos']} tramos")
+        
+        return jsonify({
+            'success': True,
+            'message': f'Se actualizaron {contador_actualizados} productos',
+            'productos_actualizados': contador_actualizados,
+            'tramos': resumen['tramos'],
+            'muestra': resumen['muestra']
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error actualizando costos: {str(e)}")
+        return jsonify({'error': f'Error al actualizar costos: {str(e)}'}), 500
+
+
+@app.route('/api/reajustar_precios_categoria', methods=['POST'])
+def reajustar_precios_categoria():
+    """Subir o bajar un porcentaje los precios (o los costos) de una categoría.
+    
+    Con base 'costo' se ajusta el costo y el precio se recalcula con el margen
+    de cada producto. Los combos se recalculan desde su producto base según
+    politica_combos (mantener el precio o el porcentaje de descuento).
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        data = request.get_json() or {}
+        categoria = (data.get('categoria') or '').strip()
+        base = data.get('base', 'precio')
+        simular = bool(data.get('simular', False))
+        
+        try:
+            porcentaje = float(data.get('porcentaje', 0))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Porcentaje inválido'}), 400
+        
+        if not categoria:
+            return jsonify({'success': False, 'error': 'La categoría es requerida'}), 400
+        if porcentaje == 0 or porcentaje <= -100:
+            return jsonify({'success': False, 'error': 'El porcentaje debe ser distinto de 0 y mayor a -100'}), 400
+        if base not in ('precio', 'costo'):
+            return jsonify({'success': False, 'error': "La base debe ser 'precio' o 'costo'"}), 400
+        try:
+            politica = politica_combos(data.get('politica_combos'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        tabla = Producto.__table__
+        factor = Decimal(str(porcentaje)) / 100 + 1
+        condiciones = [tabla.c.categoria == categoria, tabla.c.es_combo == False]
+        
+        if base == 'precio':
+            condiciones.append(tabla.c.precio > 0)
+            valores = [(tabla.c.precio, func.round(tabla.c.precio * factor, 2))]
+        else:
+            condiciones.append(tabla.c.costo > 0)
+            nuevo_costo = func.round(tabla.c.costo * factor, 2)
+            # El precio va primero: MySQL asigna en orden y debe usar el costo anterior
+            valores = [
+                (tabla.c.precio, func.round(nuevo_costo * (1 + func.coalesce(tabla.c.margen, 0) / 100), 2)),
+                (tabla.c.costo, nuevo_costo)
+            ]
+        
+        resumen = actualizar_productos_por_tramos(
+            condiciones, valores, 'reajuste',
+            columnas_muestra=(tabla.c.precio, tabla.c.costo),
+            al_actualizar=lambda ids: propagar_precios_combos(ids, politica),
+            simular=simular
+        )
+        
+        accion = 'se actualizarían' if simular else 'actualizados'
+        print(f"💲 Reajuste {categoria} {porcentaje:+g}% sobre {base}: {resumen['actualizados']} productos {accion}")
+        
+        return jsonify({
+            'success': True,
+            'simulacion': simular,
+            'mensaje': f"{resumen['actualizados']} productos de {categoria} {accion} ({porcentaje:+g}% sobre {base})",
+            **resumen
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Error en el reajuste: {str(e)}'}), 500
+
+@app.route('/obtener_categorias')
+def obtener_categorias():
+    """Obtener lista de categorías únicas"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        # Obtener categorías únicas de productos existentes
+        categorias = db.session.query(Producto.categoria).filter(
+            Producto.categoria.isnot(None),
+            Producto.categoria != ''
+        ).distinct().all()
+        
+        categorias_lista = [cat[0] for cat in categorias if cat[0]]
+        categorias_lista.sort()
+        
+        return jsonify({
+            'success': True,
+            'categorias': categorias_lista
+        })
+        
+    except Exception as e:
+        print(f"Error obteniendo categorías: {str(e)}")
+        return jsonify({'error': f'Error al obtener categorías: {str(e)}'}), 500
+
+
+###### RUTAS API PARA MANEJAR COMBOS
+
+@app.route('/api/productos_con_ofertas')
+def api_productos_con_ofertas():
+    """API para obtener productos con sus ofertas/combos"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        productos = Producto.obtener_productos_con_ofertas()
+        return jsonify({
+            'success': True,
+            'productos': productos
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/crear_combo', methods=['POST'])
+def crear_combo():
+    """Crear un nuevo combo/oferta basado en un producto existente o editarlo"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        data = request.json
+        
+        # ✅ DETECTAR SI ES EDICIÓN
+        combo_id = data.get('id')
+        es_edicion = combo_id is not None
+        
+        if es_edicion:
+            print(f"🔧 EDITANDO combo ID: {combo_id}")
+            combo = Producto.query.get_or_404(combo_id)
+            if not combo.es_combo:
+                return jsonify({'error': 'El producto no es un combo'}), 400
+        else:
+            print("🆕 CREANDO nuevo combo")
+            combo = None
+        
+        # Validar datos
+        producto_base_id = data.get('producto_base_id')
+        cantidad_combo = float(data.get('cantidad_combo', 1))
+        precio_combo = float(data.get('precio_combo', 0))
+        nombre_combo = data.get('nombre_combo', '').strip()
+        
+        if not producto_base_id:
+            return jsonify({'error': 'Producto base requerido'}), 400
+        
+        if cantidad_combo <= 0:
+            return jsonify({'error': 'La cantidad debe ser mayor a 0'}), 400
+        
+        if precio_combo <= 0:
+            return jsonify({'error': 'El precio debe ser mayor a 0'}), 400
+        
+        # Obtener producto base
+        producto_base = Producto.query.get_or_404(producto_base_id)
+        
+        # Calcular precio normal y descuento
+        precio_normal = float(producto_base.precio) * cantidad_combo
+        descuento_monto = precio_normal - precio_combo
+        descuento_porcentaje = (descuento_monto / precio_normal) * 100 if precio_normal > 0 else 0
+        
+        # Generar código automático si no se proporciona
+        codigo_combo = data.get('codigo_combo', '').strip()
+        if not codigo_combo:
+            cantidad_str = f"{cantidad_combo:g}".replace('.', '')
+            codigo_combo = f"{producto_base.codigo}-{cantidad_str}UN"
+        
+        # ✅ VERIFICAR CÓDIGO DUPLICADO SOLO SI ES NUEVO O CAMBIÓ
+        if not es_edicion or (es_edicion and combo.codigo != codigo_combo):
+            if Producto.query.filter_by(codigo=codigo_combo).first():
+                return jsonify({'error': f'Ya existe un producto con el código {codigo_combo}'}), 400
+        
+        # Generar nombre automático si no se proporciona
+        if not nombre_combo:
+            cantidad_str = f"{cantidad_combo:g}"
+            nombre_combo = f"{cantidad_str} x {producto_base.nombre} (Oferta)"
+        
+        if es_edicion:
+            # ✅ ACTUALIZAR COMBO EXISTENTE
+            combo.codigo = codigo_combo
+            combo.nombre = nombre_combo
+            combo.descripcion = data.get('descripcion_combo', combo.descripcion)
+            combo.precio = Decimal(str(precio_combo))
+            combo.categoria = 'OFERTAS'
+            combo.iva = producto_base.iva
+            combo.costo = Decimal(str(float(producto_base.costo or 0) * cantidad_combo))
+            combo.stock = int(float(producto_base.stock) / cantidad_combo)
+            combo.producto_base_id = producto_base.id
+            combo.cantidad_combo = Decimal(str(cantidad_combo))
+            combo.precio_unitario_base = producto_base.precio
+            combo.descuento_porcentaje = Decimal(str(descuento_porcentaje))
+            
+            accion = "actualizado"
+        else:
+            # ✅ CREAR NUEVO COMBO
+            combo = Producto(
+                codigo=codigo_combo,
+                nombre=nombre_combo,
+                descripcion=f"Oferta especial: {cantidad_combo:g} unidades de {producto_base.nombre}",
+                precio=Decimal(str(precio_combo)),
+                categoria='OFERTAS',
+                iva=producto_base.iva,
+                costo=Decimal(str(float(producto_base.costo or 0) * cantidad_combo)),
+                stock=int(float(producto_base.stock) / cantidad_combo),
+                es_combo=True,
+                producto_base_id=producto_base.id,
+                cantidad_combo=Decimal(str(cantidad_combo)),
+                precio_unitario_base=producto_base.precio,
+                descuento_porcentaje=Decimal(str(descuento_porcentaje))
+            )
             
-        except Exception as e:
-            print(f"❌ Error en autorización AFIP: {e}")
-            return {
-                'success': False,
-                'error': str(e),
-                'cae': None,
-                'vto_cae': None,
-                'estado': 'error_afip'
-            }
-
-    def get_codigo_iva_afip(self, porcentaje):
-        """Mapear porcentajes de IVA a códigos AFIP"""
-        mapeo_iva = {
-            0: 3,      # Exento
-            10.5: 4,   # IVA 10.5%
-            21: 5,     # IVA 21%
-            27: 6,     # IVA 27%
-            2.5: 9     # IVA 2.5%
-        }
+            db.session.add(combo)
+            accion = "creado"
         
-        codigo = mapeo_iva.get(porcentaje, None)
-        if codigo is None:
-            print(f"⚠️ Porcentaje IVA {porcentaje}% no reconocido, usando código 5 (21%) por defecto")
-            return 5  # Por defecto IVA 21%
+        db.session.commit()
         
-        return codigo
+        print(f"✅ Combo {accion}: {codigo_combo}")
+        print(f"   Producto base: {producto_base.nombre}")
+        print(f"   Cantidad: {cantidad_combo}")
+        print(f"   Precio normal: ${precio_normal:.2f}")
+        print(f"   Precio combo: ${precio_combo:.2f}")
+        print(f"   Descuento: {descuento_porcentaje:.1f}% (${descuento_monto:.2f})")
+        
+        return jsonify({
+            'success': True,
+            'message': f'Combo {accion} correctamente',
+            'combo': combo.to_dict()
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error en combo: {str(e)}")
+        return jsonify({'error': f'Error al procesar combo: {str(e)}'}), 500
+
+@app.route('/api/combos_producto/<int:producto_id>')
+def obtener_combos_producto(producto_id):
+    """Obtener todos los combos de un producto base"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
     
+    try:
+        producto_base = Producto.query.get_or_404(producto_id)
+        
+        # Obtener combos del producto
+        combos = Producto.query.filter_by(
+            producto_base_id=producto_id,
+            es_combo=True,
+            activo=True
+        ).order_by(Producto.cantidad_combo.asc()).all()
+        
+        # Preparar respuesta
+        combos_data = []
+        for combo in combos:
+            combo_info = combo.to_dict()
+            combos_data.append(combo_info)
+        
+        return jsonify({
+            'success': True,
+            'producto_base': producto_base.to_dict(),
+            'combos': combos_data,
+            'total_combos': len(combos_data)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-    def get_ultimo_comprobante(self, tipo_cbte):
-        """Obtener último comprobante autorizado"""
+
+@app.route('/api/recalcular_combos', methods=['POST'])
+def recalcular_combos():
+    """Recalcular los combos desde su producto base (todos o los de un producto)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        data = request.get_json(silent=True) or {}
         try:
-            print(f"📋 Consultando último comprobante tipo {tipo_cbte}...")
-            
-            if not self.get_ticket_access():
-                raise Exception("No se pudo obtener acceso a AFIP")
-            
-            # URL del WSFEv1
-            wsfe_url = self.config.WSFEv1_URL
-            
-            print(f"🌐 Conectando con WSFEv1: {wsfe_url}")
-            
-            # USAR SESIÓN PERSONALIZADA
-            session = crear_session_afip()
-            
-            from zeep.transports import Transport
-            
-            transport = Transport(session=session, timeout=60)
-            client = Client(wsfe_url, transport=transport)
-            
-            response = client.service.FECompUltimoAutorizado(
-                Auth={
-                    'Token': self.token,
-                    'Sign': self.sign,
-                    'Cuit': self.cuit
-                },
-                PtoVta=self.config.PUNTO_VENTA,
-                CbteTipo=tipo_cbte
-            )
-            
-            if hasattr(response, 'Errors') and response.Errors:
-                error_msg = response.Errors.Err[0].Msg
-                raise Exception(f"Error AFIP: {error_msg}")
+            politica = politica_combos(data.get('politica'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if data.get('producto_base_id'):
+            ids_base = [int(data['producto_base_id'])]
+        else:
+            ids_base = [producto_id for (producto_id,) in db.session.query(Producto.producto_base_id).filter(
+                Producto.es_combo == True,
+                Producto.producto_base_id.isnot(None)
+            ).distinct().all()]
+        
+        actualizados = propagar_precios_combos(ids_base, politica)
+        if actualizados:
+            _registrar_actualizacion_masiva_productos('combos')
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'politica': politica,
+            'combos_actualizados': actualizados,
+            'productos_base': len(ids_base)
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Error recalculando combos: {str(e)}'}), 500
+
+
+# FUNCIÓN PARA MIGRAR PRODUCTOS EXISTENTES
+def migrar_productos_para_combos():
+    """Migrar productos existentes al nuevo sistema de combos"""
+    try:
+        print("🔄 Iniciando migración para sistema de combos...")
+        
+        # Actualizar productos existentes
+        productos_sin_migrar = Producto.query.filter(
+            Producto.es_combo.is_(None)
+        ).all()
+        
+        contador_migrados = 0
+        
+        for producto in productos_sin_migrar:
+            # Todos los productos existentes son productos base (no combos)
+            producto.es_combo = False
+            producto.cantidad_combo = Decimal('1.000')
+            producto.precio_unitario_base = producto.precio
+            producto.descuento_porcentaje = Decimal('0.00')
             
-            ultimo_num = response.CbteNro
-            print(f"✅ Último comprobante: {ultimo_num}")
-            return ultimo_num
+            contador_migrados += 1
+        
+        if contador_migrados > 0:
+            db.session.commit()
+            print(f"✅ Migración completada: {contador_migrados} productos actualizados")
+        else:
+            print("✅ No hay productos para migrar")
             
-        except Exception as e:
-            print(f"❌ Error consultando comprobante: {e}")
-            raise Exception(f"Error al obtener último comprobante: {e}")
-
+        return contador_migrados
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error en migración: {e}")
+        return 0
 
-arca_client = ARCAClient()
 
-# Monitor AFIP simplificado
-class AFIPStatusMonitor:
-    def __init__(self, arca_config):
-        self.config = arca_config
-    
-    def verificar_rapido(self):
-        """Verificación rápida solo de conectividad"""
-        try:
-            import socket
-            from urllib.parse import urlparse
+# EJEMPLO DE USO PARA CREAR COMBOS
+def crear_ejemplos_combos():
+    """Crear ejemplos de combos para demostración"""
+    try:
+        # Buscar producto base (milanesa)
+        producto_base = Producto.query.filter_by(codigo='MIL001').first()
+        
+        if not producto_base:
+            print("⚠️ Producto base MIL001 no encontrado")
+            return
+        
+        combos_ejemplos = [
+            {
+                'codigo': 'MIL001-3KG',
+                'nombre': '3kg Milanesa de Ternera (Oferta)',
+                'cantidad': 3.0,
+                'precio': 10000.00,
+                'descripcion': 'Oferta especial: 3 kilogramos de milanesa de ternera'
+            },
+            {
+                'codigo': 'MIL001-5KG', 
+                'nombre': '5kg Milanesa de Ternera (Super Oferta)',
+                'cantidad': 5.0,
+                'precio': 18000.00,
+                'descripcion': 'Super oferta: 5 kilogramos de milanesa de ternera'
+            }
+        ]
+        
+        for combo_data in combos_ejemplos:
+            # Verificar si ya existe
+            if Producto.query.filter_by(codigo=combo_data['codigo']).first():
+                print(f"⚠️ Combo {combo_data['codigo']} ya existe")
+                continue
             
-            wsaa_host = urlparse(self.config.WSAA_URL).hostname
+            # Calcular valores
+            precio_normal = float(producto_base.precio) * combo_data['cantidad']
+            descuento_monto = precio_normal - combo_data['precio']
+            descuento_porcentaje = (descuento_monto / precio_normal) * 100
             
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)
-            result = sock.connect_ex((wsaa_host, 443))
-            sock.close()
+            # Crear combo
+            combo = Producto(
+                codigo=combo_data['codigo'],
+                nombre=combo_data['nombre'],
+                descripcion=combo_data['descripcion'],
+                precio=Decimal(str(combo_data['precio'])),
+                categoria='OFERTAS',
+                iva=producto_base.iva,
+                costo=Decimal(str(float(producto_base.costo or 0) * combo_data['cantidad'])),
+                stock=int(float(producto_base.stock) / combo_data['cantidad']),
+                
+                es_combo=True,
+                producto_base_id=producto_base.id,
+                cantidad_combo=Decimal(str(combo_data['cantidad'])),
+                precio_unitario_base=producto_base.precio,
+                descuento_porcentaje=Decimal(str(descuento_porcentaje))
+            )
             
-            return {
-                'conectividad': result == 0,
-                'mensaje': '✅ AFIP accesible' if result == 0 else '❌ AFIP no accesible'
-            }
-        except Exception as e:
-            return {
-                'conectividad': False,
-                'mensaje': f'❌ Error: {str(e)}'
-            }
+            db.session.add(combo)
+            print(f"✅ Combo creado: {combo_data['codigo']} - Descuento: {descuento_porcentaje:.1f}%")
+        
+        db.session.commit()
+        print("🎉 Ejemplos de combos creados exitosamente")
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error creando ejemplos: {e}")
 
-# Crear instancia del monitor
-afip_monitor = AFIPStatusMonitor(ARCA_CONFIG)
 
+# RUTA PARA EJECUTAR MIGRACIÓN
+@app.route('/migrar_combos', methods=['POST'])
+def ejecutar_migracion_combos():
+    """Endpoint para ejecutar migración de combos"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        contador = migrar_productos_para_combos()
+        
+        return jsonify({
+            'success': True,
+            'mensaje': f'Migración completada: {contador} productos actualizados',
+            'productos_migrados': contador
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error en migración: {str(e)}'
+        }), 500
 
-# DESPUÉS DE DEFINIR LOS MODELOS Y ANTES DE LAS RUTAS:
-# Inicializar y registrar el blueprint de estadísticas
-estadisticas_bp = init_estadisticas(db, Factura, DetalleFactura, Producto)
-app.register_blueprint(estadisticas_bp)
 
 
-# Rutas de la aplicación
-@app.route('/')
-def index():
+@app.route('/nueva_venta')
+def nueva_venta():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    return render_template('dashboard.html')
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        username = request.form['username']
-        password = request.form['password']
-        
-        usuario = Usuario.query.filter_by(username=username, activo=True).first()
-        
-        # Login simple sin encriptación
-        if usuario and usuario.password_hash == password:
-            session['user_id'] = usuario.id
-            session['username'] = usuario.username
-            session['nombre'] = usuario.nombre
-            return redirect(url_for('index'))
-        else:
-            flash('Usuario o contraseña incorrectos')
     
-    return render_template('login.html')
-
-@app.route('/logout')
-def logout():
-    session.clear()
-    return redirect(url_for('login'))
+    # Obtener productos de acceso rápido en lugar de los primeros 8
+    productos = Producto.query.filter_by(
+        acceso_rapido=True,
+        activo=True
+    ).order_by(
+        Producto.orden_acceso_rapido.asc(),
+        Producto.codigo.asc()
+    ).limit(8).all()
+    
+    clientes = Cliente.query.all()
+    return render_template('nueva_venta.html', productos=productos, clientes=clientes)
 
+# APIs para búsqueda de productos
+# 4. ACTUALIZAR LAS APIS DE BÚSQUEDA PARA INCLUIR COSTO
+@app.route('/api/buscar_productos/<termino>')
+def buscar_productos(termino):
+    """Busca productos por código o nombre - CORREGIDO"""
+    if not termino or len(termino) < 2:
+        return jsonify([])
     
-@app.route('/api/hora_actual')
-def hora_actual():
-    from datetime import datetime
-    import pytz
+    # Búsqueda por código exacto primero
+    producto_exacto = Producto.query.filter_by(codigo=termino.upper(), activo=True).first()
+    if producto_exacto:
+        resultado = {
+            'id': producto_exacto.id,
+            'codigo': producto_exacto.codigo,
+            'nombre': producto_exacto.nombre,
+            'precio': float(producto_exacto.precio),
+            'precio_base': float(producto_exacto.precio),
+            'costo': float(producto_exacto.costo) if producto_exacto.costo else 0.0,
+            'margen': float(producto_exacto.margen) if producto_exacto.margen else 0.0,
+            'stock': producto_exacto.stock,
+            'iva': float(producto_exacto.iva),
+            'match_tipo': 'codigo_exacto',
+            'descripcion': producto_exacto.descripcion or '',
+            'es_combo': producto_exacto.es_combo,
+            'producto_base_id': producto_exacto.producto_base_id,
+            'cantidad_combo': float(producto_exacto.cantidad_combo) if producto_exacto.cantidad_combo else 1.0,
+            'precio_unitario_base': float(producto_exacto.precio_unitario_base) if producto_exacto.precio_unitario_base else float(producto_exacto.precio),
+            'descuento_porcentaje': float(producto_exacto.descuento_porcentaje) if producto_exacto.descuento_porcentaje else 0.0,
+            'ahorro_combo': producto_exacto.calcular_ahorro_combo(),
+            'precio_normal': producto_exacto.calcular_precio_normal(),
+            'tiene_ofertas': producto_exacto.tiene_ofertas_volumen()
+        }
+        return jsonify([resultado])  # ← ESTA LÍNEA ESTABA FALTANDO O MAL UBICADA
     
-    # Zona horaria de Argentina
-    argentina_tz = pytz.timezone('America/Argentina/Buenos_Aires')
-    ahora = datetime.now(argentina_tz)
+    # Búsqueda parcial en código y nombre
+    termino_busqueda = f"%{termino.lower()}%"
     
-    return jsonify({
-        'success': True,
-        'timestamp': ahora.isoformat(),
-        'fecha_legible': ahora.strftime('%A, %d de %B de %Y'),
-        'hora_legible': ahora.strftime('%H:%M:%S'),
-        'zona_horaria': 'America/Argentina/Buenos_Aires'
-    })
-
-@app.route('/productos')
-def productos():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
+    productos = Producto.query.filter(
+        and_(
+            Producto.activo == True,
+            or_(
+                Producto.codigo.ilike(termino_busqueda),
+                Producto.nombre.ilike(termino_busqueda),
+                Producto.descripcion.ilike(termino_busqueda)
+            )
+        )
+    ).limit(15).all()
     
-    productos = Producto.query.filter_by(activo=True).all()
-    return render_template('productos.html', productos=productos)
-
-@app.route('/combos')
-def combos():
-    # Obtener solo productos que son combos
-    combos = Producto.query.filter_by(es_combo=True).all()
-    return render_template('combos.html', combos=combos)
-
-@app.route('/clientes')
-def clientes():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
+    resultados = []
+    for producto in productos:
+        # Determinar tipo de coincidencia para ordenar resultados
+        match_tipo = 'nombre'
+        if termino.lower() in producto.codigo.lower():
+            match_tipo = 'codigo'
+        elif termino.lower() in producto.nombre.lower()[:20]:
+            match_tipo = 'nombre_inicio'
+        
+        resultado = {
+            'id': producto.id,
+            'codigo': producto.codigo,
+            'nombre': producto.nombre,
+            'precio': float(producto.precio),
+            'precio_base': float(producto.precio),
+            'costo': float(producto.costo) if producto.costo else 0.0,
+            'margen': float(producto.margen) if producto.margen else 0.0,
+            'stock': producto.stock,
+            'iva': float(producto.iva),
+            'match_tipo': match_tipo,
+            'descripcion': producto.descripcion or '',
+            'es_combo': producto.es_combo,
+            'producto_base_id': producto.producto_base_id,
+            'cantidad_combo': float(producto.cantidad_combo) if producto.cantidad_combo else 1.0,
+            'precio_unitario_base': float(producto.precio_unitario_base) if producto.precio_unitario_base else float(producto.precio),
+            'descuento_porcentaje': float(producto.descuento_porcentaje) if producto.descuento_porcentaje else 0.0,
+            'ahorro_combo': producto.calcular_ahorro_combo(),
+            'precio_normal': producto.calcular_precio_normal(),
+            'tiene_ofertas': producto.tiene_ofertas_volumen()
+        }
+        resultados.append(resultado)
     
-    clientes = Cliente.query.all()
-    return render_template('clientes.html', clientes=clientes)
+    def orden_relevancia(item):
+        if item['match_tipo'] == 'codigo_exacto':
+            return 0
+        elif item['match_tipo'] == 'codigo':
+            return 1
+        elif item['match_tipo'] == 'nombre_inicio':
+            return 2
+        else:
+            return 3
+    
+    resultados.sort(key=orden_relevancia)
+    return jsonify(resultados)
 
-# ==================== RUTAS DE CLIENTES ====================
 
-@app.route('/api/cliente/<int:cliente_id>')
-def obtener_cliente(cliente_id):
-    """Obtener datos de un cliente por ID para edición"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'No autorizado'}), 401
-    
-    try:
-        # Método compatible con SQLAlchemy antiguo
-        cliente = Cliente.query.get_or_404(cliente_id)
+@app.route('/api/producto_por_id/<int:producto_id>')
+def get_producto_por_id(producto_id):
+    """Obtiene un producto por ID - INCLUYE COSTO"""
+    producto = Producto.query.filter_by(id=producto_id, activo=True).first()
+    if producto:
         return jsonify({
-            'id': cliente.id,
-            'nombre': cliente.nombre,
-            'documento': cliente.documento or '',
-            'tipo_documento': cliente.tipo_documento or 'DNI',
-            'email': cliente.email or '',
-            'telefono': cliente.telefono or '',
-            'direccion': cliente.direccion or '',
-            'condicion_iva': cliente.condicion_iva or 'CONSUMIDOR_FINAL'
+            'id': producto.id,
+            'codigo': producto.codigo,
+            'nombre': producto.nombre,
+            'precio': float(producto.precio),
+            'costo': float(producto.costo) if producto.costo else 0.0,  # ← NUEVO
+            'margen': float(producto.margen) if producto.margen else 0.0,  # ← NUEVO
+            'stock': producto.stock,
+            'iva': float(producto.iva),
+            'descripcion': producto.descripcion or '',
+            'es_combo': producto.es_combo,
+            'producto_base_id': producto.producto_base_id,
+            'cantidad_combo': float(producto.cantidad_combo) if producto.cantidad_combo else 1.0,
+            'precio_unitario_base': float(producto.precio_unitario_base) if producto.precio_unitario_base else float(producto.precio),
+            'descuento_porcentaje': float(producto.descuento_porcentaje) if producto.descuento_porcentaje else 0.0,
+            'ahorro_combo': producto.calcular_ahorro_combo(),
+            'precio_normal': producto.calcular_precio_normal()
         })
-    except Exception as e:
-        return jsonify({'error': f'Error al obtener cliente: {str(e)}'}), 500
+    return jsonify({'error': 'Producto no encontrado'}), 404
 
-@app.route('/guardar_cliente', methods=['POST'])
-def guardar_cliente():
-    """Crear o actualizar un cliente"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'No autorizado'}), 401
+@app.route('/api/producto/<codigo>')
+def get_producto(codigo):
+    """Obtiene un producto por código exacto o etiqueta de balanza - INCLUYE COSTO"""
+    producto = Producto.query.filter_by(codigo=codigo.upper(), activo=True).first()
+    etiqueta_balanza = None
     
-    try:
-        data = request.json
-        
-        # Validar datos requeridos
-        if not data.get('nombre', '').strip():
-            return jsonify({'error': 'El nombre es obligatorio'}), 400
-        
-        # Validar CUIT si es necesario
-        if data.get('tipo_documento') == 'CUIT' and data.get('documento'):
-            documento = data['documento'].strip()
-            if not documento.isdigit() or len(documento) != 11:
-                return jsonify({'error': 'El CUIT debe tener 11 dígitos sin guiones'}), 400
-        
-        cliente_id = data.get('id')
-        
-        if cliente_id:  # Editar cliente existente
-            cliente = Cliente.query.get_or_404(cliente_id)
-            accion = 'actualizado'
-        else:  # Crear nuevo cliente
-            cliente = Cliente()
-            accion = 'creado'
-        
-        # Actualizar datos del cliente
-        cliente.nombre = data['nombre'].strip()
-        cliente.documento = data.get('documento', '').strip() or None
-        cliente.tipo_documento = data.get('tipo_documento', 'DNI')
-        cliente.email = data.get('email', '').strip() or None
-        cliente.telefono = data.get('telefono', '').strip() or None
-        cliente.direccion = data.get('direccion', '').strip() or None
-        cliente.condicion_iva = data.get('condicion_iva', 'CONSUMIDOR_FINAL')
-        
-        # Guardar en base de datos
-        if not cliente_id:  # Solo agregar si es nuevo
-            db.session.add(cliente)
-        
-        db.session.commit()
+    # Si no existe el código, probar como etiqueta de balanza (prefijos 20-29)
+    if not producto:
+        producto, etiqueta_balanza = buscar_producto_por_codigo_balanza(codigo)
+    
+    if producto:
+        resultado = {
+            'id': producto.id,
+            'codigo': producto.codigo,
+            'nombre': producto.nombre,
+            'precio': float(producto.precio),
+            'costo': float(producto.costo) if producto.costo else 0.0,  # ← NUEVO
+            'margen': float(producto.margen) if producto.margen else 0.0,  # ← NUEVO
+            'stock': producto.stock,
+            'iva': float(producto.iva),
+            'descripcion': producto.descripcion or '',
+            'es_combo': producto.es_combo,
+            'producto_base_id': producto.producto_base_id,
+            'cantidad_combo': float(producto.cantidad_combo) if producto.cantidad_combo else 1.0,
+            'precio_unitario_base': float(producto.precio_unitario_base) if producto.precio_unitario_base else float(producto.precio),
+            'descuento_porcentaje': float(producto.descuento_porcentaje) if producto.descuento_porcentaje else 0.0,
+            'ahorro_combo': producto.calcular_ahorro_combo(),
+            'precio_normal': producto.calcular_precio_normal()
+        }
         
-        return jsonify({
-            'success': True,
-            'message': f'Cliente {accion} correctamente',
-            'cliente_id': cliente.id,
-            'cliente_nombre': cliente.nombre
-        })
+        if etiqueta_balanza:
+            resultado['codigo_balanza'] = etiqueta_balanza
+            resultado['cantidad_balanza'] = etiqueta_balanza['cantidad']
+            resultado['importe_balanza'] = etiqueta_balanza['importe']
+            resultado['tipo_balanza'] = etiqueta_balanza['tipo']
         
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error guardando cliente: {str(e)}")
-        return jsonify({'error': f'Error al guardar cliente: {str(e)}'}), 500
+        return jsonify(resultado)
+    return jsonify({'error': 'Producto no encontrado'}), 404
 
-@app.route('/eliminar_cliente/<int:cliente_id>', methods=['DELETE'])
-def eliminar_cliente(cliente_id):
-    """Eliminar un cliente (marcar como inactivo)"""
+
+# ==================== CATÁLOGO PARA BÚSQUEDA LOCAL EN CAJA ====================
+
+COLUMNAS_CATALOGO = [
+    'id', 'codigo', 'nombre', 'descripcion', 'precio', 'stock', 'iva', 'categoria',
+    'es_combo', 'producto_base_id', 'cantidad_combo', 'precio_unitario_base', 'descuento_porcentaje'
+]
+COLUMNAS_OFERTAS_CATALOGO = ['producto_id', 'cantidad_minima', 'precio_oferta', 'descripcion']
+
+
+def _consulta_filas_catalogo():
+    """Consulta de columnas planas de productos (sin armar objetos ORM)"""
+    return db.session.query(
+        Producto.id, Producto.codigo, Producto.nombre, Producto.descripcion,
+        Producto.precio, Producto.stock, Producto.iva, Producto.categoria,
+        Producto.es_combo, Producto.producto_base_id, Producto.cantidad_combo,
+        Producto.precio_unitario_base, Producto.descuento_porcentaje, Producto.activo
+    )
+
+
+def _fila_catalogo(fila):
+    """Convertir una fila de producto al formato compacto del catálogo"""
+    return [
+        fila.id,
+        fila.codigo,
+        fila.nombre,
+        fila.descripcion or '',
+        float(fila.precio),
+        float(fila.stock or 0),
+        float(fila.iva) if fila.iva is not None else 21.0,
+        fila.categoria,
+        bool(fila.es_combo),
+        fila.producto_base_id,
+        float(fila.cantidad_combo) if fila.cantidad_combo else 1.0,
+        float(fila.precio_unitario_base) if fila.precio_unitario_base else float(fila.precio),
+        float(fila.descuento_porcentaje) if fila.descuento_porcentaje else 0.0
+    ]
+
+
+def _ofertas_catalogo(producto_ids=None):
+    """Filas compactas de ofertas por volumen activas (opcionalmente de algunos productos)"""
+    query = db.session.query(
+        OfertaVolumen.producto_id,
+        OfertaVolumen.cantidad_minima,
+        OfertaVolumen.precio_oferta,
+        OfertaVolumen.descripcion
+    ).filter(OfertaVolumen.activo == True)
+    
+    if producto_ids is not None:
+        query = query.filter(OfertaVolumen.producto_id.in_(producto_ids))
+    
+    return [
+        [oferta.producto_id, float(oferta.cantidad_minima), float(oferta.precio_oferta), oferta.descripcion]
+        for oferta in query.order_by(OfertaVolumen.producto_id, OfertaVolumen.cantidad_minima).all()
+    ]
+
+
+def _respuesta_catalogo(datos, etag=None):
+    """Respuesta JSON compacta, comprimida con gzip si el navegador lo acepta"""
+    cuerpo = json.dumps(datos, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    
+    comprimir = 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+    if comprimir:
+        cuerpo = gzip.compress(cuerpo, compresslevel=6)
+    
+    response = make_response(cuerpo)
+    response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if comprimir:
+        response.headers['Content-Encoding'] = 'gzip'
+    if etag:
+        response.set_etag(etag)
+    
+    return response
+
+
+@app.route('/api/catalogo/snapshot')
+def api_catalogo_snapshot():
+    """Snapshot compacto de productos activos, combos y ofertas con su versión"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        cliente = Cliente.query.get_or_404(cliente_id)
-        
-        # Verificar si tiene facturas asociadas
-        facturas_count = Factura.query.filter_by(cliente_id=cliente_id).count()
-        
-        if facturas_count > 0:
-            return jsonify({
-                'error': f'No se puede eliminar el cliente porque tiene {facturas_count} facturas asociadas'
-            }), 400
+        # Leer la versión ANTES que los datos: si algo cambia en el medio,
+        # el próximo delta lo vuelve a enviar
+        version = CatalogoCambio.version_actual()
+        etag = f'catalogo-{version}'
+        
+        # El navegador ya tiene esta versión: no regenerar el snapshot
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+        
+        # La caja pide después los productos modificados desde esta fecha (stock)
+        generado = datetime.now()
+        filas = _consulta_filas_catalogo().filter(Producto.activo == True).order_by(Producto.id).all()
+        
+        datos = {
+            'success': True,
+            'version': version,
+            'generado': generado.isoformat(),
+            'productos': {
+                'columnas': COLUMNAS_CATALOGO,
+                'filas': [_fila_catalogo(fila) for fila in filas]
+            },
+            'ofertas': {
+                'columnas': COLUMNAS_OFERTAS_CATALOGO,
+                'filas': _ofertas_catalogo()
+            }
+        }
         
-        # Si no tiene facturas, se puede eliminar
-        db.session.delete(cliente)
-        db.session.commit()
+        print(f"📦 Snapshot de catálogo v{version}: {len(filas)} productos")
         
-        return jsonify({
-            'success': True,
-            'message': 'Cliente eliminado correctamente'
-        })
+        return _respuesta_catalogo(datos, etag=etag)
         
     except Exception as e:
-        db.session.rollback()
-        print(f"Error eliminando cliente: {str(e)}")
-        return jsonify({'error': f'Error al eliminar cliente: {str(e)}'}), 500
+        print(f"❌ Error generando snapshot de catálogo: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/buscar_clientes')
-def buscar_clientes():
-    """Buscar clientes con filtros"""
+
+@app.route('/api/catalogo/delta')
+def api_catalogo_delta():
+    """Cambios del catálogo desde una versión: filas modificadas, bajas y ofertas
+    
+    'sincronizado' es el 'generado' de la respuesta anterior: los productos
+    modificados desde esa fecha se envían aunque la versión no haya cambiado
+    (el stock no mueve la versión y la caja pudo perder sus eventos).
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        # Obtener parámetros de búsqueda
-        buscar = request.args.get('buscar', '').strip()
-        tipo_doc = request.args.get('tipo_documento', '').strip()
-        condicion_iva = request.args.get('condicion_iva', '').strip()
-        
-        # Construir query base
-        query = Cliente.query
+        desde = request.args.get('desde', type=int)
+        if desde is None:
+            return jsonify({'success': False, 'error': 'Debe indicar la versión desde'}), 400
         
-        # Aplicar filtros
-        if buscar:
-            query = query.filter(
-                or_(
-                    Cliente.nombre.ilike(f'%{buscar}%'),
-                    Cliente.documento.ilike(f'%{buscar}%'),
-                    Cliente.email.ilike(f'%{buscar}%')
-                )
-            )
+        sincronizado = request.args.get('sincronizado')
+        if sincronizado:
+            try:
+                sincronizado = datetime.fromisoformat(sincronizado)
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Fecha de sincronización inválida'}), 400
         
-        if tipo_doc:
-            query = query.filter(Cliente.tipo_documento == tipo_doc)
+        generado = datetime.now()
+        version = CatalogoCambio.version_actual()
+        margen = timedelta(seconds=app.config.get('CATALOGO_MARGEN_DELTA_SEGUNDOS', 300))
         
-        if condicion_iva:
-            query = query.filter(Cliente.condicion_iva == condicion_iva)
+        respuesta = {
+            'success': True,
+            'version': version,
+            'desde': desde,
+            'generado': generado.isoformat(),
+            'recargar': False,
+            'productos': {'columnas': COLUMNAS_CATALOGO, 'filas': []},
+            'eliminados': [],
+            'ofertas': {'columnas': COLUMNAS_OFERTAS_CATALOGO, 'filas': [], 'productos': []}
+        }
         
-        # Obtener resultados
-        clientes = query.order_by(Cliente.nombre).all()
+        ids_productos = set()
+        ids_ofertas = set()
+        desde_fecha = sincronizado - margen if sincronizado else None
+        
+        if desde < version:
+            # La versión de referencia debe existir en el registro para conocer su fecha
+            cambio_referencia = db.session.get(CatalogoCambio, desde) if desde > 0 else None
+            if not cambio_referencia:
+                respuesta['recargar'] = True
+                return _respuesta_catalogo(respuesta)
+            
+            # Margen hacia atrás: cambios con id menor que 'desde' que se
+            # confirmaron después de que la caja leyó esa versión
+            fecha_version = cambio_referencia.fecha - margen
+            desde_fecha = min(desde_fecha, fecha_version) if desde_fecha else fecha_version
+            
+            cambios = db.session.query(
+                CatalogoCambio.entidad,
+                CatalogoCambio.entidad_id
+            ).filter(
+                or_(CatalogoCambio.id > desde, CatalogoCambio.fecha >= fecha_version),
+                CatalogoCambio.id <= version
+            ).distinct().all()
+            
+            ids_productos.update(entidad_id for entidad, entidad_id in cambios if entidad == 'producto')
+            ids_ofertas.update(entidad_id for entidad, entidad_id in cambios if entidad == 'oferta')
         
-        # Formatear respuesta
-        resultado = []
-        for cliente in clientes:
-            resultado.append({
-                'id': cliente.id,
-                'nombre': cliente.nombre,
-                'documento': cliente.documento,
-                'tipo_documento': cliente.tipo_documento,
-                'email': cliente.email,
-                'telefono': cliente.telefono,
-                'direccion': cliente.direccion,
-                'condicion_iva': cliente.condicion_iva
-            })
+        if desde_fecha is None:
+            return _respuesta_catalogo(respuesta)
         
-        return jsonify({
-            'success': True,
-            'clientes': resultado,
-            'total': len(resultado)
-        })
+        # Stock y actualizaciones masivas (sin eventos ORM) se detectan por fecha_modificacion
+        modificados = db.session.query(Producto.id).filter(
+            Producto.fecha_modificacion >= desde_fecha
+        ).all()
+        ids_productos.update(producto_id for (producto_id,) in modificados)
+        ids_productos.discard(None)
+        ids_ofertas.discard(None)
+        
+        filas = []
+        encontrados = set()
+        ids_lista = sorted(ids_productos)
+        for inicio in range(0, len(ids_lista), 500):
+            bloque = ids_lista[inicio:inicio + 500]
+            for fila in _consulta_filas_catalogo().filter(Producto.id.in_(bloque)).all():
+                if fila.activo:
+                    filas.append(_fila_catalogo(fila))
+                    encontrados.add(fila.id)
+        
+        respuesta['productos']['filas'] = filas
+        respuesta['eliminados'] = sorted(ids_productos - encontrados)
+        
+        if ids_ofertas:
+            # Se envían TODAS las ofertas de cada producto afectado (reemplazo completo)
+            respuesta['ofertas']['productos'] = sorted(ids_ofertas)
+            respuesta['ofertas']['filas'] = _ofertas_catalogo(sorted(ids_ofertas))
+        
+        return _respuesta_catalogo(respuesta)
         
     except Exception as e:
-        print(f"Error buscando clientes: {str(e)}")
-        return jsonify({'error': f'Error en la búsqueda: {str(e)}'}), 500
+        print(f"❌ Error generando delta de catálogo: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# ==================== RUTAS DE PRODUCTOS ====================
 
-# 1. ACTUALIZAR LA RUTA /api/producto_detalle/<int:producto_id>
-@app.route('/api/producto_detalle/<int:producto_id>')
-def obtener_producto_detalle(producto_id):
-    """Obtener datos completos de un producto para edición"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'No autorizado'}), 401
-    
+# 5. FUNCIÓN AUXILIAR PARA MIGRAR PRODUCTOS EXISTENTES
+def migrar_productos_sin_costo_margen():
+    """Función para migrar productos existentes que no tienen costo ni margen"""
     try:
-        producto = Producto.query.get_or_404(producto_id)
-        
-        # Usar valores por defecto si costo o margen son 0 o None
-        costo = float(producto.costo) if producto.costo and producto.costo > 0 else 0.0
-        margen = float(producto.margen) if producto.margen is not None else 30.0
-        
-        # Si no hay costo pero hay precio, calcular costo aproximado
-        if costo == 0.0 and producto.precio > 0:
-            costo = float(producto.precio) / (1 + (margen / 100))
+        tabla = Producto.__table__
+        # Si no tiene costo, calcular desde precio con margen del 30%: costo = precio / 1.30
+        resumen = actualizar_productos_por_tramos(
+            [or_(tabla.c.costo.is_(None), tabla.c.costo == 0)],
+            [
+                (tabla.c.costo, func.round(tabla.c.precio / Decimal('1.30'), 2)),
+                (tabla.c.margen, Decimal('30.0'))
+            ],
+            'costos',
+            al_actualizar=propagar_precios_combos
+        )
         
-        # Datos base del producto
-        resultado = {
-            'id': producto.id,
-            'codigo': producto.codigo,
-            'nombre': producto.nombre,
-            'descripcion': producto.descripcion or '',
-            'precio': float(producto.precio),
-            'costo': round(costo, 2),
-            'margen': float(margen),
-            'stock': producto.stock,
-            'categoria': producto.categoria or '',
-            'iva': float(producto.iva),
-            'activo': producto.activo,
+        if resumen['actualizados'] > 0:
+            print(f"✅ Migración completada: {resumen['actualizados']} productos actualizados ({resumen['tramos']} tramos)")
+        else:
+            print("✅ No hay productos que migrar")
             
-            # ✅ CAMPOS DE COMBO AGREGADOS
-            'es_combo': getattr(producto, 'es_combo', False),
-            'cantidad_combo': getattr(producto, 'cantidad_combo', None),
-            'producto_base_id': getattr(producto, 'producto_base_id', None)
-        }
-        
-        # ✅ SI ES UN COMBO, AGREGAR INFORMACIÓN DEL PRODUCTO BASE
-        if resultado['es_combo'] and resultado['producto_base_id']:
-            try:
-                producto_base = Producto.query.get(resultado['producto_base_id'])
-                if producto_base:
-                    resultado['producto_base'] = {
-                        'id': producto_base.id,
-                        'codigo': producto_base.codigo,
-                        'nombre': producto_base.nombre,
-                        'precio': float(producto_base.precio)
-                    }
-                    # Precio unitario del producto base para cálculos
-                    resultado['precio_unitario_base'] = float(producto_base.precio)
-                else:
-                    resultado['producto_base'] = None
-                    resultado['precio_unitario_base'] = 0.0
-            except Exception as e:
-                print(f"Error obteniendo producto base: {str(e)}")
-                resultado['producto_base'] = None
-                resultado['precio_unitario_base'] = 0.0
-        
-        return jsonify(resultado)
-        
     except Exception as e:
-        print(f"Error en obtener_producto_detalle: {str(e)}")
-        return jsonify({'error': f'Error al obtener producto: {str(e)}'}), 500
+        db.session.rollback()
+        print(f"❌ Error en migración: {e}")
+        raise
+
+
+# REGISTRAR DESCUENTOEN PROCESAR_VENTA 
+def registrar_descuento_factura(factura_id, porcentaje, monto, total_original, usuario_id):
+    """Registrar descuento en tabla separada - se llama DESPUÉS de crear factura"""
+    try:
+        if porcentaje > 0 and monto > 0:
+            descuento = DescuentoFactura(
+                factura_id=factura_id,
+                porcentaje_descuento=Decimal(str(porcentaje)),
+                monto_descuento=Decimal(str(monto)),
+                total_original=Decimal(str(total_original)),
+                usuario_id=usuario_id
+            )
+            db.session.add(descuento)
+            db.session.commit()
+            print(f"Descuento registrado: {porcentaje}% = ${monto} para factura {factura_id}")
+            return True
+    except Exception as e:
+        print(f"Error registrando descuento: {e}")
+        return False
 
-# 2. ACTUALIZAR LA RUTA /guardar_producto
-@app.route('/guardar_producto', methods=['POST'])
-def guardar_producto():
-    """Crear o actualizar un producto con costo y margen"""
+
+
+# FUNCIÓN PROCESAR_VENTA
+
+@app.route('/procesar_venta', methods=['POST'])
+def procesar_venta():
+    """Procesar venta con medios de pago y items detallados para AFIP"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
         data = request.json
         
-        # Validar datos requeridos
-        if not data.get('codigo', '').strip():
-            return jsonify({'error': 'El código es obligatorio'}), 400
+        # Validar datos básicos
+        cliente_id = data.get('cliente_id')
+        tipo_comprobante = data.get('tipo_comprobante')
+        items = data.get('items', [])
+        items_detalle = data.get('items_detalle', [])  # *** NUEVO: Items con detalle IVA ***
+        medios_pago = data.get('medios_pago', [])
+        imprimir_automatico = data.get('imprimir_automatico', True)
         
-        if not data.get('nombre', '').strip():
-            return jsonify({'error': 'El nombre es obligatorio'}), 400
+        if not items:
+            return jsonify({'success': False, 'error': 'No hay productos en la venta'})
         
-        # Validar costo
-        try:
-            costo = float(data.get('costo', 0))
-            if costo <= 0:
-                return jsonify({'error': 'El costo debe ser mayor a 0'}), 400
-        except (ValueError, TypeError):
-            return jsonify({'error': 'Costo inválido'}), 400
+        if not medios_pago:
+            return jsonify({'success': False, 'error': 'No se especificaron medios de pago'})
         
-        # Validar margen
-        try:
-            margen = float(data.get('margen', 30))
-            if margen < 0:
-                return jsonify({'error': 'El margen no puede ser negativo'}), 400
-        except (ValueError, TypeError):
-            return jsonify({'error': 'Margen inválido'}), 400
+        if not items_detalle:
+            return jsonify({'success': False, 'error': 'No se recibieron items detallados para AFIP'})
         
-        # Calcular precio automáticamente
-        precio_calculado = costo * (1 + (margen / 100))
+        # VALIDACIÓN CORREGIDA PARA VUELTO EN EFECTIVO
+        total_medios = sum(float(mp.get('importe', 0)) for mp in medios_pago)
+        total_venta = float(data.get('total', 0))
+        descuento_monto = float(data.get('descuento_monto', 0))
+        descuento_porcentaje = float(data.get('descuento_porcentaje', 0))
+
+        print(f"🔍 DEBUG VALIDACIÓN BACKEND:")
+        print(f"   Total medios de pago: ${total_medios:.2f}")
+        print(f"   Total venta (con descuento): ${total_venta:.2f}")
+        print(f"   Descuento aplicado: ${descuento_monto:.2f}")
+
+        diferencia = total_medios - total_venta
+
+        if diferencia < -0.01:
+            # Falta dinero - ERROR
+            faltante = abs(diferencia)
+            print(f"❌ ERROR: Faltan ${faltante:.2f}")
+            print(f"   Medios individuales:")
+            for i, mp in enumerate(medios_pago):
+                print(f"     {i+1}. {mp.get('medio_pago', 'UNKNOWN')}: ${float(mp.get('importe', 0)):.2f}")
+            
+            return jsonify({
+                'success': False, 
+                'error': f'Faltan ${faltante:.2f} para completar el pago'
+            })
+        elif diferencia > 0.01:
+            # Hay exceso - verificar si es efectivo para dar vuelto
+            medios_efectivo = [mp for mp in medios_pago if mp.get('medio_pago') == 'efectivo']
+            total_efectivo = sum(float(mp.get('importe', 0)) for mp in medios_efectivo)
+            
+            # Si todo el exceso puede cubrirse con efectivo, está OK
+            if total_efectivo >= total_venta:
+                vuelto = diferencia
+                print(f"✅ Pago con vuelto: ${vuelto:.2f}")
+                # Continuar procesando - el vuelto se maneja en el frontend
+            else:
+                # Hay exceso pero no suficiente efectivo para vuelto
+                print(f"❌ ERROR: Exceso de ${diferencia:.2f} sin suficiente efectivo")
+                return jsonify({
+                    'success': False,
+                    'error': f'Exceso de ${diferencia:.2f} pero no hay suficiente efectivo para dar vuelto'
+                })
+        else:
+            print(f"✅ Pago exacto")
+
+        print(f"✅ Validación exitosa. Procediendo con la venta.")
         
-        producto_id = data.get('id')
-        codigo = data['codigo'].strip().upper()
+        # PASO 1: Determinar el próximo número de comprobante
+        tipo_comprobante_int = int(tipo_comprobante)
+        punto_venta = ARCA_CONFIG.PUNTO_VENTA
         
-        # Verificar que el código no exista (excepto si es el mismo producto)
-        producto_existente = Producto.query.filter_by(codigo=codigo).first()
-        if producto_existente and (not producto_id or producto_existente.id != int(producto_id)):
-            return jsonify({'error': f'Ya existe un producto con el código {codigo}'}), 400
+        # PASO 2: Generar número temporal primero
+        ultima_factura_local = Factura.query.filter_by(
+            tipo_comprobante=str(tipo_comprobante_int),
+            punto_venta=punto_venta
+        ).order_by(Factura.id.desc()).first()
         
-        if producto_id:  # Editar producto existente
-            producto = Producto.query.get_or_404(producto_id)
-            accion = 'actualizado'
-        else:  # Crear nuevo producto
-            producto = Producto()
-            accion = 'creado'
+        numero_temporal = 1
+        if ultima_factura_local and ultima_factura_local.numero:
+            try:
+                ultimo_numero_local = int(ultima_factura_local.numero.split('-')[1])
+                numero_temporal = ultimo_numero_local + 1
+            except:
+                numero_temporal = 1
         
-        # Actualizar datos del producto
-        producto.codigo = codigo
-        producto.nombre = data['nombre'].strip()
-        producto.descripcion = data.get('descripcion', '').strip() or None
-        producto.precio = Decimal(str(round(precio_calculado, 2)))
-        producto.costo = Decimal(str(round(costo, 2)))
-        producto.margen = Decimal(str(round(margen, 2)))
-        producto.categoria = data.get('categoria', '').strip() or None
-        producto.iva = Decimal(str(data.get('iva', 21)))
-        producto.activo = bool(data.get('activo', True))
-        producto.fecha_modificacion = datetime.now()
+        # Generar número temporal para la base de datos
+        numero_factura_temporal = f"{punto_venta:04d}-{numero_temporal:08d}"
         
-        # Solo actualizar stock si es producto nuevo
-        if not producto_id:
-            producto.stock = int(data.get('stock', 0))
+        # Verificar que el número temporal no exista
+        factura_existente = Factura.query.filter_by(numero=numero_factura_temporal).first()
+        while factura_existente:
+            numero_temporal += 1
+            numero_factura_temporal = f"{punto_venta:04d}-{numero_temporal:08d}"
+            factura_existente = Factura.query.filter_by(numero=numero_factura_temporal).first()
         
-        # Guardar en base de datos
-        if not producto_id:  # Solo agregar si es nuevo
-            db.session.add(producto)
+        print(f"📝 Número temporal asignado: {numero_factura_temporal}")
+        
+        # PASO 3: Crear factura CON número temporal
+        total_final = float(data.get('total', total_venta))  # Usar el total que ya tiene descuento
+        factura = Factura(
+            numero=numero_factura_temporal,
+            tipo_comprobante=str(tipo_comprobante_int),
+            punto_venta=punto_venta,
+            cliente_id=cliente_id,
+            usuario_id=session['user_id'],
+            subtotal=Decimal(str(data['subtotal'])),
+            iva=Decimal(str(data['iva'])),
+            total=Decimal(str(total_venta))
+        )
+        factura.resumen_pendiente = True  # Se suma a los resúmenes al final (PASO 7)
+        
+        db.session.add(factura)
+        db.session.flush()  # Para obtener el ID sin hacer commit
+        
+        print(f"✅ Factura creada con ID: {factura.id} y número temporal: {factura.numero}")
+        
+       # PASO 4: Agregar detalles de productos CON IVA CORRECTO
+        for i, item in enumerate(items):
+            # Obtener el detalle correspondiente con IVA
+            item_detalle = items_detalle[i] if i < len(items_detalle) else {}
+            iva_porcentaje = float(item_detalle.get('iva_porcentaje', 21.0))
+            
+            # Calcular IVA del item con redondeo AFIP
+            subtotal = float(item['subtotal'])
+            importe_iva = round((subtotal * iva_porcentaje / 100), 2)
+            
+            detalle = DetalleFactura(
+                factura_id=factura.id,
+                producto_id=item['producto_id'],
+                cantidad=Decimal(str(item['cantidad'])),
+                precio_unitario=Decimal(str(item['precio_unitario'])),
+                subtotal=Decimal(str(subtotal)),
+                porcentaje_iva=Decimal(str(iva_porcentaje)),  # ✅ GUARDAR IVA CORRECTO
+                importe_iva=Decimal(str(importe_iva))          # ✅ GUARDAR IMPORTE IVA
+            )
+            db.session.add(detalle)
+            
+            # Actualizar stock
+            producto = Producto.query.get(item['producto_id'])
+            if producto:
+                producto.stock -= Decimal(str(item['cantidad']))
+                print(f"📦 Stock actualizado para {producto.nombre}: {producto.stock}")
+                print(f"💰 Detalle guardado: IVA {iva_porcentaje}% = ${importe_iva:.2f}")
+            else:
+                print(f"⚠️ Producto ID {item['producto_id']} no encontrado")
         
+        # PASO 5: Agregar medios de pago
+        print(f"💳 Agregando {len(medios_pago)} medios de pago...")
+        for medio_data in medios_pago:
+            medio_pago = MedioPago(
+                factura_id=factura.id,
+                medio_pago=medio_data['medio_pago'],
+                importe=Decimal(str(medio_data['importe'])),
+                fecha_registro=datetime.now()
+            )
+            db.session.add(medio_pago)
+            print(f"💰 Medio agregado: {medio_data['medio_pago']} ${medio_data['importe']}")
+        
+        # PASO 6: Intentar autorizar en AFIP con items detallados
+        try:
+            print("📄 Autorizando en AFIP con items detallados...")
+            cliente = Cliente.query.get(cliente_id)
+            
+            # *** CLAVE: Preparar datos para AFIP con items_detalle ***
+            datos_comprobante = {
+                'tipo_comprobante': tipo_comprobante_int,
+                'punto_venta': punto_venta,
+                'importe_neto': float(factura.subtotal),
+                'importe_iva': float(factura.iva),
+                'items_detalle': items_detalle,  # *** NUEVO: Items con IVA individual ***
+                'doc_tipo': 99,  # Sin identificar por defecto
+                'doc_nro': 0
+            }
+            
+            # Debug: Mostrar items que se envían a AFIP
+            print("🧮 Items detallados enviados a AFIP:")
+            for item in items_detalle:
+                print(f"   📦 ${item['subtotal']:.2f} (IVA {item['iva_porcentaje']}%)")
+            
+            # Si el cliente tiene documento, agregar datos
+            if cliente and cliente.documento:
+                if cliente.tipo_documento == 'CUIT' and len(cliente.documento) == 11:
+                    datos_comprobante['doc_tipo'] = 80  # CUIT
+                    datos_comprobante['doc_nro'] = int(cliente.documento)
+                elif cliente.tipo_documento == 'DNI' and len(cliente.documento) >= 7:
+                    datos_comprobante['doc_tipo'] = 96  # DNI
+                    datos_comprobante['doc_nro'] = int(cliente.documento)
+            
+            resultado_afip = arca_client.autorizar_comprobante(datos_comprobante)
+            
+            if resultado_afip['success']:
+                # AFIP devuelve el número correcto - ACTUALIZAR la factura
+                numero_afip = resultado_afip['numero']
+                print(f"✅ AFIP asignó número: {numero_afip}")
+                
+                # Verificar si el número de AFIP ya existe en la BD
+                factura_afip_existente = Factura.query.filter(
+                    and_(Factura.numero == numero_afip, Factura.id != factura.id)
+                ).first()
+                
+                if factura_afip_existente:
+                    print(f"⚠️ Número AFIP {numero_afip} ya existe, manteniendo temporal")
+                    # Mantener número temporal y marcar como autorizada
+                    factura.cae = resultado_afip['cae']
+                    factura.vto_cae = resultado_afip['vto_cae']
+                    factura.estado = 'autorizada'
+                else:
+                    # Actualizar con número de AFIP
+                    factura.numero = numero_afip
+                    factura.cae = resultado_afip['cae']
+                    factura.vto_cae = resultado_afip['vto_cae']
+                    factura.estado = 'autorizada'
+                
+                print(f"✅ Autorización AFIP exitosa. CAE: {factura.cae}")
+                print(f"✅ Número final: {factura.numero}")
+            else:
+                # Si AFIP falla, mantener número temporal
+                factura.estado = 'error_afip'
+                print(f"❌ Error AFIP: {resultado_afip.get('error', 'Error desconocido')}")
+                print(f"📝 Manteniendo número temporal: {factura.numero}")
+            
+        except Exception as e:
+            # Si hay error completo, mantener número temporal
+            factura.estado = 'error_afip'
+            print(f"❌ Error completo al autorizar en AFIP: {e}")
+            print(f"📝 Manteniendo número temporal: {factura.numero}")
+            
+        # PASO 7: Resúmenes diarios con el estado final y guardar todo. El
+        # upsert va recién acá para no retener las filas del día mientras se
+        # espera la respuesta de AFIP
+        registrar_venta_en_resumenes(factura)
         db.session.commit()
         
-        print(f"✅ Producto {accion}: {codigo}")
-        print(f"   Costo: ${costo:.2f}")
-        print(f"   Margen: {margen}%")
-        print(f"   Precio: ${precio_calculado:.2f}")
+        print(f"🎉 Venta procesada exitosamente: {factura.numero}")
+        
+        # NUEVA LÍNEA: Registrar descuento si existe (tabla separada)
+        if data.get('descuento_monto', 0) > 0:
+            total_antes_descuento = float(data.get('subtotal', 0)) + float(data.get('iva', 0))
+            registrar_descuento_factura(
+                factura.id, 
+                data.get('descuento_porcentaje', 0),
+                data.get('descuento_monto', 0),
+                total_antes_descuento,
+                session['user_id']
+            )
+
+        # PASO 8: Imprimir automáticamente si está configurado
+        if imprimir_automatico and IMPRESION_DISPONIBLE:
+            try:
+                print("🖨️ Imprimiendo factura automáticamente...")
+                impresora_termica.imprimir_factura(factura)
+            except Exception as e:
+                print(f"⚠️ Error en impresión automática: {e}")
         
         return jsonify({
             'success': True,
-            'message': f'Producto {accion} correctamente',
-            'producto_id': producto.id,
-            'producto_codigo': producto.codigo,
-            'precio_calculado': round(precio_calculado, 2),
-            'costo': round(costo, 2),
-            'margen': round(margen, 2)
+            'factura_id': factura.id,
+            'numero': factura.numero,
+            'cae': factura.cae,
+            'estado': factura.estado,
+            'mensaje': f"Factura {factura.numero} generada correctamente"
         })
         
     except Exception as e:
+        print(f"❌ Error en procesar_venta: {str(e)}")
         db.session.rollback()
-        print(f"Error guardando producto: {str(e)}")
-        return jsonify({'error': f'Error al guardar producto: {str(e)}'}), 500
-
-
+        return jsonify({'error': f'Error al procesar la venta: {str(e)}'}), 500
 
 
-@app.route('/ajustar_stock', methods=['POST'])
-def ajustar_stock():
-    """Ajustar stock de un producto"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'No autorizado'}), 401
-    
+# RUTAS DE IMPRESIÓN
+@app.route('/imprimir_factura/<int:factura_id>')
+def imprimir_factura(factura_id):
+    """Endpoint para imprimir factura específica"""
     try:
-        data = request.json
-        
-        producto_id = data.get('producto_id')
-        tipo_movimiento = data.get('tipo_movimiento')  # entrada, salida, ajuste
-        cantidad = int(data.get('cantidad', 0))
-        motivo = data.get('motivo', '').strip()
-        
-        if not producto_id:
-            return jsonify({'error': 'ID de producto requerido'}), 400
+        print(f"🖨️ Iniciando impresión de factura ID: {factura_id}")
         
-        if cantidad <= 0 and tipo_movimiento != 'ajuste':
-            return jsonify({'error': 'La cantidad debe ser mayor a 0'}), 400
+        # Obtener la factura de la base de datos
+        factura = Factura.query.get_or_404(factura_id)
         
-        producto = Producto.query.get_or_404(producto_id)
-        stock_anterior = producto.stock
+        # Usar directamente la instancia de la clase
+        resultado = impresora_termica.imprimir_factura(factura)
         
-        # Aplicar movimiento según el tipo
-        if tipo_movimiento == 'entrada':
-            producto.stock += cantidad
-            descripcion = f"Entrada: +{cantidad}"
-        elif tipo_movimiento == 'salida':
-            if cantidad > producto.stock:
-                return jsonify({'error': f'No hay suficiente stock. Stock actual: {producto.stock}'}), 400
-            producto.stock -= cantidad
-            descripcion = f"Salida: -{cantidad}"
-        elif tipo_movimiento == 'ajuste':
-            if cantidad < 0:
-                return jsonify({'error': 'La cantidad para ajuste no puede ser negativa'}), 400
-            descripcion = f"Ajuste: {stock_anterior} → {cantidad}"
-            producto.stock = cantidad
+        if resultado:
+            return jsonify({
+                'success': True,
+                'mensaje': f'Factura impresa correctamente en {impresora_termica.nombre_impresora}'
+            })
         else:
-            return jsonify({'error': 'Tipo de movimiento inválido'}), 400
-        
-        # Guardar cambios
-        db.session.commit()
-        
-        # Registrar el movimiento (opcional - puedes crear una tabla de movimientos)
-        print(f"MOVIMIENTO STOCK: Producto {producto.codigo} - {descripcion} - Motivo: {motivo}")
-        
-        return jsonify({
-            'success': True,
-            'message': f'Stock ajustado correctamente',
-            'stock_anterior': stock_anterior,
-            'stock_nuevo': producto.stock,
-            'movimiento': descripcion
-        })
+            return jsonify({
+                'success': False,
+                'error': 'Error al imprimir factura'
+            })
         
     except Exception as e:
-        db.session.rollback()
-        print(f"Error ajustando stock: {str(e)}")
-        return jsonify({'error': f'Error al ajustar stock: {str(e)}'}), 500
-
-@app.route('/toggle_producto/<int:producto_id>', methods=['POST'])
-def toggle_producto(producto_id):
-    """Activar/desactivar un producto"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'No autorizado'}), 401
-    
-    try:
-        producto = Producto.query.get_or_404(producto_id)
-        
-        # Cambiar estado
-        producto.activo = not producto.activo
-        estado = 'activado' if producto.activo else 'desactivado'
-        
-        db.session.commit()
-        
+        print(f"❌ Error en endpoint imprimir: {e}")
         return jsonify({
-            'success': True,
-            'message': f'Producto {estado} correctamente',
-            'activo': producto.activo
-        })
+            'success': False,
+            'error': f'Error al imprimir factura: {str(e)}'
+        }), 500
         
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error cambiando estado del producto: {str(e)}")
-        return jsonify({'error': f'Error al cambiar estado: {str(e)}'}), 500
-
-# 3. ACTUALIZAR LA RUTA /buscar_productos_admin
-@app.route('/buscar_productos_admin')
-def buscar_productos_admin():
-    """Buscar productos con filtros para administración - INCLUYE FILTROS PARA COMBOS"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'No autorizado'}), 401
-    
+@app.route('/test_impresion')
+def test_impresion():
     try:
-        # Obtener parámetros de búsqueda
-        buscar = request.args.get('buscar', '').strip()
-        categoria = request.args.get('categoria', '').strip()
-        filtro_stock = request.args.get('stock', '').strip()
-        estado = request.args.get('estado', '').strip()
-        
-        # ✅ NUEVOS PARÁMETROS PARA COMBOS
-        solo_combos = request.args.get('solo_combos', '').strip().lower() == 'true'
-        estado = request.args.get('estado', '').strip()  # activo, inactivo
-        descuento = request.args.get('descuento', '').strip()  # alto, medio, bajo
-        
-        print(f"🔍 Búsqueda productos admin:")
-        print(f"   Buscar: '{buscar}'")
-        print(f"   Solo combos: {solo_combos}")
-        print(f"   Estado: '{estado}'")
-        print(f"   Descuento: '{descuento}'")
-        
-        # Construir query base
-        query = Producto.query
-        
-        # ✅ FILTRO PARA SOLO COMBOS
-        if solo_combos:
-            query = query.filter(Producto.es_combo == True)
-            print("   Filtro aplicado: Solo combos")
-        
-        # Aplicar filtros generales
-        if buscar:
-            query = query.filter(
-                or_(
-                    Producto.codigo.ilike(f'%{buscar}%'),
-                    Producto.nombre.ilike(f'%{buscar}%'),
-                    Producto.descripcion.ilike(f'%{buscar}%')
-                )
-            )
-            print(f"   Filtro aplicado: Búsqueda '{buscar}'")
-        
-        if categoria:
-            query = query.filter(Producto.categoria == categoria)
-            print(f"   Filtro aplicado: Categoría '{categoria}'")
-        
-        if filtro_stock == 'bajo':
-            query = query.filter(Producto.stock < 10)
-        elif filtro_stock == 'sin_stock':
-            query = query.filter(Producto.stock <= 0)
-        
-        # ✅ FILTRO DE ESTADO (ACTIVO/INACTIVO)
-        if estado == 'activo':
-            query = query.filter(Producto.activo == True)
-            print("   Filtro aplicado: Solo activos")
-        elif estado == 'inactivo':
-            query = query.filter(Producto.activo == False)
-            print("   Filtro aplicado: Solo inactivos")
-        
-        # Obtener resultados SIN filtro de descuento primero
-        productos = query.order_by(Producto.codigo).all()
-        print(f"   Productos encontrados (antes filtro descuento): {len(productos)}")
-        
-        # ✅ APLICAR FILTRO DE DESCUENTO DESPUÉS (solo para combos)
-        if descuento and solo_combos:
-            productos_filtrados = []
-            
-            for producto in productos:
-                if producto.es_combo and producto.producto_base:
-                    # Calcular descuento del combo
-                    precio_normal = float(producto.producto_base.precio) * float(producto.cantidad_combo)
-                    precio_combo = float(producto.precio)
-                    descuento_porcentaje = ((precio_normal - precio_combo) / precio_normal) * 100 if precio_normal > 0 else 0
-                    
-                    # Aplicar filtro según nivel de descuento
-                    if descuento == 'alto' and descuento_porcentaje > 30:
-                        productos_filtrados.append(producto)
-                    elif descuento == 'medio' and 15 <= descuento_porcentaje <= 30:
-                        productos_filtrados.append(producto)
-                    elif descuento == 'bajo' and descuento_porcentaje < 15:
-                        productos_filtrados.append(producto)
-                else:
-                    # Si no es combo, incluir sin filtro de descuento
-                    productos_filtrados.append(producto)
-            
-            productos = productos_filtrados
-            print(f"   Productos después filtro descuento '{descuento}': {len(productos)}")
-        
-        # Formatear respuesta
-        resultado = []
-        for producto in productos:
-            # Manejar valores por defecto
-            costo = float(producto.costo) if producto.costo else 0.0
-            margen = float(producto.margen) if producto.margen is not None else 0.0
-            
-            # Si no hay costo guardado, calcularlo aproximadamente desde precio
-            if costo == 0.0 and producto.precio > 0 and margen > 0:
-                costo = float(producto.precio) / (1 + (margen / 100))
-            
-            producto_dict = {
-                'id': producto.id,
-                'codigo': producto.codigo,
-                'nombre': producto.nombre,
-                'descripcion': producto.descripcion,
-                'precio': float(producto.precio),
-                'costo': round(costo, 2),
-                'margen': round(margen, 1),
-                'stock': producto.stock,
-                'categoria': producto.categoria,
-                'iva': float(producto.iva),
-                'activo': producto.activo,
-                'es_combo': producto.es_combo,
-                'acceso_rapido': producto.acceso_rapido if hasattr(producto, 'acceso_rapido') else False,
-                'orden_acceso_rapido': producto.orden_acceso_rapido if hasattr(producto, 'orden_acceso_rapido') else 0
-            }
-            
-            # ✅ AGREGAR INFORMACIÓN ESPECÍFICA PARA COMBOS
-            if producto.es_combo:
-                producto_dict.update({
-                    'producto_base_id': producto.producto_base_id,
-                    'cantidad_combo': float(producto.cantidad_combo) if producto.cantidad_combo else 1.0,
-                    'precio_unitario_base': float(producto.precio_unitario_base) if producto.precio_unitario_base else 0.0
-                })
-                
-                # Información del producto base
-                if producto.producto_base:
-                    producto_dict['producto_base'] = {
-                        'id': producto.producto_base.id,
-                        'codigo': producto.producto_base.codigo,
-                        'nombre': producto.producto_base.nombre,
-                        'precio': float(producto.producto_base.precio)
-                    }
-            
-            resultado.append(producto_dict)
-        
-        print(f"✅ Búsqueda completada: {len(resultado)} productos")
-        
-        return jsonify({
-            'success': True,
-            'productos': resultado,
-            'total': len(resultado),
-            'filtros_aplicados': {
-                'buscar': buscar,
-                'solo_combos': solo_combos,
-                'estado': estado,
-                'descuento': descuento,
-                'categoria': categoria,
-                'filtro_stock': filtro_stock
-            }
-        })
+        print("🧪 Iniciando test de impresión...")
+        resultado = impresora_termica.test_impresion()  # ← Llama al método de la clase
         
+        if resultado:
+            return jsonify({
+                'success': True,
+                'mensaje': f'Test enviado correctamente a {impresora_termica.nombre_impresora}'
+            })
+        else:
+            return jsonify({
+                'success': False,
+                'error': 'Error al enviar test de impresión'
+            })
     except Exception as e:
-        print(f"❌ Error buscando productos: {str(e)}")
-        import traceback
-        print(f"📋 Stack trace: {traceback.format_exc()}")
-        return jsonify({'error': f'Error en la búsqueda: {str(e)}'}), 500
+        return jsonify({
+            'success': False,
+            'error': f'Error en test: {str(e)}'
+        }), 500
 
-# FUNCIÓN PARA ACTUALIZAR PRODUCTOS EXISTENTES CON COSTO CALCULADO
-@app.route('/actualizar_costos_productos', methods=['POST'])
-def actualizar_costos_productos():
-    """Actualizar productos que tienen costo 0 calculándolo desde precio y margen"""
+@app.route('/estado_impresora')
+def estado_impresora():
+    """Endpoint para verificar estado de impresora"""
+    try:
+        estado = impresora_termica.verificar_estado()
+        return jsonify(estado)
+    except Exception as e:
+        return jsonify({
+            'disponible': False,
+            'error': f'Error verificando estado: {str(e)}'
+        }), 500
+
+@app.route('/facturas')
+def facturas():
+    """Página de gestión de facturas (carga dinámica via JavaScript)"""
     if 'user_id' not in session:
-        return jsonify({'error': 'No autorizado'}), 401
+        return redirect(url_for('login'))
     
+    # No cargar facturas aquí - se cargan dinámicamente via JavaScript
+    # Esto mejora significativamente el tiempo de carga de la página
+    
+    return render_template('facturas.html', facturas=[])
+
+@app.route('/factura/<int:factura_id>')
+def ver_factura(factura_id):
     try:
-        productos_sin_costo = Producto.query.filter(
-            or_(Producto.costo == 0, Producto.costo.is_(None))
-        ).all()
+        # Método compatible con SQLAlchemy antiguo
+        factura = Factura.query.get_or_404(factura_id)
         
-        contador_actualizados = 0
+        return render_template('factura_detalle.html', factura=factura)
         
-        for producto in productos_sin_costo:
-            if producto.precio > 0:
-                margen = float(producto.margen) if producto.margen else 30.0
-                # Calcular costo desde precio: costo = precio / (1 + margen/100)
-                costo_calculado = float(producto.precio) / (1 + (margen / 100))
-                
-                producto.costo = Decimal(str(round(costo_calculado, 2)))
-                producto.fecha_modificacion = datetime.now()
-                
-                contador_actualizados += 1
-                print(f"📦 Actualizado: {producto.codigo} - Precio=${float(producto.precio):.2f} → Costo=${costo_calculado:.2f}")
+    except Exception as e:
+        app.logger.error(f"Error al cargar factura {factura_id}: {str(e)}")
+        flash('Error al cargar la factura', 'error')
+        return redirect(url_for('facturas'))
+
+# ================== ESCÁNER DE INTEGRIDAD DE FACTURAS ==================
+# Reemplaza a limpiar_facturas_duplicadas y verificar_estado_facturas, que
+# recorrían facturas en Python (y borraban duplicados sin dejar registro).
+# Cada control es un INSERT ... SELECT con GROUP BY/HAVING o anti-join sobre
+# las facturas nuevas desde la última pasada (más una ventana de ids ya
+# revisados), así que revisar cada hora cuesta lo que se vendió en esa hora.
+# Los hallazgos quedan en integridad_hallazgos para revisarlos: no se
+# corrige ni se borra nada automáticamente.
+
+TIPOS_HALLAZGO_INTEGRIDAD = {
+    'numero_duplicado': 'Número de factura repetido',
+    'total_detalles': 'Total distinto de la suma de los detalles',
+    'total_medios_pago': 'Total distinto de la suma de los medios de pago',
+    'autorizada_sin_cae': 'Factura autorizada sin CAE',
+    'producto_inexistente': 'Detalle con producto inexistente',
+    'salto_numeracion': 'Salto en la numeración del punto de venta',
+}
+
+_escaner_integridad = {'hilo': None, 'ultimo_error': None, 'ultimo_escaneo': None}
+_escaner_integridad_lock = threading.Lock()
+
+
+def _insertar_hallazgos(escaneo, tipo, consulta):
+    """INSERT ... SELECT de los hallazgos de un control; devuelve cuántos hubo.
+
+    La consulta devuelve columnas con el nombre de las de HallazgoIntegridad.
+    """
+    encontrados = consulta.subquery()
+
+    # Los escaneos se superponen (INTEGRIDAD_VENTANA_IDS): no repetir lo ya reportado,
+    # esté resuelto o no
+    detalle_id = encontrados.c.detalle_id if 'detalle_id' in encontrados.c else literal(None)
+    ya_reportado = select(HallazgoIntegridad.id).where(
+        HallazgoIntegridad.tipo == tipo,
+        HallazgoIntegridad.factura_id == encontrados.c.factura_id,
+        func.coalesce(HallazgoIntegridad.detalle_id, 0) == func.coalesce(detalle_id, 0)
+    )
+
+    consulta = select(
+        *encontrados.c,
+        literal(escaneo.id).label('escaneo_id'),
+        literal(tipo).label('tipo'),
+        literal(False).label('resuelto'),
+        literal(escaneo.fecha_inicio).label('fecha')
+    ).where(~ya_reportado.exists())
+    columnas = [columna.key for columna in consulta.selected_columns]
+    resultado = db.session.execute(
+        HallazgoIntegridad.__table__.insert().from_select(columnas, consulta)
+    )
+    return resultado.rowcount or 0
+
+
+def _controles_integridad(escaneo):
+    """Consultas de cada control sobre las facturas (desde_id, hasta_id]"""
+    tolerancia = app.config.get('INTEGRIDAD_TOLERANCIA', 0.05)
+    en_rango = and_(Factura.id > escaneo.desde_id, Factura.id <= escaneo.hasta_id)
+    vigente = or_(Factura.estado.is_(None), Factura.estado != 'anulada')
+    total = func.coalesce(Factura.total, 0)
+
+    # Números de las facturas nuevas que aparecen más de una vez en toda la tabla
+    numeros_nuevos = select(Factura.numero).where(en_rango).distinct().subquery()
+    yield 'numero_duplicado', (
+        select(
+            func.max(Factura.id).label('factura_id'),
+            Factura.numero.label('numero'),
+            func.max(Factura.punto_venta).label('punto_venta'),
+            literal(1).label('esperado'),
+            func.count(Factura.id).label('encontrado')
+        )
+        .join(numeros_nuevos, numeros_nuevos.c.numero == Factura.numero)
+        .group_by(Factura.numero)
+        .having(func.count(Factura.id) > 1)
+    )
+
+    # Total contra neto + IVA de los detalles, menos el descuento registrado
+    detalles = (
+        select(
+            DetalleFactura.factura_id,
+            func.sum(DetalleFactura.subtotal + DetalleFactura.importe_iva).label('suma')
+        )
+        .join(Factura, Factura.id == DetalleFactura.factura_id)
+        .where(en_rango)
+        .group_by(DetalleFactura.factura_id)
+        .subquery()
+    )
+    esperado = func.coalesce(detalles.c.suma, 0) - func.coalesce(DescuentoFactura.monto_descuento, 0)
+    yield 'total_detalles', (
+        select(
+            Factura.id.label('factura_id'),
+            Factura.numero.label('numero'),
+            Factura.punto_venta.label('punto_venta'),
+            esperado.label('esperado'),
+            Factura.total.label('encontrado')
+        )
+        .outerjoin(detalles, detalles.c.factura_id == Factura.id)
+        .outerjoin(DescuentoFactura, DescuentoFactura.factura_id == Factura.id)
+        .where(en_rango, vigente, func.abs(total - esperado) > tolerancia)
+    )
+
+    # Medios de pago: puede sobrar solo si el efectivo alcanza para dar vuelto
+    # (la misma regla con la que procesar_venta acepta el pago)
+    medios = (
+        select(
+            MedioPago.factura_id,
+            func.sum(MedioPago.importe).label('suma'),
+            func.sum(case((MedioPago.medio_pago == 'efectivo', MedioPago.importe), else_=0)).label('efectivo')
+        )
+        .join(Factura, Factura.id == MedioPago.factura_id)
+        .where(en_rango)
+        .group_by(MedioPago.factura_id)
+        .subquery()
+    )
+    suma_medios = func.coalesce(medios.c.suma, 0)
+    yield 'total_medios_pago', (
+        select(
+            Factura.id.label('factura_id'),
+            Factura.numero.label('numero'),
+            Factura.punto_venta.label('punto_venta'),
+            Factura.total.label('esperado'),
+            suma_medios.label('encontrado')
+        )
+        .outerjoin(medios, medios.c.factura_id == Factura.id)
+        .where(en_rango, vigente, or_(
+            suma_medios < total - tolerancia,
+            and_(suma_medios > total + tolerancia, func.coalesce(medios.c.efectivo, 0) < total)
+        ))
+    )
+
+    yield 'autorizada_sin_cae', (
+        select(
+            Factura.id.label('factura_id'),
+            Factura.numero.label('numero'),
+            Factura.punto_venta.label('punto_venta')
+        )
+        .where(en_rango, Factura.estado == 'autorizada', or_(Factura.cae.is_(None), Factura.cae == ''))
+    )
+
+    # Anti-join: detalles cuyo producto ya no existe (o nunca se cargó)
+    yield 'producto_inexistente', (
+        select(
+            Factura.id.label('factura_id'),
+            DetalleFactura.id.label('detalle_id'),
+            DetalleFactura.producto_id.label('producto_id'),
+            Factura.numero.label('numero'),
+            Factura.punto_venta.label('punto_venta')
+        )
+        .select_from(DetalleFactura)
+        .join(Factura, Factura.id == DetalleFactura.factura_id)
+        .outerjoin(Producto, Producto.id == DetalleFactura.producto_id)
+        .where(en_rango, Producto.id.is_(None))
+    )
+
+    yield from _controles_numeracion(escaneo)
+
+
+def _controles_numeracion(escaneo):
+    """Saltos de numeración por tipo y punto de venta entre facturas autorizadas.
+
+    Solo se miran las series con facturas nuevas, desde el último número que ya
+    se había revisado; LAG compara cada número con el anterior de la serie.
+    """
+    # Número "0001-00000125": el texto tiene ancho fijo, así que ordenar por
+    # numero es ordenar por número de comprobante (y usa el índice único)
+    con_formato = Factura.numero.like('____-%')
+    autorizada = and_(Factura.estado == 'autorizada', con_formato)
+    comprobante = sa_cast(func.substr(Factura.numero, 6), db.Integer)
+
+    series = db.session.execute(
+        select(Factura.tipo_comprobante, Factura.punto_venta, func.min(Factura.numero))
+        .where(Factura.id > escaneo.desde_id, Factura.id <= escaneo.hasta_id, autorizada)
+        .group_by(Factura.tipo_comprobante, Factura.punto_venta)
+    ).all()
+
+    for tipo_comprobante, punto_venta, primer_numero in series:
+        de_la_serie = and_(
+            autorizada,
+            Factura.tipo_comprobante == tipo_comprobante,
+            Factura.punto_venta == punto_venta
+        )
+        anterior = db.session.execute(
+            select(func.max(Factura.numero)).where(de_la_serie, Factura.numero < primer_numero)
+        ).scalar()
+
+        numerados = (
+            select(
+                Factura.id,
+                Factura.numero,
+                Factura.punto_venta,
+                comprobante.label('comprobante'),
+                func.lag(comprobante).over(order_by=Factura.numero).label('comprobante_anterior')
+            )
+            .where(de_la_serie, Factura.numero >= (anterior or primer_numero), Factura.id <= escaneo.hasta_id)
+            .subquery()
+        )
+        yield 'salto_numeracion', (
+            select(
+                numerados.c.id.label('factura_id'),
+                numerados.c.numero.label('numero'),
+                numerados.c.punto_venta.label('punto_venta'),
+                (numerados.c.comprobante_anterior + 1).label('esperado'),
+                numerados.c.comprobante.label('encontrado')
+            )
+            .where(
+                numerados.c.id > escaneo.desde_id,
+                numerados.c.comprobante - numerados.c.comprobante_anterior > 1
+            )
+        )
+
+
+def escanear_integridad_facturas(completo=False):
+    """Revisar las facturas nuevas desde el último escaneo (o todas si completo).
+
+    Se vuelve a revisar una ventana de ids anteriores al último revisado: una
+    venta esperando a AFIP puede confirmar un id menor después de que otra
+    confirmó uno mayor. Los hallazgos ya reportados no se repiten.
+
+    Devuelve el EscaneoIntegridad, o None si no había facturas para revisar.
+    Un escaneo completo reemplaza los hallazgos sin resolver de los anteriores.
+    """
+    import time
+
+    with _escaner_integridad_lock:
+        ultimo_revisado = 0
+        if not completo:
+            ultimo_revisado = db.session.query(func.max(EscaneoIntegridad.hasta_id)).filter(
+                EscaneoIntegridad.estado == 'completado'
+            ).scalar() or 0
+
+        limite = datetime.now() - timedelta(seconds=app.config.get('INTEGRIDAD_MARGEN_SEGUNDOS', 60))
+        hasta = db.session.query(func.max(Factura.id)).filter(Factura.fecha <= limite).scalar() or 0
+        if hasta <= ultimo_revisado:
+            return None
         
-        if contador_actualizados > 0:
+        desde = max(ultimo_revisado - app.config.get('INTEGRIDAD_VENTANA_IDS', 500), 0)
+
+        inicio = time.perf_counter()
+        escaneo = EscaneoIntegridad(
+            desde_id=desde,
+            hasta_id=hasta,
+            completo=desde == 0,
+            estado='en_curso',
+            fecha_inicio=datetime.now()
+        )
+        db.session.add(escaneo)
+        db.session.commit()
+
+        try:
+            if completo:
+                HallazgoIntegridad.query.filter_by(resuelto=False).delete(synchronize_session=False)
+
+            hallazgos = 0
+            for tipo, consulta in _controles_integridad(escaneo):
+                hallazgos += _insertar_hallazgos(escaneo, tipo, consulta)
+
+            escaneo.hallazgos = hallazgos
+            escaneo.estado = 'completado'
+            escaneo.fecha_fin = datetime.now()
+            escaneo.duracion_ms = int((time.perf_counter() - inicio) * 1000)
+            db.session.commit()
+
+        except Exception as e:
+            db.session.rollback()
+            escaneo.estado = 'error'
+            escaneo.error = str(e)[:1000]
+            escaneo.fecha_fin = datetime.now()
             db.session.commit()
+            raise
+
+        print(f"🔍 Integridad: facturas {desde + 1}-{hasta} revisadas, {hallazgos} hallazgos "
+              f"({escaneo.duracion_ms} ms)")
+        return escaneo
+
+
+def resumen_integridad():
+    """Hallazgos sin resolver por tipo y facturas por estado"""
+    hallazgos = dict(
+        db.session.query(HallazgoIntegridad.tipo, func.count(HallazgoIntegridad.id))
+        .filter(HallazgoIntegridad.resuelto == False)
+        .group_by(HallazgoIntegridad.tipo)
+        .all()
+    )
+    facturas = dict(
+        db.session.query(Factura.estado, func.count(Factura.id)).group_by(Factura.estado).all()
+    )
+    return {
+        'hallazgos': {tipo: hallazgos.get(tipo, 0) for tipo in TIPOS_HALLAZGO_INTEGRIDAD},
+        'facturas': {estado or 'sin_estado': cantidad for estado, cantidad in facturas.items()}
+    }
+
+
+def mostrar_resumen_integridad():
+    """Imprimir el estado de las facturas y los hallazgos pendientes"""
+    try:
+        resumen = resumen_integridad()
         
-        return jsonify({
-            'success': True,
-            'message': f'Se actualizaron {contador_actualizados} productos',
-            'productos_actualizados': contador_actualizados
-        })
+        print("\n📊 ESTADO ACTUAL DE FACTURAS:")
+        print(f"   Total facturas: {sum(resumen['facturas'].values())}")
+        for estado, cantidad in sorted(resumen['facturas'].items()):
+            print(f"   {estado}: {cantidad}")
+        
+        pendientes = {tipo: cantidad for tipo, cantidad in resumen['hallazgos'].items() if cantidad}
+        if pendientes:
+            print("⚠️ Hallazgos de integridad sin resolver (ver /api/integridad):")
+            for tipo, cantidad in pendientes.items():
+                print(f"   {TIPOS_HALLAZGO_INTEGRIDAD[tipo]}: {cantidad}")
+        else:
+            print("✅ Sin hallazgos de integridad pendientes")
         
     except Exception as e:
-        db.session.rollback()
-        print(f"Error actualizando costos: {str(e)}")
-        return jsonify({'error': f'Error al actualizar costos: {str(e)}'}), 500
+        print(f"❌ Error verificando estado: {e}")
 
-@app.route('/obtener_categorias')
-def obtener_categorias():
-    """Obtener lista de categorías únicas"""
+
+def _escanear_integridad_en_segundo_plano(intervalo):
+    """Revisar las facturas nuevas cada 'intervalo' segundos"""
+    import time
+    while True:
+        with app.app_context():
+            try:
+                escaneo = escanear_integridad_facturas()
+                if escaneo is not None:
+                    _escaner_integridad['ultimo_escaneo'] = escaneo.fecha_fin
+                _escaner_integridad['ultimo_error'] = None
+            except Exception as e:
+                _escaner_integridad['ultimo_error'] = str(e)
+                print(f"❌ Error en el escáner de integridad: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(intervalo)
+
+
+@app.before_request
+def _iniciar_escaner_integridad():
+    """Arrancar el escáner periódico con el primer request del proceso"""
+    hilo = _escaner_integridad['hilo']
+    if hilo is not None and hilo.is_alive():
+        return
+    
+    with _escaner_integridad_lock:
+        hilo = _escaner_integridad['hilo']
+        if hilo is None or not hilo.is_alive():
+            hilo = threading.Thread(
+                target=_escanear_integridad_en_segundo_plano,
+                args=(app.config.get('INTEGRIDAD_INTERVALO', 3600),),
+                daemon=True
+            )
+            _escaner_integridad['hilo'] = hilo
+            hilo.start()
+
+
+@app.route('/api/integridad')
+def estado_integridad():
+    """Resumen, últimos escaneos y hallazgos (filtrables por tipo y resuelto)"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        # Obtener categorías únicas de productos existentes
-        categorias = db.session.query(Producto.categoria).filter(
-            Producto.categoria.isnot(None),
-            Producto.categoria != ''
-        ).distinct().all()
+        tipo = request.args.get('tipo')
+        resuelto = request.args.get('resuelto', 'false').lower() in ('1', 'true', 'si')
+        limite = min(request.args.get('limite', 200, type=int), 1000)
         
-        categorias_lista = [cat[0] for cat in categorias if cat[0]]
-        categorias_lista.sort()
+        consulta = HallazgoIntegridad.query.filter(HallazgoIntegridad.resuelto == resuelto)
+        if tipo:
+            consulta = consulta.filter(HallazgoIntegridad.tipo == tipo)
+        hallazgos = consulta.order_by(HallazgoIntegridad.id.desc()).limit(limite).all()
+        
+        escaneos = EscaneoIntegridad.query.order_by(EscaneoIntegridad.id.desc()).limit(5).all()
         
         return jsonify({
             'success': True,
-            'categorias': categorias_lista
+            'resumen': resumen_integridad(),
+            'tipos': TIPOS_HALLAZGO_INTEGRIDAD,
+            'escaneos': [escaneo.to_dict() for escaneo in escaneos],
+            'hallazgos': [hallazgo.to_dict() for hallazgo in hallazgos],
+            'ultimo_error': _escaner_integridad['ultimo_error']
         })
         
     except Exception as e:
-        print(f"Error obteniendo categorías: {str(e)}")
-        return jsonify({'error': f'Error al obtener categorías: {str(e)}'}), 500
-
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-###### RUTAS API PARA MANEJAR COMBOS
 
-@app.route('/api/productos_con_ofertas')
-def api_productos_con_ofertas():
-    """API para obtener productos con sus ofertas/combos"""
+@app.route('/api/integridad/escanear', methods=['POST'])
+def escanear_integridad():
+    """Revisar ahora las facturas nuevas ({'completo': true} para revisar todas)"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        productos = Producto.obtener_productos_con_ofertas()
+        data = request.get_json(silent=True) or {}
+        escaneo = escanear_integridad_facturas(completo=bool(data.get('completo')))
+        
         return jsonify({
             'success': True,
-            'productos': productos
+            'escaneo': escaneo.to_dict() if escaneo else None,
+            'mensaje': None if escaneo else 'No hay facturas nuevas para revisar',
+            'resumen': resumen_integridad()
         })
+        
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/crear_combo', methods=['POST'])
-def crear_combo():
-    """Crear un nuevo combo/oferta basado en un producto existente o editarlo"""
+@app.route('/api/integridad/hallazgos/<int:hallazgo_id>/resolver', methods=['POST'])
+def resolver_hallazgo_integridad(hallazgo_id):
+    """Marcar un hallazgo como revisado"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        data = request.json
-        
-        # ✅ DETECTAR SI ES EDICIÓN
-        combo_id = data.get('id')
-        es_edicion = combo_id is not None
-        
-        if es_edicion:
-            print(f"🔧 EDITANDO combo ID: {combo_id}")
-            combo = Producto.query.get_or_404(combo_id)
-            if not combo.es_combo:
-                return jsonify({'error': 'El producto no es un combo'}), 400
-        else:
-            print("🆕 CREANDO nuevo combo")
-            combo = None
-        
-        # Validar datos
-        producto_base_id = data.get('producto_base_id')
-        cantidad_combo = float(data.get('cantidad_combo', 1))
-        precio_combo = float(data.get('precio_combo', 0))
-        nombre_combo = data.get('nombre_combo', '').strip()
+        hallazgo = db.session.get(HallazgoIntegridad, hallazgo_id)
+        if hallazgo is None:
+            return jsonify({'success': False, 'error': 'Hallazgo no encontrado'}), 404
         
-        if not producto_base_id:
-            return jsonify({'error': 'Producto base requerido'}), 400
-        
-        if cantidad_combo <= 0:
-            return jsonify({'error': 'La cantidad debe ser mayor a 0'}), 400
-        
-        if precio_combo <= 0:
-            return jsonify({'error': 'El precio debe ser mayor a 0'}), 400
-        
-        # Obtener producto base
-        producto_base = Producto.query.get_or_404(producto_base_id)
+        hallazgo.resuelto = True
+        db.session.commit()
+        return jsonify({'success': True, 'hallazgo': hallazgo.to_dict()})
         
-        # Calcular precio normal y descuento
-        precio_normal = float(producto_base.precio) * cantidad_combo
-        descuento_monto = precio_normal - precio_combo
-        descuento_porcentaje = (descuento_monto / precio_normal) * 100 if precio_normal > 0 else 0
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# Funciones de inicialización
+def create_tables():
+    """Crea las tablas de la base de datos"""
+    try:
+        db.create_all()
         
-        # Generar código automático si no se proporciona
-        codigo_combo = data.get('codigo_combo', '').strip()
-        if not codigo_combo:
-            cantidad_str = f"{cantidad_combo:g}".replace('.', '')
-            codigo_combo = f"{producto_base.codigo}-{cantidad_str}UN"
+        # Crear usuario admin por defecto si no existe
+        if not Usuario.query.filter_by(username='admin').first():
+            admin = Usuario(
+                username='admin',
+                password_hash='admin123',  # Sin encriptación para simplicidad
+                nombre='Administrador',
+                rol='admin'
+            )
+            db.session.add(admin)
+            db.session.commit()
+            print("✅ Usuario admin creado (admin/admin123)")
         
-        # ✅ VERIFICAR CÓDIGO DUPLICADO SOLO SI ES NUEVO O CAMBIÓ
-        if not es_edicion or (es_edicion and combo.codigo != codigo_combo):
-            if Producto.query.filter_by(codigo=codigo_combo).first():
-                return jsonify({'error': f'Ya existe un producto con el código {codigo_combo}'}), 400
+        print("✅ Base de datos inicializada correctamente")
         
-        # Generar nombre automático si no se proporciona
-        if not nombre_combo:
-            cantidad_str = f"{cantidad_combo:g}"
-            nombre_combo = f"{cantidad_str} x {producto_base.nombre} (Oferta)"
+    except Exception as e:
+        print(f"❌ Error al inicializar base de datos: {e}")
+        raise
+
+@app.route('/qr_afip/<int:factura_id>')
+def generar_qr_afip(factura_id):
+    try:
+        # Método compatible con SQLAlchemy antiguo
+        factura = Factura.query.get_or_404(factura_id)
         
-        if es_edicion:
-            # ✅ ACTUALIZAR COMBO EXISTENTE
-            combo.codigo = codigo_combo
-            combo.nombre = nombre_combo
-            combo.descripcion = data.get('descripcion_combo', combo.descripcion)
-            combo.precio = Decimal(str(precio_combo))
-            combo.categoria = 'OFERTAS'
-            combo.iva = producto_base.iva
-            combo.costo = Decimal(str(float(producto_base.costo or 0) * cantidad_combo))
-            combo.stock = int(float(producto_base.stock) / cantidad_combo)
-            combo.producto_base_id = producto_base.id
-            combo.cantidad_combo = Decimal(str(cantidad_combo))
-            combo.precio_unitario_base = producto_base.precio
-            combo.descuento_porcentaje = Decimal(str(descuento_porcentaje))
+        try:
+            generador_qr = crear_generador_qr(ARCA_CONFIG)  # ← Ya está correcto
             
-            accion = "actualizado"
-        else:
-            # ✅ CREAR NUEVO COMBO
-            combo = Producto(
-                codigo=codigo_combo,
-                nombre=nombre_combo,
-                descripcion=f"Oferta especial: {cantidad_combo:g} unidades de {producto_base.nombre}",
-                precio=Decimal(str(precio_combo)),
-                categoria='OFERTAS',
-                iva=producto_base.iva,
-                costo=Decimal(str(float(producto_base.costo or 0) * cantidad_combo)),
-                stock=int(float(producto_base.stock) / cantidad_combo),
-                es_combo=True,
-                producto_base_id=producto_base.id,
-                cantidad_combo=Decimal(str(cantidad_combo)),
-                precio_unitario_base=producto_base.precio,
-                descuento_porcentaje=Decimal(str(descuento_porcentaje))
-            )
+            # Generar imagen QR
+            qr_base64 = generador_qr.generar_qr_imagen(factura)
+            info_qr = generador_qr.obtener_info_qr(factura)
+            
+            if qr_base64:
+                return jsonify({
+                    'success': True,
+                    'qr_image': qr_base64,
+                    'qr_url': info_qr['url'],
+                    'qr_valido': info_qr['valido'],
+                    'mensaje': info_qr['mensaje']
+                })
+            else:
+                return jsonify({
+                    'success': False,
+                    'error': 'Error al generar código QR'
+                }), 500
+                
+        except ImportError:
+            return jsonify({
+                'success': False,
+                'error': 'Módulo QR no disponible'
+            }), 500
             
-            db.session.add(combo)
-            accion = "creado"
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Error: {str(e)}'
+        }), 500
+
+# Ruta para mostrar QR en página completa (para escanear con móvil)
+@app.route('/mostrar_qr/<int:factura_id>')
+def mostrar_qr_completo(factura_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    # Método compatible con SQLAlchemy antiguo
+    factura = Factura.query.get_or_404(factura_id)
+    
+    try:
+        generador_qr = crear_generador_qr(ARCA_CONFIG)  # ← Ya está correcto
+        info_qr = generador_qr.obtener_info_qr(factura)
+        qr_base64 = generador_qr.generar_qr_imagen(factura, tamaño=8) if info_qr['valido'] else None
+    except Exception as e:
+        print(f"⚠️ Error generando QR: {e}")
+        info_qr = {'valido': False, 'mensaje': f'Error al generar QR: {str(e)}'}
+        qr_base64 = None
+    
+    return render_template('mostrar_qr.html', 
+                         factura=factura, 
+                         qr_info=info_qr,
+                         qr_image=qr_base64)
+
+# Ruta para validar datos QR
+@app.route('/validar_qr/<int:factura_id>')
+def validar_qr_factura(factura_id):
+    try:
+        # Método compatible con SQLAlchemy antiguo
+        factura = Factura.query.get_or_404(factura_id)
         
-        db.session.commit()
+        try:
+            generador_qr = crear_generador_qr(ARCA_CONFIG)  # ← Ya está correcto
+            info_qr = generador_qr.obtener_info_qr(factura)
+            errores = generador_qr.validar_datos_qr(factura)
+        except Exception as e:
+            print(f"⚠️ Error con módulo QR: {e}")
+            info_qr = {'valido': False, 'mensaje': f'Error con módulo QR: {str(e)}'}
+            errores = [str(e)]
         
-        print(f"✅ Combo {accion}: {codigo_combo}")
-        print(f"   Producto base: {producto_base.nombre}")
-        print(f"   Cantidad: {cantidad_combo}")
-        print(f"   Precio normal: ${precio_normal:.2f}")
-        print(f"   Precio combo: ${precio_combo:.2f}")
-        print(f"   Descuento: {descuento_porcentaje:.1f}% (${descuento_monto:.2f})")
+        return jsonify({
+            'factura_id': factura_id,
+            'numero': factura.numero,
+            'qr_valido': info_qr['valido'],
+            'qr_url': info_qr['url'] if info_qr['valido'] else None,
+            'errores': errores,
+            'datos_qr': info_qr.get('datos', {}),
+            'mensaje': info_qr['mensaje']
+        })
         
+    except Exception as e:
+        return jsonify({
+            'error': f'Error validando QR: {str(e)}'
+        }), 500
+
+
+
+@app.route('/api/estado_afip_rapido')
+def api_estado_afip_rapido():
+    """API para verificación rápida de AFIP"""
+    try:
+        estado = afip_monitor.verificar_rapido()
         return jsonify({
             'success': True,
-            'message': f'Combo {accion} correctamente',
-            'combo': combo.to_dict()
+            'estado': estado
         })
-        
     except Exception as e:
-        db.session.rollback()
-        print(f"Error en combo: {str(e)}")
-        return jsonify({'error': f'Error al procesar combo: {str(e)}'}), 500
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-@app.route('/api/combos_producto/<int:producto_id>')
-def obtener_combos_producto(producto_id):
-    """Obtener todos los combos de un producto base"""
+@app.route('/test_afip')
+def test_afip():
+    """Test manual de conexión AFIP"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        producto_base = Producto.query.get_or_404(producto_id)
-        
-        # Obtener combos del producto
-        combos = Producto.query.filter_by(
-            producto_base_id=producto_id,
-            es_combo=True,
-            activo=True
-        ).order_by(Producto.cantidad_combo.asc()).all()
-        
-        # Preparar respuesta
-        combos_data = []
-        for combo in combos:
-            combo_info = combo.to_dict()
-            combos_data.append(combo_info)
+        resultado_auth = arca_client.get_ticket_access()
         
         return jsonify({
-            'success': True,
-            'producto_base': producto_base.to_dict(),
-            'combos': combos_data,
-            'total_combos': len(combos_data)
+            'success': resultado_auth,
+            'mensaje': "✅ Test AFIP exitoso" if resultado_auth else "❌ Test AFIP falló",
+            'estado': "success" if resultado_auth else "error",
+            'tiene_token': bool(arca_client.token),
+            'timestamp': datetime.now().isoformat()
         })
         
     except Exception as e:
         return jsonify({
             'success': False,
-            'error': str(e)
+            'mensaje': f"❌ Error en test: {str(e)}",
+            'estado': 'error'
         }), 500
 
 
-# FUNCIÓN PARA MIGRAR PRODUCTOS EXISTENTES
-def migrar_productos_para_combos():
-    """Migrar productos existentes al nuevo sistema de combos"""
-    try:
-        print("🔄 Iniciando migración para sistema de combos...")
-        
-        # Actualizar productos existentes
-        productos_sin_migrar = Producto.query.filter(
-            Producto.es_combo.is_(None)
-        ).all()
-        
-        contador_migrados = 0
-        
-        for producto in productos_sin_migrar:
-            # Todos los productos existentes son productos base (no combos)
-            producto.es_combo = False
-            producto.cantidad_combo = Decimal('1.000')
-            producto.precio_unitario_base = producto.precio
-            producto.descuento_porcentaje = Decimal('0.00')
-            
-            contador_migrados += 1
-        
-        if contador_migrados > 0:
-            db.session.commit()
-            print(f"✅ Migración completada: {contador_migrados} productos actualizados")
-        else:
-            print("✅ No hay productos para migrar")
-            
-        return contador_migrados
-        
-    except Exception as e:
-        db.session.rollback()
-        print(f"❌ Error en migración: {e}")
-        return 0
+# Agregar esta función en app.py para debug de WSFEv1
 
+# Versión simplificada sin verificación de sesión para debug
+##### http://localhost:5000/debug_afip_simple LLAMAR ESTA RUTA PARA VERIFICAR ARCA
 
-# EJEMPLO DE USO PARA CREAR COMBOS
-def crear_ejemplos_combos():
-    """Crear ejemplos de combos para demostración"""
+@app.route('/debug_afip_simple')
+def debug_afip_simple():
+    """Debug simple de AFIP sin verificación de sesión"""
     try:
-        # Buscar producto base (milanesa)
-        producto_base = Producto.query.filter_by(codigo='MIL001').first()
+        resultado = {
+            'timestamp': datetime.now().isoformat(),
+            'tests': {}
+        }
         
-        if not producto_base:
-            print("⚠️ Producto base MIL001 no encontrado")
-            return
+        print("🔍 INICIANDO DEBUG SIMPLE DE AFIP...")
         
-        combos_ejemplos = [
-            {
-                'codigo': 'MIL001-3KG',
-                'nombre': '3kg Milanesa de Ternera (Oferta)',
-                'cantidad': 3.0,
-                'precio': 10000.00,
-                'descripcion': 'Oferta especial: 3 kilogramos de milanesa de ternera'
-            },
-            {
-                'codigo': 'MIL001-5KG', 
-                'nombre': '5kg Milanesa de Ternera (Super Oferta)',
-                'cantidad': 5.0,
-                'precio': 18000.00,
-                'descripcion': 'Super oferta: 5 kilogramos de milanesa de ternera'
+        # Test 1: Autenticación WSAA
+        print("1️⃣ Test autenticación WSAA...")
+        try:
+            auth_result = arca_client.get_ticket_access()
+            resultado['tests']['wsaa_auth'] = {
+                'success': auth_result,
+                'token_exists': bool(arca_client.token),
+                'message': 'Autenticación exitosa' if auth_result else 'Fallo en autenticación'
+            }
+        except Exception as e:
+            resultado['tests']['wsaa_auth'] = {
+                'success': False,
+                'error': str(e),
+                'message': 'Error en autenticación'
             }
-        ]
         
-        for combo_data in combos_ejemplos:
-            # Verificar si ya existe
-            if Producto.query.filter_by(codigo=combo_data['codigo']).first():
-                print(f"⚠️ Combo {combo_data['codigo']} ya existe")
-                continue
+        # Test 2: Conectividad WSFEv1
+        print("2️⃣ Test conectividad WSFEv1...")
+        try:
+            import socket
+            from urllib.parse import urlparse
             
-            # Calcular valores
-            precio_normal = float(producto_base.precio) * combo_data['cantidad']
-            descuento_monto = precio_normal - combo_data['precio']
-            descuento_porcentaje = (descuento_monto / precio_normal) * 100
+            wsfe_url = ARCA_CONFIG.WSFEv1_URL
+            parsed = urlparse(wsfe_url)
+            host = parsed.hostname
+            port = 443
             
-            # Crear combo
-            combo = Producto(
-                codigo=combo_data['codigo'],
-                nombre=combo_data['nombre'],
-                descripcion=combo_data['descripcion'],
-                precio=Decimal(str(combo_data['precio'])),
-                categoria='OFERTAS',
-                iva=producto_base.iva,
-                costo=Decimal(str(float(producto_base.costo or 0) * combo_data['cantidad'])),
-                stock=int(float(producto_base.stock) / combo_data['cantidad']),
-                
-                es_combo=True,
-                producto_base_id=producto_base.id,
-                cantidad_combo=Decimal(str(combo_data['cantidad'])),
-                precio_unitario_base=producto_base.precio,
-                descuento_porcentaje=Decimal(str(descuento_porcentaje))
-            )
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(10)
+            connect_result = sock.connect_ex((host, port))
+            sock.close()
             
-            db.session.add(combo)
-            print(f"✅ Combo creado: {combo_data['codigo']} - Descuento: {descuento_porcentaje:.1f}%")
+            resultado['tests']['wsfe_connectivity'] = {
+                'success': connect_result == 0,
+                'host': host,
+                'port': port,
+                'url': wsfe_url,
+                'message': 'Conectividad OK' if connect_result == 0 else f'No se puede conectar (código: {connect_result})'
+            }
+        except Exception as e:
+            resultado['tests']['wsfe_connectivity'] = {
+                'success': False,
+                'error': str(e),
+                'message': 'Error verificando conectividad'
+            }
         
-        db.session.commit()
-        print("🎉 Ejemplos de combos creados exitosamente")
+        # Test 3: Solo si tenemos autenticación, probar FEDummy
+        if resultado['tests']['wsaa_auth']['success']:
+            print("3️⃣ Test FEDummy...")
+            try:
+                from zeep import Client
+                from zeep.transports import Transport
+                
+                session_afip = crear_session_afip()
+                transport = Transport(session=session_afip, timeout=30)
+                client = Client(ARCA_CONFIG.WSFEv1_URL, transport=transport)
+                
+                dummy_response = client.service.FEDummy()
+                
+                resultado['tests']['fe_dummy'] = {
+                    'success': True,
+                    'response': str(dummy_response),
+                    'message': 'FEDummy exitoso'
+                }
+            except Exception as e:
+                resultado['tests']['fe_dummy'] = {
+                    'success': False,
+                    'error': str(e),
+                    'message': 'Error en FEDummy'
+                }
+        
+        # Generar resumen
+        total_tests = len(resultado['tests'])
+        successful_tests = sum(1 for test in resultado['tests'].values() if test['success'])
+        
+        resultado['summary'] = {
+            'total_tests': total_tests,
+            'successful_tests': successful_tests,
+            'success_rate': f"{(successful_tests/total_tests*100):.1f}%" if total_tests > 0 else "0%",
+            'overall_status': 'OK' if successful_tests == total_tests else 'PROBLEMAS'
+        }
+        
+        return jsonify(resultado)
         
     except Exception as e:
-        db.session.rollback()
-        print(f"❌ Error creando ejemplos: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Error general: {str(e)}',
+            'timestamp': datetime.now().isoformat()
+        }), 500
 
 
-# RUTA PARA EJECUTAR MIGRACIÓN
-@app.route('/migrar_combos', methods=['POST'])
-def ejecutar_migracion_combos():
-    """Endpoint para ejecutar migración de combos"""
+
+@app.route('/reporte_medios_hoy')
+def reporte_medios_hoy():
+    """Reporte rápido de medios de pago del día actual"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        contador = migrar_productos_para_combos()
+        hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        fin_hoy = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999)
+        
+        reporte = MedioPago.calcular_recaudacion_por_fecha(hoy, fin_hoy)
         
         return jsonify({
             'success': True,
-            'mensaje': f'Migración completada: {contador} productos actualizados',
-            'productos_migrados': contador
+            'reporte': reporte
         })
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': f'Error en migración: {str(e)}'
-        }), 500
-
+        print(f"Error en reporte del día: {e}")
+        return jsonify({'success': False, 'error': str(e)})
 
 
-@app.route('/nueva_venta')
-def nueva_venta():
+@app.route('/medios_pago_factura/<int:factura_id>')
+def medios_pago_factura(factura_id):
+    """Obtener los medios de pago de una factura específica"""
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    # Obtener productos de acceso rápido en lugar de los primeros 8
-    productos = Producto.query.filter_by(
-        acceso_rapido=True,
-        activo=True
-    ).order_by(
-        Producto.orden_acceso_rapido.asc(),
-        Producto.codigo.asc()
-    ).limit(8).all()
-    
-    clientes = Cliente.query.all()
-    return render_template('nueva_venta.html', productos=productos, clientes=clientes)
-
-# APIs para búsqueda de productos
-# 4. ACTUALIZAR LAS APIS DE BÚSQUEDA PARA INCLUIR COSTO
-@app.route('/api/buscar_productos/<termino>')
-def buscar_productos(termino):
-    """Busca productos por código o nombre - CORREGIDO"""
-    if not termino or len(termino) < 2:
-        return jsonify([])
-    
-    # Búsqueda por código exacto primero
-    producto_exacto = Producto.query.filter_by(codigo=termino.upper(), activo=True).first()
-    if producto_exacto:
-        resultado = {
-            'id': producto_exacto.id,
-            'codigo': producto_exacto.codigo,
-            'nombre': producto_exacto.nombre,
-            'precio': float(producto_exacto.precio),
-            'precio_base': float(producto_exacto.precio),
-            'costo': float(producto_exacto.costo) if producto_exacto.costo else 0.0,
-            'margen': float(producto_exacto.margen) if producto_exacto.margen else 0.0,
-            'stock': producto_exacto.stock,
-            'iva': float(producto_exacto.iva),
-            'match_tipo': 'codigo_exacto',
-            'descripcion': producto_exacto.descripcion or '',
-            'es_combo': producto_exacto.es_combo,
-            'producto_base_id': producto_exacto.producto_base_id,
-            'cantidad_combo': float(producto_exacto.cantidad_combo) if producto_exacto.cantidad_combo else 1.0,
-            'precio_unitario_base': float(producto_exacto.precio_unitario_base) if producto_exacto.precio_unitario_base else float(producto_exacto.precio),
-            'descuento_porcentaje': float(producto_exacto.descuento_porcentaje) if producto_exacto.descuento_porcentaje else 0.0,
-            'ahorro_combo': producto_exacto.calcular_ahorro_combo(),
-            'precio_normal': producto_exacto.calcular_precio_normal(),
-            'tiene_ofertas': producto_exacto.tiene_ofertas_volumen()
-        }
-        return jsonify([resultado])  # ← ESTA LÍNEA ESTABA FALTANDO O MAL UBICADA
-    
-    # Búsqueda parcial en código y nombre
-    termino_busqueda = f"%{termino.lower()}%"
-    
-    productos = Producto.query.filter(
-        and_(
-            Producto.activo == True,
-            or_(
-                Producto.codigo.ilike(termino_busqueda),
-                Producto.nombre.ilike(termino_busqueda),
-                Producto.descripcion.ilike(termino_busqueda)
-            )
-        )
-    ).limit(15).all()
+        return jsonify({'error': 'No autorizado'}), 401
     
-    resultados = []
-    for producto in productos:
-        # Determinar tipo de coincidencia para ordenar resultados
-        match_tipo = 'nombre'
-        if termino.lower() in producto.codigo.lower():
-            match_tipo = 'codigo'
-        elif termino.lower() in producto.nombre.lower()[:20]:
-            match_tipo = 'nombre_inicio'
+    try:
+        factura = Factura.query.get_or_404(factura_id)
+        
+        medios = [{
+            'medio_pago': mp.medio_pago,
+            'importe': float(mp.importe),
+            'fecha_registro': mp.fecha_registro.strftime('%Y-%m-%d %H:%M:%S')
+        } for mp in factura.medios_pago]
         
-        resultado = {
-            'id': producto.id,
-            'codigo': producto.codigo,
-            'nombre': producto.nombre,
-            'precio': float(producto.precio),
-            'precio_base': float(producto.precio),
-            'costo': float(producto.costo) if producto.costo else 0.0,
-            'margen': float(producto.margen) if producto.margen else 0.0,
-            'stock': producto.stock,
-            'iva': float(producto.iva),
-            'match_tipo': match_tipo,
-            'descripcion': producto.descripcion or '',
-            'es_combo': producto.es_combo,
-            'producto_base_id': producto.producto_base_id,
-            'cantidad_combo': float(producto.cantidad_combo) if producto.cantidad_combo else 1.0,
-            'precio_unitario_base': float(producto.precio_unitario_base) if producto.precio_unitario_base else float(producto.precio),
-            'descuento_porcentaje': float(producto.descuento_porcentaje) if producto.descuento_porcentaje else 0.0,
-            'ahorro_combo': producto.calcular_ahorro_combo(),
-            'precio_normal': producto.calcular_precio_normal(),
-            'tiene_ofertas': producto.tiene_ofertas_volumen()
-        }
-        resultados.append(resultado)
-    
-    def orden_relevancia(item):
-        if item['match_tipo'] == 'codigo_exacto':
-            return 0
-        elif item['match_tipo'] == 'codigo':
-            return 1
-        elif item['match_tipo'] == 'nombre_inicio':
-            return 2
-        else:
-            return 3
-    
-    resultados.sort(key=orden_relevancia)
-    return jsonify(resultados)
-
-
-@app.route('/api/producto_por_id/<int:producto_id>')
-def get_producto_por_id(producto_id):
-    """Obtiene un producto por ID - INCLUYE COSTO"""
-    producto = Producto.query.filter_by(id=producto_id, activo=True).first()
-    if producto:
         return jsonify({
-            'id': producto.id,
-            'codigo': producto.codigo,
-            'nombre': producto.nombre,
-            'precio': float(producto.precio),
-            'costo': float(producto.costo) if producto.costo else 0.0,  # ← NUEVO
-            'margen': float(producto.margen) if producto.margen else 0.0,  # ← NUEVO
-            'stock': producto.stock,
-            'iva': float(producto.iva),
-            'descripcion': producto.descripcion or '',
-            'es_combo': producto.es_combo,
-            'producto_base_id': producto.producto_base_id,
-            'cantidad_combo': float(producto.cantidad_combo) if producto.cantidad_combo else 1.0,
-            'precio_unitario_base': float(producto.precio_unitario_base) if producto.precio_unitario_base else float(producto.precio),
-            'descuento_porcentaje': float(producto.descuento_porcentaje) if producto.descuento_porcentaje else 0.0,
-            'ahorro_combo': producto.calcular_ahorro_combo(),
-            'precio_normal': producto.calcular_precio_normal()
+            'success': True,
+            'factura_numero': factura.numero,
+            'total_factura': float(factura.total),
+            'medios_pago': medios
         })
-    return jsonify({'error': 'Producto no encontrado'}), 404
-
-@app.route('/api/producto/<codigo>')
-def get_producto(codigo):
-    """Obtiene un producto por código exacto - INCLUYE COSTO"""
-    producto = Producto.query.filter_by(codigo=codigo.upper(), activo=True).first()
-    if producto:
-        return jsonify({
-            'id': producto.id,
-            'codigo': producto.codigo,
-            'nombre': producto.nombre,
-            'precio': float(producto.precio),
-            'costo': float(producto.costo) if producto.costo else 0.0,  # ← NUEVO
-            'margen': float(producto.margen) if producto.margen else 0.0,  # ← NUEVO
-            'stock': producto.stock,
-            'iva': float(producto.iva),
-            'descripcion': producto.descripcion or '',
-            'es_combo': producto.es_combo,
-            'producto_base_id': producto.producto_base_id,
-            'cantidad_combo': float(producto.cantidad_combo) if producto.cantidad_combo else 1.0,
-            'precio_unitario_base': float(producto.precio_unitario_base) if producto.precio_unitario_base else float(producto.precio),
-            'descuento_porcentaje': float(producto.descuento_porcentaje) if producto.descuento_porcentaje else 0.0,
-            'ahorro_combo': producto.calcular_ahorro_combo(),
-            'precio_normal': producto.calcular_precio_normal()
+        
+    except Exception as e:
+        print(f"Error obteniendo medios de pago: {e}")
+        return jsonify({'success': False, 'error': str(e)})
 
-        })
-    return jsonify({'error': 'Producto no encontrado'}), 404
 
+# ================== BACKFILLS DE DATOS HISTÓRICOS ==================
+# Correcciones sobre tablas grandes por rangos de id con UPDATE ... JOIN,
+# con checkpoint por rango (se pueden retomar) y pausa entre rangos. Para
+# agregar una corrección, registrar sus sentencias por rango.
+
+backfills = crear_ejecutor_backfill(
+    db, AvanceBackfill,
+    tamano_tramo=app.config.get('BACKFILL_TAMANO_TRAMO', 5000),
+    pausa=app.config.get('BACKFILL_PAUSA', 0.1)
+)
+
+
+def _sentencias_iva_detalle(desde, hasta):
+    """IVA de cada detalle sin porcentaje o importe, tomado del producto (21% si no existe)"""
+    detalle = DetalleFactura.__table__
+    productos = Producto.__table__
+    condiciones = [
+        detalle.c.id.between(desde, hasta),
+        or_(
+            detalle.c.porcentaje_iva.is_(None),
+            detalle.c.importe_iva.is_(None),
+            detalle.c.porcentaje_iva == 0
+        )
+    ]
+    iva_producto = func.coalesce(productos.c.iva, 21)
+    return [
+        update(detalle)
+        .where(detalle.c.producto_id == productos.c.id, *condiciones)
+        .values(
+            porcentaje_iva=iva_producto,
+            importe_iva=func.round(detalle.c.subtotal * iva_producto / 100, 2)
+        ),
+        # Detalles cuyo producto ya no existe
+        update(detalle)
+        .where(
+            *condiciones,
+            ~select(productos.c.id).where(productos.c.id == detalle.c.producto_id).exists()
+        )
+        .values(
+            porcentaje_iva=21,
+            importe_iva=func.round(detalle.c.subtotal * 21 / 100, 2)
+        )
+    ]
 
-# 5. FUNCIÓN AUXILIAR PARA MIGRAR PRODUCTOS EXISTENTES
-def migrar_productos_sin_costo_margen():
-    """Función para migrar productos existentes que no tienen costo ni margen"""
+
+backfills.registrar(
+    'iva_detalle', DetalleFactura.id,
+    'IVA individual en detalles de facturas', _sentencias_iva_detalle
+)
+
+
+@app.route('/api/backfills')
+def listar_backfills():
+    """Backfills registrados con su avance"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
     try:
-        productos_sin_costo = Producto.query.filter(
-            or_(
-                Producto.costo.is_(None),
-                Producto.margen.is_(None),
-                Producto.costo == 0
-            )
-        ).all()
-        
-        contador_migrados = 0
-        
-        for producto in productos_sin_costo:
-            # Si no tiene costo, calcular desde precio con margen del 30%
-            if not producto.costo or producto.costo == 0:
-                # Asumiendo un margen del 30%, costo = precio / 1.30
-                precio_actual = float(producto.precio)
-                costo_calculado = precio_actual / 1.30
-                margen_calculado = 30.0
-                
-                producto.costo = Decimal(str(round(costo_calculado, 2)))
-                producto.margen = Decimal(str(margen_calculado))
-                
-                contador_migrados += 1
-                print(f"📦 Migrado: {producto.codigo} - Precio=${precio_actual:.2f} → Costo=${costo_calculado:.2f}, Margen=30%")
-        
-        if contador_migrados > 0:
-            db.session.commit()
-            print(f"✅ Migración completada: {contador_migrados} productos actualizados")
-        else:
-            print("✅ No hay productos que migrar")
-            
+        return jsonify({
+            'success': True,
+            'backfills': [backfills.estado(nombre) for nombre in backfills.nombres]
+        })
     except Exception as e:
-        db.session.rollback()
-        print(f"❌ Error en migración: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 
-# REGISTRAR DESCUENTOEN PROCESAR_VENTA 
-def registrar_descuento_factura(factura_id, porcentaje, monto, total_original, usuario_id):
-    """Registrar descuento en tabla separada - se llama DESPUÉS de crear factura"""
+@app.route('/api/backfills/<nombre>')
+def estado_backfill(nombre):
+    """Avance de un backfill (para consultar mientras corre)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    if nombre not in backfills:
+        return jsonify({'success': False, 'error': 'Backfill no encontrado'}), 404
+    
     try:
-        if porcentaje > 0 and monto > 0:
-            descuento = DescuentoFactura(
-                factura_id=factura_id,
-                porcentaje_descuento=Decimal(str(porcentaje)),
-                monto_descuento=Decimal(str(monto)),
-                total_original=Decimal(str(total_original)),
-                usuario_id=usuario_id
-            )
-            db.session.add(descuento)
-            db.session.commit()
-            print(f"Descuento registrado: {porcentaje}% = ${monto} para factura {factura_id}")
-            return True
+        return jsonify({'success': True, **backfills.estado(nombre)})
     except Exception as e:
-        print(f"Error registrando descuento: {e}")
-        return False
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/backfills/<nombre>/iniciar', methods=['POST'])
+def iniciar_backfill(nombre):
+    """Iniciar o retomar un backfill en segundo plano"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    if nombre not in backfills:
+        return jsonify({'success': False, 'error': 'Backfill no encontrado'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    if not backfills.iniciar_en_segundo_plano(nombre, app, reiniciar=bool(data.get('reiniciar', False))):
+        return jsonify({'success': False, 'error': 'El backfill ya está corriendo'}), 409
+    
+    return jsonify({
+        'success': True,
+        'nombre': nombre,
+        'estado_url': url_for('estado_backfill', nombre=nombre)
+    }), 202
 
-# FUNCIÓN PROCESAR_VENTA
 
-@app.route('/procesar_venta', methods=['POST'])
-def procesar_venta():
-    """Procesar venta con medios de pago y items detallados para AFIP"""
+@app.route('/api/backfills/<nombre>/detener', methods=['POST'])
+def detener_backfill(nombre):
+    """Pausar un backfill al terminar el rango actual (se retoma desde ahí)"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
-    try:
-        data = request.json
-        
-        # Validar datos básicos
-        cliente_id = data.get('cliente_id')
-        tipo_comprobante = data.get('tipo_comprobante')
-        items = data.get('items', [])
-        items_detalle = data.get('items_detalle', [])  # *** NUEVO: Items con detalle IVA ***
-        medios_pago = data.get('medios_pago', [])
-        imprimir_automatico = data.get('imprimir_automatico', True)
-        
-        if not items:
-            return jsonify({'success': False, 'error': 'No hay productos en la venta'})
-        
-        if not medios_pago:
-            return jsonify({'success': False, 'error': 'No se especificaron medios de pago'})
-        
-        if not items_detalle:
-            return jsonify({'success': False, 'error': 'No se recibieron items detallados para AFIP'})
-        
-        # VALIDACIÓN CORREGIDA PARA VUELTO EN EFECTIVO
-        total_medios = sum(float(mp.get('importe', 0)) for mp in medios_pago)
-        total_venta = float(data.get('total', 0))
-        descuento_monto = float(data.get('descuento_monto', 0))
-        descuento_porcentaje = float(data.get('descuento_porcentaje', 0))
+    if nombre not in backfills:
+        return jsonify({'success': False, 'error': 'Backfill no encontrado'}), 404
+    
+    backfills.detener(nombre)
+    return jsonify({'success': True, 'mensaje': 'Se detendrá al terminar el rango actual'})
 
-        print(f"🔍 DEBUG VALIDACIÓN BACKEND:")
-        print(f"   Total medios de pago: ${total_medios:.2f}")
-        print(f"   Total venta (con descuento): ${total_venta:.2f}")
-        print(f"   Descuento aplicado: ${descuento_monto:.2f}")
 
-        diferencia = total_medios - total_venta
+# ================== MIGRACIONES DE ESQUEMA Y DATOS ==================
+# Cada migración se aplica una sola vez, en orden, y queda registrada en
+# schema_version. Al iniciar solo se consulta la versión: las rutinas que
+# antes recorrían tablas en cada arranque corren únicamente la primera vez.
+# Para agregar una migración, registrar la siguiente versión al final.
 
-        if diferencia < -0.01:
-            # Falta dinero - ERROR
-            faltante = abs(diferencia)
-            print(f"❌ ERROR: Faltan ${faltante:.2f}")
-            print(f"   Medios individuales:")
-            for i, mp in enumerate(medios_pago):
-                print(f"     {i+1}. {mp.get('medio_pago', 'UNKNOWN')}: ${float(mp.get('importe', 0)):.2f}")
-            
-            return jsonify({
-                'success': False, 
-                'error': f'Faltan ${faltante:.2f} para completar el pago'
-            })
-        elif diferencia > 0.01:
-            # Hay exceso - verificar si es efectivo para dar vuelto
-            medios_efectivo = [mp for mp in medios_pago if mp.get('medio_pago') == 'efectivo']
-            total_efectivo = sum(float(mp.get('importe', 0)) for mp in medios_efectivo)
-            
-            # Si todo el exceso puede cubrirse con efectivo, está OK
-            if total_efectivo >= total_venta:
-                vuelto = diferencia
-                print(f"✅ Pago con vuelto: ${vuelto:.2f}")
-                # Continuar procesando - el vuelto se maneja en el frontend
-            else:
-                # Hay exceso pero no suficiente efectivo para vuelto
-                print(f"❌ ERROR: Exceso de ${diferencia:.2f} sin suficiente efectivo")
-                return jsonify({
-                    'success': False,
-                    'error': f'Exceso de ${diferencia:.2f} pero no hay suficiente efectivo para dar vuelto'
-                })
-        else:
-            print(f"✅ Pago exacto")
+migraciones = crear_registro_migraciones(db, VersionEsquema)
 
-        print(f"✅ Validación exitosa. Procediendo con la venta.")
-        
-        # PASO 1: Determinar el próximo número de comprobante
-        tipo_comprobante_int = int(tipo_comprobante)
-        punto_venta = ARCA_CONFIG.PUNTO_VENTA
-        
-        # PASO 2: Generar número temporal primero
-        ultima_factura_local = Factura.query.filter_by(
-            tipo_comprobante=str(tipo_comprobante_int),
-            punto_venta=punto_venta
-        ).order_by(Factura.id.desc()).first()
-        
-        numero_temporal = 1
-        if ultima_factura_local and ultima_factura_local.numero:
-            try:
-                ultimo_numero_local = int(ultima_factura_local.numero.split('-')[1])
-                numero_temporal = ultimo_numero_local + 1
-            except:
-                numero_temporal = 1
-        
-        # Generar número temporal para la base de datos
-        numero_factura_temporal = f"{punto_venta:04d}-{numero_temporal:08d}"
-        
-        # Verificar que el número temporal no exista
-        factura_existente = Factura.query.filter_by(numero=numero_factura_temporal).first()
-        while factura_existente:
-            numero_temporal += 1
-            numero_factura_temporal = f"{punto_venta:04d}-{numero_temporal:08d}"
-            factura_existente = Factura.query.filter_by(numero=numero_factura_temporal).first()
-        
-        print(f"📝 Número temporal asignado: {numero_factura_temporal}")
-        
-        # PASO 3: Crear factura CON número temporal
-        total_final = float(data.get('total', total_venta))  # Usar el total que ya tiene descuento
-        factura = Factura(
-            numero=numero_factura_temporal,
-            tipo_comprobante=str(tipo_comprobante_int),
-            punto_venta=punto_venta,
-            cliente_id=cliente_id,
-            usuario_id=session['user_id'],
-            subtotal=Decimal(str(data['subtotal'])),
-            iva=Decimal(str(data['iva'])),
-            total=Decimal(str(total_venta))
+
+@migraciones.migracion(1, 'Crear tablas y usuario admin')
+def _migracion_crear_tablas():
+    create_tables()
+
+
+@migraciones.migracion(2, 'Productos existentes como productos base (sistema de combos)')
+def _migracion_productos_combos():
+    tabla = Producto.__table__
+    db.session.execute(
+        update(tabla)
+        .where(tabla.c.es_combo.is_(None))
+        .values(
+            es_combo=False,
+            cantidad_combo=Decimal('1.000'),
+            precio_unitario_base=tabla.c.precio,
+            descuento_porcentaje=Decimal('0.00')
         )
-        
-        db.session.add(factura)
-        db.session.flush()  # Para obtener el ID sin hacer commit
-        
-        print(f"✅ Factura creada con ID: {factura.id} y número temporal: {factura.numero}")
-        
-       # PASO 4: Agregar detalles de productos CON IVA CORRECTO
-        for i, item in enumerate(items):
-            # Obtener el detalle correspondiente con IVA
-            item_detalle = items_detalle[i] if i < len(items_detalle) else {}
-            iva_porcentaje = float(item_detalle.get('iva_porcentaje', 21.0))
-            
-            # Calcular IVA del item con redondeo AFIP
-            subtotal = float(item['subtotal'])
-            importe_iva = round((subtotal * iva_porcentaje / 100), 2)
-            
-            detalle = DetalleFactura(
-                factura_id=factura.id,
-                producto_id=item['producto_id'],
-                cantidad=item['cantidad'],
-                precio_unitario=Decimal(str(item['precio_unitario'])),
-                subtotal=Decimal(str(subtotal)),
-                porcentaje_iva=Decimal(str(iva_porcentaje)),  # ✅ GUARDAR IVA CORRECTO
-                importe_iva=Decimal(str(importe_iva))          # ✅ GUARDAR IMPORTE IVA
+    )
+
+
+@migraciones.migracion(3, 'Acceso rápido en productos existentes')
+def _migracion_acceso_rapido():
+    tabla = Producto.__table__
+    db.session.execute(
+        update(tabla)
+        .where(tabla.c.acceso_rapido.is_(None))
+        .values(acceso_rapido=False, orden_acceso_rapido=0)
+    )
+
+
+@migraciones.migracion(4, 'Costo y margen de productos sin costo')
+def _migracion_costo_margen():
+    migrar_productos_sin_costo_margen()
+
+
+@migraciones.migracion(5, 'Índice y descuentos persistidos de combos')
+def _migracion_descuentos_combos():
+    sincronizar_descuentos_combos()
+
+
+@migraciones.migracion(6, 'Nombre normalizado de clientes')
+def _migracion_nombres_clientes():
+    sincronizar_nombres_clientes()
+
+
+@migraciones.migracion(7, 'Resúmenes diarios de ventas')
+def _migracion_resumenes_ventas():
+    inicializar_resumenes_ventas()
+
+
+@migraciones.migracion(8, 'IVA individual en detalles de facturas')
+def _migracion_iva_detalle():
+    tabla = DetalleFactura.__table__
+    productos = Producto.__table__
+    porcentaje = func.coalesce(
+        select(productos.c.iva).where(productos.c.id == tabla.c.producto_id).scalar_subquery(),
+        21
+    )
+    db.session.execute(
+        update(tabla)
+        .where(or_(
+            tabla.c.porcentaje_iva.is_(None),
+            tabla.c.importe_iva.is_(None),
+            tabla.c.porcentaje_iva == 0
+        ))
+        .values(
+            porcentaje_iva=porcentaje,
+            importe_iva=func.round(tabla.c.subtotal * porcentaje / 100, 2)
+        )
+    )
+
+
+@migraciones.migracion(9, 'Índices de los modelos en bases existentes')
+def _migracion_indices():
+    # create_all no agrega índices a tablas que ya existían
+    for tabla in db.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(db.engine, checkfirst=True)
+
+
+@migraciones.migracion(10, 'Reglas iniciales de categorías')
+def _migracion_reglas_categoria():
+    inicializar_reglas_categoria()
+
+
+@migraciones.migracion(11, 'Tablas del escáner de integridad de facturas')
+def _migracion_tablas_integridad():
+    for modelo in (EscaneoIntegridad, HallazgoIntegridad):
+        modelo.__table__.create(db.engine, checkfirst=True)
+
+
+@migraciones.migracion(12, 'Índice de fecha de modificación de productos')
+def _migracion_indice_fecha_modificacion():
+    for indice in Producto.__table__.indexes:
+        if indice.name == 'idx_producto_fecha_modificacion':
+            indice.create(db.engine, checkfirst=True)
+
+
+@migraciones.migracion(13, 'Cantidad decimal en detalles de facturas (productos pesables)')
+def _migracion_cantidad_decimal_detalle():
+    # Las etiquetas de balanza venden 0,735 kg: la columna entera redondeaba
+    tabla = DetalleFactura.__table__
+    columnas = {columna['name']: columna['type'] for columna in sa_inspect(db.engine).get_columns(tabla.name)}
+    if db.engine.dialect.name == 'mysql' and not isinstance(columnas.get('cantidad'), Numeric):
+        with db.engine.begin() as conexion:
+            conexion.exec_driver_sql(
+                f"ALTER TABLE {tabla.name} MODIFY cantidad DECIMAL(10,3) NOT NULL"
             )
-            db.session.add(detalle)
-            
-            # Actualizar stock
-            producto = Producto.query.get(item['producto_id'])
-            if producto:
-                producto.stock -= Decimal(str(item['cantidad']))
-                print(f"📦 Stock actualizado para {producto.nombre}: {producto.stock}")
-                print(f"💰 Detalle guardado: IVA {iva_porcentaje}% = ${importe_iva:.2f}")
-            else:
-                print(f"⚠️ Producto ID {item['producto_id']} no encontrado")
+
+
+@migraciones.migracion(14, 'Tabla de avance de backfills')
+def _migracion_tabla_backfills():
+    # Bases que ya pasaron la migración 1 no la tenían; los datos de IVA
+    # ya los corrigió la migración 8, los backfills se corren a pedido
+    AvanceBackfill.__table__.create(db.engine, checkfirst=True)
+
+
+@app.route('/api/migraciones')
+def estado_migraciones():
+    """Versión del esquema, migraciones aplicadas y pendientes"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        version = migraciones.version_actual()
+        return jsonify({
+            'success': True,
+            'version': version,
+            'ultima_version': migraciones.ultima_version,
+            'pendientes': [
+                {'version': m['version'], 'descripcion': m['descripcion']}
+                for m in migraciones.pendientes(version)
+            ],
+            'aplicadas': [aplicada.to_dict() for aplicada in migraciones.aplicadas()]
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+if __name__ == '__main__':
+    # Crear directorios necesarios
+    os.makedirs('cache', exist_ok=True)
+    os.makedirs('logs', exist_ok=True)
+    os.makedirs('certificados', exist_ok=True)
+    
+    print("🚀 Iniciando POS Argentina...")
+    print(f"📍 URL: http://localhost:5000")
+    print(f"🏢 CUIT: {ARCA_CONFIG.CUIT}")
+    print(f"🏪 Punto de Venta: {ARCA_CONFIG.PUNTO_VENTA}")
+    print(f"🔧 Ambiente: {'HOMOLOGACIÓN' if ARCA_CONFIG.USE_HOMOLOGACION else 'PRODUCCIÓN'}")
+    print(f"🖨️ Impresión: {'Disponible' if IMPRESION_DISPONIBLE else 'No disponible'}")
+    print(f"👤 Usuario: admin")
+    print(f"🔑 Contraseña: admin123")
+    print()
+    
+    with app.app_context():
+        # Solo consulta la versión del esquema si no hay migraciones pendientes.
+        # Si una falla no se arranca: el esquema quedaría a medio migrar
+        try:
+            migraciones.ejecutar()
+        except Exception as e:
+            print(f"❌ No se pudieron aplicar las migraciones, se cancela el inicio: {e}")
+            raise SystemExit(1)
+
+        # Revisar solo las facturas nuevas desde el último escaneo
+        print("🧹 Verificando integridad de datos...")
+        try:
+            escanear_integridad_facturas()
+        except Exception as e:
+            print(f"❌ Error en el escáner de integridad: {e}")
+        mostrar_resumen_integridad()
+    
+# AGREGAR esta función a tu app.py (después de la línea que dice @app.route('/medios_pago_factura/<int:factura_id>')):
+
+@app.route('/api/reporte_medios_pago')
+def reporte_medios_pago():
+    """Generar reporte de medios de pago por fecha usando SQLAlchemy"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        # Obtener parámetros de fecha
+        fecha_desde = request.args.get('desde')
+        fecha_hasta = request.args.get('hasta')
         
-        # PASO 5: Agregar medios de pago
-        print(f"💳 Agregando {len(medios_pago)} medios de pago...")
-        for medio_data in medios_pago:
-            medio_pago = MedioPago(
-                factura_id=factura.id,
-                medio_pago=medio_data['medio_pago'],
-                importe=Decimal(str(medio_data['importe'])),
-                fecha_registro=datetime.now()
-            )
-            db.session.add(medio_pago)
-            print(f"💰 Medio agregado: {medio_data['medio_pago']} ${medio_data['importe']}")
+        if not fecha_desde or not fecha_hasta:
+            return jsonify({
+                'success': False,
+                'error': 'Debe proporcionar fechas desde y hasta'
+            })
         
-        # PASO 6: Intentar autorizar en AFIP con items detallados
+        # Convertir strings a datetime
         try:
-            print("📄 Autorizando en AFIP con items detallados...")
-            cliente = Cliente.query.get(cliente_id)
-            
-            # *** CLAVE: Preparar datos para AFIP con items_detalle ***
-            datos_comprobante = {
-                'tipo_comprobante': tipo_comprobante_int,
-                'punto_venta': punto_venta,
-                'importe_neto': float(factura.subtotal),
-                'importe_iva': float(factura.iva),
-                'items_detalle': items_detalle,  # *** NUEVO: Items con IVA individual ***
-                'doc_tipo': 99,  # Sin identificar por defecto
-                'doc_nro': 0
-            }
-            
-            # Debug: Mostrar items que se envían a AFIP
-            print("🧮 Items detallados enviados a AFIP:")
-            for item in items_detalle:
-                print(f"   📦 ${item['subtotal']:.2f} (IVA {item['iva_porcentaje']}%)")
-            
-            # Si el cliente tiene documento, agregar datos
-            if cliente and cliente.documento:
-                if cliente.tipo_documento == 'CUIT' and len(cliente.documento) == 11:
-                    datos_comprobante['doc_tipo'] = 80  # CUIT
-                    datos_comprobante['doc_nro'] = int(cliente.documento)
-                elif cliente.tipo_documento == 'DNI' and len(cliente.documento) >= 7:
-                    datos_comprobante['doc_tipo'] = 96  # DNI
-                    datos_comprobante['doc_nro'] = int(cliente.documento)
-            
-            resultado_afip = arca_client.autorizar_comprobante(datos_comprobante)
-            
-            if resultado_afip['success']:
-                # AFIP devuelve el número correcto - ACTUALIZAR la factura
-                numero_afip = resultado_afip['numero']
-                print(f"✅ AFIP asignó número: {numero_afip}")
-                
-                # Verificar si el número de AFIP ya existe en la BD
-                factura_afip_existente = Factura.query.filter(
-                    and_(Factura.numero == numero_afip, Factura.id != factura.id)
-                ).first()
-                
-                if factura_afip_existente:
-                    print(f"⚠️ Número AFIP {numero_afip} ya existe, manteniendo temporal")
-                    # Mantener número temporal y marcar como autorizada
-                    factura.cae = resultado_afip['cae']
-                    factura.vto_cae = resultado_afip['vto_cae']
-                    factura.estado = 'autorizada'
-                else:
-                    # Actualizar con número de AFIP
-                    factura.numero = numero_afip
-                    factura.cae = resultado_afip['cae']
-                    factura.vto_cae = resultado_afip['vto_cae']
-                    factura.estado = 'autorizada'
-                
-                print(f"✅ Autorización AFIP exitosa. CAE: {factura.cae}")
-                print(f"✅ Número final: {factura.numero}")
-            else:
-                # Si AFIP falla, mantener número temporal
-                factura.estado = 'error_afip'
-                print(f"❌ Error AFIP: {resultado_afip.get('error', 'Error desconocido')}")
-                print(f"📝 Manteniendo número temporal: {factura.numero}")
-            
-        except Exception as e:
-            # Si hay error completo, mantener número temporal
-            factura.estado = 'error_afip'
-            print(f"❌ Error completo al autorizar en AFIP: {e}")
-            print(f"📝 Manteniendo número temporal: {factura.numero}")
-            
-        # PASO 7: Guardar todo en la base de datos
-        db.session.commit()
+            fecha_desde_dt = datetime.strptime(fecha_desde, '%Y-%m-%d')
+            fecha_hasta_dt = datetime.strptime(fecha_hasta, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'Formato de fecha inválido. Use YYYY-MM-DD'
+            })
         
-        print(f"🎉 Venta procesada exitosamente: {factura.numero}")
+        # Consulta usando SQLAlchemy
+        from sqlalchemy import func
         
-        # NUEVA LÍNEA: Registrar descuento si existe (tabla separada)
-        if data.get('descuento_monto', 0) > 0:
-            total_antes_descuento = float(data.get('subtotal', 0)) + float(data.get('iva', 0))
-            registrar_descuento_factura(
-                factura.id, 
-                data.get('descuento_porcentaje', 0),
-                data.get('descuento_monto', 0),
-                total_antes_descuento,
-                session['user_id']
+        resultados = db.session.query(
+            VentaDiariaMedioPago.medio_pago,
+            func.sum(VentaDiariaMedioPago.operaciones).label('cantidad'),
+            func.sum(VentaDiariaMedioPago.importe).label('total')
+        ).filter(
+            and_(
+                VentaDiariaMedioPago.fecha >= fecha_desde_dt.date(),
+                VentaDiariaMedioPago.fecha <= fecha_hasta_dt.date()
             )
-
-        # PASO 8: Imprimir automáticamente si está configurado
-        if imprimir_automatico and IMPRESION_DISPONIBLE:
-            try:
-                print("🖨️ Imprimiendo factura automáticamente...")
-                impresora_termica.imprimir_factura(factura)
-            except Exception as e:
-                print(f"⚠️ Error en impresión automática: {e}")
+        ).group_by(VentaDiariaMedioPago.medio_pago).order_by(
+            func.sum(VentaDiariaMedioPago.importe).desc()
+        ).all()
+        
+        # Formatear resultados
+        medios_pago = []
+        total_general = 0
+        
+        for medio, cantidad, total in resultados:
+            medios_pago.append({
+                'medio_pago': medio,
+                'cantidad': int(cantidad or 0),
+                'total': float(total)
+            })
+            total_general += float(total)
         
         return jsonify({
             'success': True,
-            'factura_id': factura.id,
-            'numero': factura.numero,
-            'cae': factura.cae,
-            'estado': factura.estado,
-            'mensaje': f"Factura {factura.numero} generada correctamente"
+            'reporte': {
+                'medios_pago': medios_pago,
+                'fecha_desde': fecha_desde,
+                'fecha_hasta': fecha_hasta,
+                'total_general': total_general
+            }
         })
         
     except Exception as e:
-        print(f"❌ Error en procesar_venta: {str(e)}")
-        db.session.rollback()
-        return jsonify({'error': f'Error al procesar la venta: {str(e)}'}), 500
+        print(f"Error en reporte_medios_pago: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Error interno del servidor: {str(e)}'
+        }), 500
 
 
-# RUTAS DE IMPRESIÓN
-@app.route('/imprimir_factura/<int:factura_id>')
-def imprimir_factura(factura_id):
-    """Endpoint para imprimir factura específica"""
+@app.route('/reporte_ventas')
+def reporte_ventas():
+    """Página principal del reporte de ventas"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    return render_template('reporte_ventas.html')
+
+
+@app.route('/api/reporte_ventas_productos')
+def api_reporte_ventas_productos():
+    """API para generar reporte de ventas por producto - CORREGIDO PARA COMBOS"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
     try:
-        print(f"🖨️ Iniciando impresión de factura ID: {factura_id}")
-        
-        # Obtener la factura de la base de datos
-        factura = Factura.query.get_or_404(factura_id)
+        # Obtener parámetros
+        fecha_desde = request.args.get('fecha_desde')
+        fecha_hasta = request.args.get('fecha_hasta')
+        categoria = request.args.get('categoria', '').strip()
+        orden = request.args.get('orden', 'cantidad_desc')
+        solo_con_ventas = request.args.get('solo_con_ventas', 'true').lower() == 'true'
         
-        # Usar directamente la instancia de la clase
-        resultado = impresora_termica.imprimir_factura(factura)
+        # Validar fechas
+        if not fecha_desde or not fecha_hasta:
+            return jsonify({
+                'success': False,
+                'error': 'Debe proporcionar fechas desde y hasta'
+            })
         
-        if resultado:
+        try:
+            fecha_desde_dt = datetime.strptime(fecha_desde, '%Y-%m-%d')
+            fecha_hasta_dt = datetime.strptime(fecha_hasta, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+        except ValueError:
             return jsonify({
-                'success': True,
-                'mensaje': f'Factura impresa correctamente en {impresora_termica.nombre_impresora}'
+                'success': False,
+                'error': 'Formato de fecha inválido'
             })
-        else:
+        
+        # Validar rango de fechas (máximo 2 años)
+        if (fecha_hasta_dt - fecha_desde_dt).days > 730:
             return jsonify({
                 'success': False,
-                'error': 'Error al imprimir factura'
+                'error': 'El rango de fechas no puede ser mayor a 2 años'
             })
         
-    except Exception as e:
-        print(f"❌ Error en endpoint imprimir: {e}")
-        return jsonify({
-            'success': False,
-            'error': f'Error al imprimir factura: {str(e)}'
-        }), 500
+        def calcular():
+            print(f"📊 Generando reporte de ventas (CORREGIDO PARA COMBOS):")
+            print(f"   Período: {fecha_desde} a {fecha_hasta}")
+            print(f"   Categoría: {categoria or 'Todas'}")
+            print(f"   Orden: {orden}")
+            print(f"   Solo con ventas: {solo_con_ventas}")
+            
+            # ✅ LEER DESDE EL RESUMEN DIARIO (cantidad real de combos ya calculada)
+            # Incluye TODAS las facturas (sin filtro de estado)
+            query = consulta_resumen_ventas_productos(
+                fecha_desde_dt.date(), fecha_hasta_dt.date(), categoria, orden
+            )
+            
+            print(f"   Ordenamiento aplicado: {orden} (usando cantidad real)")
+            
+            # Ejecutar query
+            print(f"🔍 Ejecutando consulta...")
+            resultados = query.all()
+            print(f"📋 Encontrados {len(resultados)} productos con ventas")
+            
+            # Consulta adicional: información de estados de facturas para debug
+            debug_estados = db.session.query(
+                Factura.estado,
+                func.count(Factura.id).label('cantidad'),
+                func.sum(Factura.total).label('total')
+            ).filter(
+                and_(
+                    Factura.fecha >= fecha_desde_dt,
+                    Factura.fecha <= fecha_hasta_dt
+                )
+            ).group_by(Factura.estado).all()
+            
+            estados_info = {}
+            for estado, cantidad, total in debug_estados:
+                estados_info[estado] = {
+                    'cantidad': cantidad,
+                    'total': float(total) if total else 0.0
+                }
+            
+            print(f"📊 Estados de facturas en el período:")
+            for estado, info in estados_info.items():
+                print(f"   {estado}: {info['cantidad']} facturas (${info['total']:.2f})")
+            
+            # *** FORMATEAR RESULTADOS CON CANTIDAD REAL ***
+            productos = []
+            total_unidades_reales = 0
+            total_ventas = 0.0
+            
+            for resultado in resultados:
+                # *** USAR CANTIDAD REAL (ya calculada en SQL) ***
+                cantidad_real = float(resultado.cantidad_real_vendida) if resultado.cantidad_real_vendida else 0.0
+                unidades_combos = int(resultado.unidades_combos_vendidas) if resultado.unidades_combos_vendidas else 0
+                total_producto = float(resultado.total_vendido) if resultado.total_vendido else 0.0
+                precio_promedio = float(resultado.precio_promedio) if resultado.precio_promedio else 0.0
+            
+                # *** INFORMACIÓN ADICIONAL PARA COMBOS ***
+                info_combo = ""
+                unidad_medida = "unidades"
+            
+                if resultado.es_combo and resultado.cantidad_combo:
+                    cantidad_combo = float(resultado.cantidad_combo)
+                    info_combo = f" ({unidades_combos} combos de {cantidad_combo:g} c/u)"
+                    # Detectar unidad de medida basada en cantidad del combo
+                    if cantidad_combo >= 1:
+                        if cantidad_combo == int(cantidad_combo):
+                            unidad_medida = "kg" if cantidad_combo >= 1 else "unidades"
+                        else:
+                            unidad_medida = "kg"
+                
+                    print(f"📦 {resultado.codigo}: {unidades_combos} combos × {cantidad_combo:g} = {cantidad_real:g} {unidad_medida}")
+            
+                productos.append({
+                    'id': resultado.id,
+                    'codigo': resultado.codigo,
+                    'nombre': resultado.nombre,
+                    'descripcion': resultado.descripcion,
+                    'categoria': resultado.categoria,
+                    'es_combo': resultado.es_combo,
+                    'cantidad_combo': float(resultado.cantidad_combo) if resultado.cantidad_combo else 1.0,
+                    'cantidad_vendida': cantidad_real,  # *** CANTIDAD REAL ***
+                    'unidades_combos_vendidas': unidades_combos,  # *** COMBOS VENDIDOS ***
+                    'info_combo': info_combo,  # *** INFORMACIÓN ADICIONAL ***
+                    'unidad_medida': unidad_medida,  # *** UNIDAD DE MEDIDA ***
+                    'total_vendido': total_producto,
+                    'precio_promedio': precio_promedio,
+                    'ultima_venta': resultado.ultima_venta.isoformat() if resultado.ultima_venta else None,
+                    'num_transacciones': int(resultado.num_transacciones) if resultado.num_transacciones else 0
+                })
+            
+                total_unidades_reales += cantidad_real
+                total_ventas += total_producto
+            
+            # *** RESUMEN CORREGIDO ***
+            resumen = {
+                'total_productos': len(productos),
+                'total_unidades_reales': total_unidades_reales,  # *** UNIDADES REALES ***
+                'total_ventas': total_ventas,
+                'promedio_por_producto': total_ventas / len(productos) if len(productos) > 0 else 0,
+                'fecha_desde': fecha_desde,
+                'fecha_hasta': fecha_hasta,
+                'categoria_filtro': categoria or 'Todas',
+                'incluye_todas_facturas': True,
+                'estados_facturas': estados_info,
+                'correccion_combos': True  # *** FLAG PARA INDICAR CORRECCIÓN ***
+            }
+            
+            print(f"✅ Reporte generado exitosamente (CON CORRECCIÓN DE COMBOS):")
+            print(f"   Productos: {resumen['total_productos']}")
+            print(f"   Unidades REALES: {resumen['total_unidades_reales']:g}")
+            print(f"   Total: ${resumen['total_ventas']:.2f}")
+            print(f"   Incluye corrección de combos: SÍ")
+            
+            return {
+                'success': True,
+                'productos': productos,
+                'resumen': resumen,
+                'parametros': {
+                    'fecha_desde': fecha_desde,
+                    'fecha_hasta': fecha_hasta,
+                    'categoria': categoria,
+                    'orden': orden,
+                    'solo_con_ventas': solo_con_ventas,
+                    'incluye_todas_facturas': True,
+                    'correccion_combos_aplicada': True
+                }
+            }
         
-@app.route('/test_impresion')
-def test_impresion():
-    try:
-        print("🧪 Iniciando test de impresión...")
-        resultado = impresora_termica.test_impresion()  # ← Llama al método de la clase
+        return jsonify(cache_reportes.obtener(
+            'reporte_ventas_productos',
+            {'fecha_desde': fecha_desde, 'fecha_hasta': fecha_hasta, 'categoria': categoria,
+             'orden': orden, 'solo_con_ventas': solo_con_ventas},
+            fecha_desde_dt.date(), fecha_hasta_dt.date(), calcular
+        ))
         
-        if resultado:
-            return jsonify({
-                'success': True,
-                'mensaje': f'Test enviado correctamente a {impresora_termica.nombre_impresora}'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': 'Error al enviar test de impresión'
-            })
     except Exception as e:
+        print(f"❌ Error en reporte de ventas: {str(e)}")
+        import traceback
+        print(f"📋 Stack trace: {traceback.format_exc()}")
         return jsonify({
             'success': False,
-            'error': f'Error en test: {str(e)}'
+            'error': f'Error interno del servidor: {str(e)}'
         }), 500
 
-@app.route('/estado_impresora')
-def estado_impresora():
-    """Endpoint para verificar estado de impresora"""
-    try:
-        estado = impresora_termica.verificar_estado()
-        return jsonify(estado)
-    except Exception as e:
-        return jsonify({
-            'disponible': False,
-            'error': f'Error verificando estado: {str(e)}'
-        }), 500
 
-@app.route('/facturas')
-def facturas():
-    """Página de gestión de facturas (carga dinámica via JavaScript)"""
+ENCABEZADOS_EXPORTACION_VENTAS = [
+    'Código',
+    'Producto',
+    'Descripción',
+    'Categoría',
+    'Tipo',  # *** NUEVO: Producto Base / Combo
+    'Cantidad Real Vendida',  # *** CORREGIDO ***
+    'Unidades/Combos',  # *** NUEVO: Detalle de combos ***
+    'Precio Promedio',
+    'Total Vendido',
+    'Última Venta',
+    'Número de Transacciones'
+]
+
+# Filas que se traen por vez del cursor del servidor al exportar
+LOTE_EXPORTACION_VENTAS = 500
+
+
+def _fila_exportacion_ventas(resultado):
+    """Armar una fila del reporte exportado con información de combos"""
+    # Calcular cantidad real y información de combo
+    cantidad_real = float(resultado.cantidad_real_vendida) if resultado.cantidad_real_vendida else 0.0
+    unidades_combos = int(resultado.unidades_combos_vendidas) if resultado.unidades_combos_vendidas else 0
+    
+    # Información del tipo de producto
+    if resultado.es_combo:
+        tipo_producto = "Combo/Oferta"
+        cantidad_combo = float(resultado.cantidad_combo) if resultado.cantidad_combo else 1.0
+        detalle_unidades = f"{unidades_combos} combos × {cantidad_combo:g} c/u"
+    else:
+        tipo_producto = "Producto Base"
+        detalle_unidades = f"{int(cantidad_real)} unidades"
+    
+    return [
+        resultado.codigo,
+        resultado.nombre,
+        resultado.descripcion or '',
+        resultado.categoria or 'Sin categoría',
+        tipo_producto,  # *** NUEVO ***
+        f"{cantidad_real:g}",  # *** CANTIDAD REAL ***
+        detalle_unidades,  # *** DETALLE ***
+        f"{float(resultado.precio_promedio):.2f}" if resultado.precio_promedio else "0.00",
+        f"{float(resultado.total_vendido):.2f}" if resultado.total_vendido else "0.00",
+        resultado.ultima_venta.strftime('%d/%m/%Y') if resultado.ultima_venta else 'N/A',
+        int(resultado.num_transacciones) if resultado.num_transacciones else 0
+    ]
+
+
+def filas_exportacion_ventas(query):
+    """Recorrer la consulta con un cursor del servidor, fila por fila"""
+    for resultado in query.yield_per(LOTE_EXPORTACION_VENTAS):
+        yield _fila_exportacion_ventas(resultado)
+
+
+@app.route('/exportar_reporte_ventas')
+def exportar_reporte_ventas():
+    """Exportar reporte de ventas a Excel o CSV - CORREGIDO PARA COMBOS"""
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    # No cargar facturas aquí - se cargan dinámicamente via JavaScript
-    # Esto mejora significativamente el tiempo de carga de la página
+        return jsonify({'error': 'No autorizado'}), 401
     
-    return render_template('facturas.html', facturas=[])
-
-@app.route('/factura/<int:factura_id>')
-def ver_factura(factura_id):
     try:
-        # Método compatible con SQLAlchemy antiguo
-        factura = Factura.query.get_or_404(factura_id)
-        
-        return render_template('factura_detalle.html', factura=factura)
+        # Obtener parámetros (mismos que el reporte)
+        fecha_desde = request.args.get('fecha_desde')
+        fecha_hasta = request.args.get('fecha_hasta')
+        categoria = request.args.get('categoria', '').strip()
+        orden = request.args.get('orden', 'cantidad_desc')
+        formato = request.args.get('formato', 'csv')  # csv o excel
         
-    except Exception as e:
-        app.logger.error(f"Error al cargar factura {factura_id}: {str(e)}")
-        flash('Error al cargar la factura', 'error')
-        return redirect(url_for('facturas'))
-
-# Funciones de utilidad para limpieza de datos
-def limpiar_facturas_duplicadas():
-    """Limpiar facturas duplicadas o problemáticas"""
-    try:
-        # Buscar facturas con números duplicados
-        facturas_duplicadas = db.session.query(Factura.numero).group_by(Factura.numero).having(db.func.count(Factura.numero) > 1).all()
+        # Validar fechas
+        fecha_desde_dt = datetime.strptime(fecha_desde, '%Y-%m-%d')
+        fecha_hasta_dt = datetime.strptime(fecha_hasta, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
         
-        if facturas_duplicadas:
-            print(f"⚠️ Encontradas {len(facturas_duplicadas)} facturas con números duplicados")
-            
-            for numero_duplicado in facturas_duplicadas:
-                numero = numero_duplicado[0]
-                facturas = Factura.query.filter_by(numero=numero).order_by(Factura.id).all()
-                
-                # Mantener solo la primera, eliminar las demás
-                for i, factura in enumerate(facturas):
-                    if i > 0:  # Eliminar todas excepto la primera
-                        print(f"🗑️ Eliminando factura duplicada: {factura.numero} (ID: {factura.id})")
-                        
-                        # Eliminar detalles primero
-                        DetalleFactura.query.filter_by(factura_id=factura.id).delete()
-                        
-                        # Eliminar factura
-                        db.session.delete(factura)
-            
-            db.session.commit()
-            print("✅ Limpieza de duplicados completada")
-        else:
-            print("✅ No se encontraron facturas duplicadas")
-            
-    except Exception as e:
-        print(f"❌ Error en limpieza: {e}")
-        db.session.rollback()
-
-def verificar_estado_facturas():
-    """Verificar el estado actual de las facturas"""
-    try:
-        total_facturas = Factura.query.count()
-        facturas_con_cae = Factura.query.filter(Factura.cae.isnot(None)).count()
-        facturas_pendientes = Factura.query.filter_by(estado='pendiente').count()
-        facturas_error = Factura.query.filter_by(estado='error_afip').count()
+        print(f"📤 Exportando reporte a {formato.upper()}: {fecha_desde} a {fecha_hasta}")
         
-        print("\n📊 ESTADO ACTUAL DE FACTURAS:")
-        print(f"   Total facturas: {total_facturas}")
-        print(f"   Con CAE: {facturas_con_cae}")
-        print(f"   Pendientes: {facturas_pendientes}")
-        print(f"   Con errores: {facturas_error}")
+        # *** MISMA CONSULTA DEL REPORTE (desde el resumen diario) ***
+        query = consulta_resumen_ventas_productos(
+            fecha_desde_dt.date(), fecha_hasta_dt.date(), categoria, orden
+        )
         
-        # Mostrar últimas facturas
-        ultimas_facturas = Factura.query.order_by(Factura.id.desc()).limit(5).all()
-        print(f"\n📋 ÚLTIMAS 5 FACTURAS:")
-        for factura in ultimas_facturas:
-            cae_status = f"CAE: {factura.cae[:10]}..." if factura.cae else "Sin CAE"
-            print(f"   {factura.numero} - {factura.estado} - {cae_status}")
+        # Generar archivo según formato
+        if formato == 'excel':
+            # Reportes grandes: generar en segundo plano si el cliente puede esperar el trabajo
+            if request.args.get('segundo_plano') == 'auto':
+                total_filas = query.order_by(None).count()
+                if total_filas > app.config.get('EXCEL_UMBRAL_SEGUNDO_PLANO', 5000):
+                    trabajo = iniciar_exportacion_excel(
+                        fecha_desde, fecha_hasta, categoria, orden, total_filas
+                    )
+                    return jsonify({
+                        'success': True,
+                        'en_segundo_plano': True,
+                        'trabajo_id': trabajo['id'],
+                        'total_filas': total_filas,
+                        'estado_url': url_for('estado_exportacion_excel', trabajo_id=trabajo['id'])
+                    }), 202
+            
+            return generar_excel_reporte(filas_exportacion_ventas(query), fecha_desde, fecha_hasta)
+        else:  # CSV por defecto, en streaming
+            return generar_csv_reporte(filas_exportacion_ventas(query), fecha_desde, fecha_hasta)
         
     except Exception as e:
-        print(f"❌ Error verificando estado: {e}")
-
-# Funciones de inicialización
-def create_tables():
-    """Crea las tablas de la base de datos"""
-    try:
-        db.create_all()
+        print(f"❌ Error exportando reporte: {str(e)}")
+        return jsonify({'error': f'Error al exportar: {str(e)}'}), 500
         
-        # Crear usuario admin por defecto si no existe
-        if not Usuario.query.filter_by(username='admin').first():
-            admin = Usuario(
-                username='admin',
-                password_hash='admin123',  # Sin encriptación para simplicidad
-                nombre='Administrador',
-                rol='admin'
-            )
-            db.session.add(admin)
-            db.session.commit()
-            print("✅ Usuario admin creado (admin/admin123)")
+
+def generar_csv_reporte(filas, fecha_desde, fecha_hasta, filas_por_bloque=200):
+    """Generar CSV del reporte en streaming: se envía por bloques mientras se lee la consulta"""
+    def generar():
+        output = io.StringIO()
+        writer = csv.writer(output)
         
-        print("✅ Base de datos inicializada correctamente")
+        # Escribir encabezado del reporte
+        writer.writerow([f'Reporte de Ventas por Producto'])
+        writer.writerow([f'Período: {fecha_desde} al {fecha_hasta}'])
+        writer.writerow([f'Generado: {datetime.now().strftime("%d/%m/%Y %H:%M")}'])
+        writer.writerow([])  # Línea vacía
+        writer.writerow(ENCABEZADOS_EXPORTACION_VENTAS)
         
-    except Exception as e:
-        print(f"❌ Error al inicializar base de datos: {e}")
+        # Primer bloque enseguida, antes de esperar a la consulta
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate(0)
+        
+        enviadas = 0
+        for fila in filas:
+            writer.writerow(fila)
+            enviadas += 1
+            if enviadas % filas_por_bloque == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate(0)
+        
+        if output.tell():
+            yield output.getvalue()
+        print(f"📊 CSV exportado: {enviadas} productos")
+    
+    response = app.response_class(stream_with_context(generar()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=reporte_ventas_{fecha_desde}_{fecha_hasta}.csv'
+    
+    return response
 
-@app.route('/qr_afip/<int:factura_id>')
-def generar_qr_afip(factura_id):
+def escribir_excel_reporte(archivo, filas, fecha_desde, fecha_hasta, progreso=None):
+    """Escribir el reporte con openpyxl en modo write-only (las filas no quedan en memoria)"""
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+    
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Reporte de Ventas")
+    
+    # Ajustar ancho de columnas (en write-only va antes de escribir filas)
+    for col in range(1, len(ENCABEZADOS_EXPORTACION_VENTAS) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = 15
+    
+    # Estilos
+    encabezado_font = Font(bold=True, size=12, color="FFFFFF")
+    encabezado_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    
+    # Título del reporte
+    titulo = WriteOnlyCell(ws, value='Reporte de Ventas por Producto')
+    titulo.font = Font(bold=True, size=16)
+    ws.append([titulo])
+    ws.append([f'Período: {fecha_desde} al {fecha_hasta}'])
+    ws.append([f'Generado: {datetime.now().strftime("%d/%m/%Y %H:%M")}'])
+    ws.append([])
+    
+    # Escribir encabezados
+    encabezados = []
+    for encabezado in ENCABEZADOS_EXPORTACION_VENTAS:
+        celda = WriteOnlyCell(ws, value=encabezado)
+        celda.font = encabezado_font
+        celda.fill = encabezado_fill
+        celda.alignment = Alignment(horizontal='center')
+        encabezados.append(celda)
+    ws.append(encabezados)
+    
+    # Escribir datos a medida que llegan del cursor
+    escritas = 0
+    for fila in filas:
+        ws.append(fila)
+        escritas += 1
+        if progreso and escritas % 1000 == 0:
+            progreso(escritas)
+    
+    wb.save(archivo)
+    return escritas
+
+
+def generar_excel_reporte(filas, fecha_desde, fecha_hasta):
+    """Generar archivo Excel del reporte en un temporal y enviarlo (requiere openpyxl)"""
     try:
-        # Método compatible con SQLAlchemy antiguo
-        factura = Factura.query.get_or_404(factura_id)
-        
+        import openpyxl
+    except ImportError:
+        # Si no está instalado openpyxl, devolver CSV
+        return generar_csv_reporte(filas, fecha_desde, fecha_hasta)
+    
+    archivo = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        escritas = escribir_excel_reporte(archivo, filas, fecha_desde, fecha_hasta)
+    except Exception:
+        archivo.close()
+        raise
+    
+    print(f"📊 Excel exportado: {escritas} productos")
+    archivo.seek(0)
+    
+    # El temporal se cierra (y se borra) al terminar de enviar la respuesta
+    return send_file(
+        archivo,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'reporte_ventas_{fecha_desde}_{fecha_hasta}.xlsx'
+    )
+
+# ==================== EXPORTACIÓN EXCEL EN SEGUNDO PLANO ====================
+
+DIRECTORIO_EXPORTACIONES = os.path.join(tempfile.gettempdir(), 'pos_exportaciones')
+VIGENCIA_EXPORTACIONES = timedelta(hours=1)
+
+_exportaciones_excel = {}
+_exportaciones_lock = threading.Lock()
+
+
+def _limpiar_exportaciones_vencidas():
+    """Borrar trabajos terminados (y sus archivos) que superaron la vigencia"""
+    limite = datetime.now() - VIGENCIA_EXPORTACIONES
+    with _exportaciones_lock:
+        vencidos = [
+            trabajo_id for trabajo_id, trabajo in _exportaciones_excel.items()
+            if trabajo['estado'] != 'procesando' and trabajo['creado'] < limite
+        ]
+        for trabajo_id in vencidos:
+            trabajo = _exportaciones_excel.pop(trabajo_id)
+            if trabajo.get('archivo') and os.path.exists(trabajo['archivo']):
+                os.remove(trabajo['archivo'])
+
+
+def _actualizar_exportacion(trabajo_id, **cambios):
+    with _exportaciones_lock:
+        _exportaciones_excel[trabajo_id].update(cambios)
+
+
+def _generar_excel_en_segundo_plano(trabajo_id, fecha_desde, fecha_hasta, categoria, orden):
+    """Hilo que arma el Excel en disco leyendo el resumen diario con cursor del servidor"""
+    with app.app_context():
+        ruta = os.path.join(DIRECTORIO_EXPORTACIONES, f'{trabajo_id}.xlsx')
         try:
-            generador_qr = crear_generador_qr(ARCA_CONFIG)  # ← Ya está correcto
-            
-            # Generar imagen QR
-            qr_base64 = generador_qr.generar_qr_imagen(factura)
-            info_qr = generador_qr.obtener_info_qr(factura)
-            
-            if qr_base64:
-                return jsonify({
-                    'success': True,
-                    'qr_image': qr_base64,
-                    'qr_url': info_qr['url'],
-                    'qr_valido': info_qr['valido'],
-                    'mensaje': info_qr['mensaje']
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': 'Error al generar código QR'
-                }), 500
-                
-        except ImportError:
-            return jsonify({
-                'success': False,
-                'error': 'Módulo QR no disponible'
-            }), 500
-            
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': f'Error: {str(e)}'
-        }), 500
+            query = consulta_resumen_ventas_productos(
+                datetime.strptime(fecha_desde, '%Y-%m-%d').date(),
+                datetime.strptime(fecha_hasta, '%Y-%m-%d').date(),
+                categoria, orden
+            )
+            with open(ruta, 'wb') as archivo:
+                escritas = escribir_excel_reporte(
+                    archivo, filas_exportacion_ventas(query), fecha_desde, fecha_hasta,
+                    progreso=lambda n: _actualizar_exportacion(trabajo_id, filas_escritas=n)
+                )
+            _actualizar_exportacion(trabajo_id, estado='listo', filas_escritas=escritas, archivo=ruta)
+            print(f"✅ Exportación Excel {trabajo_id} lista: {escritas} productos")
+        except Exception as e:
+            print(f"❌ Error en exportación Excel {trabajo_id}: {e}")
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            _actualizar_exportacion(trabajo_id, estado='error', error=str(e))
+        finally:
+            db.session.remove()
+
+
+def iniciar_exportacion_excel(fecha_desde, fecha_hasta, categoria, orden, total_filas):
+    """Registrar un trabajo de exportación y lanzarlo en un hilo"""
+    _limpiar_exportaciones_vencidas()
+    os.makedirs(DIRECTORIO_EXPORTACIONES, exist_ok=True)
+    
+    trabajo = {
+        'id': uuid.uuid4().hex,
+        'usuario_id': session.get('user_id'),
+        'estado': 'procesando',
+        'total_filas': total_filas,
+        'filas_escritas': 0,
+        'nombre_archivo': f'reporte_ventas_{fecha_desde}_{fecha_hasta}.xlsx',
+        'archivo': None,
+        'error': None,
+        'creado': datetime.now()
+    }
+    with _exportaciones_lock:
+        _exportaciones_excel[trabajo['id']] = trabajo
+    
+    print(f"🧵 Exportación Excel en segundo plano: {total_filas} productos ({trabajo['id']})")
+    threading.Thread(
+        target=_generar_excel_en_segundo_plano,
+        args=(trabajo['id'], fecha_desde, fecha_hasta, categoria, orden),
+        daemon=True
+    ).start()
+    return trabajo
+
+
+def _obtener_exportacion_usuario(trabajo_id):
+    """Copia del trabajo si existe y pertenece al usuario de la sesión"""
+    with _exportaciones_lock:
+        trabajo = _exportaciones_excel.get(trabajo_id)
+        if not trabajo or trabajo['usuario_id'] != session.get('user_id'):
+            return None
+        return dict(trabajo)
 
-# Ruta para mostrar QR en página completa (para escanear con móvil)
-@app.route('/mostrar_qr/<int:factura_id>')
-def mostrar_qr_completo(factura_id):
+
+@app.route('/api/exportaciones_excel/<trabajo_id>')
+def estado_exportacion_excel(trabajo_id):
+    """Estado de una exportación Excel en segundo plano"""
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return jsonify({'error': 'No autorizado'}), 401
     
-    # Método compatible con SQLAlchemy antiguo
-    factura = Factura.query.get_or_404(factura_id)
+    trabajo = _obtener_exportacion_usuario(trabajo_id)
+    if not trabajo:
+        return jsonify({'success': False, 'error': 'Exportación no encontrada'}), 404
     
-    try:
-        generador_qr = crear_generador_qr(ARCA_CONFIG)  # ← Ya está correcto
-        info_qr = generador_qr.obtener_info_qr(factura)
-        qr_base64 = generador_qr.generar_qr_imagen(factura, tamaño=8) if info_qr['valido'] else None
-    except Exception as e:
-        print(f"⚠️ Error generando QR: {e}")
-        info_qr = {'valido': False, 'mensaje': f'Error al generar QR: {str(e)}'}
-        qr_base64 = None
+    respuesta = {
+        'success': True,
+        'estado': trabajo['estado'],
+        'total_filas': trabajo['total_filas'],
+        'filas_escritas': trabajo['filas_escritas'],
+        'error': trabajo['error']
+    }
+    if trabajo['estado'] == 'listo':
+        respuesta['descarga_url'] = url_for('descargar_exportacion_excel', trabajo_id=trabajo_id)
+        respuesta['nombre_archivo'] = trabajo['nombre_archivo']
     
-    return render_template('mostrar_qr.html', 
-                         factura=factura, 
-                         qr_info=info_qr,
-                         qr_image=qr_base64)
+    return jsonify(respuesta)
 
-# Ruta para validar datos QR
-@app.route('/validar_qr/<int:factura_id>')
-def validar_qr_factura(factura_id):
-    try:
-        # Método compatible con SQLAlchemy antiguo
-        factura = Factura.query.get_or_404(factura_id)
-        
-        try:
-            generador_qr = crear_generador_qr(ARCA_CONFIG)  # ← Ya está correcto
-            info_qr = generador_qr.obtener_info_qr(factura)
-            errores = generador_qr.validar_datos_qr(factura)
-        except Exception as e:
-            print(f"⚠️ Error con módulo QR: {e}")
-            info_qr = {'valido': False, 'mensaje': f'Error con módulo QR: {str(e)}'}
-            errores = [str(e)]
-        
-        return jsonify({
-            'factura_id': factura_id,
-            'numero': factura.numero,
-            'qr_valido': info_qr['valido'],
-            'qr_url': info_qr['url'] if info_qr['valido'] else None,
-            'errores': errores,
-            'datos_qr': info_qr.get('datos', {}),
-            'mensaje': info_qr['mensaje']
-        })
-        
-    except Exception as e:
-        return jsonify({
-            'error': f'Error validando QR: {str(e)}'
-        }), 500
 
+@app.route('/exportaciones_excel/<trabajo_id>/descargar')
+def descargar_exportacion_excel(trabajo_id):
+    """Descargar el Excel generado en segundo plano"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    trabajo = _obtener_exportacion_usuario(trabajo_id)
+    if not trabajo or trabajo['estado'] != 'listo' or not os.path.exists(trabajo['archivo']):
+        return jsonify({'success': False, 'error': 'Exportación no disponible'}), 404
+    
+    return send_file(
+        trabajo['archivo'],
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=trabajo['nombre_archivo']
+    )
 
+# ==================== REPORTE RÁPIDO DE TOP PRODUCTOS ====================
 
-@app.route('/api/estado_afip_rapido')
-def api_estado_afip_rapido():
-    """API para verificación rápida de AFIP"""
+@app.route('/api/top_productos_vendidos')
+def api_top_productos_vendidos():
+    """API para obtener top 10 productos más vendidos (últimos 30 días)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
     try:
-        estado = afip_monitor.verificar_rapido()
+        # Últimos 30 días
+        fecha_hasta = datetime.now()
+        fecha_desde = fecha_hasta - timedelta(days=30)
+        
+        # Query para top productos (resumen diario)
+        resultados = db.session.query(
+            Producto.codigo,
+            Producto.nombre,
+            func.sum(VentaDiariaProducto.cantidad).label('cantidad_vendida'),
+            func.sum(VentaDiariaProducto.subtotal).label('total_vendido')
+        ).join(
+            VentaDiariaProducto, Producto.id == VentaDiariaProducto.producto_id
+        ).filter(
+            and_(
+                VentaDiariaProducto.fecha >= fecha_desde.date(),
+                VentaDiariaProducto.fecha <= fecha_hasta.date(),
+                VentaDiariaProducto.estado == 'autorizada'
+            )
+        ).group_by(
+            Producto.id,
+            Producto.codigo,
+            Producto.nombre
+        ).order_by(
+            desc('cantidad_vendida')
+        ).limit(10).all()
+        
+        # Formatear respuesta
+        top_productos = []
+        for resultado in resultados:
+            top_productos.append({
+                'codigo': resultado.codigo,
+                'nombre': resultado.nombre,
+                'cantidad_vendida': int(resultado.cantidad_vendida),
+                'total_vendido': float(resultado.total_vendido)
+            })
+        
         return jsonify({
             'success': True,
-            'estado': estado
+            'productos': top_productos,
+            'periodo': '30 días'
         })
+        
     except Exception as e:
+        print(f"Error en top productos: {str(e)}")
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/test_afip')
-def test_afip():
-    """Test manual de conexión AFIP"""
+# ==================== DASHBOARD DE VENTAS PARA INCLUIR EN MAIN ====================
+
+# REEMPLAZA tu función api_dashboard_ventas() existente con esta versión mejorada:
+
+@app.route('/api/dashboard_ventas')
+def api_dashboard_ventas():
+    """API para dashboard de ventas (resumen del día) - VERSIÓN CORREGIDA"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        resultado_auth = arca_client.get_ticket_access()
+        print("🔍 Iniciando consulta dashboard ventas...")
         
-        return jsonify({
-            'success': resultado_auth,
-            'mensaje': "✅ Test AFIP exitoso" if resultado_auth else "❌ Test AFIP falló",
-            'estado': "success" if resultado_auth else "error",
-            'tiene_token': bool(arca_client.token),
-            'timestamp': datetime.now().isoformat()
-        })
+        # Obtener fecha actual
+        from datetime import date
+        hoy = date.today()
+        print(f"📅 Consultando ventas para: {hoy}")
         
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'mensaje': f"❌ Error en test: {str(e)}",
-            'estado': 'error'
-        }), 500
-
-
-# Agregar esta función en app.py para debug de WSFEv1
-
-# Versión simplificada sin verificación de sesión para debug
-##### http://localhost:5000/debug_afip_simple LLAMAR ESTA RUTA PARA VERIFICAR ARCA
-
-@app.route('/debug_afip_simple')
-def debug_afip_simple():
-    """Debug simple de AFIP sin verificación de sesión"""
-    try:
-        resultado = {
-            'timestamp': datetime.now().isoformat(),
-            'tests': {}
-        }
+        # CONSULTA 1: Datos básicos de ventas del día
+        # Rango semiabierto sobre la columna (usa el índice de fecha)
+        inicio_hoy, inicio_manana = rango_dia(hoy)
+        consulta_ventas = db.session.query(
+            func.count(Factura.id).label('num_facturas'),
+            func.coalesce(func.sum(Factura.total), 0).label('total_vendido')
+        ).filter(
+            Factura.fecha >= inicio_hoy,
+            Factura.fecha < inicio_manana
+        ).first()
         
-        print("🔍 INICIANDO DEBUG SIMPLE DE AFIP...")
+        print(f"📊 Consulta ventas básicas completada")
+        print(f"   Facturas: {consulta_ventas.num_facturas}")
+        print(f"   Total: ${consulta_ventas.total_vendido}")
         
-        # Test 1: Autenticación WSAA
-        print("1️⃣ Test autenticación WSAA...")
-        try:
-            auth_result = arca_client.get_ticket_access()
-            resultado['tests']['wsaa_auth'] = {
-                'success': auth_result,
-                'token_exists': bool(arca_client.token),
-                'message': 'Autenticación exitosa' if auth_result else 'Fallo en autenticación'
-            }
-        except Exception as e:
-            resultado['tests']['wsaa_auth'] = {
-                'success': False,
-                'error': str(e),
-                'message': 'Error en autenticación'
-            }
+        # CONSULTA 2: Total de unidades vendidas del día (resumen diario)
+        consulta_unidades = db.session.query(
+            func.coalesce(func.sum(VentaDiariaProducto.cantidad), 0).label('total_unidades')
+        ).filter(
+            VentaDiariaProducto.fecha == hoy
+        ).first()
         
-        # Test 2: Conectividad WSFEv1
-        print("2️⃣ Test conectividad WSFEv1...")
-        try:
-            import socket
-            from urllib.parse import urlparse
-            
-            wsfe_url = ARCA_CONFIG.WSFEv1_URL
-            parsed = urlparse(wsfe_url)
-            host = parsed.hostname
-            port = 443
-            
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(10)
-            connect_result = sock.connect_ex((host, port))
-            sock.close()
-            
-            resultado['tests']['wsfe_connectivity'] = {
-                'success': connect_result == 0,
-                'host': host,
-                'port': port,
-                'url': wsfe_url,
-                'message': 'Conectividad OK' if connect_result == 0 else f'No se puede conectar (código: {connect_result})'
-            }
-        except Exception as e:
-            resultado['tests']['wsfe_connectivity'] = {
-                'success': False,
-                'error': str(e),
-                'message': 'Error verificando conectividad'
-            }
+        print(f"📦 Unidades vendidas: {consulta_unidades.total_unidades}")
         
-        # Test 3: Solo si tenemos autenticación, probar FEDummy
-        if resultado['tests']['wsaa_auth']['success']:
-            print("3️⃣ Test FEDummy...")
-            try:
-                from zeep import Client
-                from zeep.transports import Transport
-                
-                session_afip = crear_session_afip()
-                transport = Transport(session=session_afip, timeout=30)
-                client = Client(ARCA_CONFIG.WSFEv1_URL, transport=transport)
-                
-                dummy_response = client.service.FEDummy()
-                
-                resultado['tests']['fe_dummy'] = {
-                    'success': True,
-                    'response': str(dummy_response),
-                    'message': 'FEDummy exitoso'
-                }
-            except Exception as e:
-                resultado['tests']['fe_dummy'] = {
-                    'success': False,
-                    'error': str(e),
-                    'message': 'Error en FEDummy'
-                }
+        # CONSULTA 3: Producto más vendido del día
+        consulta_top_producto = db.session.query(
+            Producto.codigo,
+            Producto.nombre,
+            func.sum(VentaDiariaProducto.cantidad).label('cantidad_vendida')
+        ).join(
+            VentaDiariaProducto, Producto.id == VentaDiariaProducto.producto_id
+        ).filter(
+            VentaDiariaProducto.fecha == hoy
+        ).group_by(
+            Producto.id,
+            Producto.codigo, 
+            Producto.nombre
+        ).order_by(
+            desc('cantidad_vendida')
+        ).first()
         
-        # Generar resumen
-        total_tests = len(resultado['tests'])
-        successful_tests = sum(1 for test in resultado['tests'].values() if test['success'])
+        if consulta_top_producto:
+            print(f"👑 Top producto: {consulta_top_producto.codigo} - {consulta_top_producto.nombre} ({consulta_top_producto.cantidad_vendida} unidades)")
+        else:
+            print("👑 No hay ventas de productos hoy")
         
-        resultado['summary'] = {
-            'total_tests': total_tests,
-            'successful_tests': successful_tests,
-            'success_rate': f"{(successful_tests/total_tests*100):.1f}%" if total_tests > 0 else "0%",
-            'overall_status': 'OK' if successful_tests == total_tests else 'PROBLEMAS'
+        # Preparar respuesta
+        response_data = {
+            'success': True,
+            'ventas_hoy': {
+                'num_facturas': int(consulta_ventas.num_facturas or 0),
+                'total_vendido': float(consulta_ventas.total_vendido or 0),
+                'unidades_vendidas': int(consulta_unidades.total_unidades or 0)
+            },
+            'producto_top_hoy': None
         }
         
-        return jsonify(resultado)
+        # Agregar producto top si existe
+        if consulta_top_producto:
+            response_data['producto_top_hoy'] = {
+                'codigo': consulta_top_producto.codigo,
+                'nombre': consulta_top_producto.nombre,
+                'cantidad': int(consulta_top_producto.cantidad_vendida)
+            }
+        
+        print(f"✅ Dashboard data preparada correctamente")
+        print(f"📤 Enviando respuesta: {response_data}")
+        
+        return jsonify(response_data)
         
     except Exception as e:
+        print(f"❌ Error en api_dashboard_ventas: {str(e)}")
+        import traceback
+        print(f"📋 Stack trace: {traceback.format_exc()}")
+        
+        # Devolver datos por defecto en caso de error
         return jsonify({
-            'success': False,
-            'error': f'Error general: {str(e)}',
-            'timestamp': datetime.now().isoformat()
-        }), 500
-
-
+            'success': True,
+            'ventas_hoy': {
+                'num_facturas': 0,
+                'total_vendido': 0.0,
+                'unidades_vendidas': 0
+            },
+            'producto_top_hoy': None,
+            'error_debug': str(e)
+        })
 
-@app.route('/reporte_medios_hoy')
-def reporte_medios_hoy():
-    """Reporte rápido de medios de pago del día actual"""
+# AGREGAR TAMBIÉN ESTA RUTA PARA DEBUG:
+@app.route('/debug/dashboard_data')
+def debug_dashboard_data():
+    """Endpoint para debugging del dashboard"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        fin_hoy = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999)
+        from datetime import date
+        hoy = date.today()
+        inicio_hoy, inicio_manana = rango_dia(hoy)
         
-        reporte = MedioPago.calcular_recaudacion_por_fecha(hoy, fin_hoy)
+        # Información de debug
+        debug_info = {
+            'fecha_hoy': str(hoy),
+            'total_facturas_bd': Factura.query.count(),
+            'total_productos_bd': Producto.query.count(),
+            'facturas_hoy': Factura.query.filter(
+                Factura.fecha >= inicio_hoy,
+                Factura.fecha < inicio_manana
+            ).count(),
+            'ultimas_facturas': []
+        }
+        
+        # Últimas 5 facturas para debug
+        ultimas_facturas = Factura.query.order_by(Factura.id.desc()).limit(5).all()
+        for factura in ultimas_facturas:
+            debug_info['ultimas_facturas'].append({
+                'id': factura.id,
+                'numero': factura.numero,
+                'total': float(factura.total),
+                'fecha': factura.fecha.strftime('%Y-%m-%d %H:%M:%S'),
+                'estado': factura.estado
+            })
+        
+        # Probar la consulta de dashboard
+        try:
+            dashboard_data = api_dashboard_ventas()
+            debug_info['dashboard_response'] = dashboard_data.get_json()
+        except Exception as e:
+            debug_info['dashboard_error'] = str(e)
         
         return jsonify({
             'success': True,
-            'reporte': reporte
+            'debug_info': debug_info
         })
         
     except Exception as e:
-        print(f"Error en reporte del día: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+# ==================== PASO 3: FUNCIÓN PARA MIGRAR DATOS EXISTENTES ====================
+
+def migrar_detalle_facturas_con_iva():
+    """Migrar detalles de facturas existentes para agregar IVA individual (por rangos de id)"""
+    try:
+        print("🔄 Iniciando migración de detalles con IVA...")
+        estado = backfills.ejecutar('iva_detalle', reiniciar=True)
+        print(f"✅ Migración completada: {estado['filas_actualizadas']} detalles actualizados")
+        return estado['filas_actualizadas']
+        
+    except Exception as e:
+        print(f"❌ Error en migración: {e}")
+        return 0
 
 
-@app.route('/medios_pago_factura/<int:factura_id>')
-def medios_pago_factura(factura_id):
-    """Obtener los medios de pago de una factura específica"""
+# ==================== PASO 4: FUNCIÓN PARA VERIFICAR IVA POR DETALLE ====================
+
+@app.route('/api/verificar_iva_detalle/<int:factura_id>')
+def verificar_iva_detalle(factura_id):
+    """Verificar que los detalles tengan IVA individual correcto"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
         factura = Factura.query.get_or_404(factura_id)
         
-        medios = [{
-            'medio_pago': mp.medio_pago,
-            'importe': float(mp.importe),
-            'fecha_registro': mp.fecha_registro.strftime('%Y-%m-%d %H:%M:%S')
-        } for mp in factura.medios_pago]
+        # IVA guardado y recalculado de todos los detalles en una sola consulta
+        porcentaje_producto = func.coalesce(Producto.iva, 21)
+        filas = db.session.query(
+            DetalleFactura.id,
+            Producto.nombre,
+            DetalleFactura.subtotal,
+            DetalleFactura.porcentaje_iva,
+            DetalleFactura.importe_iva,
+            porcentaje_producto.label('porcentaje_producto'),
+            func.round(DetalleFactura.subtotal * porcentaje_producto / 100, 2).label('iva_recalculado')
+        ).outerjoin(
+            Producto, Producto.id == DetalleFactura.producto_id
+        ).filter(
+            DetalleFactura.factura_id == factura_id
+        ).order_by(DetalleFactura.id).all()
+        
+        detalles_info = []
+        total_iva_calculado = 0
+        
+        for fila in filas:
+            iva_bd = float(fila.importe_iva) if fila.importe_iva else 0
+            iva_recalculado = float(fila.iva_recalculado or 0)
+            total_iva_calculado += iva_recalculado
+            
+            detalles_info.append({
+                'id': fila.id,
+                'producto': fila.nombre or 'Sin producto',
+                'subtotal': float(fila.subtotal),
+                'porcentaje_bd': float(fila.porcentaje_iva) if fila.porcentaje_iva else 0,
+                'porcentaje_producto': float(fila.porcentaje_producto),
+                'iva_bd': iva_bd,
+                'iva_recalculado': iva_recalculado,
+                'coincide': abs(iva_bd - iva_recalculado) < 0.01
+            })
+        
+        # Comparar con total de factura
+        iva_factura = float(factura.iva)
         
         return jsonify({
             'success': True,
             'factura_numero': factura.numero,
-            'total_factura': float(factura.total),
-            'medios_pago': medios
+            'iva_factura': iva_factura,
+            'iva_calculado_suma': round(total_iva_calculado, 2),
+            'total_coincide': abs(iva_factura - total_iva_calculado) < 0.01,
+            'detalles': detalles_info
         })
         
     except Exception as e:
-        print(f"Error obteniendo medios de pago: {e}")
-        return jsonify({'success': False, 'error': str(e)})
-
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-if __name__ == '__main__':
-    # Crear directorios necesarios
-    os.makedirs('cache', exist_ok=True)
-    os.makedirs('logs', exist_ok=True)
-    os.makedirs('certificados', exist_ok=True)
-    
-    print("🚀 Iniciando POS Argentina...")
-    print(f"📍 URL: http://localhost:5000")
-    print(f"🏢 CUIT: {ARCA_CONFIG.CUIT}")
-    print(f"🏪 Punto de Venta: {ARCA_CONFIG.PUNTO_VENTA}")
-    print(f"🔧 Ambiente: {'HOMOLOGACIÓN' if ARCA_CONFIG.USE_HOMOLOGACION else 'PRODUCCIÓN'}")
-    print(f"🖨️ Impresión: {'Disponible' if IMPRESION_DISPONIBLE else 'No disponible'}")
-    print(f"👤 Usuario: admin")
-    print(f"🔑 Contraseña: admin123")
-    print()
-    
-    with app.app_context():
-        create_tables()
-        
-        migrar_productos_sin_costo_margen()  # ← EJECUTAR UNA SOLA VEZ
 
-        # Limpiar datos problemáticos
-        print("🧹 Verificando integridad de datos...")
-        limpiar_facturas_duplicadas()
-        verificar_estado_facturas()
-    
-# AGREGAR esta función a tu app.py (después de la línea que dice @app.route('/medios_pago_factura/<int:factura_id>')):
+# ==================== PASO 5: RUTA PARA MIGRACIÓN MANUAL ====================
 
-@app.route('/api/reporte_medios_pago')
-def reporte_medios_pago():
-    """Generar reporte de medios de pago por fecha usando SQLAlchemy"""
+@app.route('/migrar_iva_detalles', methods=['POST'])
+def migrar_iva_detalles_endpoint():
+    """Endpoint para ejecutar migración de IVA en detalles (en segundo plano, por rangos de id)"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        # Obtener parámetros de fecha
-        fecha_desde = request.args.get('desde')
-        fecha_hasta = request.args.get('hasta')
-        
-        if not fecha_desde or not fecha_hasta:
-            return jsonify({
-                'success': False,
-                'error': 'Debe proporcionar fechas desde y hasta'
-            })
-        
-        # Convertir strings a datetime
-        try:
-            fecha_desde_dt = datetime.strptime(fecha_desde, '%Y-%m-%d')
-            fecha_hasta_dt = datetime.strptime(fecha_hasta, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-        except ValueError:
-            return jsonify({
-                'success': False,
-                'error': 'Formato de fecha inválido. Use YYYY-MM-DD'
-            })
-        
-        # Consulta usando SQLAlchemy
-        from sqlalchemy import func
-        
-        resultados = db.session.query(
-            MedioPago.medio_pago,
-            func.count(MedioPago.id).label('cantidad'),
-            func.sum(MedioPago.importe).label('total')
-        ).join(
-            Factura, MedioPago.factura_id == Factura.id
-        ).filter(
-            and_(
-                Factura.fecha >= fecha_desde_dt,
-                Factura.fecha <= fecha_hasta_dt
-            )
-        ).group_by(MedioPago.medio_pago).order_by(
-            func.sum(MedioPago.importe).desc()
-        ).all()
-        
-        # Formatear resultados
-        medios_pago = []
-        total_general = 0
-        
-        for medio, cantidad, total in resultados:
-            medios_pago.append({
-                'medio_pago': medio,
-                'cantidad': cantidad,
-                'total': float(total)
-            })
-            total_general += float(total)
+        if not backfills.iniciar_en_segundo_plano('iva_detalle', app, reiniciar=True):
+            return jsonify({'success': False, 'error': 'La migración ya está corriendo'}), 409
         
         return jsonify({
             'success': True,
-            'reporte': {
-                'medios_pago': medios_pago,
-                'fecha_desde': fecha_desde,
-                'fecha_hasta': fecha_hasta,
-                'total_general': total_general
-            }
-        })
+            'mensaje': 'Migración iniciada en segundo plano',
+            'estado_url': url_for('estado_backfill', nombre='iva_detalle')
+        }), 202
         
     except Exception as e:
-        print(f"Error en reporte_medios_pago: {e}")
         return jsonify({
             'success': False,
-            'error': f'Error interno del servidor: {str(e)}'
+            'error': f'Error en migración: {str(e)}'
         }), 500
 
-
-@app.route('/reporte_ventas')
-def reporte_ventas():
-    """Página principal del reporte de ventas"""
+@app.route('/importar_productos')
+def importar_productos_vista():
+    """Vista para importar productos desde Excel"""
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    return render_template('reporte_ventas.html')
-
+    return render_template('importar_productos.html')
 
-@app.route('/api/reporte_ventas_productos')
-def api_reporte_ventas_productos():
-    """API para generar reporte de ventas por producto - CORREGIDO PARA COMBOS"""
+@app.route('/api/importar_productos_lote', methods=['POST'])
+def importar_productos_lote():
+    """Importar un lote de productos desde Excel"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        # Obtener parámetros
-        fecha_desde = request.args.get('fecha_desde')
-        fecha_hasta = request.args.get('fecha_hasta')
-        categoria = request.args.get('categoria', '').strip()
-        orden = request.args.get('orden', 'cantidad_desc')
-        solo_con_ventas = request.args.get('solo_con_ventas', 'true').lower() == 'true'
-        
-        # Validar fechas
-        if not fecha_desde or not fecha_hasta:
-            return jsonify({
-                'success': False,
-                'error': 'Debe proporcionar fechas desde y hasta'
-            })
-        
-        try:
-            fecha_desde_dt = datetime.strptime(fecha_desde, '%Y-%m-%d')
-            fecha_hasta_dt = datetime.strptime(fecha_hasta, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-        except ValueError:
-            return jsonify({
-                'success': False,
-                'error': 'Formato de fecha inválido'
-            })
-        
-        # Validar rango de fechas (máximo 2 años)
-        if (fecha_hasta_dt - fecha_desde_dt).days > 730:
-            return jsonify({
-                'success': False,
-                'error': 'El rango de fechas no puede ser mayor a 2 años'
-            })
-        
-        print(f"📊 Generando reporte de ventas (CORREGIDO PARA COMBOS):")
-        print(f"   Período: {fecha_desde} a {fecha_hasta}")
-        print(f"   Categoría: {categoria or 'Todas'}")
-        print(f"   Orden: {orden}")
-        print(f"   Solo con ventas: {solo_con_ventas}")
-        
-        # ✅ QUERY CORREGIDA: Incluir cantidad_combo en el cálculo
-        query = db.session.query(
-            Producto.id,
-            Producto.codigo,
-            Producto.nombre,
-            Producto.descripcion,
-            Producto.categoria,
-            Producto.es_combo,
-            Producto.cantidad_combo,
-            # *** CLAVE: Multiplicar cantidad por cantidad_combo si es combo ***
-            func.sum(
-                case(
-                    (Producto.es_combo == True, DetalleFactura.cantidad * Producto.cantidad_combo),
-                    else_=DetalleFactura.cantidad
-                )
-            ).label('cantidad_real_vendida'),
-            func.sum(DetalleFactura.cantidad).label('unidades_combos_vendidas'),  # Para mostrar también combos vendidos
-            func.sum(DetalleFactura.subtotal).label('total_vendido'),
-            func.avg(DetalleFactura.precio_unitario).label('precio_promedio'),
-            func.max(Factura.fecha).label('ultima_venta'),
-            func.count(DetalleFactura.id).label('num_transacciones')
-        ).join(
-            DetalleFactura, Producto.id == DetalleFactura.producto_id
-        ).join(
-            Factura, DetalleFactura.factura_id == Factura.id
-        ).filter(
-            and_(
-                Factura.fecha >= fecha_desde_dt,
-                Factura.fecha <= fecha_hasta_dt
-                # Incluye TODAS las facturas (sin filtro de estado)
-            )
-        )
-        
-        print(f"✅ Query configurada con corrección para combos")
-        
-        # Filtrar por categoría si se especifica
-        if categoria:
-            query = query.filter(Producto.categoria == categoria)
-            print(f"   Filtro categoría aplicado: {categoria}")
-        
-        # Agrupar por producto
-        query = query.group_by(
-            Producto.id,
-            Producto.codigo,
-            Producto.nombre,
-            Producto.descripcion,
-            Producto.categoria,
-            Producto.es_combo,
-            Producto.cantidad_combo
-        )
-        
-        # *** APLICAR ORDENAMIENTO USANDO LA CANTIDAD REAL ***
-        if orden == 'cantidad_desc':
-            query = query.order_by(desc('cantidad_real_vendida'))
-        elif orden == 'cantidad_asc':
-            query = query.order_by(asc('cantidad_real_vendida'))
-        elif orden == 'total_desc':
-            query = query.order_by(desc('total_vendido'))
-        elif orden == 'total_asc':
-            query = query.order_by(asc('total_vendido'))
-        elif orden == 'codigo':
-            query = query.order_by(Producto.codigo)
-        elif orden == 'nombre':
-            query = query.order_by(Producto.nombre)
-        
-        print(f"   Ordenamiento aplicado: {orden} (usando cantidad real)")
-        
-        # Ejecutar query
-        print(f"🔍 Ejecutando consulta...")
-        resultados = query.all()
-        print(f"📋 Encontrados {len(resultados)} productos con ventas")
-        
-        # Consulta adicional: información de estados de facturas para debug
-        debug_estados = db.session.query(
-            Factura.estado,
-            func.count(Factura.id).label('cantidad'),
-            func.sum(Factura.total).label('total')
-        ).filter(
-            and_(
-                Factura.fecha >= fecha_desde_dt,
-                Factura.fecha <= fecha_hasta_dt
-            )
-        ).group_by(Factura.estado).all()
-        
-        estados_info = {}
-        for estado, cantidad, total in debug_estados:
-            estados_info[estado] = {
-                'cantidad': cantidad,
-                'total': float(total) if total else 0.0
-            }
-        
-        print(f"📊 Estados de facturas en el período:")
-        for estado, info in estados_info.items():
-            print(f"   {estado}: {info['cantidad']} facturas (${info['total']:.2f})")
+        data = request.json
+        productos = data.get('productos', [])
+        opciones = data.get('opciones', {})
         
-        # *** FORMATEAR RESULTADOS CON CANTIDAD REAL ***
-        productos = []
-        total_unidades_reales = 0
-        total_ventas = 0.0
+        print(f"📦 Procesando lote de {len(productos)} productos...")
         
-        for resultado in resultados:
-            # *** USAR CANTIDAD REAL (ya calculada en SQL) ***
-            cantidad_real = float(resultado.cantidad_real_vendida) if resultado.cantidad_real_vendida else 0.0
-            unidades_combos = int(resultado.unidades_combos_vendidas) if resultado.unidades_combos_vendidas else 0
-            total_producto = float(resultado.total_vendido) if resultado.total_vendido else 0.0
-            precio_promedio = float(resultado.precio_promedio) if resultado.precio_promedio else 0.0
-            
-            # *** INFORMACIÓN ADICIONAL PARA COMBOS ***
-            info_combo = ""
-            unidad_medida = "unidades"
-            
-            if resultado.es_combo and resultado.cantidad_combo:
-                cantidad_combo = float(resultado.cantidad_combo)
-                info_combo = f" ({unidades_combos} combos de {cantidad_combo:g} c/u)"
-                # Detectar unidad de medida basada en cantidad del combo
-                if cantidad_combo >= 1:
-                    if cantidad_combo == int(cantidad_combo):
-                        unidad_medida = "kg" if cantidad_combo >= 1 else "unidades"
-                    else:
-                        unidad_medida = "kg"
-                
-                print(f"📦 {resultado.codigo}: {unidades_combos} combos × {cantidad_combo:g} = {cantidad_real:g} {unidad_medida}")
-            
-            productos.append({
-                'id': resultado.id,
-                'codigo': resultado.codigo,
-                'nombre': resultado.nombre,
-                'descripcion': resultado.descripcion,
-                'categoria': resultado.categoria,
-                'es_combo': resultado.es_combo,
-                'cantidad_combo': float(resultado.cantidad_combo) if resultado.cantidad_combo else 1.0,
-                'cantidad_vendida': cantidad_real,  # *** CANTIDAD REAL ***
-                'unidades_combos_vendidas': unidades_combos,  # *** COMBOS VENDIDOS ***
-                'info_combo': info_combo,  # *** INFORMACIÓN ADICIONAL ***
-                'unidad_medida': unidad_medida,  # *** UNIDAD DE MEDIDA ***
-                'total_vendido': total_producto,
-                'precio_promedio': precio_promedio,
-                'ultima_venta': resultado.ultima_venta.isoformat() if resultado.ultima_venta else None,
-                'num_transacciones': int(resultado.num_transacciones) if resultado.num_transacciones else 0
-            })
-            
-            total_unidades_reales += cantidad_real
-            total_ventas += total_producto
-        
-        # *** RESUMEN CORREGIDO ***
-        resumen = {
-            'total_productos': len(productos),
-            'total_unidades_reales': total_unidades_reales,  # *** UNIDADES REALES ***
-            'total_ventas': total_ventas,
-            'promedio_por_producto': total_ventas / len(productos) if len(productos) > 0 else 0,
-            'fecha_desde': fecha_desde,
-            'fecha_hasta': fecha_hasta,
-            'categoria_filtro': categoria or 'Todas',
-            'incluye_todas_facturas': True,
-            'estados_facturas': estados_info,
-            'correccion_combos': True  # *** FLAG PARA INDICAR CORRECCIÓN ***
-        }
+        resultados = importador_productos.procesar(productos, opciones)
         
-        print(f"✅ Reporte generado exitosamente (CON CORRECCIÓN DE COMBOS):")
-        print(f"   Productos: {resumen['total_productos']}")
-        print(f"   Unidades REALES: {resumen['total_unidades_reales']:g}")
-        print(f"   Total: ${resumen['total_ventas']:.2f}")
-        print(f"   Incluye corrección de combos: SÍ")
+        print(f"✅ Lote completado: {resultados['nuevos']} nuevos, {resultados['actualizados']} actualizados, {resultados['sin_cambios']} sin cambios, {resultados['errores']} errores")
         
         return jsonify({
             'success': True,
-            'productos': productos,
-            'resumen': resumen,
-            'parametros': {
-                'fecha_desde': fecha_desde,
-                'fecha_hasta': fecha_hasta,
-                'categoria': categoria,
-                'orden': orden,
-                'solo_con_ventas': solo_con_ventas,
-                'incluye_todas_facturas': True,
-                'correccion_combos_aplicada': True
-            }
+            'message': 'Lote procesado correctamente',
+            'nuevos': resultados['nuevos'],
+            'actualizados': resultados['actualizados'],
+            'sin_cambios': resultados['sin_cambios'],
+            'errores': resultados['errores'],
+            'detalles_errores': resultados['detalles_errores'],
+            'productos_procesados': resultados['productos_procesados']  # NUEVO: Estados detallados
         })
         
     except Exception as e:
-        print(f"❌ Error en reporte de ventas: {str(e)}")
-        import traceback
-        print(f"📋 Stack trace: {traceback.format_exc()}")
+        db.session.rollback()
+        print(f"❌ Error en importación de lote: {str(e)}")
         return jsonify({
             'success': False,
-            'error': f'Error interno del servidor: {str(e)}'
+            'error': f'Error al procesar lote: {str(e)}'
         }), 500
 
 
-@app.route('/exportar_reporte_ventas')
-def exportar_reporte_ventas():
-    """Exportar reporte de ventas a Excel o CSV - CORREGIDO PARA COMBOS"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'No autorizado'}), 401
+def detectar_categoria(descripcion):
+    """Detectar categoría básica desde la descripción del producto"""
+    return obtener_clasificador_categorias().clasificar(descripcion)
+
+
+def clasificar_categorias(descripciones):
+    """Categorías de un lote de descripciones con una sola pasada del clasificador"""
+    return obtener_clasificador_categorias().clasificar_lote(descripciones)
+
+
+# ================== IMPORTACIÓN MASIVA DE PRODUCTOS ==================
+# Los lotes de la lista de precios se aplican con operaciones masivas, que no
+# pasan por los eventos del ORM: el registro de cambios del catálogo, el
+# descuento de los combos y la invalidación de caches se hacen acá.
+
+def _registrar_cambios_masivos_productos(ids_modificados, catalogo_modificado=False):
+    """Registro de cambios y avisos de invalidación para un UPDATE/INSERT masivo de productos"""
+    ids_modificados = list(ids_modificados)
+    
+    if ids_modificados:
+        ahora = datetime.now()
+        db.session.execute(
+            CatalogoCambio.__table__.insert(),
+            [{'entidad': 'producto', 'entidad_id': producto_id, 'fecha': ahora} for producto_id in ids_modificados]
+        )
+    
+    # Los mismos avisos que dejan los eventos after_flush, para invalidar al confirmar
+    if catalogo_modificado:
+        db.session.info['catalogo_modificado'] = True
+    db.session.info['datos_catalogo_modificados'] = True
+    db.session.info['productos_reportes_modificados'] = True
+
+
+def _al_importar_productos(ids_nuevos, ids_actualizados, ids_precio_modificado):
+    """Efectos de una importación masiva dentro de la misma transacción"""
+    _registrar_cambios_masivos_productos(list(ids_nuevos) + list(ids_actualizados), catalogo_modificado=bool(ids_nuevos))
+    
+    # Combos cuyo producto base cambió de precio o de costo: un UPDATE por tramo de ids
+    propagar_precios_combos(ids_precio_modificado)
+
+
+importador_productos = crear_importador_productos(
+    db, Producto, clasificar_categorias, al_aplicar=_al_importar_productos
+)
+
+
+# ================== REGLAS DE CATEGORÍAS Y RECATEGORIZACIÓN ==================
+
+CATEGORIAS_SIN_ASIGNAR = ('', CATEGORIA_DEFECTO)
+TAMANO_TRAMO_RECATEGORIZACION = 1000
+MAX_EJEMPLOS_RECATEGORIZACION = 100
+
+
+def recategorizar_productos(sobrescribir=False, simular=False):
+    """Volver a clasificar el catálogo con las reglas actuales.
     
-    try:
-        # Obtener parámetros (mismos que el reporte)
-        fecha_desde = request.args.get('fecha_desde')
-        fecha_hasta = request.args.get('fecha_hasta')
-        categoria = request.args.get('categoria', '').strip()
-        orden = request.args.get('orden', 'cantidad_desc')
-        formato = request.args.get('formato', 'csv')  # csv o excel
+    Sin sobrescribir solo se tocan los productos sin categoría o en la
+    categoría por defecto. Con sobrescribir se reclasifican todos, pero un
+    producto cuya descripción no coincide con ninguna regla conserva la suya.
+    Los productos se recorren por tramos de id y cada tramo se clasifica de
+    una vez y se escribe con un UPDATE por categoría.
+    """
+    clasificador = obtener_clasificador_categorias()
+    tabla = Producto.__table__
+    
+    resumen = {'revisados': 0, 'modificados': 0, 'por_categoria': {}, 'ejemplos': []}
+    ultimo_id = 0
+    
+    while True:
+        consulta = db.session.query(
+            Producto.id, Producto.codigo, Producto.nombre, Producto.descripcion, Producto.categoria
+        ).filter(Producto.id > ultimo_id)
         
-        # Validar fechas
-        fecha_desde_dt = datetime.strptime(fecha_desde, '%Y-%m-%d')
-        fecha_hasta_dt = datetime.strptime(fecha_hasta, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+        if not sobrescribir:
+            consulta = consulta.filter(or_(
+                Producto.categoria.is_(None),
+                Producto.categoria.in_(CATEGORIAS_SIN_ASIGNAR)
+            ))
         
-        print(f"📤 Exportando reporte a {formato.upper()}: {fecha_desde} a {fecha_hasta}")
+        filas = consulta.order_by(Producto.id).limit(TAMANO_TRAMO_RECATEGORIZACION).all()
+        if not filas:
+            break
+        ultimo_id = filas[-1].id
+        resumen['revisados'] += len(filas)
         
-        # *** QUERY CORREGIDA (MISMA DEL REPORTE) ***
-        query = db.session.query(
-            Producto.codigo,
-            Producto.nombre,
-            Producto.descripcion,
-            Producto.categoria,
-            Producto.es_combo,
-            Producto.cantidad_combo,
-            # *** CANTIDAD REAL CALCULADA ***
-            func.sum(
-                case(
-                    (Producto.es_combo == True, DetalleFactura.cantidad * Producto.cantidad_combo),
-                    else_=DetalleFactura.cantidad
-                )
-            ).label('cantidad_real_vendida'),
-            func.sum(DetalleFactura.cantidad).label('unidades_combos_vendidas'),
-            func.sum(DetalleFactura.subtotal).label('total_vendido'),
-            func.avg(DetalleFactura.precio_unitario).label('precio_promedio'),
-            func.max(Factura.fecha).label('ultima_venta'),
-            func.count(DetalleFactura.id).label('num_transacciones')
-        ).join(
-            DetalleFactura, Producto.id == DetalleFactura.producto_id
-        ).join(
-            Factura, DetalleFactura.factura_id == Factura.id
-        ).filter(
-            and_(
-                Factura.fecha >= fecha_desde_dt,
-                Factura.fecha <= fecha_hasta_dt
-                # *** SIN FILTRO DE ESTADO - Incluye todas las facturas ***
-            )
+        categorias = clasificador.clasificar_lote(
+            [fila.descripcion or fila.nombre for fila in filas], defecto=None
         )
         
-        if categoria:
-            query = query.filter(Producto.categoria == categoria)
+        ids_por_categoria = {}
+        for fila, categoria in zip(filas, categorias):
+            actual = (fila.categoria or '').strip()
+            if categoria is None:
+                if actual:
+                    continue
+                categoria = CATEGORIA_DEFECTO
+            if categoria == actual:
+                continue
+            
+            ids_por_categoria.setdefault(categoria, []).append(fila.id)
+            if len(resumen['ejemplos']) < MAX_EJEMPLOS_RECATEGORIZACION:
+                resumen['ejemplos'].append({
+                    'codigo': fila.codigo,
+                    'nombre': fila.nombre,
+                    'anterior': fila.categoria,
+                    'nueva': categoria
+                })
         
-        query = query.group_by(
-            Producto.id,
-            Producto.codigo,
-            Producto.nombre,
-            Producto.descripcion,
-            Producto.categoria,
-            Producto.es_combo,
-            Producto.cantidad_combo
-        )
+        if not ids_por_categoria:
+            continue
         
-        # *** ORDENAMIENTO USANDO CANTIDAD REAL ***
-        if orden == 'cantidad_desc':
-            query = query.order_by(desc('cantidad_real_vendida'))
-        elif orden == 'cantidad_asc':
-            query = query.order_by(asc('cantidad_real_vendida'))
-        elif orden == 'total_desc':
-            query = query.order_by(desc('total_vendido'))
-        elif orden == 'total_asc':
-            query = query.order_by(asc('total_vendido'))
-        elif orden == 'codigo':
-            query = query.order_by(Producto.codigo)
-        elif orden == 'nombre':
-            query = query.order_by(Producto.nombre)
-        
-        resultados = query.all()
-        print(f"📊 Exportando {len(resultados)} productos")
-        
-        # *** PREPARAR DATOS PARA EXPORTACIÓN CON INFORMACIÓN DE COMBOS ***
-        datos_exportacion = []
-        encabezados = [
-            'Código',
-            'Producto',
-            'Descripción',
-            'Categoría',
-            'Tipo',  # *** NUEVO: Producto Base / Combo
-            'Cantidad Real Vendida',  # *** CORREGIDO ***
-            'Unidades/Combos',  # *** NUEVO: Detalle de combos ***
-            'Precio Promedio',
-            'Total Vendido',
-            'Última Venta',
-            'Número de Transacciones'
-        ]
+        for categoria, ids in ids_por_categoria.items():
+            resumen['modificados'] += len(ids)
+            resumen['por_categoria'][categoria] = resumen['por_categoria'].get(categoria, 0) + len(ids)
         
-        # Agregar encabezados
-        datos_exportacion.append(encabezados)
+        if simular:
+            continue
         
-        # *** AGREGAR DATOS CON INFORMACIÓN DE COMBOS ***
-        for resultado in resultados:
-            # Calcular cantidad real y información de combo
-            cantidad_real = float(resultado.cantidad_real_vendida) if resultado.cantidad_real_vendida else 0.0
-            unidades_combos = int(resultado.unidades_combos_vendidas) if resultado.unidades_combos_vendidas else 0
-            
-            # Información del tipo de producto
-            if resultado.es_combo:
-                tipo_producto = "Combo/Oferta"
-                cantidad_combo = float(resultado.cantidad_combo) if resultado.cantidad_combo else 1.0
-                detalle_unidades = f"{unidades_combos} combos × {cantidad_combo:g} c/u"
-            else:
-                tipo_producto = "Producto Base"
-                detalle_unidades = f"{int(cantidad_real)} unidades"
-            
-            fila = [
-                resultado.codigo,
-                resultado.nombre,
-                resultado.descripcion or '',
-                resultado.categoria or 'Sin categoría',
-                tipo_producto,  # *** NUEVO ***
-                f"{cantidad_real:g}",  # *** CANTIDAD REAL ***
-                detalle_unidades,  # *** DETALLE ***
-                f"{float(resultado.precio_promedio):.2f}" if resultado.precio_promedio else "0.00",
-                f"{float(resultado.total_vendido):.2f}" if resultado.total_vendido else "0.00",
-                resultado.ultima_venta.strftime('%d/%m/%Y') if resultado.ultima_venta else 'N/A',
-                int(resultado.num_transacciones) if resultado.num_transacciones else 0
-            ]
-            datos_exportacion.append(fila)
+        try:
+            ahora = datetime.now()
+            for categoria, ids in ids_por_categoria.items():
+                db.session.execute(
+                    update(tabla)
+                    .where(tabla.c.id.in_(ids))
+                    .values(categoria=categoria, fecha_modificacion=ahora)
+                )
+            _registrar_cambios_masivos_productos(
+                [producto_id for ids in ids_por_categoria.values() for producto_id in ids]
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    return resumen
+
+
+@app.route('/api/reglas_categoria', methods=['GET'])
+def listar_reglas_categoria():
+    """Listar las reglas de categorías"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        reglas = ReglaCategoria.query.order_by(
+            ReglaCategoria.prioridad.desc(), ReglaCategoria.categoria, ReglaCategoria.palabra
+        ).all()
         
-        # Generar archivo según formato
-        if formato == 'excel':
-            return generar_excel_reporte(datos_exportacion, fecha_desde, fecha_hasta)
-        else:  # CSV por defecto
-            return generar_csv_reporte(datos_exportacion, fecha_desde, fecha_hasta)
+        return jsonify({
+            'success': True,
+            'reglas': [regla.to_dict() for regla in reglas],
+            'total': len(reglas)
+        })
         
     except Exception as e:
-        print(f"❌ Error exportando reporte: {str(e)}")
-        return jsonify({'error': f'Error al exportar: {str(e)}'}), 500
-        
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-def generar_csv_reporte(datos, fecha_desde, fecha_hasta):
-    """Generar archivo CSV del reporte"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Escribir encabezado del reporte
-    writer.writerow([f'Reporte de Ventas por Producto'])
-    writer.writerow([f'Período: {fecha_desde} al {fecha_hasta}'])
-    writer.writerow([f'Generado: {datetime.now().strftime("%d/%m/%Y %H:%M")}'])
-    writer.writerow([])  # Línea vacía
+
+def _datos_regla_categoria(data, regla=None):
+    """Validar los datos de una regla; devuelve (valores, error)"""
+    palabra = str(data.get('palabra', regla.palabra if regla else '')).strip().lower()
+    categoria = str(data.get('categoria', regla.categoria if regla else '')).strip().upper()
     
-    # Escribir datos
-    for fila in datos:
-        writer.writerow(fila)
+    if not palabra:
+        return None, 'La palabra clave es requerida'
+    if not categoria:
+        return None, 'La categoría es requerida'
     
-    # Crear respuesta
-    output.seek(0)
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = f'attachment; filename=reporte_ventas_{fecha_desde}_{fecha_hasta}.csv'
+    try:
+        prioridad = int(data.get('prioridad', regla.prioridad if regla else 0) or 0)
+    except (TypeError, ValueError):
+        return None, 'La prioridad debe ser un número entero'
     
-    return response
+    return {
+        'palabra': palabra[:100],
+        'categoria': categoria[:50],
+        'prioridad': prioridad,
+        'activo': bool(data.get('activo', regla.activo if regla else True))
+    }, None
+
 
-def generar_excel_reporte(datos, fecha_desde, fecha_hasta):
-    """Generar archivo Excel del reporte (requiere openpyxl)"""
+@app.route('/api/reglas_categoria', methods=['POST'])
+def crear_regla_categoria():
+    """Crear una regla de categoría"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
     try:
-        import openpyxl
-        from openpyxl.styles import Font, PatternFill, Alignment
-        from openpyxl.utils import get_column_letter
-        
-        # Crear workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Reporte de Ventas"
-        
-        # Estilos
-        titulo_font = Font(bold=True, size=16)
-        encabezado_font = Font(bold=True, size=12, color="FFFFFF")
-        encabezado_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        
-        # Título del reporte
-        ws['A1'] = f'Reporte de Ventas por Producto'
-        ws['A1'].font = titulo_font
-        ws['A2'] = f'Período: {fecha_desde} al {fecha_hasta}'
-        ws['A3'] = f'Generado: {datetime.now().strftime("%d/%m/%Y %H:%M")}'
-        
-        # Fila inicial para datos
-        fila_inicio = 5
-        
-        # Escribir encabezados
-        encabezados = datos[0]
-        for col, encabezado in enumerate(encabezados, 1):
-            celda = ws.cell(row=fila_inicio, column=col, value=encabezado)
-            celda.font = encabezado_font
-            celda.fill = encabezado_fill
-            celda.alignment = Alignment(horizontal='center')
-        
-        # Escribir datos
-        for fila_idx, fila_datos in enumerate(datos[1:], fila_inicio + 1):
-            for col_idx, valor in enumerate(fila_datos, 1):
-                ws.cell(row=fila_idx, column=col_idx, value=valor)
-        
-        # Ajustar ancho de columnas
-        for col in range(1, len(encabezados) + 1):
-            ws.column_dimensions[get_column_letter(col)].width = 15
-        
-        # Guardar en memoria
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
+        valores, error = _datos_regla_categoria(request.get_json() or {})
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        # Crear respuesta
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename=reporte_ventas_{fecha_desde}_{fecha_hasta}.xlsx'
+        regla = ReglaCategoria(**valores)
+        db.session.add(regla)
+        db.session.commit()
         
-        return response
+        return jsonify({'success': True, 'regla': regla.to_dict()})
         
-    except ImportError:
-        # Si no está instalado openpyxl, devolver CSV
-        return generar_csv_reporte(datos, fecha_desde, fecha_hasta)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Error al crear regla: {str(e)}'}), 500
 
-# ==================== REPORTE RÁPIDO DE TOP PRODUCTOS ====================
 
-@app.route('/api/top_productos_vendidos')
-def api_top_productos_vendidos():
-    """API para obtener top 10 productos más vendidos (últimos 30 días)"""
+@app.route('/api/reglas_categoria/<int:regla_id>', methods=['PUT'])
+def actualizar_regla_categoria(regla_id):
+    """Modificar una regla de categoría"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        # Últimos 30 días
-        fecha_hasta = datetime.now()
-        fecha_desde = fecha_hasta - timedelta(days=30)
+        regla = ReglaCategoria.query.get_or_404(regla_id)
+        valores, error = _datos_regla_categoria(request.get_json() or {}, regla)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        # Query para top productos
-        resultados = db.session.query(
-            Producto.codigo,
-            Producto.nombre,
-            func.sum(DetalleFactura.cantidad).label('cantidad_vendida'),
-            func.sum(DetalleFactura.subtotal).label('total_vendido')
-        ).join(
-            DetalleFactura, Producto.id == DetalleFactura.producto_id
-        ).join(
-            Factura, DetalleFactura.factura_id == Factura.id
-        ).filter(
-            and_(
-                Factura.fecha >= fecha_desde,
-                Factura.fecha <= fecha_hasta,
-                Factura.estado == 'autorizada'
-            )
-        ).group_by(
-            Producto.id,
-            Producto.codigo,
-            Producto.nombre
-        ).order_by(
-            desc('cantidad_vendida')
-        ).limit(10).all()
+        for campo, valor in valores.items():
+            setattr(regla, campo, valor)
+        db.session.commit()
         
-        # Formatear respuesta
-        top_productos = []
-        for resultado in resultados:
-            top_productos.append({
-                'codigo': resultado.codigo,
-                'nombre': resultado.nombre,
-                'cantidad_vendida': int(resultado.cantidad_vendida),
-                'total_vendido': float(resultado.total_vendido)
-            })
+        return jsonify({'success': True, 'regla': regla.to_dict()})
         
-        return jsonify({
-            'success': True,
-            'productos': top_productos,
-            'periodo': '30 días'
-        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Error al modificar regla: {str(e)}'}), 500
+
+
+@app.route('/api/reglas_categoria/<int:regla_id>', methods=['DELETE'])
+def eliminar_regla_categoria(regla_id):
+    """Eliminar una regla de categoría"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        regla = ReglaCategoria.query.get_or_404(regla_id)
+        db.session.delete(regla)
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Regla eliminada correctamente'})
         
     except Exception as e:
-        print(f"Error en top productos: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Error al eliminar regla: {str(e)}'}), 500
 
-# ==================== DASHBOARD DE VENTAS PARA INCLUIR EN MAIN ====================
 
-# REEMPLAZA tu función api_dashboard_ventas() existente con esta versión mejorada:
+@app.route('/api/clasificar_categoria', methods=['POST'])
+def probar_clasificacion_categoria():
+    """Categoría que asignan las reglas actuales a una o varias descripciones"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    data = request.get_json() or {}
+    descripciones = data.get('descripciones')
+    if descripciones is None:
+        descripciones = [data.get('descripcion', '')]
+    if not isinstance(descripciones, list):
+        return jsonify({'success': False, 'error': 'descripciones debe ser una lista'}), 400
+    
+    categorias = clasificar_categorias(descripciones)
+    return jsonify({
+        'success': True,
+        'resultados': [
+            {'descripcion': descripcion, 'categoria': categoria}
+            for descripcion, categoria in zip(descripciones, categorias)
+        ]
+    })
 
-@app.route('/api/dashboard_ventas')
-def api_dashboard_ventas():
-    """API para dashboard de ventas (resumen del día) - VERSIÓN CORREGIDA"""
+
+@app.route('/api/recategorizar_productos', methods=['POST'])
+def api_recategorizar_productos():
+    """Reclasificar el catálogo existente con las reglas actuales"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        print("🔍 Iniciando consulta dashboard ventas...")
-        
-        # Obtener fecha actual
-        from datetime import date
-        hoy = date.today()
-        print(f"📅 Consultando ventas para: {hoy}")
+        data = request.get_json(silent=True) or {}
+        simular = bool(data.get('simular', False))
+        resumen = recategorizar_productos(
+            sobrescribir=bool(data.get('sobrescribir', False)),
+            simular=simular
+        )
         
-        # CONSULTA 1: Datos básicos de ventas del día
-        # Usar DATE() para comparar solo la fecha, no hora
-        consulta_ventas = db.session.query(
-            func.count(Factura.id).label('num_facturas'),
-            func.coalesce(func.sum(Factura.total), 0).label('total_vendido')
-        ).filter(
-            func.date(Factura.fecha) == hoy
-        ).first()
+        accion = 'se modificarían' if simular else 'modificados'
+        print(f"🏷️ Recategorización: {resumen['revisados']} revisados, {resumen['modificados']} {accion}")
         
-        print(f"📊 Consulta ventas básicas completada")
-        print(f"   Facturas: {consulta_ventas.num_facturas}")
-        print(f"   Total: ${consulta_ventas.total_vendido}")
+        return jsonify({
+            'success': True,
+            'simulacion': simular,
+            'mensaje': f"{resumen['modificados']} de {resumen['revisados']} productos {accion}",
+            **resumen
+        })
         
-        # CONSULTA 2: Total de unidades vendidas del día
-        consulta_unidades = db.session.query(
-            func.coalesce(func.sum(DetalleFactura.cantidad), 0).label('total_unidades')
-        ).join(
-            Factura, DetalleFactura.factura_id == Factura.id
-        ).filter(
-            func.date(Factura.fecha) == hoy
-        ).first()
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Error en recategorización: {str(e)}'}), 500
+
+
+# ================== CAMBIOS DE PRECIO PROGRAMADOS ==================
+# Los aumentos se cargan con anticipación y un hilo en segundo plano los
+# aplica cuando entran en vigencia: todos los cambios vencidos en un solo
+# UPDATE sobre producto, los combos derivados en otro, una única fila en
+# catalogo_cambios y todo en la misma transacción.
+
+TAMANO_TRAMO_PRECIOS_PROGRAMADOS = 500
+
+_aplicador_precios = {'hilo': None, 'ultimo_error': None, 'ultima_aplicacion': None}
+_aplicador_precios_lock = threading.Lock()
+
+
+def _decimal_opcional(valor, campo):
+    """Decimal de un dato opcional del pedido (None si viene vacío)"""
+    if valor is None or valor == '':
+        return None
+    try:
+        numero = Decimal(str(valor))
+    except Exception:
+        raise ValueError(f'{campo} inválido')
+    if numero < 0:
+        raise ValueError(f'{campo} no puede ser negativo')
+    return numero
+
+
+def programar_cambios_precio(cambios, vigente_desde, lote=None, usuario_id=None):
+    """Validar y guardar cambios programados; devuelve (creados, errores)"""
+    ids = {c.get('producto_id') for c in cambios if c.get('producto_id')}
+    codigos = {str(c.get('codigo')).strip().upper() for c in cambios if not c.get('producto_id') and c.get('codigo')}
+    
+    # Productos referidos, con una consulta IN por tramo de ids y de códigos
+    productos_por_id = {}
+    productos_por_codigo = {}
+    columnas = (Producto.id, Producto.codigo, Producto.es_combo, Producto.costo)
+    for filtro, valores in ((Producto.id, list(ids)), (Producto.codigo, list(codigos))):
+        for inicio in range(0, len(valores), TAMANO_TRAMO_PRECIOS_PROGRAMADOS):
+            tramo = valores[inicio:inicio + TAMANO_TRAMO_PRECIOS_PROGRAMADOS]
+            for fila in db.session.query(*columnas).filter(filtro.in_(tramo)).all():
+                productos_por_id[fila.id] = fila
+                productos_por_codigo[fila.codigo.strip().upper()] = fila
+    
+    filas = []
+    errores = []
+    ahora = datetime.now()
+    for numero, cambio in enumerate(cambios, start=1):
+        referencia = cambio.get('producto_id') or cambio.get('codigo') or f'fila {numero}'
+        try:
+            if cambio.get('producto_id'):
+                producto = productos_por_id.get(cambio.get('producto_id'))
+            else:
+                producto = productos_por_codigo.get(str(cambio.get('codigo') or '').strip().upper())
+            if producto is None:
+                raise ValueError('Producto no encontrado')
+            
+            nuevo_costo = _decimal_opcional(cambio.get('nuevo_costo'), 'Costo')
+            nuevo_margen = _decimal_opcional(cambio.get('nuevo_margen'), 'Margen')
+            nuevo_precio = _decimal_opcional(cambio.get('nuevo_precio'), 'Precio')
+            
+            if nuevo_costo is None and nuevo_margen is None and nuevo_precio is None:
+                raise ValueError('Debe indicar nuevo costo, margen o precio')
+            if producto.es_combo and (nuevo_costo is not None or nuevo_margen is not None):
+                raise ValueError('Los combos solo admiten nuevo precio (el costo sale del producto base)')
+            if nuevo_precio is None and not (nuevo_costo or producto.costo):
+                raise ValueError('Sin costo para calcular el precio')
+            if nuevo_precio is not None and nuevo_precio == 0:
+                raise ValueError('El precio debe ser mayor a 0')
+            
+            filas.append({
+                'producto_id': producto.id,
+                'nuevo_costo': nuevo_costo,
+                'nuevo_margen': nuevo_margen,
+                'nuevo_precio': nuevo_precio,
+                'vigente_desde': vigente_desde,
+                'lote': lote,
+                'estado': 'pendiente',
+                'usuario_id': usuario_id,
+                'fecha_creacion': ahora
+            })
+        except ValueError as e:
+            errores.append({'referencia': referencia, 'error': str(e)})
+    
+    if filas:
+        try:
+            db.session.execute(CambioPrecioProgramado.__table__.insert(), filas)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    return len(filas), errores
+
+
+def aplicar_cambios_precio_vencidos(hasta=None):
+    """Aplicar de una vez todos los cambios pendientes con vigencia hasta 'hasta' (ahora).
+    
+    Si un producto tiene varios cambios vencidos se aplica el de vigencia más
+    reciente y los demás quedan como reemplazados. Devuelve la cantidad de
+    productos modificados.
+    """
+    hasta = hasta or datetime.now()
+    ahora = datetime.now()
+    aplicacion = uuid.uuid4().hex
+    cambios = CambioPrecioProgramado.__table__
+    tabla = Producto.__table__
+    
+    try:
+        # 1) Tomar los cambios vencidos (otro proceso que llegue a la vez no los ve)
+        tomados = db.session.execute(
+            update(cambios)
+            .where(
+                cambios.c.estado == 'pendiente',
+                cambios.c.aplicacion.is_(None),
+                cambios.c.vigente_desde <= hasta
+            )
+            .values(aplicacion=aplicacion)
+        ).rowcount
         
-        print(f"📦 Unidades vendidas: {consulta_unidades.total_unidades}")
+        if not tomados:
+            db.session.rollback()
+            return 0
         
-        # CONSULTA 3: Producto más vendido del día
-        consulta_top_producto = db.session.query(
-            Producto.codigo,
-            Producto.nombre,
-            func.sum(DetalleFactura.cantidad).label('cantidad_vendida')
-        ).join(
-            DetalleFactura, Producto.id == DetalleFactura.producto_id
-        ).join(
-            Factura, DetalleFactura.factura_id == Factura.id
+        # 2) Un solo cambio por producto: el de vigencia más reciente
+        filas = db.session.query(
+            CambioPrecioProgramado.id, CambioPrecioProgramado.producto_id
         ).filter(
-            func.date(Factura.fecha) == hoy
-        ).group_by(
-            Producto.id,
-            Producto.codigo, 
-            Producto.nombre
+            CambioPrecioProgramado.aplicacion == aplicacion
         ).order_by(
-            desc('cantidad_vendida')
-        ).first()
+            CambioPrecioProgramado.vigente_desde, CambioPrecioProgramado.id
+        ).all()
         
-        if consulta_top_producto:
-            print(f"👑 Top producto: {consulta_top_producto.codigo} - {consulta_top_producto.nombre} ({consulta_top_producto.cantidad_vendida} unidades)")
-        else:
-            print("👑 No hay ventas de productos hoy")
+        elegido = {}
+        for fila in filas:
+            elegido[fila.producto_id] = fila.id
+        ids_elegidos = set(elegido.values())
+        reemplazados = [fila.id for fila in filas if fila.id not in ids_elegidos]
+        for inicio in range(0, len(reemplazados), TAMANO_TRAMO_PRECIOS_PROGRAMADOS):
+            db.session.execute(
+                update(cambios)
+                .where(cambios.c.id.in_(reemplazados[inicio:inicio + TAMANO_TRAMO_PRECIOS_PROGRAMADOS]))
+                .values(estado='reemplazado', fecha_aplicacion=ahora)
+            )
         
-        # Preparar respuesta
-        response_data = {
-            'success': True,
-            'ventas_hoy': {
-                'num_facturas': int(consulta_ventas.num_facturas or 0),
-                'total_vendido': float(consulta_ventas.total_vendido or 0),
-                'unidades_vendidas': int(consulta_unidades.total_unidades or 0)
-            },
-            'producto_top_hoy': None
-        }
+        vigentes = and_(
+            cambios.c.aplicacion == aplicacion,
+            cambios.c.estado == 'pendiente'
+        )
         
-        # Agregar producto top si existe
-        if consulta_top_producto:
-            response_data['producto_top_hoy'] = {
-                'codigo': consulta_top_producto.codigo,
-                'nombre': consulta_top_producto.nombre,
-                'cantidad': int(consulta_top_producto.cantidad_vendida)
-            }
+        # 3) Guardar el precio anterior de cada producto
+        db.session.execute(
+            update(cambios)
+            .where(cambios.c.producto_id == tabla.c.id, vigentes)
+            .values(precio_anterior=tabla.c.precio)
+        )
         
-        print(f"✅ Dashboard data preparada correctamente")
-        print(f"📤 Enviando respuesta: {response_data}")
+        # 4) Todos los productos en un solo UPDATE: el precio indicado o costo * (1 + margen)
+        costo = func.coalesce(cambios.c.nuevo_costo, tabla.c.costo)
+        margen = func.coalesce(cambios.c.nuevo_margen, tabla.c.margen, 0)
+        db.session.execute(
+            update(tabla)
+            .where(tabla.c.id == cambios.c.producto_id, vigentes)
+            .values(
+                costo=costo,
+                margen=margen,
+                precio=func.coalesce(
+                    cambios.c.nuevo_precio,
+                    case((costo > 0, func.round(costo * (1 + margen / 100), 2)), else_=tabla.c.precio)
+                ),
+                fecha_modificacion=ahora
+            )
+        )
         
-        return jsonify(response_data)
+        # 5) Combos derivados de los productos modificados, según la política de
+        # combos; los combos con precio programado propio conservan ese precio y
+        # solo se les recalcula el descuento
+        modificados = select(cambios.c.producto_id).where(vigentes)
+        ids_modificados = [producto_id for (producto_id,) in db.session.execute(modificados).all()]
+        propagar_precios_combos(ids_modificados, excluir=modificados)
+        
+        base = tabla.alias('base')
+        db.session.execute(
+            update(tabla)
+            .where(
+                tabla.c.producto_base_id == base.c.id,
+                tabla.c.es_combo == True,
+                tabla.c.id.in_(modificados)
+            )
+            .values(
+                precio_unitario_base=base.c.precio,
+                descuento_porcentaje=_expresion_descuento_combo(tabla, base.c.precio),
+                fecha_modificacion=ahora
+            )
+        )
         
-    except Exception as e:
-        print(f"❌ Error en api_dashboard_ventas: {str(e)}")
-        import traceback
-        print(f"📋 Stack trace: {traceback.format_exc()}")
+        # 6) Cerrar los cambios y subir la versión del catálogo una sola vez (la
+        # caja recibe los productos por fecha_modificacion en el delta)
+        aplicados = db.session.execute(
+            update(cambios)
+            .where(vigentes)
+            .values(estado='aplicado', fecha_aplicacion=ahora)
+        ).rowcount
         
-        # Devolver datos por defecto en caso de error
-        return jsonify({
-            'success': True,
-            'ventas_hoy': {
-                'num_facturas': 0,
-                'total_vendido': 0.0,
-                'unidades_vendidas': 0
-            },
-            'producto_top_hoy': None,
-            'error_debug': str(e)
-        })
+        _registrar_actualizacion_masiva_productos('precios_programados', ahora)
+        db.session.commit()
+        
+        print(f"💲 Cambios de precio programados aplicados: {aplicados} productos ({len(reemplazados)} reemplazados)")
+        return aplicados
+        
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _aplicar_precios_en_segundo_plano(intervalo):
+    """Buscar cambios vencidos cada 'intervalo' segundos"""
+    import time
+    while True:
+        with app.app_context():
+            try:
+                if aplicar_cambios_precio_vencidos():
+                    _aplicador_precios['ultima_aplicacion'] = datetime.now()
+                _aplicador_precios['ultimo_error'] = None
+            except Exception as e:
+                _aplicador_precios['ultimo_error'] = str(e)
+                print(f"❌ Error aplicando cambios de precio programados: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(intervalo)
+
+
+@app.before_request
+def _iniciar_aplicador_precios():
+    """Arrancar el aplicador de cambios programados con el primer request del proceso"""
+    hilo = _aplicador_precios['hilo']
+    if hilo is not None and hilo.is_alive():
+        return
+    
+    with _aplicador_precios_lock:
+        hilo = _aplicador_precios['hilo']
+        if hilo is None or not hilo.is_alive():
+            hilo = threading.Thread(
+                target=_aplicar_precios_en_segundo_plano,
+                args=(app.config.get('PRECIOS_PROGRAMADOS_INTERVALO', 60),),
+                daemon=True
+            )
+            _aplicador_precios['hilo'] = hilo
+            hilo.start()
 
-# AGREGAR TAMBIÉN ESTA RUTA PARA DEBUG:
-@app.route('/debug/dashboard_data')
-def debug_dashboard_data():
-    """Endpoint para debugging del dashboard"""
+
+@app.route('/api/precios_programados', methods=['GET'])
+def listar_precios_programados():
+    """Listar cambios de precio programados (por estado y lote)"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        from datetime import date
-        hoy = date.today()
-        
-        # Información de debug
-        debug_info = {
-            'fecha_hoy': str(hoy),
-            'total_facturas_bd': Factura.query.count(),
-            'total_productos_bd': Producto.query.count(),
-            'facturas_hoy': Factura.query.filter(func.date(Factura.fecha) == hoy).count(),
-            'ultimas_facturas': []
-        }
+        estado = request.args.get('estado', 'pendiente')
+        lote = request.args.get('lote')
+        limite = min(request.args.get('limite', 200, type=int), 1000)
         
-        # Últimas 5 facturas para debug
-        ultimas_facturas = Factura.query.order_by(Factura.id.desc()).limit(5).all()
-        for factura in ultimas_facturas:
-            debug_info['ultimas_facturas'].append({
-                'id': factura.id,
-                'numero': factura.numero,
-                'total': float(factura.total),
-                'fecha': factura.fecha.strftime('%Y-%m-%d %H:%M:%S'),
-                'estado': factura.estado
-            })
+        consulta = CambioPrecioProgramado.query.options(joinedload(CambioPrecioProgramado.producto))
+        if estado:
+            consulta = consulta.filter(CambioPrecioProgramado.estado == estado)
+        if lote:
+            consulta = consulta.filter(CambioPrecioProgramado.lote == lote)
         
-        # Probar la consulta de dashboard
-        try:
-            dashboard_data = api_dashboard_ventas()
-            debug_info['dashboard_response'] = dashboard_data.get_json()
-        except Exception as e:
-            debug_info['dashboard_error'] = str(e)
+        total = consulta.count()
+        cambios = consulta.order_by(
+            CambioPrecioProgramado.vigente_desde, CambioPrecioProgramado.id
+        ).limit(limite).all()
         
         return jsonify({
             'success': True,
-            'debug_info': debug_info
+            'cambios': [cambio.to_dict() for cambio in cambios],
+            'total': total,
+            'ultima_aplicacion': _aplicador_precios['ultima_aplicacion'].isoformat() if _aplicador_precios['ultima_aplicacion'] else None,
+            'ultimo_error': _aplicador_precios['ultimo_error']
         })
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# ==================== PASO 3: FUNCIÓN PARA MIGRAR DATOS EXISTENTES ====================
 
-def migrar_detalle_facturas_con_iva():
-    """Migrar detalles de facturas existentes para agregar IVA individual"""
+@app.route('/api/precios_programados', methods=['POST'])
+def crear_precios_programados():
+    """Programar cambios de precio: {vigente_desde, lote, cambios: [{producto_id|codigo, nuevo_costo, nuevo_margen, nuevo_precio}]}"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
     try:
-        print("🔄 Iniciando migración de detalles con IVA...")
+        data = request.get_json() or {}
+        cambios = data.get('cambios') or []
+        if not isinstance(cambios, list) or not cambios:
+            return jsonify({'success': False, 'error': 'No se recibieron cambios'}), 400
         
-        # Buscar detalles sin porcentaje_iva o importe_iva
-        detalles_sin_iva = DetalleFactura.query.filter(
-            or_(
-                DetalleFactura.porcentaje_iva.is_(None),
-                DetalleFactura.importe_iva.is_(None),
-                DetalleFactura.porcentaje_iva == 0
-            )
-        ).all()
+        try:
+            vigente_desde = datetime.fromisoformat(str(data.get('vigente_desde', '')))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'vigente_desde inválida (formato AAAA-MM-DDTHH:MM)'}), 400
         
-        print(f"📋 Encontrados {len(detalles_sin_iva)} detalles para migrar")
+        lote = (data.get('lote') or '').strip()[:50] or None
+        creados, errores = programar_cambios_precio(cambios, vigente_desde, lote, session.get('user_id'))
         
-        contador_migrados = 0
+        return jsonify({
+            'success': creados > 0,
+            'creados': creados,
+            'errores': len(errores),
+            'detalles_errores': errores[:MAX_ERRORES_IMPORTACION],
+            'vigente_desde': vigente_desde.isoformat(),
+            'lote': lote
+        })
         
-        for detalle in detalles_sin_iva:
-            try:
-                # Obtener porcentaje de IVA del producto
-                if detalle.producto:
-                    porcentaje_iva = float(detalle.producto.iva)
-                else:
-                    porcentaje_iva = 21.0  # Por defecto
-                
-                # Calcular importe de IVA
-                subtotal = float(detalle.subtotal)
-                importe_iva = round((subtotal * porcentaje_iva / 100), 2)
-                
-                # Actualizar campos
-                detalle.porcentaje_iva = Decimal(str(porcentaje_iva))
-                detalle.importe_iva = Decimal(str(importe_iva))
-                
-                contador_migrados += 1
-                
-                if contador_migrados % 50 == 0:
-                    print(f"   📊 Migrados {contador_migrados}/{len(detalles_sin_iva)}")
-                
-            except Exception as e:
-                print(f"⚠️ Error migrando detalle ID {detalle.id}: {e}")
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Error programando cambios: {str(e)}'}), 500
+
+
+@app.route('/api/precios_programados/cancelar', methods=['POST'])
+def cancelar_precios_programados():
+    """Cancelar cambios pendientes por ids o por lote"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        data = request.get_json() or {}
+        ids = data.get('ids') or []
+        lote = data.get('lote')
+        if not ids and not lote:
+            return jsonify({'success': False, 'error': 'Debe indicar ids o lote'}), 400
+        
+        cambios = CambioPrecioProgramado.__table__
+        condicion = cambios.c.id.in_(ids) if ids else cambios.c.lote == lote
+        cancelados = db.session.execute(
+            update(cambios)
+            .where(condicion, cambios.c.estado == 'pendiente', cambios.c.aplicacion.is_(None))
+            .values(estado='cancelado')
+        ).rowcount
+        db.session.commit()
         
-        # Guardar cambios
-        if contador_migrados > 0:
-            db.session.commit()
-            print(f"✅ Migración completada: {contador_migrados} detalles actualizados")
-        else:
-            print("✅ No hay detalles para migrar")
-            
-        return contador_migrados
+        return jsonify({'success': True, 'cancelados': cancelados})
         
     except Exception as e:
-        print(f"❌ Error en migración: {e}")
         db.session.rollback()
-        return 0
-
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-# ==================== PASO 4: FUNCIÓN PARA VERIFICAR IVA POR DETALLE ====================
 
-@app.route('/api/verificar_iva_detalle/<int:factura_id>')
-def verificar_iva_detalle(factura_id):
-    """Verificar que los detalles tengan IVA individual correcto"""
+@app.route('/api/precios_programados/aplicar', methods=['POST'])
+def aplicar_precios_programados():
+    """Aplicar ahora los cambios que ya entraron en vigencia (sin esperar al hilo)"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        factura = Factura.query.get_or_404(factura_id)
+        aplicados = aplicar_cambios_precio_vencidos()
+        if aplicados:
+            _aplicador_precios['ultima_aplicacion'] = datetime.now()
+        return jsonify({'success': True, 'aplicados': aplicados})
         
-        detalles_info = []
-        total_iva_calculado = 0
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Error aplicando cambios: {str(e)}'}), 500
+
+
+# ================== IMPORTACIÓN DE LISTAS DE PRECIOS EN SEGUNDO PLANO ==================
+# El .xlsx se sube una sola vez y se lee en el servidor fila por fila; las
+# filas se aplican por tramos con el importador masivo y la página consulta el
+# avance del trabajo.
+
+DIRECTORIO_IMPORTACIONES = os.path.join(tempfile.gettempdir(), 'pos_importaciones')
+VIGENCIA_IMPORTACIONES = timedelta(hours=1)
+TAMANO_TRAMO_IMPORTACION = 1000
+MAX_ERRORES_IMPORTACION = 500
+
+_importaciones_productos = {}
+_importaciones_lock = threading.Lock()
+
+
+def _limpiar_importaciones_vencidas():
+    """Olvidar los trabajos terminados que superaron la vigencia"""
+    limite = datetime.now() - VIGENCIA_IMPORTACIONES
+    with _importaciones_lock:
+        vencidos = [
+            trabajo_id for trabajo_id, trabajo in _importaciones_productos.items()
+            if trabajo['estado'] != 'procesando' and trabajo['creado'] < limite
+        ]
+        for trabajo_id in vencidos:
+            del _importaciones_productos[trabajo_id]
+
+
+def _actualizar_importacion(trabajo_id, **cambios):
+    with _importaciones_lock:
+        _importaciones_productos[trabajo_id].update(cambios)
+
+
+def _acumular_importacion(trabajo_id, resultados, **cambios):
+    """Sumar el resultado de un tramo al progreso del trabajo"""
+    with _importaciones_lock:
+        trabajo = _importaciones_productos[trabajo_id]
+        trabajo.update(cambios)
+        for clave in ('nuevos', 'actualizados', 'sin_cambios', 'errores'):
+            trabajo[clave] += resultados.get(clave, 0)
+        espacio = MAX_ERRORES_IMPORTACION - len(trabajo['detalles_errores'])
+        if espacio > 0:
+            trabajo['detalles_errores'].extend(resultados['detalles_errores'][:espacio])
+
+
+def _filas_lista_precios(trabajo_id, lector, contadores):
+    """Filas de productos de la lista (sin omitidas ni códigos repetidos), informando el avance"""
+    codigos_vistos = set()
+    
+    for numero, datos, error in lector.filas():
+        contadores['filas_leidas'] = numero
+        if numero % TAMANO_TRAMO_IMPORTACION == 0:
+            _actualizar_importacion(trabajo_id, **contadores)
         
-        for detalle in factura.detalles:
-            # IVA guardado en BD
-            iva_bd = float(detalle.importe_iva) if detalle.importe_iva else 0
-            porcentaje_bd = float(detalle.porcentaje_iva) if detalle.porcentaje_iva else 0
-            
-            # IVA recalculado
-            subtotal = float(detalle.subtotal)
-            porcentaje_producto = float(detalle.producto.iva) if detalle.producto else 21.0
-            iva_recalculado = round((subtotal * porcentaje_producto / 100), 2)
-            
-            total_iva_calculado += iva_recalculado
+        if error:
+            _acumular_importacion(trabajo_id, {
+                'errores': 1,
+                'detalles_errores': [{'error': f'Fila {numero}: {error}', 'codigo': None}]
+            })
+        elif datos is None:
+            contadores['omitidas'] += 1
+        else:
+            # Igual que en el navegador: un código repetido en la lista se omite
+            codigo = datos['codigo'].strip().upper()
+            if codigo in codigos_vistos:
+                contadores['duplicados'] += 1
+            else:
+                codigos_vistos.add(codigo)
+                yield datos
+
+
+def _importar_lista_en_segundo_plano(trabajo_id, ruta, opciones, simulacion=False):
+    """Hilo que lee la lista de precios y la aplica por tramos (o solo la compara)"""
+    with app.app_context():
+        try:
+            lector = crear_lector_lista_precios(
+                ruta,
+                app.config.get('IMPORTACION_ALIAS_COLUMNAS'),
+                app.config.get('IMPORTACION_UNIDAD_MARGEN')
+            )
+            _actualizar_importacion(trabajo_id, total_filas=lector.total_filas)
             
-            detalle_info = {
-                'id': detalle.id,
-                'producto': detalle.producto.nombre if detalle.producto else 'Sin producto',
-                'subtotal': subtotal,
-                'porcentaje_bd': porcentaje_bd,
-                'porcentaje_producto': porcentaje_producto,
-                'iva_bd': iva_bd,
-                'iva_recalculado': iva_recalculado,
-                'coincide': abs(iva_bd - iva_recalculado) < 0.01
-            }
+            contadores = {'filas_leidas': 0, 'omitidas': 0, 'duplicados': 0}
+            filas = _filas_lista_precios(trabajo_id, lector, contadores)
             
-            detalles_info.append(detalle_info)
-        
-        # Comparar con total de factura
-        iva_factura = float(factura.iva)
-        
-        return jsonify({
-            'success': True,
-            'factura_numero': factura.numero,
-            'iva_factura': iva_factura,
-            'iva_calculado_suma': round(total_iva_calculado, 2),
-            'total_coincide': abs(iva_factura - total_iva_calculado) < 0.01,
-            'detalles': detalles_info
-        })
-        
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+            if simulacion:
+                comparacion = importador_productos.comparar(filas, opciones)
+                _actualizar_importacion(trabajo_id, **comparacion)
+            else:
+                tramo = []
+                for datos in filas:
+                    tramo.append(datos)
+                    if len(tramo) >= TAMANO_TRAMO_IMPORTACION:
+                        _acumular_importacion(trabajo_id, importador_productos.procesar(tramo, opciones))
+                        tramo = []
+                if tramo:
+                    _acumular_importacion(trabajo_id, importador_productos.procesar(tramo, opciones))
+            
+            _actualizar_importacion(trabajo_id, estado='listo', **contadores)
+            print(f"✅ Importación de lista {trabajo_id} terminada: {contadores['filas_leidas']} filas leídas")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error en importación de lista {trabajo_id}: {e}")
+            _actualizar_importacion(trabajo_id, estado='error', error=str(e))
+        finally:
+            db.session.remove()
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+
+def _registrar_importacion(nombre_archivo, simulacion):
+    """Crear el registro de avance de un trabajo de importación"""
+    _limpiar_importaciones_vencidas()
+    trabajo = {
+        'id': uuid.uuid4().hex,
+        'usuario_id': session.get('user_id'),
+        'modo': 'simulacion' if simulacion else 'importacion',
+        'estado': 'procesando',
+        'nombre_archivo': nombre_archivo,
+        'total_filas': None,
+        'filas_leidas': 0,
+        'nuevos': 0,
+        'actualizados': 0,
+        'sin_cambios': 0,
+        'errores': 0,
+        'omitidas': 0,
+        'duplicados': 0,
+        'detalles_errores': [],
+        'resumen': None,
+        'diferencias': None,
+        'error': None,
+        'creado': datetime.now()
+    }
+    with _importaciones_lock:
+        _importaciones_productos[trabajo['id']] = trabajo
+    return trabajo
 
 
-# ==================== PASO 5: RUTA PARA MIGRACIÓN MANUAL ====================
+def _obtener_importacion_usuario(trabajo_id):
+    """Trabajo de importación si existe y pertenece al usuario de la sesión"""
+    with _importaciones_lock:
+        trabajo = _importaciones_productos.get(trabajo_id)
+        if not trabajo or trabajo['usuario_id'] != session.get('user_id'):
+            return None
+        return dict(trabajo, detalles_errores=list(trabajo['detalles_errores']))
 
-@app.route('/migrar_iva_detalles', methods=['POST'])
-def migrar_iva_detalles_endpoint():
-    """Endpoint para ejecutar migración de IVA en detalles"""
+
+@app.route('/api/importar_lista_precios', methods=['POST'])
+def importar_lista_precios():
+    """Subir una lista de precios .xlsx y procesarla (o simularla) en segundo plano"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        return jsonify({'success': False, 'error': 'No se recibió ningún archivo'}), 400
+    if not archivo.filename.lower().endswith('.xlsx'):
+        return jsonify({'success': False, 'error': 'Solo se pueden procesar en el servidor archivos .xlsx'}), 400
+    
     try:
-        contador = migrar_detalle_facturas_con_iva()
+        os.makedirs(DIRECTORIO_IMPORTACIONES, exist_ok=True)
+        
+        opciones = {
+            'solo_actualizar': request.form.get('solo_actualizar') == 'true',
+            'crear_nuevos': request.form.get('crear_nuevos', 'true') == 'true'
+        }
+        simulacion = request.form.get('simulacion') == 'true'
+        trabajo = _registrar_importacion(archivo.filename, simulacion)
+        
+        ruta = os.path.join(DIRECTORIO_IMPORTACIONES, f"{trabajo['id']}.xlsx")
+        archivo.save(ruta)
+        
+        print(f"🧵 {'Simulación' if simulacion else 'Importación'} de lista en segundo plano: {archivo.filename} ({trabajo['id']})")
+        threading.Thread(
+            target=_importar_lista_en_segundo_plano,
+            args=(trabajo['id'], ruta, opciones, simulacion),
+            daemon=True
+        ).start()
         
         return jsonify({
             'success': True,
-            'mensaje': f'Migración completada: {contador} detalles actualizados',
-            'detalles_migrados': contador
-        })
+            'trabajo_id': trabajo['id'],
+            'estado_url': url_for('estado_importacion_lista', trabajo_id=trabajo['id']),
+            'diferencias_url': url_for('diferencias_importacion_lista', trabajo_id=trabajo['id']) if simulacion else None
+        }), 202
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': f'Error en migración: {str(e)}'
-        }), 500
+        print(f"❌ Error iniciando importación de lista: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/importar_productos')
-def importar_productos_vista():
-    """Vista para importar productos desde Excel"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    return render_template('importar_productos.html')
 
-@app.route('/api/importar_productos_lote', methods=['POST'])
-def importar_productos_lote():
-    """Importar un lote de productos desde Excel"""
+@app.route('/api/importar_productos_simulacion', methods=['POST'])
+def simular_importacion_productos():
+    """Comparar una lista (ya leída en el navegador) con el catálogo sin escribir nada"""
     if 'user_id' not in session:
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
         data = request.json
         productos = data.get('productos', [])
-        opciones = data.get('opciones', {})
-        
-        solo_actualizar = opciones.get('solo_actualizar', False)
-        crear_nuevos = opciones.get('crear_nuevos', True)
-        
-        resultados = {
-            'nuevos': 0,
-            'actualizados': 0,
-            'errores': 0,
-            'detalles_errores': [],
-            'productos_procesados': []  # NUEVO: Array con el estado de cada producto
-        }
-        
-        print(f"📦 Procesando lote de {len(productos)} productos...")
-        
-        for producto_data in productos:
-            producto_resultado = {
-                'codigo': producto_data.get('codigo', 'UNKNOWN'),
-                'estado': 'error',  # Por defecto error, se cambia si todo va bien
-                'mensaje': ''
-            }
-            
-            try:
-                codigo = str(producto_data['codigo']).strip().upper()
-                descripcion = str(producto_data['descripcion']).strip()
-                precio = float(producto_data['precio'])
-                
-                producto_resultado['codigo'] = codigo  # Actualizar con código limpio
-                
-                # Validaciones básicas
-                if not codigo or not descripcion or precio <= 0:
-                    producto_resultado['estado'] = 'error'
-                    producto_resultado['mensaje'] = 'Datos inválidos'
-                    resultados['errores'] += 1
-                    resultados['detalles_errores'].append({
-                        'error': f'Datos inválidos para código {codigo}',
-                        'codigo': codigo
-                    })
-                    resultados['productos_procesados'].append(producto_resultado)
-                    continue
-                
-                # Buscar si el producto ya existe
-                producto_existente = Producto.query.filter_by(codigo=codigo).first()
-                
-                if producto_existente:
-                    # Producto existe - actualizar si está permitido
-                    if solo_actualizar:
-                        # Actualizar precio y descripción
-                        producto_existente.precio = Decimal(str(precio))
-                        producto_existente.nombre = descripcion
-                        producto_existente.descripcion = descripcion
-                        producto_existente.fecha_modificacion = datetime.now()
-                        
-                        # Si no tiene costo, intentar calcularlo con margen por defecto
-                        if not producto_existente.costo or producto_existente.costo == 0:
-                            margen_defecto = 30.0  # 30% de margen por defecto
-                            costo_calculado = precio / (1 + (margen_defecto / 100))
-                            producto_existente.costo = Decimal(str(costo_calculado))
-                            producto_existente.margen = Decimal(str(margen_defecto))
-                        
-                        # ACTUALIZAR ESTADO
-                        producto_resultado['estado'] = 'actualizado'
-                        producto_resultado['mensaje'] = 'Producto actualizado correctamente'
-                        
-                        resultados['actualizados'] += 1
-                        print(f"✅ Actualizado: {codigo} - {descripcion}")
-                    else:
-                        # Si no se permite actualizar, contar como error
-                        producto_resultado['estado'] = 'error'
-                        producto_resultado['mensaje'] = 'Producto ya existe (actualización deshabilitada)'
-                        
-                        resultados['errores'] += 1
-                        resultados['detalles_errores'].append({
-                            'error': f'Producto {codigo} ya existe (actualización deshabilitada)',
-                            'codigo': codigo
-                        })
-                        
-                else:
-                    # Producto nuevo - crear si está permitido
-                    if crear_nuevos:
-                        # Calcular costo con margen por defecto del 30%
-                        margen_defecto = 30.0
-                        costo_calculado = precio / (1 + (margen_defecto / 100))
-                        
-                        # Detectar categoría básica desde la descripción
-                        categoria = detectar_categoria(descripcion)
-                        
-                        nuevo_producto = Producto(
-                            codigo=codigo,
-                            nombre=descripcion,
-                            descripcion=descripcion,
-                            precio=Decimal(str(precio)),                    # <- Del Excel
-                            costo=Decimal(str(float(producto_data.get('costo', 0)))),   # <- Del Excel
-                            margen=Decimal(str(float(producto_data.get('margen', 30)))), # <- Del Excel
-                            stock=0,  # Stock inicial en 0
-                            categoria=categoria,
-                            iva=Decimal('21.0'),  # IVA por defecto 21%
-                            activo=True,
-                            es_combo=False,
-                            fecha_creacion=datetime.now(),
-                            fecha_modificacion=datetime.now()
-                        )
-                        
-                        db.session.add(nuevo_producto)
-                        
-                        # ACTUALIZAR ESTADO
-                        producto_resultado['estado'] = 'nuevo'
-                        producto_resultado['mensaje'] = 'Producto creado correctamente'
-                        
-                        resultados['nuevos'] += 1
-                        print(f"🆕 Creado: {codigo} - {descripcion}")
-                    else:
-                        # Si no se permite crear nuevos, contar como error
-                        producto_resultado['estado'] = 'error'
-                        producto_resultado['mensaje'] = 'Producto no existe (creación deshabilitada)'
-                        
-                        resultados['errores'] += 1
-                        resultados['detalles_errores'].append({
-                            'error': f'Producto {codigo} no existe (creación deshabilitada)',
-                            'codigo': codigo
-                        })
-                
-            except Exception as e:
-                producto_resultado['estado'] = 'error'
-                producto_resultado['mensaje'] = f'Error: {str(e)}'
-                
-                resultados['errores'] += 1
-                resultados['detalles_errores'].append({
-                    'error': f'Error procesando {producto_data.get("codigo", "UNKNOWN")}: {str(e)}',
-                    'codigo': producto_data.get('codigo', 'UNKNOWN')
-                })
-                print(f"❌ Error en producto {producto_data.get('codigo', 'UNKNOWN')}: {str(e)}")
-            
-            # SIEMPRE agregar el resultado del producto al array
-            resultados['productos_procesados'].append(producto_resultado)
         
-        # Confirmar cambios en la base de datos
-        db.session.commit()
-        
-        print(f"✅ Lote completado: {resultados['nuevos']} nuevos, {resultados['actualizados']} actualizados, {resultados['errores']} errores")
+        trabajo = _registrar_importacion(data.get('nombre_archivo'), simulacion=True)
+        comparacion = importador_productos.comparar(productos, data.get('opciones', {}))
+        _actualizar_importacion(trabajo['id'], estado='listo', filas_leidas=len(productos), **comparacion)
         
         return jsonify({
             'success': True,
-            'message': 'Lote procesado correctamente',
-            'nuevos': resultados['nuevos'],
-            'actualizados': resultados['actualizados'],
-            'errores': resultados['errores'],
-            'detalles_errores': resultados['detalles_errores'],
-            'productos_procesados': resultados['productos_procesados']  # NUEVO: Estados detallados
+            'trabajo_id': trabajo['id'],
+            'resumen': comparacion['resumen'],
+            'diferencias_url': url_for('diferencias_importacion_lista', trabajo_id=trabajo['id']),
+            **importador_productos.paginar_diferencias(comparacion['diferencias'])
         })
         
     except Exception as e:
-        db.session.rollback()
-        print(f"❌ Error en importación de lote: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': f'Error al procesar lote: {str(e)}'
-        }), 500
+        print(f"❌ Error simulando importación: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 
-def detectar_categoria(descripcion):
-    """Detectar categoría básica desde la descripción del producto"""
-    descripcion_lower = descripcion.lower()
-    
-    # Mapeo de palabras clave a categorías
-    categorias = {
-        'POLLO': ['pollo', 'pechuga', 'muslo', 'ala', 'carcasa'],
-        'CARNE': ['carne', 'bife', 'asado', 'costilla', 'vacio', 'chorizo'],
-        'CERDO': ['cerdo', 'bondiola', 'matambre', 'costilla cerdo'],
-        'PESCADO': ['pescado', 'salmon', 'merluza', 'atun'],
-        'CHACINADOS': ['salame', 'jamon', 'mortadela', 'chorizo', 'morcilla'],
-        'LACTEOS': ['leche', 'queso', 'yogur', 'manteca', 'crema'],
-        'CONGELADOS': ['congelado', 'frozen', 'helado'],
-        'BEBIDAS': ['gaseosa', 'agua', 'jugo', 'cerveza', 'vino'],
-        'PANADERIA': ['pan', 'facturas', 'torta', 'galletas'],
-        'LIMPIEZA': ['detergente', 'lavandina', 'jabon', 'shampoo'],
-        'VERDURAS': ['verdura', 'lechuga', 'tomate', 'cebolla', 'papa']
-    }
+@app.route('/api/importaciones_productos/<trabajo_id>')
+def estado_importacion_lista(trabajo_id):
+    """Avance de una importación de lista de precios"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    trabajo = _obtener_importacion_usuario(trabajo_id)
+    if not trabajo:
+        return jsonify({'success': False, 'error': 'Importación no encontrada'}), 404
+    
+    respuesta = {clave: valor for clave, valor in trabajo.items() if clave not in ('usuario_id', 'creado', 'diferencias')}
+    respuesta['success'] = True
+    return jsonify(respuesta)
+
+
+@app.route('/api/importaciones_productos/<trabajo_id>/diferencias')
+def diferencias_importacion_lista(trabajo_id):
+    """Página de diferencias de una simulación (filtro opcional por tipo)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 401
     
-    for categoria, palabras_clave in categorias.items():
-        if any(palabra in descripcion_lower for palabra in palabras_clave):
-            return categoria
+    trabajo = _obtener_importacion_usuario(trabajo_id)
+    if not trabajo or trabajo['modo'] != 'simulacion':
+        return jsonify({'success': False, 'error': 'Simulación no encontrada'}), 404
+    if trabajo['estado'] != 'listo':
+        return jsonify({'success': False, 'estado': trabajo['estado'], 'error': trabajo['error'] or 'La simulación todavía se está procesando'}), 409
     
-    return 'GENERAL'  # Categoría por defecto
+    return jsonify({
+        'success': True,
+        'resumen': trabajo['resumen'],
+        **importador_productos.paginar_diferencias(
+            trabajo['diferencias'],
+            tipo=request.args.get('tipo') or None,
+            pagina=request.args.get('pagina', 1, type=int),
+            por_pagina=request.args.get('por_pagina', 50, type=int)
+        )
+    })
 
 # AGREGAR esta nueva ruta en app.py:
 
@@ -4706,6 +8175,50 @@ def verificar_eliminacion_combo(combo_id):
 
 # AGREGAR estas rutas en app.py:
 
+_puntos_venta_facturas = {'valores': None}
+
+
+def _puntos_venta_conocidos():
+    """Puntos de venta usados en facturas (se consulta una vez por proceso)"""
+    if _puntos_venta_facturas['valores'] is None:
+        valores = {ARCA_CONFIG.PUNTO_VENTA}
+        valores.update(
+            pv for (pv,) in db.session.query(Factura.punto_venta).distinct() if pv is not None
+        )
+        _puntos_venta_facturas['valores'] = sorted(valores)
+    return _puntos_venta_facturas['valores']
+
+
+def _filtro_numero_factura(numero):
+    """Filtro indexable para el número de comprobante (formato PPPP-NNNNNNNN).
+    
+    - "3-125" o "0003-00000125": número exacto (normalizado con ceros)
+    - "0003-0000012": exacto o prefijo (se está tipeando el número)
+    - "125": número exacto en cualquiera de los puntos de venta usados
+    - "000300000125": número completo sin guion
+    - cualquier otro texto: prefijo
+    """
+    texto = numero.strip()
+    
+    partes = re.fullmatch(r'(\d{1,5})-(\d{0,8})', texto)
+    if partes:
+        punto_venta, comprobante = partes.groups()
+        if not comprobante:
+            return Factura.numero.like(f'{int(punto_venta):04d}-%')
+        exacto = Factura.numero == f'{int(punto_venta):04d}-{int(comprobante):08d}'
+        if len(comprobante) == 8:
+            return exacto
+        return or_(exacto, Factura.numero.startswith(texto))
+    
+    if texto.isdigit():
+        if len(texto) <= 8:
+            return Factura.numero.in_([f'{pv:04d}-{int(texto):08d}' for pv in _puntos_venta_conocidos()])
+        if len(texto) == 12:
+            return Factura.numero == f'{texto[:4]}-{texto[4:]}'
+    
+    return Factura.numero.startswith(texto, autoescape=True)
+
+
 @app.route('/api/buscar_facturas')
 def buscar_facturas():
     """Buscar facturas con filtros avanzados"""
@@ -4721,6 +8234,10 @@ def buscar_facturas():
         fecha_hasta = request.args.get('fecha_hasta', '').strip()
         limite = int(request.args.get('limite', 100))  # Limitar resultados
         
+        # Cursor de paginación: última factura (fecha, id) de la página anterior
+        despues_fecha = request.args.get('despues_fecha', '').strip()
+        despues_id = request.args.get('despues_id', type=int)
+        
         print(f"🔍 Búsqueda de facturas:")
         print(f"   Número: '{numero}'")
         print(f"   Cliente: '{cliente}'")
@@ -4729,17 +8246,37 @@ def buscar_facturas():
         print(f"   Fecha hasta: '{fecha_hasta}'")
         print(f"   Límite: {limite}")
         
-        # Construir query base con join a cliente
-        query = db.session.query(Factura).join(Cliente, Factura.cliente_id == Cliente.id)
+        # Cantidad de items por factura (subconsulta COUNT, sin cargar los detalles)
+        cantidad_items = select(func.count(DetalleFactura.id)).where(
+            DetalleFactura.factura_id == Factura.id
+        ).correlate(Factura).scalar_subquery()
         
-        # Aplicar filtros
+        # Construir query base con join a cliente, descuento (LEFT JOIN) y usuario.
+        # Los medios de pago se traen en una sola consulta extra para todas las facturas.
+        query = db.session.query(
+            Factura,
+            DescuentoFactura,
+            cantidad_items.label('cantidad_items')
+        ).join(
+            Cliente, Factura.cliente_id == Cliente.id
+        ).outerjoin(
+            DescuentoFactura, DescuentoFactura.factura_id == Factura.id
+        ).options(
+            contains_eager(Factura.cliente),
+            joinedload(Factura.usuario),
+            selectinload(Factura.medios_pago)
+        )
+        
+        # Aplicar filtros (número y cliente resueltos sobre índices)
         if numero:
-            query = query.filter(Factura.numero.ilike(f'%{numero}%'))
-            print(f"   Filtro aplicado: Número contiene '{numero}'")
+            query = query.filter(_filtro_numero_factura(numero))
+            print(f"   Filtro aplicado: Número '{numero}'")
         
         if cliente:
-            query = query.filter(Cliente.nombre.ilike(f'%{cliente}%'))
-            print(f"   Filtro aplicado: Cliente contiene '{cliente}'")
+            query = query.filter(
+                Cliente.nombre_normalizado.startswith(normalizar_texto_busqueda(cliente), autoescape=True)
+            )
+            print(f"   Filtro aplicado: Cliente empieza con '{cliente}'")
         
         if estado:
             query = query.filter(Factura.estado == estado)
@@ -4768,20 +8305,41 @@ def buscar_facturas():
                     'error': 'Formato de fecha hasta inválido. Use YYYY-MM-DD'
                 }), 400
         
-        # Ordenar por fecha descendente (más recientes primero)
-        query = query.order_by(Factura.fecha.desc())
-        
-        # Aplicar límite
-        facturas = query.limit(limite).all()
+        # Paginación por cursor: facturas anteriores a (fecha, id) de la última enviada
+        if despues_fecha and despues_id:
+            try:
+                cursor_fecha = datetime.fromisoformat(despues_fecha)
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Cursor de paginación inválido'
+                }), 400
+            query = query.filter(or_(
+                Factura.fecha < cursor_fecha,
+                and_(Factura.fecha == cursor_fecha, Factura.id < despues_id)
+            ))
+        
+        # Ordenar por fecha descendente (más recientes primero), id para desempatar
+        query = query.order_by(Factura.fecha.desc(), Factura.id.desc())
+        
+        # Aplicar límite (uno más para saber si hay otra página)
+        facturas = query.limit(limite + 1).all()
+        hay_mas = len(facturas) > limite
+        facturas = facturas[:limite]
+        
+        siguiente_cursor = None
+        if hay_mas and facturas:
+            ultima = facturas[-1][0]
+            siguiente_cursor = {
+                'despues_fecha': ultima.fecha.isoformat(),
+                'despues_id': ultima.id
+            }
         
         print(f"   Facturas encontradas: {len(facturas)}")
         
         # Formatear resultados
         resultado = []
-        for factura in facturas:
-            # ✅ BUSCAR DESCUENTO APLICADO
-            descuento = DescuentoFactura.query.filter_by(factura_id=factura.id).first()
-
+        for factura, descuento, cantidad_items_factura in facturas:
             # Obtener información de medios de pago
             medios_pago = []
             for medio in factura.medios_pago:
@@ -4811,7 +8369,7 @@ def buscar_facturas():
                 'cae': factura.cae,
                 'vto_cae': factura.vto_cae.strftime('%d/%m/%Y') if factura.vto_cae else None,
                 'medios_pago': medios_pago,
-                'cantidad_items': len(factura.detalles),
+                'cantidad_items': int(cantidad_items_factura or 0),
                 'usuario': factura.usuario.nombre if factura.usuario else 'Desconocido',
                  'tiene_descuento': bool(descuento),
                 'descuento_porcentaje': float(descuento.porcentaje_descuento) if descuento else 0,
@@ -4825,7 +8383,9 @@ def buscar_facturas():
             'success': True,
             'facturas': resultado,
             'total': len(resultado),
-            'limite_aplicado': len(facturas) == limite,
+            'limite_aplicado': hay_mas,
+            'hay_mas': hay_mas,
+            'siguiente_cursor': siguiente_cursor,
             'filtros_aplicados': {
                 'numero': numero,
                 'cliente': cliente,
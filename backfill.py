@@ -0,0 +1,190 @@
+# backfill.py - Correcciones de datos históricos por rangos de clave primaria
+
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+
+class EjecutorBackfill:
+    """Aplica correcciones de datos sobre tablas grandes por rangos de id.
+
+    Cada backfill registrado es una función sentencias(desde, hasta) que
+    devuelve los UPDATE (con JOIN si hace falta) para el rango [desde, hasta]
+    de la clave primaria. Cada rango se confirma junto con el avance en la
+    tabla de checkpoints, así que un proceso cortado sigue desde el último
+    rango confirmado. Entre rangos se hace una pausa proporcional a lo que
+    tardó el rango para no acaparar la base mientras las cajas venden.
+    """
+
+    def __init__(self, db, AvanceBackfill, tamano_tramo=5000, pausa=0.1, factor_pausa=1.0):
+        self.db = db
+        self.AvanceBackfill = AvanceBackfill
+        self.tamano_tramo = tamano_tramo
+        self.pausa = pausa
+        self.factor_pausa = factor_pausa
+        self._backfills = {}
+        self._detener = set()
+        self._hilos = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nombre, columna_id, descripcion, sentencias):
+        """Registrar un backfill sobre la clave primaria 'columna_id'"""
+        self._backfills[nombre] = {
+            'nombre': nombre,
+            'columna_id': columna_id,
+            'descripcion': descripcion,
+            'sentencias': sentencias
+        }
+
+    def __contains__(self, nombre):
+        return nombre in self._backfills
+
+    @property
+    def nombres(self):
+        return list(self._backfills)
+
+    def _avance(self, nombre, reiniciar=False):
+        """Checkpoint del backfill, creado (o reiniciado) con el rango de ids actual"""
+        backfill = self._backfills[nombre]
+        session = self.db.session
+        avance = session.get(self.AvanceBackfill, nombre)
+
+        if avance is None or reiniciar or avance.estado == 'completado':
+            columna = backfill['columna_id']
+            id_minimo, id_maximo = session.execute(
+                select(func.min(columna), func.max(columna))
+            ).one()
+            if avance is None:
+                avance = self.AvanceBackfill(nombre=nombre)
+                session.add(avance)
+            avance.id_minimo = id_minimo or 0
+            avance.id_maximo = id_maximo or 0
+            avance.ultimo_id = (id_minimo or 1) - 1
+            avance.filas_actualizadas = 0
+            avance.tramos = 0
+            avance.fecha_inicio = datetime.now()
+            avance.fecha_fin = None
+
+        avance.estado = 'en_curso'
+        avance.error = None
+        avance.fecha_actualizacion = datetime.now()
+        session.commit()
+        return avance
+
+    def ejecutar(self, nombre, reiniciar=False):
+        """Correr el backfill hasta el final (o hasta que se pida detenerlo); devuelve el estado"""
+        backfill = self._backfills[nombre]
+        session = self.db.session
+        self._detener.discard(nombre)
+
+        try:
+            avance = self._avance(nombre, reiniciar)
+
+            while avance.ultimo_id < avance.id_maximo:
+                if nombre in self._detener:
+                    avance.estado = 'pausado'
+                    avance.fecha_actualizacion = datetime.now()
+                    session.commit()
+                    break
+
+                inicio = time.perf_counter()
+                desde = avance.ultimo_id + 1
+                hasta = min(avance.ultimo_id + self.tamano_tramo, avance.id_maximo)
+
+                filas = 0
+                for sentencia in backfill['sentencias'](desde, hasta):
+                    filas += session.execute(sentencia).rowcount or 0
+
+                # El avance se confirma en la misma transacción que el rango
+                avance.ultimo_id = hasta
+                avance.filas_actualizadas += filas
+                avance.tramos += 1
+                avance.fecha_actualizacion = datetime.now()
+                session.commit()
+
+                duracion = time.perf_counter() - inicio
+                time.sleep(max(self.pausa, duracion * self.factor_pausa))
+            else:
+                avance.estado = 'completado'
+                avance.fecha_fin = datetime.now()
+                avance.fecha_actualizacion = avance.fecha_fin
+                session.commit()
+                print(f"✅ Backfill {nombre}: {avance.filas_actualizadas} filas en {avance.tramos} tramos")
+
+            return self.estado(nombre)
+
+        except Exception as e:
+            session.rollback()
+            avance = session.get(self.AvanceBackfill, nombre)
+            if avance is not None:
+                avance.estado = 'error'
+                avance.error = str(e)[:1000]
+                avance.fecha_actualizacion = datetime.now()
+                session.commit()
+            print(f"❌ Error en backfill {nombre}: {e}")
+            raise
+
+    def iniciar_en_segundo_plano(self, nombre, app, reiniciar=False):
+        """Correr el backfill en un hilo; False si ya está corriendo"""
+        with self._lock:
+            hilo = self._hilos.get(nombre)
+            if hilo is not None and hilo.is_alive():
+                return False
+
+            def correr():
+                with app.app_context():
+                    try:
+                        self.ejecutar(nombre, reiniciar)
+                    except Exception:
+                        pass  # El error queda en el checkpoint
+                    finally:
+                        self.db.session.remove()
+
+            hilo = threading.Thread(target=correr, daemon=True)
+            self._hilos[nombre] = hilo
+            hilo.start()
+            return True
+
+    def detener(self, nombre):
+        """Pedir que el backfill se detenga al terminar el rango actual"""
+        self._detener.add(nombre)
+
+    def estado(self, nombre):
+        """Avance del backfill como diccionario"""
+        backfill = self._backfills[nombre]
+        avance = self.db.session.get(self.AvanceBackfill, nombre)
+        hilo = self._hilos.get(nombre)
+
+        estado = {
+            'nombre': nombre,
+            'descripcion': backfill['descripcion'],
+            'estado': 'sin_iniciar',
+            'corriendo': bool(hilo and hilo.is_alive()),
+            'porcentaje': 0.0
+        }
+        if avance is None:
+            return estado
+
+        total = max(avance.id_maximo - avance.id_minimo + 1, 0)
+        hechos = max(min(avance.ultimo_id, avance.id_maximo) - avance.id_minimo + 1, 0)
+        estado.update({
+            'estado': avance.estado,
+            'ultimo_id': avance.ultimo_id,
+            'id_minimo': avance.id_minimo,
+            'id_maximo': avance.id_maximo,
+            'filas_actualizadas': avance.filas_actualizadas,
+            'tramos': avance.tramos,
+            'porcentaje': round(hechos * 100 / total, 1) if total else 100.0,
+            'error': avance.error,
+            'fecha_inicio': avance.fecha_inicio.isoformat() if avance.fecha_inicio else None,
+            'fecha_actualizacion': avance.fecha_actualizacion.isoformat() if avance.fecha_actualizacion else None,
+            'fecha_fin': avance.fecha_fin.isoformat() if avance.fecha_fin else None
+        })
+        return estado
+
+
+def crear_ejecutor_backfill(db, AvanceBackfill, tamano_tramo=5000, pausa=0.1, factor_pausa=1.0):
+    """Función de conveniencia para crear el ejecutor de backfills"""
+    return EjecutorBackfill(db, AvanceBackfill, tamano_tramo, pausa, factor_pausa)
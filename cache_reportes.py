@@ -0,0 +1,117 @@
+# cache_reportes.py - Cache en memoria de resultados de reportes
+
+import threading
+from collections import OrderedDict
+from datetime import date
+
+
+class CacheReportes:
+    """Cache LRU de resultados de reportes por endpoint y parámetros normalizados.
+
+    Un resultado de un período cerrado (que termina antes de hoy) queda guardado
+    hasta que se registra un cambio en alguna de sus fechas. Un resultado que
+    incluye el día de hoy además se descarta cuando sube la versión de datos,
+    que aumenta con cada venta, anulación o gasto confirmado.
+    """
+
+    def __init__(self, max_entradas=500):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    @staticmethod
+    def normalizar_parametros(parametros):
+        """Tupla ordenada de parámetros, sin vacíos y con listas ordenadas"""
+        normalizados = []
+        for clave, valor in parametros.items():
+            if isinstance(valor, (list, tuple, set)):
+                valor = tuple(sorted(str(v).strip() for v in valor))
+            elif valor is not None:
+                valor = str(valor).strip()
+
+            if valor in (None, '', ()):
+                continue
+            normalizados.append((clave, valor))
+        return tuple(sorted(normalizados))
+
+    @property
+    def version(self):
+        return self._version
+
+    def obtener(self, endpoint, parametros, fecha_desde, fecha_hasta, calcular):
+        """Devolver el resultado cacheado o calcularlo con calcular() y guardarlo.
+
+        fecha_desde y fecha_hasta (date, inclusive) son el rango de datos que
+        lee el reporte. El resultado es compartido entre requests: no modificarlo.
+        """
+        clave = (endpoint, self.normalizar_parametros(parametros))
+
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and (not entrada['abierto'] or entrada['version'] == self._version):
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada['resultado']
+            self.fallos += 1
+            version = self._version
+
+        resultado = calcular()
+
+        with self._lock:
+            # Si hubo cambios mientras se calculaba, no publicar un resultado viejo
+            if version == self._version:
+                self._entradas[clave] = {
+                    'resultado': resultado,
+                    'desde': fecha_desde,
+                    'hasta': fecha_hasta,
+                    'abierto': fecha_hasta >= date.today(),
+                    'version': version
+                }
+                self._entradas.move_to_end(clave)
+                while len(self._entradas) > self.max_entradas:
+                    self._entradas.popitem(last=False)
+
+        return resultado
+
+    def registrar_cambio(self, fechas=()):
+        """Registrar ventas, anulaciones o gastos confirmados en esas fechas.
+
+        Sube la versión de datos (invalida los resultados que incluyen hoy) y
+        descarta los períodos cerrados que contienen alguna fecha pasada.
+        """
+        hoy = date.today()
+        pasadas = {fecha for fecha in fechas if fecha is not None and fecha < hoy}
+
+        with self._lock:
+            self._version += 1
+            if pasadas:
+                afectadas = [
+                    clave for clave, entrada in self._entradas.items()
+                    if any(entrada['desde'] <= fecha <= entrada['hasta'] for fecha in pasadas)
+                ]
+                for clave in afectadas:
+                    del self._entradas[clave]
+
+    def limpiar(self):
+        """Vaciar el cache (por ejemplo al reconstruir resúmenes o editar productos)"""
+        with self._lock:
+            self._entradas.clear()
+            self._version += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'version': self._version,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos
+            }
+
+
+def crear_cache_reportes(max_entradas=500):
+    """Función de conveniencia para crear el cache de reportes"""
+    return CacheReportes(max_entradas)
@@ -0,0 +1,111 @@
+# clasificador_categorias.py - Clasificación de productos en categorías por palabras clave
+
+import re
+import unicodedata
+from bisect import bisect_right
+
+CATEGORIA_DEFECTO = 'GENERAL'
+
+# Reglas iniciales (palabra, categoria, prioridad): las mismas listas que usaba
+# detectar_categoria, con prioridad decreciente para respetar el orden en que
+# se revisaban las categorías (si una descripción tiene palabras de dos
+# categorías, gana la de mayor prioridad).
+REGLAS_CATEGORIA_DEFECTO = [
+    (palabra, categoria, prioridad)
+    for prioridad, (categoria, palabras) in zip(range(110, 0, -10), [
+        ('POLLO', ['pollo', 'pechuga', 'muslo', 'ala', 'carcasa']),
+        ('CARNE', ['carne', 'bife', 'asado', 'costilla', 'vacio', 'chorizo']),
+        ('CERDO', ['cerdo', 'bondiola', 'matambre', 'costilla cerdo']),
+        ('PESCADO', ['pescado', 'salmon', 'merluza', 'atun']),
+        ('CHACINADOS', ['salame', 'jamon', 'mortadela', 'chorizo', 'morcilla']),
+        ('LACTEOS', ['leche', 'queso', 'yogur', 'manteca', 'crema']),
+        ('CONGELADOS', ['congelado', 'frozen', 'helado']),
+        ('BEBIDAS', ['gaseosa', 'agua', 'jugo', 'cerveza', 'vino']),
+        ('PANADERIA', ['pan', 'facturas', 'torta', 'galletas']),
+        ('LIMPIEZA', ['detergente', 'lavandina', 'jabon', 'shampoo']),
+        ('VERDURAS', ['verdura', 'lechuga', 'tomate', 'cebolla', 'papa']),
+    ])
+    for palabra in palabras
+]
+
+_SIN_DEFECTO = object()
+
+
+def normalizar_texto(texto):
+    """Minúsculas, sin acentos y con espacios simples"""
+    if not texto:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.split())
+
+
+class ClasificadorCategorias:
+    """Asigna una categoría a cada descripción según reglas de palabras clave.
+
+    Todas las palabras se compilan en una sola expresión regular con límites
+    de palabra ('ala' no coincide con 'salame') que acepta el plural simple
+    ('tomates', 'panes'). Si una descripción tiene palabras de varias reglas
+    gana la de mayor prioridad y, a igual prioridad, la primera regla.
+    """
+
+    def __init__(self, reglas, categoria_defecto=CATEGORIA_DEFECTO):
+        self.categoria_defecto = categoria_defecto
+        self.cantidad_reglas = 0
+
+        # Palabra normalizada -> (-prioridad, orden, categoria); menor es mejor
+        self._reglas = {}
+        for orden, (palabra, categoria, prioridad) in enumerate(reglas):
+            clave = normalizar_texto(palabra)
+            if not clave or not categoria:
+                continue
+            self.cantidad_reglas += 1
+            candidata = (-(prioridad or 0), orden, categoria)
+            if clave not in self._reglas or candidata < self._reglas[clave]:
+                self._reglas[clave] = candidata
+
+        self._patron = None
+        if self._reglas:
+            # Las palabras más largas primero para que 'costilla cerdo' gane a 'costilla'
+            alternativas = sorted(self._reglas, key=lambda p: (-len(p), p))
+            self._patron = re.compile(
+                r'(?<!\w)(' + '|'.join(re.escape(p) for p in alternativas) + r')(?:es|s)?(?!\w)'
+            )
+
+    def clasificar_lote(self, descripciones, defecto=_SIN_DEFECTO):
+        """Categoría de cada descripción, con una sola pasada sobre todo el lote.
+
+        Las descripciones sin coincidencias reciben 'defecto' (por omisión la
+        categoría por defecto del clasificador).
+        """
+        if defecto is _SIN_DEFECTO:
+            defecto = self.categoria_defecto
+
+        textos = [normalizar_texto(d) for d in descripciones]
+        mejores = [None] * len(textos)
+
+        if self._patron is not None and textos:
+            # Se unen las descripciones con saltos de línea (no quedan dentro de
+            # un texto normalizado) y cada coincidencia se ubica por su posición
+            inicios = []
+            posicion = 0
+            for texto in textos:
+                inicios.append(posicion)
+                posicion += len(texto) + 1
+
+            for coincidencia in self._patron.finditer('\n'.join(textos)):
+                fila = bisect_right(inicios, coincidencia.start()) - 1
+                regla = self._reglas[coincidencia.group(1)]
+                if mejores[fila] is None or regla < mejores[fila]:
+                    mejores[fila] = regla
+
+        return [regla[2] if regla else defecto for regla in mejores]
+
+    def clasificar(self, descripcion, defecto=_SIN_DEFECTO):
+        """Categoría de una sola descripción"""
+        return self.clasificar_lote([descripcion], defecto)[0]
+
+
+def crear_clasificador_categorias(reglas=None, categoria_defecto=CATEGORIA_DEFECTO):
+    """Función de conveniencia para crear el clasificador (sin reglas usa las iniciales)"""
+    return ClasificadorCategorias(REGLAS_CATEGORIA_DEFECTO if reglas is None else reglas, categoria_defecto)
@@ -0,0 +1,123 @@
+# codigos_balanza.py - Decodificador de códigos EAN-13 de medida variable (balanzas)
+
+from decimal import Decimal, ROUND_HALF_UP
+
+# Configuración por defecto de prefijos de balanza (EAN-13 prefijos 20-29)
+# Formato: PP + PLU + VALOR + DV
+#   tipo: 'peso' (valor = kilos) o 'precio' (valor = importe en pesos)
+#   digitos_plu: cantidad de dígitos del código PLU
+#   decimales: decimales implícitos del valor embebido
+PREFIJOS_BALANZA_DEFECTO = {
+    '20': {'tipo': 'peso', 'digitos_plu': 5, 'decimales': 3},
+    '21': {'tipo': 'peso', 'digitos_plu': 5, 'decimales': 3},
+    '22': {'tipo': 'precio', 'digitos_plu': 5, 'decimales': 2},
+    '23': {'tipo': 'precio', 'digitos_plu': 5, 'decimales': 2},
+}
+
+
+def calcular_digito_verificador(codigo_12):
+    """Calcular dígito verificador EAN-13 para los primeros 12 dígitos"""
+    suma = 0
+    for i, digito in enumerate(codigo_12):
+        suma += int(digito) * (3 if i % 2 else 1)
+    return (10 - (suma % 10)) % 10
+
+
+class DecodificadorBalanza:
+    """Decodificador de etiquetas de balanza con PLU y peso/precio embebido"""
+
+    def __init__(self, prefijos=None):
+        self.prefijos = {}
+        for prefijo, formato in (prefijos or PREFIJOS_BALANZA_DEFECTO).items():
+            prefijo = str(prefijo)
+            digitos_plu = int(formato.get('digitos_plu', 5))
+            digitos_valor = 12 - len(prefijo) - digitos_plu
+
+            if formato.get('tipo') not in ('peso', 'precio'):
+                raise ValueError(f"Tipo de código de balanza inválido para prefijo {prefijo}: {formato.get('tipo')}")
+            if digitos_valor <= 0:
+                raise ValueError(f"Formato de balanza inválido para prefijo {prefijo}: sin dígitos para el valor")
+
+            self.prefijos[prefijo] = {
+                'tipo': formato['tipo'],
+                'digitos_plu': digitos_plu,
+                'digitos_valor': digitos_valor,
+                'decimales': int(formato.get('decimales', 3 if formato['tipo'] == 'peso' else 2))
+            }
+
+    def es_codigo_balanza(self, codigo):
+        """Verificar si el código tiene formato de etiqueta de balanza"""
+        codigo = str(codigo or '').strip()
+        return (
+            len(codigo) == 13 and
+            codigo.isdigit() and
+            self._formato_para(codigo) is not None
+        )
+
+    def _formato_para(self, codigo):
+        """Buscar el formato configurado cuyo prefijo coincide con el código"""
+        for prefijo, formato in self.prefijos.items():
+            if codigo.startswith(prefijo):
+                return prefijo, formato
+        return None
+
+    def decodificar(self, codigo):
+        """Decodificar un código de balanza. Devuelve None si no corresponde"""
+        codigo = str(codigo or '').strip()
+
+        if len(codigo) != 13 or not codigo.isdigit():
+            return None
+
+        encontrado = self._formato_para(codigo)
+        if not encontrado:
+            return None
+
+        if calcular_digito_verificador(codigo[:12]) != int(codigo[12]):
+            return None
+
+        prefijo, formato = encontrado
+        inicio_valor = len(prefijo) + formato['digitos_plu']
+        plu = codigo[len(prefijo):inicio_valor]
+        valor_crudo = codigo[inicio_valor:inicio_valor + formato['digitos_valor']]
+        valor = Decimal(int(valor_crudo)).scaleb(-formato['decimales'])
+
+        return {
+            'codigo': codigo,
+            'prefijo': prefijo,
+            'tipo': formato['tipo'],
+            'plu': plu,
+            'valor': valor
+        }
+
+    @staticmethod
+    def codigos_candidatos(plu):
+        """Códigos de producto posibles para un PLU (con y sin ceros a la izquierda)"""
+        candidatos = [plu]
+        sin_ceros = plu.lstrip('0')
+        if sin_ceros and sin_ceros != plu:
+            candidatos.append(sin_ceros)
+        return candidatos
+
+    @staticmethod
+    def calcular_cantidad(decodificado, precio_unitario):
+        """Calcular cantidad e importe de la línea según el tipo de etiqueta"""
+        precio = Decimal(str(precio_unitario))
+
+        if decodificado['tipo'] == 'peso':
+            cantidad = decodificado['valor']
+            importe = (cantidad * precio).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        else:
+            importe = decodificado['valor']
+            if precio <= 0:
+                return None
+            cantidad = (importe / precio).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
+
+        return {
+            'cantidad': float(cantidad),
+            'importe': float(importe)
+        }
+
+
+def crear_decodificador_balanza(prefijos=None):
+    """Función de conveniencia para crear el decodificador"""
+    return DecodificadorBalanza(prefijos)
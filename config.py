@@ -25,6 +25,65 @@ class Config:
     
     # Configuración de sesiones
     PERMANENT_SESSION_LIFETIME = timedelta(hours=8)
+    
+    # Etiquetas de balanza (EAN-13 con prefijos 20-29)
+    # tipo: 'peso' (kilos embebidos) o 'precio' (importe embebido)
+    BALANZA_PREFIJOS = {
+        '20': {'tipo': 'peso', 'digitos_plu': 5, 'decimales': 3},
+        '21': {'tipo': 'peso', 'digitos_plu': 5, 'decimales': 3},
+        '22': {'tipo': 'precio', 'digitos_plu': 5, 'decimales': 2},
+        '23': {'tipo': 'precio', 'digitos_plu': 5, 'decimales': 2},
+    }
+    
+    # Exportación Excel: a partir de esta cantidad de productos se genera en segundo plano
+    EXCEL_UMBRAL_SEGUNDO_PLANO = 5000
+    
+    # Cantidad máxima de resultados de reportes guardados en memoria
+    CACHE_REPORTES_MAX_ENTRADAS = 500
+    
+    # El delta del catálogo vuelve a enviar los cambios de estos segundos previos a la
+    # versión de la caja (cubre transacciones largas, como una venta esperando a AFIP)
+    CATALOGO_MARGEN_DELTA_SEGUNDOS = 300
+    
+    # Foto columnar de ventas para analítica (se regenera todas las noches a esta hora)
+    ANALITICA_DIRECTORIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analitica')
+    ANALITICA_HORA_EXPORTACION = 3
+    
+    # Encabezados de columna aceptados al importar listas de precios .xlsx en el servidor
+    # (minúsculas, sin acentos; 'subcodigo' y 'presentacion' son opcionales)
+    IMPORTACION_ALIAS_COLUMNAS = {
+        'codigo': ['#cod', 'codigo', 'cod articulo', 'cod. articulo', 'codigo articulo'],
+        'subcodigo': ['cod', 'cod.', 'subcodigo'],
+        'descripcion': ['articulo', 'descripcion', 'producto', 'detalle', 'nombre'],
+        'presentacion': ['presentacion'],
+        'costo': ['costo c/bonif.', 'costo c/bonif', 'costo', 'precio costo'],
+        'margen': ['margen %', 'margen', 'margen (%)'],
+        'precio': ['$ precio c/iva', 'precio c/iva', 'precio', 'precio venta', 'pvp'],
+    }
+    
+    # Unidad de la columna de margen de las listas: 'porcentaje' (25 = 25%), 'fraccion'
+    # (0.25 = 25%) o None para deducirla de la columna (fracción si todos son <= 1)
+    IMPORTACION_UNIDAD_MARGEN = None
+    
+    # Backfills de datos históricos: filas de id por rango y pausa mínima entre rangos (segundos)
+    BACKFILL_TAMANO_TRAMO = 5000
+    BACKFILL_PAUSA = 0.1
+    
+    # Cuando cambia el producto base de un combo: 'mantener_precio' recalcula el
+    # descuento del combo, 'mantener_descuento' recalcula su precio
+    COMBOS_POLITICA_PRECIO = 'mantener_precio'
+    
+    # Cada cuántos segundos se buscan cambios de precio programados que ya entraron en vigencia
+    PRECIOS_PROGRAMADOS_INTERVALO = 60
+
+    # Escáner de integridad de facturas: cada cuántos segundos revisa las nuevas,
+    # diferencia de totales tolerada por redondeo, antigüedad mínima de una
+    # factura para revisarla (el descuento se registra después de confirmarla)
+    # y cuántos ids ya revisados se vuelven a mirar (ventas confirmadas tarde)
+    INTEGRIDAD_INTERVALO = 3600
+    INTEGRIDAD_TOLERANCIA = 0.05
+    INTEGRIDAD_MARGEN_SEGUNDOS = 60
+    INTEGRIDAD_VENTANA_IDS = 500
 
 class ARCAConfig:
     """Configuración para AFIP/ARCA"""
@@ -1,13 +1,13 @@
 # estadisticas.py
 from flask import Blueprint, jsonify, request
 from datetime import datetime, timedelta
-from sqlalchemy import func, extract
+from sqlalchemy import func, extract, and_, or_
 import calendar
 
 # Crear blueprint para estadísticas
 estadisticas_bp = Blueprint('estadisticas', __name__)
 
-def init_estadisticas(db, Factura, DetalleFactura, Producto):
+def init_estadisticas(db, Factura, DetalleFactura, Producto, VentaDiariaProducto, cache_reportes=None):
     """
     Inicializar el blueprint con las dependencias necesarias
     
@@ -16,84 +16,125 @@ def init_estadisticas(db, Factura, DetalleFactura, Producto):
         Factura: Modelo de Factura
         DetalleFactura: Modelo de DetalleFactura  
         Producto: Modelo de Producto
+        VentaDiariaProducto: Modelo del resumen diario de ventas por producto
+        cache_reportes: Cache de resultados (CacheReportes), opcional
     """
     
+    def con_cache(endpoint, parametros, fecha_desde, fecha_hasta, calcular):
+        """Usar el cache de reportes si fue configurado"""
+        if cache_reportes is None:
+            return calcular()
+        return cache_reportes.obtener(endpoint, parametros, fecha_desde, fecha_hasta, calcular)
+    
+    # Los filtros de fecha usan rangos semiabiertos [inicio, fin) sobre la
+    # columna sin funciones, para que MySQL pueda usar idx_factura_fecha_estado
+    def rango_ano(ano):
+        """Inicio del año y del año siguiente"""
+        return datetime(ano, 1, 1), datetime(ano + 1, 1, 1)
+    
+    def rango_mes(ano, mes):
+        """Inicio del mes y del mes siguiente"""
+        inicio = datetime(ano, mes, 1)
+        fin = datetime(ano + 1, 1, 1) if mes == 12 else datetime(ano, mes + 1, 1)
+        return inicio, fin
+    
+    def ventas_por_ano_mes(anos):
+        """Cantidad y total de ventas por (año, mes) de todos los años en una sola consulta"""
+        anos = sorted(set(anos))
+        if not anos:
+            return {}
+        
+        # Un rango semiabierto por año (los años contiguos quedan en un solo rango)
+        rangos = []
+        for ano in anos:
+            inicio, fin = rango_ano(ano)
+            if rangos and rangos[-1][1] == inicio:
+                rangos[-1] = (rangos[-1][0], fin)
+            else:
+                rangos.append((inicio, fin))
+        
+        filas = db.session.query(
+            extract('year', Factura.fecha).label('ano'),
+            extract('month', Factura.fecha).label('mes'),
+            func.count(Factura.id).label('cantidad_ventas'),
+            func.sum(Factura.total).label('total_ventas')
+        ).filter(
+            or_(*[and_(Factura.fecha >= inicio, Factura.fecha < fin) for inicio, fin in rangos]),
+            Factura.estado != 'cancelada'
+        ).group_by(
+            extract('year', Factura.fecha),
+            extract('month', Factura.fecha)
+        ).all()
+        
+        return {
+            (int(fila.ano), int(fila.mes)): (int(fila.cantidad_ventas), float(fila.total_ventas or 0))
+            for fila in filas
+        }
+    
     @estadisticas_bp.route('/api/estadisticas_ventas')
     def estadisticas_ventas():
         try:
             # Obtener parámetros
             ano = request.args.get('ano', datetime.now().year, type=int)
             
-            # Consulta para ventas por mes del año especificado
-            ventas_mensuales = db.session.query(
-                extract('month', Factura.fecha).label('mes'),
-                func.count(Factura.id).label('cantidad_ventas'),
-                func.sum(Factura.total).label('total_ventas'),
-                func.avg(Factura.total).label('promedio_venta')
-            ).filter(
-                extract('year', Factura.fecha) == ano,
-                Factura.estado != 'cancelada'
-            ).group_by(
-                extract('month', Factura.fecha)
-            ).order_by('mes').all()
-            
-            # Crear estructura de datos completa (todos los 12 meses)
-            datos_mensuales = []
-            ventas_dict = {v.mes: v for v in ventas_mensuales}
-            
-            for mes in range(1, 13):
-                venta_mes = ventas_dict.get(mes)
-                datos_mensuales.append({
-                    'mes': mes,
-                    'nombre_mes': calendar.month_name[mes],
-                    'nombre_corto': calendar.month_abbr[mes],
-                    'cantidad_ventas': int(venta_mes.cantidad_ventas) if venta_mes else 0,
-                    'total_ventas': float(venta_mes.total_ventas) if venta_mes else 0.0,
-                    'promedio_venta': float(venta_mes.promedio_venta) if venta_mes else 0.0
-                })
-            
-            # Estadísticas generales del año
-            total_ano = sum(m['total_ventas'] for m in datos_mensuales)
-            total_ventas_ano = sum(m['cantidad_ventas'] for m in datos_mensuales)
-            promedio_mensual = total_ano / 12 if total_ano > 0 else 0
-            
-            # Mes con mayores ventas
-            mes_mayor = max(datos_mensuales, key=lambda x: x['total_ventas'])
-            mes_menor = min(datos_mensuales, key=lambda x: x['total_ventas'])
-            
-            # Comparación con año anterior
-            ano_anterior = ano - 1
-            total_ano_anterior = db.session.query(
-                func.sum(Factura.total)
-            ).filter(
-                extract('year', Factura.fecha) == ano_anterior,
-                Factura.estado != 'cancelada'
-            ).scalar() or 0
-            
-            crecimiento = 0
-            if total_ano_anterior > 0:
-                crecimiento = ((total_ano - total_ano_anterior) / total_ano_anterior) * 100
-            
-            return jsonify({
-                'success': True,
-                'ano': ano,
-                'datos_mensuales': datos_mensuales,
-                'resumen': {
-                    'total_ventas_ano': total_ventas_ano,
-                    'total_dinero_ano': round(total_ano, 2),
-                    'promedio_mensual': round(promedio_mensual, 2),
-                    'mes_mayor': {
-                        'mes': mes_mayor['nombre_mes'],
-                        'total': mes_mayor['total_ventas']
-                    },
-                    'mes_menor': {
-                        'mes': mes_menor['nombre_mes'],
-                        'total': mes_menor['total_ventas']
-                    },
-                    'crecimiento_anual': round(crecimiento, 1),
-                    'total_ano_anterior': round(total_ano_anterior, 2)
+            def calcular():
+                # Año pedido y anterior en una sola consulta agrupada por año y mes
+                ventas = ventas_por_ano_mes([ano, ano - 1])
+                
+                # Crear estructura de datos completa (todos los 12 meses)
+                datos_mensuales = []
+                for mes in range(1, 13):
+                    cantidad, total = ventas.get((ano, mes), (0, 0.0))
+                    datos_mensuales.append({
+                        'mes': mes,
+                        'nombre_mes': calendar.month_name[mes],
+                        'nombre_corto': calendar.month_abbr[mes],
+                        'cantidad_ventas': cantidad,
+                        'total_ventas': total,
+                        'promedio_venta': total / cantidad if cantidad else 0.0
+                    })
+                
+                # Estadísticas generales del año
+                total_ano = sum(m['total_ventas'] for m in datos_mensuales)
+                total_ventas_ano = sum(m['cantidad_ventas'] for m in datos_mensuales)
+                promedio_mensual = total_ano / 12 if total_ano > 0 else 0
+                
+                # Mes con mayores ventas
+                mes_mayor = max(datos_mensuales, key=lambda x: x['total_ventas'])
+                mes_menor = min(datos_mensuales, key=lambda x: x['total_ventas'])
+                
+                # Comparación con año anterior
+                total_ano_anterior = sum(ventas.get((ano - 1, mes), (0, 0.0))[1] for mes in range(1, 13))
+                
+                crecimiento = 0
+                if total_ano_anterior > 0:
+                    crecimiento = ((total_ano - total_ano_anterior) / total_ano_anterior) * 100
+                
+                return {
+                    'success': True,
+                    'ano': ano,
+                    'datos_mensuales': datos_mensuales,
+                    'resumen': {
+                        'total_ventas_ano': total_ventas_ano,
+                        'total_dinero_ano': round(total_ano, 2),
+                        'promedio_mensual': round(promedio_mensual, 2),
+                        'mes_mayor': {
+                            'mes': mes_mayor['nombre_mes'],
+                            'total': mes_mayor['total_ventas']
+                        },
+                        'mes_menor': {
+                            'mes': mes_menor['nombre_mes'],
+                            'total': mes_menor['total_ventas']
+                        },
+                        'crecimiento_anual': round(crecimiento, 1),
+                        'total_ano_anterior': round(total_ano_anterior, 2)
+                    }
                 }
-            })
+            
+            return jsonify(con_cache(
+                'estadisticas_ventas', {'ano': ano},
+                datetime(ano - 1, 1, 1).date(), datetime(ano, 12, 31).date(), calcular
+            ))
             
         except Exception as e:
             return jsonify({
@@ -110,35 +151,29 @@ def init_estadisticas(db, Factura, DetalleFactura, Producto):
                 ano_actual = datetime.now().year
                 anos = [ano_actual - 1, ano_actual]
             
-            datos_comparacion = []
-            
-            for ano in anos:
-                ventas_ano = db.session.query(
-                    extract('month', Factura.fecha).label('mes'),
-                    func.sum(Factura.total).label('total')
-                ).filter(
-                    extract('year', Factura.fecha) == ano,
-                    Factura.estado != 'cancelada'
-                ).group_by(
-                    extract('month', Factura.fecha)
-                ).all()
+            def calcular():
+                # Todos los años en una sola consulta agrupada por año y mes
+                ventas = ventas_por_ano_mes(anos)
                 
-                # Crear array con todos los meses
-                ventas_mensuales = [0] * 12
-                for venta in ventas_ano:
-                    ventas_mensuales[venta.mes - 1] = float(venta.total)
+                datos_comparacion = []
+                for ano in anos:
+                    ventas_mensuales = [ventas.get((ano, mes), (0, 0))[1] for mes in range(1, 13)]
+                    datos_comparacion.append({
+                        'ano': ano,
+                        'ventas_mensuales': ventas_mensuales,
+                        'total_ano': sum(ventas_mensuales)
+                    })
                 
-                datos_comparacion.append({
-                    'ano': ano,
-                    'ventas_mensuales': ventas_mensuales,
-                    'total_ano': sum(ventas_mensuales)
-                })
+                return {
+                    'success': True,
+                    'datos': datos_comparacion,
+                    'meses': [calendar.month_abbr[i] for i in range(1, 13)]
+                }
             
-            return jsonify({
-                'success': True,
-                'datos': datos_comparacion,
-                'meses': [calendar.month_abbr[i] for i in range(1, 13)]
-            })
+            return jsonify(con_cache(
+                'comparacion_anos', {'anos': ','.join(str(ano) for ano in anos)},
+                datetime(min(anos), 1, 1).date(), datetime(max(anos), 12, 31).date(), calcular
+            ))
             
         except Exception as e:
             return jsonify({
@@ -158,24 +193,23 @@ def init_estadisticas(db, Factura, DetalleFactura, Producto):
                 'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'
             ]
             
-            # Consulta usando SQLAlchemy en lugar de SQL crudo
+            # Consulta sobre el resumen diario de ventas
+            inicio_mes, fin_mes = rango_mes(ano, mes)
             top_productos = db.session.query(
                 Producto.codigo,
                 Producto.nombre,
-                func.sum(DetalleFactura.cantidad).label('cantidad_vendida'),
-                func.sum(DetalleFactura.cantidad * DetalleFactura.precio_unitario).label('total_vendido')
-            ).join(
-                DetalleFactura, Producto.id == DetalleFactura.producto_id
+                func.sum(VentaDiariaProducto.cantidad).label('cantidad_vendida'),
+                func.sum(VentaDiariaProducto.subtotal).label('total_vendido')
             ).join(
-                Factura, DetalleFactura.factura_id == Factura.id
+                VentaDiariaProducto, Producto.id == VentaDiariaProducto.producto_id
             ).filter(
-                extract('month', Factura.fecha) == mes,
-                extract('year', Factura.fecha) == ano,
-                Factura.estado == 'autorizada'
+                VentaDiariaProducto.fecha >= inicio_mes.date(),
+                VentaDiariaProducto.fecha < fin_mes.date(),
+                VentaDiariaProducto.estado == 'autorizada'
             ).group_by(
                 Producto.id, Producto.codigo, Producto.nombre
             ).order_by(
-                func.sum(DetalleFactura.cantidad).desc()
+                func.sum(VentaDiariaProducto.cantidad).desc()
             ).limit(limite).all()
             
             productos = []
@@ -251,43 +285,43 @@ def init_estadisticas(db, Factura, DetalleFactura, Producto):
         """Resumen general para el dashboard"""
         try:
             # Ventas de hoy
-            hoy = datetime.now().date()
+            inicio_hoy = datetime.combine(datetime.now().date(), datetime.min.time())
             ventas_hoy = db.session.query(
                 func.count(Factura.id).label('cantidad'),
                 func.sum(Factura.total).label('total')
             ).filter(
-                func.date(Factura.fecha) == hoy,
+                Factura.fecha >= inicio_hoy,
+                Factura.fecha < inicio_hoy + timedelta(days=1),
                 Factura.estado != 'cancelada'
             ).first()
             
             # Ventas del mes actual
             mes_actual = datetime.now().month
             ano_actual = datetime.now().year
+            inicio_mes, fin_mes = rango_mes(ano_actual, mes_actual)
             ventas_mes = db.session.query(
                 func.count(Factura.id).label('cantidad'),
                 func.sum(Factura.total).label('total')
             ).filter(
-                extract('month', Factura.fecha) == mes_actual,
-                extract('year', Factura.fecha) == ano_actual,
+                Factura.fecha >= inicio_mes,
+                Factura.fecha < fin_mes,
                 Factura.estado != 'cancelada'
             ).first()
             
-            # Top 5 productos del mes
+            # Top 5 productos del mes (resumen diario)
             top_productos = db.session.query(
                 Producto.nombre,
-                func.sum(DetalleFactura.cantidad).label('cantidad_vendida')
+                func.sum(VentaDiariaProducto.cantidad).label('cantidad_vendida')
             ).join(
-                DetalleFactura, Producto.id == DetalleFactura.producto_id
-            ).join(
-                Factura, DetalleFactura.factura_id == Factura.id
+                VentaDiariaProducto, Producto.id == VentaDiariaProducto.producto_id
             ).filter(
-                extract('month', Factura.fecha) == mes_actual,
-                extract('year', Factura.fecha) == ano_actual,
-                Factura.estado != 'cancelada'
+                VentaDiariaProducto.fecha >= inicio_mes.date(),
+                VentaDiariaProducto.fecha < fin_mes.date(),
+                VentaDiariaProducto.estado != 'cancelada'
             ).group_by(
                 Producto.id, Producto.nombre
             ).order_by(
-                func.sum(DetalleFactura.cantidad).desc()
+                func.sum(VentaDiariaProducto.cantidad).desc()
             ).limit(5).all()
             
             return jsonify({
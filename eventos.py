@@ -0,0 +1,114 @@
+# eventos.py - Bus de eventos en proceso y canal SSE (server-sent events)
+
+import json
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+
+
+class BusEventos:
+    """Bus de eventos en memoria: cada evento se publica una vez y se reparte
+    a todas las suscripciones abiertas (una cola por navegador conectado).
+
+    Guarda los últimos eventos para que un cliente que se reconecta con
+    Last-Event-ID reciba lo que se perdió. Si lo perdido ya no está en el
+    historial o no entra en su cola recibe un único evento 'reset'.
+    """
+
+    def __init__(self, tamano_historial=200, tamano_cola=100):
+        self.tamano_cola = tamano_cola
+        self._historial = deque(maxlen=tamano_historial)
+        self._suscripciones = set()
+        self._ultimo_id = 0
+        self._lock = threading.Lock()
+        self._al_suscribir = []
+
+    def publicar(self, tipo, datos=None):
+        """Publicar un evento a todas las suscripciones"""
+        with self._lock:
+            self._ultimo_id += 1
+            evento = {
+                'id': self._ultimo_id,
+                'tipo': tipo,
+                'datos': datos if datos is not None else {},
+                'fecha': datetime.now().isoformat()
+            }
+            self._historial.append(evento)
+            suscripciones = list(self._suscripciones)
+
+        for cola in suscripciones:
+            try:
+                cola.put_nowait(evento)
+            except queue.Full:
+                # Cliente lento: se descarta el evento para no frenar al resto
+                pass
+        return evento
+
+    def suscribir(self, ultimo_id=None):
+        """Crear una suscripción; con ultimo_id se reenvían los eventos posteriores"""
+        cola = queue.Queue(maxsize=self.tamano_cola)
+        with self._lock:
+            if ultimo_id is not None:
+                pendientes = [evento for evento in self._historial if evento['id'] > ultimo_id]
+                primero = self._historial[0]['id'] if self._historial else self._ultimo_id + 1
+                if (ultimo_id + 1 < primero or ultimo_id > self._ultimo_id
+                        or len(pendientes) > self.tamano_cola):
+                    # Se perdieron eventos (salieron del historial, no entran en la
+                    # cola o el servidor se reinició): el cliente tiene que recargar
+                    cola.put_nowait(self._evento_reinicio(ultimo_id))
+                else:
+                    for evento in pendientes:
+                        cola.put_nowait(evento)
+            self._suscripciones.add(cola)
+            al_suscribir = list(self._al_suscribir)
+
+        for funcion in al_suscribir:
+            funcion()
+        return cola
+
+    def _evento_reinicio(self, ultimo_id):
+        """Evento 'reset': avisa que hay que recargar todo en lugar de reenviar"""
+        return {
+            'id': self._ultimo_id,
+            'tipo': 'reset',
+            'datos': {'ultimo_id_cliente': ultimo_id, 'ultimo_id': self._ultimo_id},
+            'fecha': datetime.now().isoformat()
+        }
+
+    def desuscribir(self, cola):
+        with self._lock:
+            self._suscripciones.discard(cola)
+
+    def al_suscribir(self, funcion):
+        """Registrar una función que se llama cada vez que se abre una suscripción"""
+        self._al_suscribir.append(funcion)
+        return funcion
+
+    @property
+    def cantidad_suscripciones(self):
+        with self._lock:
+            return len(self._suscripciones)
+
+    def generar_sse(self, cola, intervalo_ping=15):
+        """Generador de texto SSE para una suscripción (se desuscribe al cerrarse)"""
+        try:
+            # Reintento sugerido al navegador si se corta la conexión
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    evento = cola.get(timeout=intervalo_ping)
+                except queue.Empty:
+                    # Comentario SSE para mantener viva la conexión
+                    yield ': ping\n\n'
+                    continue
+
+                datos = json.dumps(evento['datos'], default=str)
+                yield f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {datos}\n\n"
+        finally:
+            self.desuscribir(cola)
+
+
+def crear_bus_eventos(tamano_historial=200, tamano_cola=100):
+    """Función de conveniencia para crear el bus de eventos"""
+    return BusEventos(tamano_historial, tamano_cola)
@@ -0,0 +1,583 @@
+# importacion_productos.py - Importación masiva de productos (alta y actualización por lotes)
+
+import unicodedata
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+# Margen con el que se estima el costo cuando el producto no tiene uno cargado
+MARGEN_DEFECTO = 30.0
+
+CENTAVO = Decimal('0.01')
+
+# Encabezados aceptados para cada dato de la lista de precios (se comparan en
+# minúsculas, sin acentos y con espacios simples). 'subcodigo' y 'presentacion'
+# son opcionales: si están, el código queda "codigo.subcodigo" y la descripción
+# suma el subcódigo y la presentación (formato de la planilla de Carnave).
+ALIAS_COLUMNAS_DEFECTO = {
+    'codigo': ['#cod', 'codigo', 'cod articulo', 'cod. articulo', 'codigo articulo'],
+    'subcodigo': ['cod', 'cod.', 'subcodigo'],
+    'descripcion': ['articulo', 'descripcion', 'producto', 'detalle', 'nombre'],
+    'presentacion': ['presentacion'],
+    'costo': ['costo c/bonif.', 'costo c/bonif', 'costo', 'precio costo'],
+    'margen': ['margen %', 'margen', 'margen (%)'],
+    'precio': ['$ precio c/iva', 'precio c/iva', 'precio', 'precio venta', 'pvp'],
+}
+
+COLUMNAS_OBLIGATORIAS = ('codigo', 'descripcion', 'precio')
+
+# Unidad de la columna de margen: 'porcentaje' (25 = 25%) o 'fraccion' (0.25 = 25%)
+UNIDADES_MARGEN = ('porcentaje', 'fraccion')
+
+# Orden en que se listan las diferencias de una simulación
+ORDEN_TIPOS_DIFERENCIA = ('nuevo', 'aumento', 'baja', 'datos', 'margen', 'faltante')
+
+
+class ImportadorProductos:
+    """Aplica un lote de filas de una lista de precios sobre la tabla de productos.
+
+    En lugar de buscar cada código por separado, trae los productos existentes
+    con una consulta IN por tramo de códigos y aplica los cambios con
+    bulk_insert_mappings / bulk_update_mappings. El resultado por fila es el
+    mismo que el de la importación fila por fila.
+    """
+
+    def __init__(self, db, Producto, clasificar_categorias, tamano_tramo=500, al_aplicar=None):
+        self.db = db
+        self.Producto = Producto
+        # clasificar_categorias(descripciones) -> categorías, una llamada por lote
+        self.clasificar_categorias = clasificar_categorias
+        self.tamano_tramo = tamano_tramo
+        # al_aplicar(ids_nuevos, ids_actualizados, ids_precio_modificado): efectos
+        # que los eventos del ORM no ven con las operaciones masivas (el último
+        # incluye los productos a los que cambió el precio o el costo)
+        self.al_aplicar = al_aplicar
+
+    @staticmethod
+    def _nuevo_resultado():
+        return {
+            'nuevos': 0,
+            'actualizados': 0,
+            'sin_cambios': 0,
+            'errores': 0,
+            'detalles_errores': [],
+            'productos_procesados': []
+        }
+
+    @staticmethod
+    def _registrar_error(resultados, fila, mensaje, error):
+        fila['estado'] = 'error'
+        fila['mensaje'] = mensaje
+        resultados['errores'] += 1
+        resultados['detalles_errores'].append({'error': error, 'codigo': fila['codigo']})
+
+    @staticmethod
+    def normalizar_fila(producto_data):
+        """(codigo, descripcion, precio) limpios; lanza excepción si faltan datos"""
+        codigo = str(producto_data['codigo']).strip().upper()
+        descripcion = str(producto_data['descripcion']).strip()
+        precio = float(producto_data['precio'])
+        return codigo, descripcion, precio
+
+    def existentes(self, codigos):
+        """Productos existentes por código (en mayúsculas), con una consulta IN por tramo"""
+        Producto = self.Producto
+        codigos = list(codigos)
+        encontrados = {}
+
+        for inicio in range(0, len(codigos), self.tamano_tramo):
+            tramo = codigos[inicio:inicio + self.tamano_tramo]
+            filas = self.db.session.query(
+                Producto.id, Producto.codigo, Producto.nombre, Producto.descripcion,
+                Producto.precio, Producto.costo, Producto.margen
+            ).filter(Producto.codigo.in_(tramo)).all()
+            for fila in filas:
+                encontrados[fila.codigo.strip().upper()] = fila
+
+        return encontrados
+
+    @staticmethod
+    def _costo_por_defecto(precio):
+        """Costo estimado con el margen por defecto (productos sin costo cargado)"""
+        costo_calculado = precio / (1 + (MARGEN_DEFECTO / 100))
+        return {'costo': Decimal(str(costo_calculado)), 'margen': Decimal(str(MARGEN_DEFECTO))}
+
+    def cambios_actualizacion(self, existente, descripcion, precio):
+        """Columnas que la importación modificaría en un producto existente ({} si ninguna)"""
+        cambios = {}
+        precio_nuevo = Decimal(str(precio)).quantize(CENTAVO, rounding=ROUND_HALF_UP)
+        if existente.precio is None or Decimal(str(existente.precio)) != precio_nuevo:
+            cambios['precio'] = Decimal(str(precio))
+        if existente.nombre != descripcion:
+            cambios['nombre'] = descripcion
+        if existente.descripcion != descripcion:
+            cambios['descripcion'] = descripcion
+        if not existente.costo or existente.costo == 0:
+            cambios.update(self._costo_por_defecto(precio))
+        return cambios
+
+    def procesar(self, productos, opciones):
+        """Procesar el lote y confirmarlo; devuelve el reporte por fila"""
+        solo_actualizar = opciones.get('solo_actualizar', False)
+        crear_nuevos = opciones.get('crear_nuevos', True)
+        resultados = self._nuevo_resultado()
+
+        # 1) Validar y normalizar todas las filas
+        validas = []
+        for producto_data in productos:
+            fila = {
+                'codigo': producto_data.get('codigo', 'UNKNOWN'),
+                'estado': 'error',
+                'mensaje': ''
+            }
+            resultados['productos_procesados'].append(fila)
+
+            try:
+                codigo, descripcion, precio = self.normalizar_fila(producto_data)
+                fila['codigo'] = codigo
+
+                if not codigo or not descripcion or precio <= 0:
+                    self._registrar_error(resultados, fila, 'Datos inválidos', f'Datos inválidos para código {codigo}')
+                    continue
+
+                validas.append((fila, producto_data, codigo, descripcion, precio))
+            except Exception as e:
+                self._registrar_error(
+                    resultados, fila, f'Error: {str(e)}',
+                    f'Error procesando {producto_data.get("codigo", "UNKNOWN")}: {str(e)}'
+                )
+                print(f"❌ Error en producto {producto_data.get('codigo', 'UNKNOWN')}: {str(e)}")
+
+        # 2) Traer los productos existentes de todo el lote
+        existentes = self.existentes({codigo for _, _, codigo, _, _ in validas})
+
+        # 3) Armar las altas y las modificaciones de los productos que cambian
+        ahora = datetime.now()
+        altas = {}
+        modificaciones = {}
+
+        for fila, producto_data, codigo, descripcion, precio in validas:
+            try:
+                existente = existentes.get(codigo)
+
+                if existente is not None or codigo in altas:
+                    if not solo_actualizar:
+                        self._registrar_error(
+                            resultados, fila, 'Producto ya existe (actualización deshabilitada)',
+                            f'Producto {codigo} ya existe (actualización deshabilitada)'
+                        )
+                        continue
+
+                    if codigo in altas:
+                        # Alta del mismo lote: se corrige antes de insertar
+                        mapping = altas[codigo]
+                        costo_actual = mapping['costo']
+                        mapping.update({
+                            'precio': Decimal(str(precio)),
+                            'nombre': descripcion,
+                            'descripcion': descripcion
+                        })
+                        if not costo_actual or costo_actual == 0:
+                            mapping.update(self._costo_por_defecto(precio))
+                    else:
+                        # Solo se escriben los productos que cambian (si el código se
+                        # repite en el lote, la última fila es la que queda)
+                        cambios = self.cambios_actualizacion(existente, descripcion, precio)
+                        if not cambios:
+                            modificaciones.pop(codigo, None)
+                            fila['estado'] = 'sin_cambios'
+                            fila['mensaje'] = 'Sin cambios'
+                            resultados['sin_cambios'] += 1
+                            continue
+                        cambios.update({'id': existente.id, 'fecha_modificacion': ahora})
+                        modificaciones[codigo] = cambios
+
+                    fila['estado'] = 'actualizado'
+                    fila['mensaje'] = 'Producto actualizado correctamente'
+                    resultados['actualizados'] += 1
+                else:
+                    if not crear_nuevos:
+                        self._registrar_error(
+                            resultados, fila, 'Producto no existe (creación deshabilitada)',
+                            f'Producto {codigo} no existe (creación deshabilitada)'
+                        )
+                        continue
+
+                    altas[codigo] = {
+                        'codigo': codigo,
+                        'nombre': descripcion,
+                        'descripcion': descripcion,
+                        'precio': Decimal(str(precio)),
+                        'costo': Decimal(str(float(producto_data.get('costo', 0)))),
+                        'margen': Decimal(str(float(producto_data.get('margen', MARGEN_DEFECTO)))),
+                        'stock': 0,
+                        'categoria': None,  # se clasifica todo el lote junto
+                        'iva': Decimal('21.0'),
+                        'activo': True,
+                        'es_combo': False,
+                        'fecha_creacion': ahora,
+                        'fecha_modificacion': ahora
+                    }
+
+                    fila['estado'] = 'nuevo'
+                    fila['mensaje'] = 'Producto creado correctamente'
+                    resultados['nuevos'] += 1
+            except Exception as e:
+                self._registrar_error(
+                    resultados, fila, f'Error: {str(e)}',
+                    f'Error procesando {producto_data.get("codigo", "UNKNOWN")}: {str(e)}'
+                )
+                print(f"❌ Error en producto {producto_data.get('codigo', 'UNKNOWN')}: {str(e)}")
+
+        if altas:
+            categorias = self.clasificar_categorias([alta['descripcion'] for alta in altas.values()])
+            for alta, categoria in zip(altas.values(), categorias):
+                alta['categoria'] = categoria
+
+        # 4) Aplicar todo en la misma transacción
+        try:
+            self.aplicar(list(altas.values()), list(modificaciones.values()))
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            raise
+
+        return resultados
+
+    def aplicar(self, altas, modificaciones):
+        """Insertar y actualizar con operaciones masivas (sin confirmar)"""
+        Producto = self.Producto
+        session = self.db.session
+
+        if altas:
+            session.bulk_insert_mappings(Producto, altas)
+        if modificaciones:
+            session.bulk_update_mappings(Producto, modificaciones)
+
+        if self.al_aplicar and (altas or modificaciones):
+            ids_nuevos = [fila.id for fila in self.existentes(alta['codigo'] for alta in altas).values()]
+            ids_actualizados = [mapping['id'] for mapping in modificaciones]
+            ids_precio_modificado = [
+                mapping['id'] for mapping in modificaciones if 'precio' in mapping or 'costo' in mapping
+            ]
+            self.al_aplicar(ids_nuevos, ids_actualizados, ids_precio_modificado)
+
+    # ------------------------------------------------------------------
+    # Simulación (diferencias sin escribir)
+    # ------------------------------------------------------------------
+
+    def catalogo(self, tamano_lote=2000):
+        """Catálogo completo por código (en mayúsculas)"""
+        Producto = self.Producto
+        filas = self.db.session.query(
+            Producto.id, Producto.codigo, Producto.nombre, Producto.descripcion,
+            Producto.precio, Producto.costo, Producto.margen, Producto.activo, Producto.es_combo
+        ).yield_per(tamano_lote)
+        return {fila.codigo.strip().upper(): fila for fila in filas}
+
+    def comparar(self, productos, opciones=None):
+        """Diferencias entre la lista y el catálogo actual, sin escribir nada.
+
+        Devuelve {'resumen': {...}, 'diferencias': [...]} con una entrada por
+        código nuevo, cambio de precio o de datos, cambio de margen y producto
+        activo que no figura en la lista. 'aplica' indica si importar la lista
+        con las mismas opciones que procesar escribe esa diferencia (el margen
+        y los faltantes son informativos); 'rechazo' dice por qué no.
+        """
+        opciones = opciones or {}
+        solo_actualizar = opciones.get('solo_actualizar', False)
+        crear_nuevos = opciones.get('crear_nuevos', True)
+        catalogo = self.catalogo()
+
+        # Lista entrante por código (la última fila gana, como al importar)
+        entrantes = {}
+        errores = 0
+        for producto_data in productos:
+            try:
+                codigo, descripcion, precio = self.normalizar_fila(producto_data)
+            except Exception:
+                errores += 1
+                continue
+            if not codigo or not descripcion or precio <= 0:
+                errores += 1
+                continue
+            entrantes[codigo] = (producto_data, descripcion, precio)
+
+        diferencias = []
+        sin_cambios = 0
+        rechazados = 0
+        for codigo, (producto_data, descripcion, precio) in entrantes.items():
+            existente = catalogo.get(codigo)
+            margen_lista = producto_data.get('margen')
+
+            if existente is None:
+                diferencias.append({
+                    'codigo': codigo,
+                    'tipo': 'nuevo',
+                    'aplica': crear_nuevos,
+                    'rechazo': None if crear_nuevos else 'Producto no existe (creación deshabilitada)',
+                    'descripcion': descripcion,
+                    'precio_nuevo': round(precio, 2),
+                    'costo_nuevo': producto_data.get('costo'),
+                    'margen_nuevo': margen_lista
+                })
+                rechazados += 0 if crear_nuevos else 1
+                continue
+
+            # Igual que procesar: sin solo_actualizar un código existente es error
+            rechazo = None if solo_actualizar else 'Producto ya existe (actualización deshabilitada)'
+            if rechazo:
+                rechazados += 1
+
+            cambios = self.cambios_actualizacion(existente, descripcion, precio)
+            precio_anterior = float(existente.precio or 0)
+            margen_anterior = float(existente.margen) if existente.margen is not None else None
+            cambio_margen = (
+                margen_lista is not None and margen_anterior is not None
+                and abs(float(margen_lista) - margen_anterior) >= 0.01
+            )
+
+            # procesar cuenta como 'sin cambios' lo que no escribe (el margen es informativo)
+            if not cambios and not rechazo:
+                sin_cambios += 1
+
+            if 'precio' in cambios:
+                tipo = 'aumento' if precio > precio_anterior else 'baja'
+            elif cambios:
+                tipo = 'datos'
+            elif cambio_margen:
+                tipo = 'margen'
+            else:
+                continue
+
+            diferencias.append({
+                'codigo': codigo,
+                'tipo': tipo,
+                'aplica': bool(cambios) and not rechazo,
+                'rechazo': rechazo,
+                'descripcion': descripcion,
+                'descripcion_anterior': existente.nombre,
+                'precio_anterior': precio_anterior,
+                'precio_nuevo': round(precio, 2),
+                'variacion_porcentaje': round((precio - precio_anterior) / precio_anterior * 100, 2) if precio_anterior else None,
+                'margen_anterior': margen_anterior,
+                'margen_nuevo': margen_lista,
+                'cambio_margen': cambio_margen
+            })
+
+        # Productos activos del catálogo que no vienen en la lista (los combos no)
+        for codigo, fila in catalogo.items():
+            if fila.activo and not fila.es_combo and codigo not in entrantes:
+                diferencias.append({
+                    'codigo': fila.codigo,
+                    'tipo': 'faltante',
+                    'aplica': False,
+                    'descripcion': fila.nombre,
+                    'precio_anterior': float(fila.precio or 0)
+                })
+
+        diferencias.sort(key=lambda d: (
+            ORDEN_TIPOS_DIFERENCIA.index(d['tipo']),
+            -abs(d.get('variacion_porcentaje') or 0),
+            d['codigo']
+        ))
+
+        variaciones = [d['variacion_porcentaje'] for d in diferencias if d.get('variacion_porcentaje') is not None and d['tipo'] in ('aumento', 'baja')]
+        contar = lambda tipo: sum(1 for d in diferencias if d['tipo'] == tipo)
+        resumen = {
+            'total_lista': len(entrantes),
+            'errores': errores,
+            'nuevos': contar('nuevo'),
+            'aumentos': contar('aumento'),
+            'bajas': contar('baja'),
+            'cambios_datos': contar('datos'),
+            'cambios_margen': sum(1 for d in diferencias if d.get('cambio_margen')),
+            'sin_cambios': sin_cambios,
+            'rechazados': rechazados,
+            'faltantes': contar('faltante'),
+            'escrituras': sum(1 for d in diferencias if d['aplica']),
+            'variacion_promedio': round(sum(variaciones) / len(variaciones), 2) if variaciones else 0.0
+        }
+        return {'resumen': resumen, 'diferencias': diferencias}
+
+    @staticmethod
+    def paginar_diferencias(diferencias, tipo=None, pagina=1, por_pagina=50):
+        """Una página de las diferencias (opcionalmente de un solo tipo)"""
+        if tipo:
+            diferencias = [d for d in diferencias if d['tipo'] == tipo]
+        por_pagina = max(1, min(por_pagina, 500))
+        total = len(diferencias)
+        paginas = max(1, -(-total // por_pagina))
+        pagina = max(1, min(pagina, paginas))
+        inicio = (pagina - 1) * por_pagina
+        return {
+            'diferencias': diferencias[inicio:inicio + por_pagina],
+            'pagina': pagina,
+            'paginas': paginas,
+            'por_pagina': por_pagina,
+            'total': total
+        }
+
+
+def normalizar_encabezado(texto):
+    """Minúsculas, sin acentos y con espacios simples"""
+    texto = unicodedata.normalize('NFKD', str(texto or ''))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+
+def _texto_celda(valor):
+    """Texto de una celda; los números enteros sin '.0' (códigos numéricos)"""
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def _numero_celda(valor):
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        return None
+    if isinstance(valor, str):
+        valor = valor.replace('$', '').strip()
+    return float(valor)
+
+
+class LectorListaPrecios:
+    """Lee una lista de precios .xlsx fila por fila (openpyxl en modo read-only).
+
+    Ubica la fila de encabezados por los alias de columna y entrega cada fila
+    como el dict que recibe ImportadorProductos.procesar(), sin cargar la hoja
+    completa en memoria. La unidad del margen se decide una vez para toda la
+    columna: la indicada o, si no se indica, fracción solo si todos los
+    márgenes de la lista son menores o iguales a 1.
+    """
+
+    def __init__(self, archivo, alias=None, filas_busqueda_encabezado=20, unidad_margen=None):
+        import openpyxl
+
+        if unidad_margen is not None and unidad_margen not in UNIDADES_MARGEN:
+            raise ValueError(f"Unidad de margen inválida: {unidad_margen} (usar {' o '.join(UNIDADES_MARGEN)})")
+
+        self.alias = {
+            campo: {normalizar_encabezado(nombre) for nombre in nombres}
+            for campo, nombres in (alias or ALIAS_COLUMNAS_DEFECTO).items()
+        }
+        self.filas_busqueda_encabezado = filas_busqueda_encabezado
+        self._libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+        self._hoja = self._libro.worksheets[0]
+        # Estimación desde la dimensión guardada en el archivo (puede faltar)
+        self.total_filas = self._hoja.max_row
+        self.columnas = None
+        self.fila_encabezado = None
+        self.unidad_margen = unidad_margen
+
+    def _mapear_encabezado(self, valores):
+        """{campo: índice de columna} si la fila tiene las columnas obligatorias"""
+        columnas = {}
+        for indice, valor in enumerate(valores):
+            encabezado = normalizar_encabezado(valor)
+            if not encabezado:
+                continue
+            for campo, nombres in self.alias.items():
+                if campo not in columnas and encabezado in nombres:
+                    columnas[campo] = indice
+                    break
+        # Una sola columna "COD": es el código del producto
+        if 'codigo' not in columnas and 'subcodigo' in columnas:
+            columnas['codigo'] = columnas.pop('subcodigo')
+        if all(campo in columnas for campo in COLUMNAS_OBLIGATORIAS):
+            return columnas
+        return None
+
+    def _deducir_unidad_margen(self):
+        """'fraccion' si todos los márgenes de la columna son <= 1, si no 'porcentaje'"""
+        indice = self.columnas['margen'] + 1
+        for (valor,) in self._hoja.iter_rows(
+            min_row=self.fila_encabezado + 1, min_col=indice, max_col=indice, values_only=True
+        ):
+            try:
+                margen = _numero_celda(valor)
+            except (TypeError, ValueError):
+                continue
+            if margen is not None and margen > 1:
+                return 'porcentaje'
+        return 'fraccion'
+
+    def filas(self):
+        """Generar (número de fila, datos, error) por cada fila de productos.
+
+        datos es None para las filas que se omiten (vacías o de categoría) y
+        error es el mensaje de una fila que no se pudo interpretar.
+        """
+        try:
+            for numero, valores in enumerate(self._hoja.iter_rows(values_only=True), start=1):
+                if self.columnas is None:
+                    self.columnas = self._mapear_encabezado(valores)
+                    if self.columnas is not None:
+                        self.fila_encabezado = numero
+                        if 'margen' in self.columnas and self.unidad_margen is None:
+                            self.unidad_margen = self._deducir_unidad_margen()
+                    elif numero >= self.filas_busqueda_encabezado:
+                        raise ValueError(
+                            'No se encontró la fila de encabezados (se necesitan columnas de '
+                            'código, descripción y precio)'
+                        )
+                    continue
+
+                yield (numero,) + self._interpretar(valores)
+        finally:
+            self.cerrar()
+
+    def _interpretar(self, valores):
+        """(datos, error) de una fila de la lista"""
+        def celda(campo):
+            indice = self.columnas.get(campo)
+            if indice is None or indice >= len(valores):
+                return None
+            return valores[indice]
+
+        codigo = _texto_celda(celda('codigo'))
+        # Filas vacías o de categoría (empiezan con #)
+        if not codigo or codigo.startswith('#'):
+            return None, None
+
+        try:
+            subcodigo = _texto_celda(celda('subcodigo'))
+            if subcodigo:
+                codigo = f'{codigo}.{subcodigo}'
+
+            partes = [_texto_celda(celda('descripcion')), subcodigo, _texto_celda(celda('presentacion'))]
+            datos = {
+                'codigo': codigo,
+                'descripcion': ' '.join(parte for parte in partes if parte),
+                'precio': _numero_celda(celda('precio'))
+            }
+            if datos['precio'] is None:
+                return None, f'Código {codigo}: sin precio'
+
+            costo = _numero_celda(celda('costo'))
+            if costo is not None:
+                datos['costo'] = round(costo, 2)
+
+            margen = _numero_celda(celda('margen'))
+            if margen is not None:
+                # La planilla puede traer el margen como fracción (0.25 = 25%)
+                datos['margen'] = round(margen * 100 if self.unidad_margen == 'fraccion' else margen, 2)
+
+            datos['precio'] = round(datos['precio'], 2)
+            return datos, None
+        except (TypeError, ValueError) as e:
+            return None, f'Código {codigo}: {e}'
+
+    def cerrar(self):
+        self._libro.close()
+
+
+def crear_importador_productos(db, Producto, clasificar_categorias, tamano_tramo=500, al_aplicar=None):
+    """Función de conveniencia para crear el importador de productos"""
+    return ImportadorProductos(db, Producto, clasificar_categorias, tamano_tramo, al_aplicar)
+
+
+def crear_lector_lista_precios(archivo, alias=None, unidad_margen=None):
+    """Función de conveniencia para abrir una lista de precios"""
+    return LectorListaPrecios(archivo, alias, unidad_margen=unidad_margen)
@@ -0,0 +1,133 @@
+# migraciones.py - Registro de migraciones de esquema y datos con versión en la base
+
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+
+class RegistroMigraciones:
+    """Migraciones numeradas que se aplican una sola vez y en orden.
+
+    La tabla schema_version guarda una fila por migración aplicada. Al iniciar
+    alcanza con leer la versión máxima: si está al día no se ejecuta nada.
+    Si faltan migraciones se toma un bloqueo con nombre (GET_LOCK en MySQL)
+    para que dos procesos que arrancan a la vez no las apliquen dos veces: el
+    segundo espera a que el primero termine y vuelve a leer la versión.
+
+    Cada migración corre en su propia transacción junto con el registro de su
+    versión; si falla se deshace y no se siguen aplicando las posteriores. Las
+    que confirman por tramos o hacen DDL (que MySQL confirma solo) tienen que
+    poder repetirse sin efectos si se cortan a mitad de camino.
+    """
+
+    def __init__(self, db, VersionEsquema, nombre_bloqueo='pos_migraciones', espera_bloqueo=60):
+        self.db = db
+        self.VersionEsquema = VersionEsquema
+        self.nombre_bloqueo = nombre_bloqueo
+        self.espera_bloqueo = espera_bloqueo
+        self._migraciones = {}
+        self._lock = threading.Lock()
+
+    def migracion(self, version, descripcion):
+        """Decorador para registrar una migración"""
+        def registrar(funcion):
+            if version in self._migraciones:
+                raise ValueError(f'Versión de migración repetida: {version}')
+            self._migraciones[version] = {
+                'version': version,
+                'descripcion': descripcion,
+                'funcion': funcion
+            }
+            return funcion
+        return registrar
+
+    @property
+    def ultima_version(self):
+        return max(self._migraciones, default=0)
+
+    def version_actual(self):
+        """Versión aplicada (crea la tabla schema_version la primera vez)"""
+        tabla = self.VersionEsquema.__table__
+        try:
+            with self.db.engine.connect() as conexion:
+                return conexion.execute(select(func.max(tabla.c.version))).scalar() or 0
+        except SQLAlchemyError:
+            tabla.create(self.db.engine, checkfirst=True)
+            return 0
+
+    def aplicadas(self):
+        """Migraciones aplicadas, de la más reciente a la más antigua"""
+        VersionEsquema = self.VersionEsquema
+        return VersionEsquema.query.order_by(VersionEsquema.version.desc()).all()
+
+    def pendientes(self, version=None):
+        version = self.version_actual() if version is None else version
+        return [self._migraciones[v] for v in sorted(self._migraciones) if v > version]
+
+    def ejecutar(self):
+        """Aplicar las migraciones pendientes; devuelve la cantidad aplicada"""
+        if self.version_actual() >= self.ultima_version:
+            return 0
+
+        with self._lock, self.db.engine.connect() as conexion_bloqueo:
+            self._bloquear(conexion_bloqueo)
+            try:
+                # Otro proceso pudo aplicarlas mientras se esperaba el bloqueo
+                aplicadas = 0
+                for migracion in self.pendientes():
+                    self._aplicar(migracion)
+                    aplicadas += 1
+                return aplicadas
+            finally:
+                self._desbloquear(conexion_bloqueo)
+
+    def _aplicar(self, migracion):
+        session = self.db.session
+        inicio = time.perf_counter()
+        print(f"🔄 Migración {migracion['version']}: {migracion['descripcion']}...")
+
+        try:
+            migracion['funcion']()
+            session.add(self.VersionEsquema(
+                version=migracion['version'],
+                descripcion=migracion['descripcion'][:200],
+                fecha_aplicacion=datetime.now(),
+                duracion_ms=int((time.perf_counter() - inicio) * 1000)
+            ))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"❌ Error en migración {migracion['version']}: {e}")
+            raise
+
+        print(f"✅ Migración {migracion['version']} aplicada ({time.perf_counter() - inicio:.1f}s)")
+
+    def _bloquear(self, conexion):
+        if conexion.dialect.name != 'mysql':
+            return
+        # Se espera lo que haga falta: una migración larga (reconstruir
+        # resúmenes) puede superar la espera de un GET_LOCK y este proceso no
+        # debe atender pedidos con el esquema a medio migrar
+        while True:
+            obtenido = conexion.execute(
+                text('SELECT GET_LOCK(:nombre, :espera)'),
+                {'nombre': self.nombre_bloqueo, 'espera': self.espera_bloqueo}
+            ).scalar()
+            if obtenido == 1:
+                return
+            if obtenido is None:
+                raise RuntimeError('Error al pedir el bloqueo de migraciones')
+            print("⏳ Otro proceso está aplicando migraciones, esperando a que termine...")
+
+    def _desbloquear(self, conexion):
+        if conexion.dialect.name != 'mysql':
+            return
+        conexion.execute(text('SELECT RELEASE_LOCK(:nombre)'), {'nombre': self.nombre_bloqueo})
+
+
+def crear_registro_migraciones(db, VersionEsquema, nombre_bloqueo='pos_migraciones', espera_bloqueo=60):
+    """Función de conveniencia para crear el registro de migraciones"""
+    return RegistroMigraciones(db, VersionEsquema, nombre_bloqueo, espera_bloqueo)
@@ -0,0 +1,158 @@
+# migration_indices_reportes.py
+# Crear los índices que usan los reportes y verificar con EXPLAIN que las
+# consultas principales no recorren la tabla completa.
+# Se puede ejecutar más de una vez: solo crea los índices que faltan.
+
+import mysql.connector
+from datetime import datetime, timedelta
+
+# *** CONFIGURAR TUS DATOS DE MySQL AQUÍ ***
+MYSQL_CONFIG = {
+    'host': 'localhost',  # Cambiar si es necesario
+    'user': 'pos_user',   # Tu usuario MySQL
+    'password': 'pos_password',  # Tu contraseña MySQL
+    'database': 'pos_argentina'  # Tu base de datos
+}
+
+# Tabla -> [(nombre_indice, columnas)]
+INDICES_REPORTES = {
+    'factura': [
+        ('idx_factura_fecha_estado', ['fecha', 'estado']),
+        ('idx_factura_fecha_id', ['fecha', 'id']),
+    ],
+    'detalle_factura': [
+        ('idx_detalle_factura_producto', ['factura_id', 'producto_id']),
+    ],
+    'medios_pago': [
+        ('idx_medios_pago_fecha_medio', ['fecha_registro', 'medio_pago']),
+    ],
+    'gastos': [
+        ('idx_gastos_fecha_activo', ['fecha', 'activo']),
+    ],
+}
+
+
+def consultas_representativas():
+    """Consultas de los reportes con los mismos predicados que usa la aplicación"""
+    hoy = datetime.combine(datetime.now().date(), datetime.min.time())
+    manana = hoy + timedelta(days=1)
+    inicio_ano = datetime(hoy.year, 1, 1)
+    fin_ano = datetime(hoy.year + 1, 1, 1)
+    inicio_mes = hoy.replace(day=1)
+
+    return [
+        ('Dashboard - ventas del día',
+         "SELECT COUNT(id), SUM(total) FROM factura WHERE fecha >= %s AND fecha < %s",
+         (hoy, manana)),
+        ('Estadísticas - ventas por mes del año',
+         "SELECT MONTH(fecha), COUNT(id), SUM(total) FROM factura "
+         "WHERE fecha >= %s AND fecha < %s AND estado != 'cancelada' GROUP BY MONTH(fecha)",
+         (inicio_ano, fin_ano)),
+        ('Reportes - detalle de facturas del período',
+         "SELECT d.producto_id, SUM(d.cantidad), SUM(d.subtotal) FROM factura f "
+         "JOIN detalle_factura d ON d.factura_id = f.id "
+         "WHERE f.fecha >= %s AND f.fecha < %s GROUP BY d.producto_id",
+         (inicio_mes, manana)),
+        ('Reportes - medios de pago del período',
+         "SELECT medio_pago, SUM(importe), COUNT(id) FROM medios_pago "
+         "WHERE fecha_registro >= %s AND fecha_registro < %s GROUP BY medio_pago",
+         (inicio_mes, manana)),
+        ('Gastos - gastos activos del período',
+         "SELECT categoria, SUM(monto) FROM gastos "
+         "WHERE fecha >= %s AND fecha < %s AND activo = 1 GROUP BY categoria",
+         (inicio_mes.date(), manana.date())),
+    ]
+
+
+def obtener_indices_existentes(cursor, tabla):
+    """Nombres de los índices que ya tiene la tabla"""
+    cursor.execute("""
+        SELECT DISTINCT index_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+    """, (tabla,))
+    return {fila[0] for fila in cursor.fetchall()}
+
+
+def crear_indices_faltantes(conexion):
+    """Crear los índices de reportes que no existan todavía"""
+    cursor = conexion.cursor()
+    creados = 0
+
+    try:
+        for tabla, indices in INDICES_REPORTES.items():
+            existentes = obtener_indices_existentes(cursor, tabla)
+
+            for nombre, columnas in indices:
+                if nombre in existentes:
+                    print(f"   ✓ {tabla}.{nombre} ya existe")
+                    continue
+
+                print(f"   🔧 Creando {tabla}.{nombre} ({', '.join(columnas)})...")
+                cursor.execute(f"CREATE INDEX {nombre} ON {tabla} ({', '.join(columnas)})")
+                creados += 1
+                print(f"   ✅ {tabla}.{nombre} creado")
+
+        conexion.commit()
+        return creados
+    finally:
+        cursor.close()
+
+
+def verificar_planes(conexion):
+    """Ejecutar EXPLAIN sobre las consultas de reportes y marcar los recorridos completos"""
+    cursor = conexion.cursor(dictionary=True)
+    problemas = 0
+
+    try:
+        for descripcion, sql, parametros in consultas_representativas():
+            cursor.execute("EXPLAIN " + sql, parametros)
+            plan = cursor.fetchall()
+
+            print(f"\n📋 {descripcion}")
+            for paso in plan:
+                tipo = paso.get('type')
+                indice = paso.get('key') or '-'
+                filas = paso.get('rows')
+                if tipo == 'ALL':
+                    problemas += 1
+                    print(f"   ⚠️ {paso.get('table')}: recorrido completo (filas estimadas: {filas})")
+                else:
+                    print(f"   ✅ {paso.get('table')}: {tipo} usando {indice} (filas estimadas: {filas})")
+
+        return problemas
+    finally:
+        cursor.close()
+
+
+if __name__ == "__main__":
+    print("🚀 Índices para reportes de ventas, medios de pago y gastos")
+    print("=" * 60)
+
+    try:
+        conexion = mysql.connector.connect(**MYSQL_CONFIG)
+        print(f"✅ Conectado a MySQL en {MYSQL_CONFIG['host']}")
+    except mysql.connector.Error as e:
+        print(f"❌ Error conectando a MySQL: {e}")
+        print("💡 Verifica tu configuración de conexión en MYSQL_CONFIG")
+        exit(1)
+
+    try:
+        print("\n🔍 Verificando índices...")
+        creados = crear_indices_faltantes(conexion)
+        print(f"\n📊 Índices creados: {creados}")
+
+        print("\n🔍 Verificando planes de ejecución (EXPLAIN)...")
+        problemas = verificar_planes(conexion)
+
+        print("\n" + "=" * 60)
+        if problemas:
+            print(f"⚠️ {problemas} consulta(s) recorren una tabla completa")
+            print("💡 Con pocas filas MySQL puede preferir un recorrido completo; repetir con datos reales")
+        else:
+            print("🎉 Todas las consultas de reportes usan índices")
+    except mysql.connector.Error as e:
+        print(f"❌ Error MySQL: {e}")
+        exit(1)
+    finally:
+        conexion.close()
+        print("🔌 Conexión cerrada")
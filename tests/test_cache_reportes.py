@@ -0,0 +1,72 @@
+# test_cache_reportes.py - Invalidación del cache de reportes
+
+import unittest
+from datetime import date, timedelta
+
+from cache_reportes import crear_cache_reportes
+
+HOY = date.today()
+AYER = HOY - timedelta(days=1)
+SEMANA_PASADA = HOY - timedelta(days=7)
+
+
+class CacheReportesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = crear_cache_reportes(max_entradas=3)
+        self.calculos = 0
+
+    def _obtener(self, parametros, desde, hasta, endpoint='reporte'):
+        def calcular():
+            self.calculos += 1
+            return self.calculos
+        return self.cache.obtener(endpoint, parametros, desde, hasta, calcular)
+
+    def test_parametros_normalizados(self):
+        self.assertEqual(
+            self.cache.normalizar_parametros({'b': [' 2', '1'], 'a': 'x ', 'vacio': '', 'nulo': None}),
+            (('a', 'x'), ('b', ('1', '2')))
+        )
+        self._obtener({'a': 'x', 'b': ['2', '1']}, SEMANA_PASADA, AYER)
+        self._obtener({'b': ['1', '2'], 'a': ' x', 'c': ''}, SEMANA_PASADA, AYER)
+        self.assertEqual(self.calculos, 1)
+
+    def test_periodo_cerrado_sobrevive_a_ventas_de_hoy(self):
+        self._obtener({}, SEMANA_PASADA, AYER)
+        self.cache.registrar_cambio([HOY])
+        self.assertEqual(self._obtener({}, SEMANA_PASADA, AYER), 1)
+
+    def test_periodo_cerrado_se_descarta_con_cambio_en_su_rango(self):
+        self._obtener({}, SEMANA_PASADA, AYER)
+        self.cache.registrar_cambio([AYER])
+        self.assertEqual(self._obtener({}, SEMANA_PASADA, AYER), 2)
+
+    def test_periodo_abierto_se_descarta_con_cualquier_cambio(self):
+        self._obtener({}, AYER, HOY)
+        self.assertEqual(self._obtener({}, AYER, HOY), 1)
+        self.cache.registrar_cambio()
+        self.assertEqual(self._obtener({}, AYER, HOY), 2)
+
+    def test_no_publica_resultado_calculado_durante_un_cambio(self):
+        def calcular():
+            self.cache.registrar_cambio([AYER])
+            return 'viejo'
+        self.assertEqual(self.cache.obtener('reporte', {}, SEMANA_PASADA, AYER, calcular), 'viejo')
+        self.assertEqual(self._obtener({}, SEMANA_PASADA, AYER), 1)
+
+    def test_descarta_la_menos_usada(self):
+        for endpoint in ('a', 'b', 'c'):
+            self._obtener({}, SEMANA_PASADA, AYER, endpoint)
+        self._obtener({}, SEMANA_PASADA, AYER, 'a')
+        self._obtener({}, SEMANA_PASADA, AYER, 'd')
+        self.assertEqual(self.cache.estadisticas()['entradas'], 3)
+
+        calculos = self.calculos
+        self._obtener({}, SEMANA_PASADA, AYER, 'a')
+        self.assertEqual(self.calculos, calculos)
+        self._obtener({}, SEMANA_PASADA, AYER, 'b')
+        self.assertEqual(self.calculos, calculos + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
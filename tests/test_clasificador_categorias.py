@@ -0,0 +1,53 @@
+# test_clasificador_categorias.py - Reglas de palabras clave del clasificador
+
+import unittest
+
+from clasificador_categorias import crear_clasificador_categorias, normalizar_texto
+
+
+class ClasificadorCategoriasTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clasificador = crear_clasificador_categorias()
+
+    def test_normalizar_texto(self):
+        self.assertEqual(normalizar_texto('  Salmón   ROSADO '), 'salmon rosado')
+        self.assertEqual(normalizar_texto(None), '')
+
+    def test_limites_de_palabra(self):
+        # 'ala' no coincide dentro de 'salame'
+        self.assertEqual(self.clasificador.clasificar('Salame milan'), 'CHACINADOS')
+        self.assertEqual(self.clasificador.clasificar('Ala de pollo'), 'POLLO')
+
+    def test_plural_simple(self):
+        self.assertEqual(self.clasificador.clasificar('Tomates perita'), 'VERDURAS')
+        self.assertEqual(self.clasificador.clasificar('Panes de viena'), 'PANADERIA')
+
+    def test_gana_la_mayor_prioridad(self):
+        # 'chorizo' está en CARNE y CHACINADOS: CARNE tiene más prioridad
+        self.assertEqual(self.clasificador.clasificar('Chorizo parrillero'), 'CARNE')
+        self.assertEqual(self.clasificador.clasificar('Queso y pollo'), 'POLLO')
+
+    def test_frase_mas_larga(self):
+        clasificador = crear_clasificador_categorias([
+            ('costilla', 'CARNE', 10),
+            ('costilla cerdo', 'CERDO', 10),
+        ])
+        self.assertEqual(clasificador.clasificar('Costilla cerdo'), 'CERDO')
+        self.assertEqual(clasificador.clasificar('Costilla ancha'), 'CARNE')
+
+    def test_lote_igual_a_clasificar_de_a_uno(self):
+        descripciones = ['Leche entera', 'Detergente', 'Tornillos', '', 'Agua sin gas', 'Merluza']
+        self.assertEqual(
+            self.clasificador.clasificar_lote(descripciones),
+            [self.clasificador.clasificar(d) for d in descripciones]
+        )
+
+    def test_defecto(self):
+        self.assertEqual(self.clasificador.clasificar('Tornillos'), 'GENERAL')
+        self.assertIsNone(self.clasificador.clasificar('Tornillos', defecto=None))
+        self.assertEqual(crear_clasificador_categorias([]).clasificar_lote(['Leche']), ['GENERAL'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# test_codigos_balanza.py - Etiquetas EAN-13 de balanza
+
+import unittest
+from decimal import Decimal
+
+from codigos_balanza import calcular_digito_verificador, crear_decodificador_balanza
+
+
+def _con_digito(codigo_12):
+    return codigo_12 + str(calcular_digito_verificador(codigo_12))
+
+
+class CodigosBalanzaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.decodificador = crear_decodificador_balanza()
+
+    def test_digito_verificador(self):
+        self.assertEqual(calcular_digito_verificador('400638133393'), 1)
+        self.assertEqual(calcular_digito_verificador('779123456789'), 8)
+
+    def test_digito_incorrecto(self):
+        codigo = _con_digito('200012301234')
+        incorrecto = codigo[:12] + str((int(codigo[12]) + 1) % 10)
+        self.assertIsNotNone(self.decodificador.decodificar(codigo))
+        self.assertIsNone(self.decodificador.decodificar(incorrecto))
+
+    def test_etiqueta_de_peso(self):
+        decodificado = self.decodificador.decodificar(_con_digito('200012301234'))
+        self.assertEqual(decodificado['tipo'], 'peso')
+        self.assertEqual(decodificado['plu'], '00123')
+        self.assertEqual(decodificado['valor'], Decimal('1.234'))
+
+        calculo = self.decodificador.calcular_cantidad(decodificado, '999.99')
+        self.assertEqual(calculo, {'cantidad': 1.234, 'importe': 1233.99})
+
+    def test_etiqueta_de_precio(self):
+        decodificado = self.decodificador.decodificar(_con_digito('220012312345'))
+        self.assertEqual(decodificado['tipo'], 'precio')
+        self.assertEqual(decodificado['valor'], Decimal('123.45'))
+
+        calculo = self.decodificador.calcular_cantidad(decodificado, '999.99')
+        self.assertEqual(calculo['importe'], 123.45)
+        self.assertEqual(calculo['cantidad'], 0.123)
+        self.assertIsNone(self.decodificador.calcular_cantidad(decodificado, 0))
+
+    def test_no_es_codigo_de_balanza(self):
+        self.assertFalse(self.decodificador.es_codigo_balanza('7791234567898'))
+        self.assertIsNone(self.decodificador.decodificar('7791234567898'))
+        self.assertIsNone(self.decodificador.decodificar('20001230123'))
+        self.assertIsNone(self.decodificador.decodificar(None))
+
+    def test_codigos_candidatos(self):
+        self.assertEqual(self.decodificador.codigos_candidatos('00123'), ['00123', '123'])
+        self.assertEqual(self.decodificador.codigos_candidatos('12345'), ['12345'])
+
+    def test_formato_invalido(self):
+        with self.assertRaises(ValueError):
+            crear_decodificador_balanza({'20': {'tipo': 'volumen'}})
+        with self.assertRaises(ValueError):
+            crear_decodificador_balanza({'20': {'tipo': 'peso', 'digitos_plu': 10}})
+
+
+if __name__ == '__main__':
+    unittest.main()
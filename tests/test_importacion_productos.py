@@ -0,0 +1,186 @@
+# test_importacion_productos.py - procesar() y comparar() deben coincidir fila por fila
+
+import itertools
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+from decimal import Decimal
+
+from importacion_productos import ImportadorProductos, crear_lector_lista_precios
+
+# Las filas del catálogo tienen las mismas columnas que las consultas del importador
+FilaCatalogo = namedtuple(
+    'FilaCatalogo', 'id codigo nombre descripcion precio costo margen activo es_combo'
+)
+
+OPCIONES = [
+    {'solo_actualizar': solo_actualizar, 'crear_nuevos': crear_nuevos}
+    for solo_actualizar, crear_nuevos in itertools.product((False, True), (True, False))
+]
+
+
+class _SesionFalsa:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class _DbFalsa:
+    session = _SesionFalsa()
+
+
+class ImportadorEnMemoria(ImportadorProductos):
+    """Importador que lee el catálogo de una lista de tuplas y guarda lo que escribiría"""
+
+    def __init__(self, filas):
+        super().__init__(_DbFalsa(), None, lambda descripciones: ['GENERAL'] * len(descripciones))
+        self.filas = {fila.codigo: fila for fila in filas}
+        self.altas = []
+        self.modificaciones = []
+
+    def existentes(self, codigos):
+        return {codigo: self.filas[codigo] for codigo in codigos if codigo in self.filas}
+
+    def catalogo(self, tamano_lote=2000):
+        return dict(self.filas)
+
+    def aplicar(self, altas, modificaciones):
+        self.altas.extend(altas)
+        self.modificaciones.extend(modificaciones)
+
+    def codigos_escritos(self):
+        codigo_por_id = {fila.id: codigo for codigo, fila in self.filas.items()}
+        return (
+            {alta['codigo'] for alta in self.altas}
+            | {codigo_por_id[mapping['id']] for mapping in self.modificaciones}
+        )
+
+
+def _fila(id, codigo, precio, nombre=None, costo=Decimal('70.00'), margen=Decimal('30.00')):
+    nombre = nombre or f'Producto {codigo}'
+    return FilaCatalogo(id, codigo, nombre, nombre, Decimal(precio), costo, margen, True, False)
+
+
+CATALOGO = [
+    _fila(1, 'A1', '100.00'),                  # sube de precio
+    _fila(2, 'A2', '200.00'),                  # baja de precio
+    _fila(3, 'A3', '300.00'),                  # sin cambios
+    _fila(4, 'A4', '400.00', nombre='Viejo'),  # cambia la descripción
+    _fila(5, 'A5', '500.00', costo=None),      # sin costo: se estima
+    _fila(6, 'A6', '600.00', margen=Decimal('30.00')),  # solo cambia el margen
+    _fila(7, 'A7', '700.00'),                  # no viene en la lista
+]
+
+LISTA = [
+    {'codigo': 'a1', 'descripcion': 'Producto A1', 'precio': 110},
+    {'codigo': 'A2', 'descripcion': 'Producto A2', 'precio': 190},
+    {'codigo': 'A3', 'descripcion': 'Producto A3', 'precio': 300.001},
+    {'codigo': 'A4', 'descripcion': 'Nuevo nombre', 'precio': 400},
+    {'codigo': 'A5', 'descripcion': 'Producto A5', 'precio': 500},
+    {'codigo': 'A6', 'descripcion': 'Producto A6', 'precio': 600, 'margen': 45},
+    {'codigo': 'N1', 'descripcion': 'Nuevo uno', 'precio': 50, 'costo': 30, 'margen': 40},
+    {'codigo': 'N2', 'descripcion': 'Nuevo dos', 'precio': 60},
+    {'codigo': '', 'descripcion': 'Sin código', 'precio': 10},
+    {'codigo': 'X1', 'descripcion': 'Sin precio', 'precio': 0},
+]
+
+
+class ProcesarYCompararTest(unittest.TestCase):
+
+    def _ejecutar(self, lista, opciones):
+        comparacion = ImportadorEnMemoria(CATALOGO).comparar(lista, opciones)
+        importador = ImportadorEnMemoria(CATALOGO)
+        resultados = importador.procesar(lista, opciones)
+        return comparacion, importador, resultados
+
+    def test_aplica_marca_las_filas_que_procesar_escribe(self):
+        for opciones in OPCIONES:
+            with self.subTest(**opciones):
+                comparacion, importador, _ = self._ejecutar(LISTA, opciones)
+                aplican = {d['codigo'] for d in comparacion['diferencias'] if d['aplica']}
+                self.assertEqual(aplican, importador.codigos_escritos())
+                self.assertEqual(
+                    comparacion['resumen']['escrituras'],
+                    len(importador.altas) + len(importador.modificaciones)
+                )
+
+    def test_contadores_coinciden(self):
+        for opciones in OPCIONES:
+            with self.subTest(**opciones):
+                comparacion, _, resultados = self._ejecutar(LISTA, opciones)
+                resumen = comparacion['resumen']
+                self.assertEqual(resumen['sin_cambios'], resultados['sin_cambios'])
+                self.assertEqual(resumen['errores'] + resumen['rechazados'], resultados['errores'])
+                self.assertEqual(resumen['nuevos'] if opciones['crear_nuevos'] else 0, resultados['nuevos'])
+
+    def test_rechazos_por_opciones(self):
+        comparacion, _, _ = self._ejecutar(LISTA, {'solo_actualizar': False, 'crear_nuevos': False})
+        rechazos = {d['codigo']: d['rechazo'] for d in comparacion['diferencias'] if d.get('rechazo')}
+        self.assertEqual(rechazos['N1'], 'Producto no existe (creación deshabilitada)')
+        self.assertEqual(rechazos['A1'], 'Producto ya existe (actualización deshabilitada)')
+        self.assertEqual(comparacion['resumen']['escrituras'], 0)
+
+    def test_margen_y_faltantes_no_se_escriben(self):
+        comparacion, importador, _ = self._ejecutar(LISTA, {'solo_actualizar': True, 'crear_nuevos': True})
+        tipos = {d['codigo']: d for d in comparacion['diferencias']}
+        self.assertEqual(tipos['A6']['tipo'], 'margen')
+        self.assertFalse(tipos['A6']['aplica'])
+        self.assertEqual(tipos['A7']['tipo'], 'faltante')
+        self.assertFalse(tipos['A7']['aplica'])
+        self.assertNotIn('A3', tipos)
+        self.assertEqual(importador.codigos_escritos(), {'A1', 'A2', 'A4', 'A5', 'N1', 'N2'})
+
+    def test_codigos_repetidos_la_ultima_fila_gana(self):
+        lista = [
+            {'codigo': 'A1', 'descripcion': 'Producto A1', 'precio': 150},
+            {'codigo': 'A1', 'descripcion': 'Producto A1', 'precio': 100},
+            {'codigo': 'A2', 'descripcion': 'Producto A2', 'precio': 200},
+            {'codigo': 'A2', 'descripcion': 'Producto A2', 'precio': 250},
+            {'codigo': 'N1', 'descripcion': 'Nuevo', 'precio': 10},
+            {'codigo': 'N1', 'descripcion': 'Nuevo', 'precio': 12},
+        ]
+        for opciones in OPCIONES:
+            with self.subTest(**opciones):
+                comparacion, importador, _ = self._ejecutar(lista, opciones)
+                aplican = {d['codigo'] for d in comparacion['diferencias'] if d['aplica']}
+                self.assertEqual(aplican, importador.codigos_escritos())
+
+
+@unittest.skipUnless(
+    __import__('importlib').util.find_spec('openpyxl'), 'openpyxl no está instalado'
+)
+class UnidadMargenTest(unittest.TestCase):
+
+    def _margenes(self, margenes, unidad_margen=None):
+        import openpyxl
+
+        libro = openpyxl.Workbook()
+        hoja = libro.active
+        hoja.append(['Codigo', 'Descripcion', 'Margen %', 'Precio'])
+        for numero, margen in enumerate(margenes):
+            hoja.append([f'C{numero}', 'Producto', margen, 100])
+
+        descriptor, ruta = tempfile.mkstemp(suffix='.xlsx')
+        os.close(descriptor)
+        try:
+            libro.save(ruta)
+            lector = crear_lector_lista_precios(ruta, unidad_margen=unidad_margen)
+            return [datos['margen'] for _, datos, _ in lector.filas() if datos]
+        finally:
+            os.remove(ruta)
+
+    def test_porcentajes_chicos_no_se_multiplican(self):
+        self.assertEqual(self._margenes([1, 0.5, 25]), [1.0, 0.5, 25.0])
+
+    def test_columna_de_fracciones(self):
+        self.assertEqual(self._margenes([0.01, 0.25, 1]), [1.0, 25.0, 100.0])
+
+    def test_unidad_configurada(self):
+        self.assertEqual(self._margenes([0.25, 0.5], unidad_margen='porcentaje'), [0.25, 0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()